@@ -25,8 +25,115 @@ from routes.diet_routes import diet_bp, init_blueprint as init_diet_routes
 from models.physical_activity_models import create_physical_activity_models
 from routes.physical_activity_routes import physical_activity_bp, init_blueprint as init_physical_activity_routes
 
+# Database runtime: pooled engines per deployment profile, replica routing, batched bookkeeping writes
+from services.db_runtime import (
+    build_engine_config, init_db_runtime, RoutingSession, use_read_replica,
+    defer_write, flush_deferred_writes, pool_status
+)
+
+# Keyset (cursor) pagination shared by admin listing endpoints
+from services.pagination import keyset_paginate, SortKey, InvalidCursor
+
+# Streaming CSV / gzip-CSV / XLSX exports
+from services.export_engine import (
+    stream_export, iter_query, ExportFormatError, normalize_format as normalize_export_format
+)
+
+# Doctor slot inventory with atomic claims for appointment booking
+from services.slot_inventory import (
+    init_slot_inventory, slot_map, claim_slot, attach_appointment, release_slot, move_slot, SlotUnavailable
+)
+
+# Doctor directory read model and in-memory snapshot for appointment search
+from services.doctor_directory import (
+    init_doctor_directory, ensure_directory as ensure_doctor_directory, specialty_list, search_doctors
+)
+
+# Blood availability index (per-bank stock aggregates, radius search, expiry sweeps)
+from services.blood_index import (
+    init_blood_index, ensure_index as ensure_blood_index, add_units as add_blood_units,
+    search_availability as search_blood_availability,
+    normalise_group as normalise_blood_group, WHOLE_BLOOD_SHELF_DAYS
+)
+
+# Blood donor matching (eligible-donor index, compatibility matrix)
+from services.donor_matching import (
+    init_donor_matching, ensure_index as ensure_donor_index, match_request as match_blood_donors,
+    candidate_dict as donor_candidate_dict
+)
+
+# Organ pledge/request matching (HLA scoring, ranked match lists)
+from services.organ_matching import (
+    init_organ_matching, ensure_matches as ensure_organ_matches, ranked_matches as ranked_organ_matches
+)
+
+# Pharmacy stock engine (batches, request reservations, stock-aware routing)
+from services.pharmacy_stock import (
+    init_pharmacy_stock, ensure_index as ensure_pharmacy_stock, receive_batch, set_stock as set_pharmacy_stock,
+    set_expiry as set_pharmacy_expiry, item_batches, reserved_quantity, transition_request as transition_pharmacy_request, stock_check,
+    parse_medicine_lines, pharmacies_for, StockConflict, InsufficientStock
+)
+
+# Daily facility analytics snapshots (grouped SQL, history series)
+from services.facility_analytics import (
+    init_facility_analytics, current_analytics as current_facility_analytics,
+    analytics_history as facility_analytics_history, TREND_METRICS as FACILITY_TREND_METRICS
+)
+
+# Insurer keys on policies/claims and the per-insurer claim read model
+from services.insurer_claims import init_insurer_claims, migrate_insurer_links
+
+# Fraud risk scoring for insurance claims (on submission + nightly re-score)
+from services.fraud_scoring import init_fraud_scoring, ensure_fraud_indexes
+
+# Cashless pre-auth deadlines and the SLA breach sweeper
+from services.preauth_sla import init_preauth_sla, migrate_preauth_deadlines
+
+# Buffered, month-partitioned insurance audit log
+from services.audit_log import init_audit_log, migrate_legacy_audit
+
+# Cached consent checks for insurance, MNC and data-sharing access
+from services.consent_cache import init_consent_cache
+
+# Set-based MNC vaccination compliance recalculation
+from services.vaccination_compliance import (
+    init_vaccination_compliance, ensure_vaccine_codes, ensure_alert_constraints
+)
+
+# MNC employee summary read model (directory, health trends, compliance report)
+from services.mnc_directory import init_mnc_directory
+
+# Pre-aggregated workplace incident counts (MNC incident analytics)
+from services.incident_cube import init_incident_cube, ensure_incident_cube
+
+# Stock consumption ledger and reorder forecasts (facility and health-worker inventory)
+from services.stock_forecast import (
+    init_stock_forecast, ensure_forecasts as ensure_stock_forecasts, forecasts_for as stock_forecasts_for,
+    forecast_dict as stock_forecast_dict, forecast_summary as stock_forecast_summary
+)
+
+# ANC cohort read model for the facility/block/district maternal dashboards
+from services.anc_cohort import (
+    init_anc_cohort, ensure_cohort as ensure_anc_cohort, cohort_summary as anc_cohort_summary,
+    scope_filter as anc_scope, active_pregnancies, recent_deliveries, pregnancy_dict, postnatal_dict,
+    DUE_SOON_DAYS as ANC_DUE_SOON_DAYS, LIST_LIMIT as ANC_LIST_LIMIT
+)
+
+# Live OPD queue with token counters and server-sent events
+from services.opd_queue import (
+    init_opd_queue, queue_state, add_patient as add_opd_patient, call_patient as call_opd_patient,
+    complete_patient as complete_opd_patient, event_stream_response, QueueConflict
+)
+
+# Queued report generation for the block/district Reports Centers
+from services.report_jobs import (
+    init_report_jobs, enqueue_report, kick_embedded_worker, normalize_report_format,
+    default_period, report_file_path, REPORT_TYPES, REPORT_FORMATS
+)
+
 app = Flask(__name__)
 app.config.from_object(Config)
+app.config.update(build_engine_config(Config))
 
 # On some Windows machines, `mimetypes` initialization can fail while reading the registry
 # under low-resource conditions, causing intermittent 500s when serving static files.
@@ -104,7 +211,8 @@ os.makedirs(FAMILY_HISTORY_UPLOAD_ROOT, exist_ok=True)
 os.makedirs(PRESCRIPTION_UPLOAD_ROOT, exist_ok=True)
 
 # Initialize extensions
-db = SQLAlchemy(app) #**review 
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+init_db_runtime(app, db)
 login_manager = LoginManager(app)
 login_manager.login_view = 'index'
 mail = Mail(app)
@@ -168,10 +276,12 @@ insurance_models = create_insurance_models(db)
 InsuranceCompany = insurance_models['InsuranceCompany']
 ConsentManagement = insurance_models['ConsentManagement']
 CashlessPreAuth = insurance_models['CashlessPreAuth']
+PreAuthSlaAlert = insurance_models['PreAuthSlaAlert']
 ClaimReview = insurance_models['ClaimReview']
 FraudDetection = insurance_models['FraudDetection']
 ClaimDocument = insurance_models['ClaimDocument']
 PolicyholderDirectory = insurance_models['PolicyholderDirectory']
+InsurerClaim = insurance_models['InsurerClaim']
 AuditLog = insurance_models['AuditLog']
 
 # Create Physical Activity models after db is initialized
@@ -422,11 +532,13 @@ def update_session_activity(session_id=None):
         if not sid:
             return
         
-        session_log = SessionLog.query.filter_by(session_id=sid, status='active').first()
-        if session_log:
-            session_log.last_activity = datetime.utcnow()
-            session_log.total_requests = (session_log.total_requests or 0) + 1
-            db.session.commit()
+        # Single UPDATE, committed together with the request's other bookkeeping writes
+        def _touch_session():
+            SessionLog.query.filter_by(session_id=sid, status='active').update({
+                SessionLog.last_activity: datetime.utcnow(),
+                SessionLog.total_requests: func.coalesce(SessionLog.total_requests, 0) + 1
+            }, synchronize_session=False)
+        defer_write(_touch_session)
     except Exception as e:
         print(f"Error updating session activity: {e}")
 
@@ -502,11 +614,9 @@ def log_api_call(response, error=None):
             scope_type=scope_type,
             scope_id=scope_id
         )
-        db.session.add(api_log)
-        db.session.commit()
+        defer_write(api_log)
     except Exception as e:
         print(f"Error logging API call: {e}")
-        db.session.rollback()
 
 def log_access(resource_type, resource_id, action, resource_name=None):
     """Log resource access for audit trail"""
@@ -546,11 +656,9 @@ def log_access(resource_type, resource_id, action, resource_name=None):
             scope_type=scope_type,
             scope_id=scope_id
         )
-        db.session.add(access_log)
-        db.session.commit()
+        defer_write(access_log)
     except Exception as e:
         print(f"Error logging access: {e}")
-        db.session.rollback()
 
 def update_device_fingerprint(user):
     """Update or create device fingerprint entry for user"""
@@ -619,6 +727,8 @@ def after_request_handler(response):
         # Only log API calls
         if request.path.startswith('/api/'):
             log_api_call(response)
+        # One commit for all bookkeeping writes queued during this request
+        flush_deferred_writes()
     except Exception as e:
         print(f"Error in after_request: {e}")
     return response
@@ -1459,6 +1569,7 @@ class Insurance(db.Model):
     
     # Insurance Provider Details
     provider_name = db.Column(db.String(200), nullable=False)  # Company name
+    insurance_company_id = db.Column(db.Integer, db.ForeignKey('insurance_companies.id'), index=True)  # Linked insurer (services/insurer_claims.py)
     provider_type = db.Column(db.String(50))  # Public, Private, Government
     provider_contact = db.Column(db.String(100))  # Contact number
     provider_email = db.Column(db.String(120))
@@ -1504,10 +1615,14 @@ class Insurance(db.Model):
 class InsuranceClaim(db.Model):
     """Insurance claims made by user"""
     __tablename__ = 'insurance_claims'
+    __table_args__ = (
+        db.Index('ix_insurance_claims_fraud_window', 'insurance_company_id', 'user_id', 'claim_date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     insurance_id = db.Column(db.Integer, db.ForeignKey('insurances.id'), nullable=False)
+    insurance_company_id = db.Column(db.Integer, db.ForeignKey('insurance_companies.id'), index=True)  # Copied from the policy
     
     # Claim Details
     claim_id = db.Column(db.String(50), unique=True, nullable=False)  # Auto-generated
@@ -1872,7 +1987,7 @@ class LoginLog(db.Model):
     device_fingerprint = db.Column(db.String(255))
     
     # Timing
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     # Relationships
     user = db.relationship('User', backref=db.backref('login_logs', lazy='dynamic'))
@@ -1908,7 +2023,7 @@ class AccessLog(db.Model):
     scope_type = db.Column(db.String(50))  # block, district, state, national, global
     scope_id = db.Column(db.String(100))  # BLK-xxx, DIST-xxx, etc.
     
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     # Relationships
     user = db.relationship('User', backref=db.backref('access_logs', lazy='dynamic'))
@@ -1947,7 +2062,7 @@ class APILog(db.Model):
     scope_type = db.Column(db.String(50))
     scope_id = db.Column(db.String(100))
     
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     # Relationships
     user = db.relationship('User', backref=db.backref('api_logs', lazy='dynamic'))
@@ -2550,6 +2665,63 @@ class FacilityInventory(db.Model):
         return min(100, round((self.current_stock / self.maximum_stock) * 100))
 
 
+class StockMovement(db.Model):
+    """Consumption ledger for facility and health-worker stock (see services/stock_forecast.py)"""
+    __tablename__ = 'stock_movements'
+    __table_args__ = (
+        db.Index('ix_stock_movements_item', 'source', 'item_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(10), nullable=False)  # facility (facility_inventory), worker (inventory_items)
+    item_id = db.Column(db.Integer, nullable=False)
+    facility_id = db.Column(db.Integer)
+    health_worker_id = db.Column(db.Integer)
+    item_name = db.Column(db.String(200))
+    delta = db.Column(db.Integer, nullable=False)  # Negative = consumed/issued
+    quantity_before = db.Column(db.Integer)
+    quantity_after = db.Column(db.Integer)
+    reason = db.Column(db.String(20))  # opening, receipt, issue
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+
+
+class StockForecast(db.Model):
+    """Nightly burn-rate forecast and reorder suggestion per stock item"""
+    __tablename__ = 'stock_forecasts'
+    __table_args__ = (
+        db.UniqueConstraint('source', 'item_id', name='uq_stock_forecast_item'),
+        db.Index('ix_stock_forecasts_block_status', 'block_id', 'status'),
+        db.Index('ix_stock_forecasts_facility_status', 'facility_id', 'status'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    source = db.Column(db.String(10), nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    facility_id = db.Column(db.Integer)
+    health_worker_id = db.Column(db.Integer, index=True)
+    block_id = db.Column(db.String(50))
+    item_name = db.Column(db.String(200))
+    category = db.Column(db.String(50))
+    unit = db.Column(db.String(30))
+
+    current_stock = db.Column(db.Integer, default=0)
+    minimum_stock = db.Column(db.Integer)
+    maximum_stock = db.Column(db.Integer)
+
+    # Daily consumption (moving averages) and projection
+    burn_7d = db.Column(db.Float, default=0)
+    burn_28d = db.Column(db.Float, default=0)
+    daily_burn = db.Column(db.Float, default=0)
+    trend = db.Column(db.String(10))  # rising, steady, falling
+    days_remaining = db.Column(db.Float)  # None when nothing is being used
+    stockout_date = db.Column(db.Date)
+    status = db.Column(db.String(10))  # out, critical, reorder, ok
+    reorder_qty = db.Column(db.Integer, default=0)
+    reorder_by = db.Column(db.Date)
+
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class FacilityAsset(db.Model):
     """Phase 12: Facility Assets - equipment, furniture, vehicles"""
     __tablename__ = 'facility_assets'
@@ -2645,6 +2817,19 @@ class OPDQueue(db.Model):
     member = db.relationship('HouseholdMember', backref=db.backref('opd_visits', lazy=True))
 
 
+class OPDTokenCounter(db.Model):
+    """Last OPD token issued per facility per day (see services/opd_queue.py)"""
+    __tablename__ = 'opd_token_counters'
+    __table_args__ = (
+        db.UniqueConstraint('facility_id', 'queue_date', name='uq_opd_token_counter'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    facility_id = db.Column(db.Integer, db.ForeignKey('facilities.id'), nullable=False)
+    queue_date = db.Column(db.Date, nullable=False)
+    last_token = db.Column(db.Integer, default=0, nullable=False)
+
+
 class PatientVitals(db.Model):
     """Vitals recorded during health worker/doctor visits - linked to client user"""
     __tablename__ = 'patient_vitals'
@@ -2773,6 +2958,55 @@ class HealthAssessment(db.Model):
     health_worker = db.relationship('User', foreign_keys=[health_worker_id])
 
 
+class AncCohortEntry(db.Model):
+    """One tracked pregnancy for the maternal dashboards (see services/anc_cohort.py)"""
+    __tablename__ = 'anc_cohort'
+    __table_args__ = (
+        db.Index('ix_anc_cohort_subject', 'subject_type', 'subject_id'),
+        db.Index('ix_anc_cohort_facility_edd', 'facility_id', 'status', 'edd'),
+        db.Index('ix_anc_cohort_block_edd', 'block_id', 'status', 'edd'),
+        db.Index('ix_anc_cohort_facility_delivery', 'facility_id', 'status', 'delivery_date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    subject_type = db.Column(db.String(10), nullable=False)  # client (users.id), member (household_members.id)
+    subject_id = db.Column(db.Integer, nullable=False)
+    patient_user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'))  # ANC/PNC assessments are recorded against this user
+
+    # Responsible worker and where the row is reported
+    health_worker_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), index=True)
+    facility_id = db.Column(db.Integer)
+    block_id = db.Column(db.String(50))
+
+    name = db.Column(db.String(200))
+    age = db.Column(db.Integer)
+    village = db.Column(db.String(100))
+    phone = db.Column(db.String(20))
+
+    # Dating (gestational week is derived from lmp_date at query time)
+    lmp_date = db.Column(db.Date, index=True)
+    edd = db.Column(db.Date)
+    dating_source = db.Column(db.String(10))  # lmp, edd, week, default
+
+    is_high_risk = db.Column(db.Boolean, default=False)
+    risk_reason = db.Column(db.String(200))
+    risk_factors = db.Column(db.Text)
+    gravida = db.Column(db.Integer)
+    para = db.Column(db.Integer)
+
+    anc_visits = db.Column(db.Integer, default=0)
+    last_anc_date = db.Column(db.Date)
+    pnc_visits = db.Column(db.Integer, default=0)
+    last_pnc_date = db.Column(db.Date)
+    last_visit_date = db.Column(db.Date)
+
+    status = db.Column(db.String(12), default='active')  # active, delivered, closed
+    delivery_date = db.Column(db.Date)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class MedicalRecord(db.Model):
     """Medical Record model for storing client medical documents"""
     __tablename__ = 'medical_records'
@@ -3199,6 +3433,45 @@ class Appointment(db.Model):
         }
 
 
+class DoctorSlot(db.Model):
+    """Bookable appointment slot for a doctor (see services/slot_inventory.py)"""
+    __tablename__ = 'doctor_slots'
+    __table_args__ = (
+        db.UniqueConstraint('doctor_id', 'slot_date', 'slot_time', name='uq_doctor_slot'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.String(50), nullable=False)  # Same value as Appointment.doctor_id
+    slot_date = db.Column(db.Date, nullable=False)
+    slot_time = db.Column(db.Time, nullable=False)
+    period = db.Column(db.String(20))  # morning, afternoon, evening
+    status = db.Column(db.String(20), default='available', nullable=False)  # available, booked, blocked
+    appointment_id = db.Column(db.Integer, db.ForeignKey('appointments.id', ondelete='SET NULL'))
+    booked_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class DoctorDirectoryEntry(db.Model):
+    """Read model for appointment doctor search (see services/doctor_directory.py)"""
+    __tablename__ = 'doctor_directory'
+
+    id = db.Column(db.Integer, primary_key=True)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), unique=True, nullable=False)
+    name = db.Column(db.String(200))
+    specialty = db.Column(db.String(100))  # Display name
+    specialty_key = db.Column(db.String(100), index=True)  # Normalised: trimmed, lower-case
+    hospital = db.Column(db.String(200))
+    search_text = db.Column(db.String(400))  # Lower-cased name + hospital
+
+    # Consultation modes offered
+    offers_in_person = db.Column(db.Boolean, default=True, index=True)
+    offers_video = db.Column(db.Boolean, default=True, index=True)
+    offers_home_visit = db.Column(db.Boolean, default=False, index=True)
+
+    is_active = db.Column(db.Boolean, default=True, index=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 
 class Consultation(db.Model):
     """Consultation model for storing doctor-patient session details"""
@@ -3362,6 +3635,56 @@ class PharmacyRequest(db.Model):
     pharmacy = db.relationship('User', foreign_keys=[pharmacy_id], backref=db.backref('pharmacy_requests_received', lazy=True))
 
 
+class InventoryBatch(db.Model):
+    """Received lot of a pharmacy inventory item (see services/pharmacy_stock.py)"""
+    __tablename__ = 'inventory_batches'
+    __table_args__ = (
+        db.Index('ix_inventory_batches_fefo', 'inventory_id', 'expiry_date'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    inventory_id = db.Column(db.Integer, db.ForeignKey('inventory.id', ondelete='CASCADE'), nullable=False)
+    batch_number = db.Column(db.String(50))
+    quantity = db.Column(db.Integer, default=0, nullable=False)  # Free units (reservations already taken out)
+    received_quantity = db.Column(db.Integer)
+    expiry_date = db.Column(db.Date)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    inventory = db.relationship('Inventory', backref=db.backref('batches', lazy=True, cascade='all, delete-orphan'))
+
+
+class PharmacyReservation(db.Model):
+    """Units held from a batch for an accepted pharmacy request"""
+    __tablename__ = 'pharmacy_reservations'
+
+    id = db.Column(db.Integer, primary_key=True)
+    request_id = db.Column(db.Integer, db.ForeignKey('pharmacy_requests.id', ondelete='CASCADE'), nullable=False, index=True)
+    pharmacy_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    inventory_id = db.Column(db.Integer, db.ForeignKey('inventory.id', ondelete='SET NULL'), index=True)
+    batch_id = db.Column(db.Integer, db.ForeignKey('inventory_batches.id', ondelete='SET NULL'))
+    medicine_name = db.Column(db.String(200), nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    status = db.Column(db.String(20), default='reserved')  # reserved, dispensed, released
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class PharmacyStockIndex(db.Model):
+    """Free units per pharmacy and normalised medicine name, for routing client requests"""
+    __tablename__ = 'pharmacy_stock_index'
+    __table_args__ = (
+        db.UniqueConstraint('pharmacy_id', 'medicine_key', name='uq_pharmacy_stock_index'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    pharmacy_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    medicine_key = db.Column(db.String(200), nullable=False, index=True)
+    medicine_name = db.Column(db.String(200))
+    quantity_available = db.Column(db.Integer, default=0, nullable=False)
+    next_expiry = db.Column(db.Date)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 # ==================== MNC (CORPORATE EMPLOYER) MODELS ====================
 
 class MNCEmployee(db.Model):
@@ -3514,6 +3837,10 @@ class JobRoleRequirement(db.Model):
 class WorkplaceIncident(db.Model):
     """Workplace Health & Safety Incident Reporting"""
     __tablename__ = 'workplace_incidents'
+    __table_args__ = (
+        db.Index('ix_workplace_incidents_mnc_date', 'mnc_id', 'incident_date'),
+        db.Index('ix_workplace_incidents_employee', 'employee_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     incident_id = db.Column(db.String(100), unique=True, nullable=False)  # Auto-generated
@@ -3563,6 +3890,29 @@ class WorkplaceIncident(db.Model):
     reported_by = db.relationship('User', foreign_keys=[reported_by_id])
 
 
+class WorkplaceIncidentCube(db.Model):
+    """Pre-aggregated incident counts per MNC, period, department, type, severity and status (see services/incident_cube.py)"""
+    __tablename__ = 'workplace_incident_cube'
+    __table_args__ = (
+        db.UniqueConstraint('mnc_id', 'period_start', 'department', 'incident_type', 'severity', 'is_closed',
+                            name='uq_workplace_incident_cube_cell'),
+        db.Index('ix_workplace_incident_cube_month', 'mnc_id', 'month_start'),
+        db.Index('ix_workplace_incident_cube_week', 'mnc_id', 'week_start'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    mnc_id = db.Column(db.Integer, nullable=False)
+    period_start = db.Column(db.Date, nullable=False)  # Week start clipped to the month
+    week_start = db.Column(db.Date, nullable=False)  # Monday
+    month_start = db.Column(db.Date, nullable=False)
+    department = db.Column(db.String(100), nullable=False)  # 'Unassigned' when no employee is linked
+    incident_type = db.Column(db.String(50), nullable=False)
+    severity = db.Column(db.String(30), nullable=False)  # 'Unspecified' when not recorded
+    is_closed = db.Column(db.Boolean, nullable=False, default=False)  # Closed or Resolved
+    incident_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class MNCAuditLog(db.Model):
     """Comprehensive Audit Trail for MNC Data Access"""
     __tablename__ = 'mnc_audit_logs'
@@ -3602,6 +3952,53 @@ class MNCAuditLog(db.Model):
     consent = db.relationship('MNCConsent')
 
 
+class MNCEmployeeSummary(db.Model):
+    """Per-employee directory/fitness/vaccination summary for MNC dashboards (see services/mnc_directory.py)"""
+    __tablename__ = 'mnc_employee_summaries'
+    __table_args__ = (
+        db.Index('ix_mnc_employee_summaries_directory', 'mnc_id', 'verification_status', 'employee_pk'),
+        db.Index('ix_mnc_employee_summaries_department', 'mnc_id', 'department'),
+        db.Index('ix_mnc_employee_summaries_fitness', 'mnc_id', 'fitness_status'),
+    )
+    
+    employee_pk = db.Column(db.Integer, primary_key=True, autoincrement=False)  # mnc_employees.id
+    mnc_id = db.Column(db.Integer, nullable=False)
+    employee_code = db.Column(db.String(100))
+    full_name = db.Column(db.String(200))
+    email = db.Column(db.String(120))
+    department = db.Column(db.String(100))
+    job_role = db.Column(db.String(100))
+    verification_status = db.Column(db.String(50))
+    
+    # Linked A3 Health client
+    client_id = db.Column(db.Integer)
+    client_linked = db.Column(db.Boolean, default=False)
+    uid = db.Column(db.String(100), index=True)
+    gender = db.Column(db.String(20))
+    dob = db.Column(db.Date)
+    birth_year = db.Column(db.Integer)
+    
+    # Latest valid fitness assessment
+    fitness_status = db.Column(db.String(50))
+    last_review_date = db.Column(db.Date)
+    certificate_expiry_date = db.Column(db.Date)
+    next_review_date = db.Column(db.Date)
+    
+    # Vaccination
+    policies_active = db.Column(db.Integer, default=0)
+    policies_applicable = db.Column(db.Integer, default=0)
+    policies_compliant = db.Column(db.Integer, default=0)
+    policies_partial = db.Column(db.Integer, default=0)
+    compliance_records = db.Column(db.Integer, default=0)  # Against active policies
+    compliant_records = db.Column(db.Integer, default=0)  # Any policy
+    compliance_percent = db.Column(db.Float, default=0)
+    vaccination_band = db.Column(db.String(20))  # compliant, partial, non_compliant
+    completed_vaccinations = db.Column(db.Integer, default=0)
+    verified_uploads = db.Column(db.Integer, default=0)
+    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class MNCVaccinationPolicy(db.Model):
     """MNC Vaccination Requirements and Policies"""
     __tablename__ = 'mnc_vaccination_policies'
@@ -3658,6 +4055,9 @@ class MNCVaccinationPolicy(db.Model):
 class EmployeeVaccinationCompliance(db.Model):
     """Track Employee Vaccination Compliance Status"""
     __tablename__ = 'employee_vaccination_compliance'
+    __table_args__ = (
+        db.Index('ix_employee_vaccination_compliance_pair', 'employee_id', 'policy_id'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     employee_id = db.Column(db.Integer, db.ForeignKey('mnc_employees.id'), nullable=False)
@@ -3709,6 +4109,13 @@ class EmployeeVaccinationCompliance(db.Model):
 class VaccinationAlert(db.Model):
     """Vaccination Due/Overdue Alerts and Notifications"""
     __tablename__ = 'vaccination_alerts'
+    __table_args__ = (
+        # One open alert per compliance row (see services/vaccination_compliance.py)
+        db.Index('ux_vaccination_alerts_open_compliance', 'compliance_id', unique=True,
+                 sqlite_where=db.text('is_active AND NOT is_resolved'),
+                 postgresql_where=db.text('is_active AND NOT is_resolved')),
+        db.Index('ix_vaccination_alerts_mnc_open', 'mnc_id', 'is_active', 'is_resolved', 'created_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     mnc_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -3746,9 +4153,22 @@ class VaccinationAlert(db.Model):
     acknowledged_by = db.relationship('User', foreign_keys=[acknowledged_by_id])
 
 
+class VaccinationAlertRun(db.Model):
+    """Last alert generation run per MNC, the watermark for incremental runs"""
+    __tablename__ = 'vaccination_alert_runs'
+    
+    mnc_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    last_run_at = db.Column(db.DateTime)
+    alerts_created = db.Column(db.Integer, default=0)
+    alerts_resolved = db.Column(db.Integer, default=0)
+
+
 class MNCVaccinationRecord(db.Model):
     """MNC-uploaded vaccination records for employees"""
     __tablename__ = 'mnc_vaccination_records'
+    __table_args__ = (
+        db.Index('ix_mnc_vaccination_records_mnc_status', 'mnc_id', 'verification_status'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     mnc_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -3799,6 +4219,16 @@ class MNCVaccinationRecord(db.Model):
     verified_by = db.relationship('User', foreign_keys=[verified_by_id])
 
 
+class VaccineCode(db.Model):
+    """Normalised vaccine name/brand alias -> vaccine code (see services/vaccination_compliance.py)"""
+    __tablename__ = 'vaccine_codes'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(30), nullable=False, index=True)  # COVID19, HEPB, FLU, ...
+    alias = db.Column(db.String(200), unique=True, nullable=False)  # 'covishield', 'hep b', ...
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class BloodUnit(db.Model):
     """Model for individual blood units"""
     __tablename__ = 'blood_units'
@@ -3815,6 +4245,32 @@ class BloodUnit(db.Model):
     blood_bank = db.relationship('User', backref=db.backref('blood_units', lazy=True))
 
 
+class BloodInventory(db.Model):
+    """Available stock per blood bank / group / component (see services/blood_index.py)"""
+    __tablename__ = 'blood_inventory'
+    __table_args__ = (
+        db.UniqueConstraint('blood_bank_id', 'blood_group', 'component_type', name='uq_blood_inventory_stock'),
+        db.Index('ix_blood_inventory_cell_group', 'grid_cell', 'blood_group'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    blood_bank_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
+    blood_group = db.Column(db.String(5), nullable=False)  # A+, O-, ...
+    component_type = db.Column(db.String(50), default='Whole Blood', nullable=False)
+    units_available = db.Column(db.Integer, default=0, nullable=False)
+    next_expiry = db.Column(db.Date)
+
+    # Copied from the blood bank's profile for radius / city search
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    grid_cell = db.Column(db.String(20))
+    city_key = db.Column(db.String(100), index=True)
+
+    last_updated = db.Column(db.DateTime, default=datetime.utcnow)
+
+    blood_bank = db.relationship('User', backref=db.backref('blood_inventory', lazy=True))
+
+
 class BloodRequest(db.Model):
     """Model for blood requests from hospitals/doctors"""
     __tablename__ = 'blood_requests'
@@ -4337,6 +4793,37 @@ class Facility(db.Model):
                                       backref='facility')
 
 
+class FacilityAnalyticsSnapshot(db.Model):
+    """Daily facility analytics snapshot (see services/facility_analytics.py)"""
+    __tablename__ = 'facility_analytics_snapshots'
+    __table_args__ = (
+        db.UniqueConstraint('facility_id', 'snapshot_date', name='uq_facility_analytics_snapshot'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    facility_id = db.Column(db.Integer, db.ForeignKey('facilities.id', ondelete='CASCADE'), nullable=False)
+    snapshot_date = db.Column(db.Date, nullable=False)
+
+    # Headline counts (history series)
+    total_workers = db.Column(db.Integer, default=0)
+    total_patients = db.Column(db.Integer, default=0)
+    total_households = db.Column(db.Integer, default=0)
+    total_villages = db.Column(db.Integer, default=0)
+    high_risk = db.Column(db.Integer, default=0)
+    medium_risk = db.Column(db.Integer, default=0)
+    low_risk = db.Column(db.Integer, default=0)
+    pregnant = db.Column(db.Integer, default=0)
+    ncd = db.Column(db.Integer, default=0)
+    children_under_5 = db.Column(db.Integer, default=0)
+    elderly = db.Column(db.Integer, default=0)
+    visits_day = db.Column(db.Integer, default=0)
+    visits_week = db.Column(db.Integer, default=0)
+    visits_month = db.Column(db.Integer, default=0)
+
+    payload = db.Column(db.Text)  # JSON: distributions, visit trend, worker ranking, village coverage
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 # ==================== BLOCK ADMIN PRODUCTION MODELS ====================
 
 class BlockTask(db.Model):
@@ -4359,7 +4846,7 @@ class BlockTask(db.Model):
     # Assignment
     assigned_to_id = db.Column(db.Integer, db.ForeignKey('users.id'))  # Health Worker
     assigned_by_id = db.Column(db.Integer, db.ForeignKey('users.id'))  # Block Admin
-    block_id = db.Column(db.String(50))  # Block identifier
+    block_id = db.Column(db.String(50), index=True)  # Block identifier
     
     # Location (optional)
     village = db.Column(db.String(100))
@@ -4500,7 +4987,7 @@ class GeneratedReport(db.Model):
     file_size_bytes = db.Column(db.Integer)
     
     # Status
-    status = db.Column(db.String(20), default='processing')  # processing, ready, expired, failed
+    status = db.Column(db.String(20), default='processing')  # queued, processing, ready, expired, failed
     download_count = db.Column(db.Integer, default=0)
     expires_at = db.Column(db.DateTime)  # When the report file will be deleted
     
@@ -4524,6 +5011,36 @@ class GeneratedReport(db.Model):
     generated_by = db.relationship('User', backref='generated_reports')
 
 
+class ReportJob(db.Model):
+    """Queue entry for Reports Center generation (processed by services/report_jobs.py)"""
+    __tablename__ = 'report_jobs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    report_pk = db.Column(db.Integer, db.ForeignKey('generated_reports.id'), nullable=False, index=True)
+    
+    # Scope the report covers
+    scope_type = db.Column(db.String(20), nullable=False)  # block, district
+    scope_id = db.Column(db.String(50))  # block_id or district_id
+    params = db.Column(db.Text)  # JSON
+    
+    # Queue state
+    status = db.Column(db.String(20), default='queued', index=True)  # queued, processing, done, failed
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    available_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # Not picked up before this (retry backoff)
+    locked_by = db.Column(db.String(200))  # Worker holding the job
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    
+    # Timestamps
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    # Relationships
+    report = db.relationship('GeneratedReport', backref=db.backref('jobs', lazy=True))
+
+
 # ==================== PHASE 13: BLOOD & ORGAN DONATION MODELS ====================
 
 class ClientBloodDonation(db.Model):
@@ -4621,6 +5138,24 @@ class ClientBloodRequest(db.Model):
     user = db.relationship('User', backref='client_blood_requests')
 
 
+class BloodDonorIndexEntry(db.Model):
+    """Eligible-donor index row per registered blood donor (see services/donor_matching.py)"""
+    __tablename__ = 'blood_donor_index'
+    __table_args__ = (
+        db.Index('ix_blood_donor_index_match', 'blood_group', 'matchable', 'eligible_from'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), unique=True, nullable=False)
+    blood_group = db.Column(db.String(5), nullable=False)  # Normalised: A+, O-, ...
+    eligible_from = db.Column(db.Date)  # Last donation + deferral; NULL = never donated
+    matchable = db.Column(db.Boolean, default=True, nullable=False)  # Consent + availability
+    city_key = db.Column(db.String(100), index=True)
+    donation_count = db.Column(db.Integer, default=0)
+    last_donation_date = db.Column(db.Date)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class OrganPledge(db.Model):
     """Track organ donation pledges"""
     __tablename__ = 'organ_pledges'
@@ -4727,6 +5262,27 @@ class OrganRequest(db.Model):
     user = db.relationship('User', backref='organ_requests_list')
 
 
+class OrganMatch(db.Model):
+    """Ranked pledge candidate for an open organ request (see services/organ_matching.py)"""
+    __tablename__ = 'organ_matches'
+    __table_args__ = (
+        db.UniqueConstraint('request_id', 'pledge_id', name='uq_organ_match'),
+        db.Index('ix_organ_matches_request_rank', 'request_id', 'rank'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    request_id = db.Column(db.Integer, db.ForeignKey('organ_requests.id', ondelete='CASCADE'), nullable=False)
+    pledge_id = db.Column(db.Integer, db.ForeignKey('organ_pledges.id', ondelete='CASCADE'), nullable=False, index=True)
+    score = db.Column(db.Float, nullable=False)
+    hla_mismatches = db.Column(db.Integer)  # 0-6 over HLA-A/B/DR; NULL if either side untyped
+    abo_identical = db.Column(db.Boolean, default=False)
+    crossmatch_positive = db.Column(db.Boolean, default=False)  # Donor carries an unacceptable antigen
+    rank = db.Column(db.Integer, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    pledge = db.relationship('OrganPledge')
+
+
 # Country codes mapping
 COUNTRY_CODES = {
     'India': '091',
@@ -5665,13 +6221,17 @@ from routes.insurance_routes import insurance_bp, init_blueprint as init_insuran
 # Initialize Insurance blueprint with database and models
 init_insurance_blueprint(db, {
     'User': User,
+    'Insurance': Insurance,
+    'InsuranceClaim': InsuranceClaim,
     'InsuranceCompany': InsuranceCompany,
     'ConsentManagement': ConsentManagement,
     'CashlessPreAuth': CashlessPreAuth,
+    'PreAuthSlaAlert': PreAuthSlaAlert,
     'ClaimReview': ClaimReview,
     'FraudDetection': FraudDetection,
     'ClaimDocument': ClaimDocument,
     'PolicyholderDirectory': PolicyholderDirectory,
+    'InsurerClaim': InsurerClaim,
     'AuditLog': AuditLog
 })
 
@@ -6624,8 +7184,10 @@ def api_pharmacy_inventory():
             'name': item.medicine_name,
             'category': item.category,
             'stock': item.stock_quantity,
+            'reserved': reserved_quantity(item.id),
             'expiry': item.expiry_date.strftime('%Y-%m-%d') if item.expiry_date else '',
-            'notes': item.notes
+            'notes': item.notes,
+            'batches': item_batches(item)
         })
         
     return jsonify({'success': True, 'inventory': inventory_list})
@@ -6645,16 +7207,22 @@ def api_pharmacy_add_item():
         if data.get('expiry'):
             expiry_date = datetime.strptime(data['expiry'], '%Y-%m-%d').date()
             
+        stock = int(data.get('stock', 0))
+        if stock < 0:
+            return jsonify({'success': False, 'message': 'Stock cannot be negative'}), 400
+
         new_item = Inventory(
             pharmacy_id=current_user.id,
             medicine_name=data['name'],
             category=data.get('category'),
-            stock_quantity=int(data.get('stock', 0)),
-            expiry_date=expiry_date,
+            stock_quantity=0,
             notes=data.get('notes')
         )
         
         db.session.add(new_item)
+        db.session.flush()
+        if stock:
+            receive_batch(new_item, stock, expiry_date, data.get('batch_number'))
         db.session.commit()
         
         return jsonify({'success': True, 'message': 'Medicine added successfully'})
@@ -6680,10 +7248,21 @@ def api_pharmacy_update_item():
     try:
         if 'name' in data: item.medicine_name = data['name']
         if 'category' in data: item.category = data['category']
-        if 'stock' in data: item.stock_quantity = int(data['stock'])
-        if 'expiry' in data: 
-            item.expiry_date = datetime.strptime(data['expiry'], '%Y-%m-%d').date() if data['expiry'] else None
         if 'notes' in data: item.notes = data['notes']
+        # Stock and expiry are derived from batches: increases become a new batch
+        # with the given expiry, decreases write off the soonest-expiring units and
+        # an expiry edit moves the soonest-expiring batch
+        expiry = datetime.strptime(data['expiry'], '%Y-%m-%d').date() if data.get('expiry') else None
+        received = False
+        if 'stock' in data and int(data['stock']) != item.stock_quantity:
+            if int(data['stock']) < 0:
+                return jsonify({'success': False, 'message': 'Stock cannot be negative'}), 400
+            received = int(data['stock']) > (item.stock_quantity or 0)
+            set_pharmacy_stock(item, int(data['stock']), expiry)
+        if expiry and expiry != item.expiry_date and not received:
+            if not set_pharmacy_expiry(item, expiry):
+                db.session.rollback()
+                return jsonify({'success': False, 'message': 'No stock on hand to set an expiry date for'}), 400
         
         db.session.commit()
         return jsonify({'success': True, 'message': 'Medicine updated successfully'})
@@ -6705,6 +7284,8 @@ def api_pharmacy_delete_item():
     item = Inventory.query.filter_by(id=item_id, pharmacy_id=current_user.id).first()
     if not item:
         return jsonify({'success': False, 'message': 'Item not found'}), 404
+    if reserved_quantity(item.id):
+        return jsonify({'success': False, 'message': 'Units of this medicine are reserved for open requests'}), 409
         
     try:
         db.session.delete(item)
@@ -6715,6 +7296,36 @@ def api_pharmacy_delete_item():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@app.route('/api/pharmacy/inventory/<int:item_id>/batches', methods=['POST'])
+@login_required
+def api_pharmacy_receive_batch(item_id):
+    """Receive a new batch of an existing medicine"""
+    if current_user.user_type != 'pharmacy':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+
+    item = Inventory.query.filter_by(id=item_id, pharmacy_id=current_user.id).first()
+    if not item:
+        return jsonify({'success': False, 'message': 'Item not found'}), 404
+
+    data = request.json or {}
+    try:
+        quantity = int(data.get('quantity', 0))
+        expiry_date = datetime.strptime(data['expiry'], '%Y-%m-%d').date() if data.get('expiry') else None
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Invalid quantity or expiry date'}), 400
+    if quantity <= 0:
+        return jsonify({'success': False, 'message': 'Quantity must be positive'}), 400
+
+    try:
+        batch = receive_batch(item, quantity, expiry_date, data.get('batch_number'))
+        db.session.commit()
+        return jsonify({'success': True, 'message': 'Batch received', 'batch_id': batch.id,
+                        'stock': item.stock_quantity})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
 
 @app.route('/api/pharmacy/requests', methods=['GET'])
 @login_required
@@ -6743,7 +7354,8 @@ def api_pharmacy_get_requests():
             'file_path': req.file_path,
             'medicine_details': req.medicine_details,
             'notes': req.patient_notes,
-            'remarks': req.pharmacy_remarks
+            'remarks': req.pharmacy_remarks,
+            'stock_check': stock_check(req)
         })
         
     return jsonify({'success': True, 'requests': results})
@@ -6766,11 +7378,21 @@ def api_pharmacy_update_request():
         return jsonify({'success': False, 'message': 'Request not found'}), 404
         
     try:
-        if status: req.status = status
+        reservation = None
+        if status and status != req.status:
+            # Accepting reserves stock; rejecting/cancelling returns it
+            reservation = transition_pharmacy_request(req, status, allow_partial=bool(data.get('allow_partial')))
         if remarks: req.pharmacy_remarks = remarks
         
         db.session.commit()
-        return jsonify({'success': True, 'message': 'Request updated successfully'})
+        return jsonify({'success': True, 'message': 'Request updated successfully', 'reservation': reservation})
+    except InsufficientStock as e:
+        return jsonify({'success': False, 'message': str(e), 'lines': e.lines, 'can_partial': True}), 409
+    except StockConflict as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -6790,19 +7412,33 @@ def client_pharmacy():
 @app.route('/api/client/pharmacies', methods=['GET'])
 @login_required
 def api_client_get_pharmacies():
-    """Get list of available pharmacies"""
+    """
+    Get list of available pharmacies. With ?medicines=<request text> only
+    pharmacies stocking them are returned, those able to fill everything first.
+    """
     if current_user.user_type != 'client':
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
-        
-    pharmacies = User.query.filter_by(user_type='pharmacy').all()
+
+    lines = parse_medicine_lines(request.args.get('medicines', ''))
+    if lines:
+        ranked = pharmacies_for(lines)
+        by_id = {p.id: p for p in User.query.filter(
+            User.id.in_([pharmacy_id for pharmacy_id, _ in ranked]), User.user_type == 'pharmacy'
+        )}
+        pharmacies = [(by_id[pharmacy_id], coverage) for pharmacy_id, coverage in ranked if pharmacy_id in by_id]
+    else:
+        pharmacies = [(p, None) for p in User.query.filter_by(user_type='pharmacy').all()]
     
     results = []
-    for p in pharmacies:
-        results.append({
+    for p, coverage in pharmacies:
+        item = {
             'id': p.id,
             'name': p.pharmacy_name or p.full_name,
             'address': p.address or p.city or 'Location not available'
-        })
+        }
+        if coverage:
+            item.update(coverage)
+        results.append(item)
         
     return jsonify({'success': True, 'pharmacies': results})
 
@@ -10726,73 +11362,16 @@ def vaccination_pdf(vaccination_id):
 # ==================== APPOINTMENTS MODULE ROUTES ====================
 
 def _specialty_list():
-    # Query distinct specialties for hospital doctors
-    specialties = db.session.query(User.specialty).filter(
-        User.user_type == 'hospital_doctor',
-        User.specialty != None,
-        User.specialty != ''
-    ).distinct().all()
-    return sorted([s[0] for s in specialties])
-
-
-def _filter_doctors(specialty=None, query=None, mode=None):
-    # Start with base query
-    db_query = User.query.filter_by(user_type='hospital_doctor')
-    
-    if specialty:
-        db_query = db_query.filter(func.lower(User.specialty) == specialty.lower())
-        
-    if query:
-        search_term = f"%{query}%"
-        db_query = db_query.filter(or_(
-            User.full_name.ilike(search_term),
-            User.facility_name.ilike(search_term)
-        ))
-        
-    doctors = db_query.all()
-    
-    # Map to frontend format
-    results = []
-    for doc in doctors:
-        # Mock data for missing fields
-        modes = ['In-person', 'Video']
-        
-        results.append({
-            'id': str(doc.id),
-            'name': doc.full_name or f"{doc.first_name} {doc.last_name}",
-            'specialty': doc.specialty or 'General',
-            'hospital': doc.facility_name or 'Unknown Hospital',
-            'photo': f"https://ui-avatars.com/api/?name={doc.full_name}&background=random",
-            'modes': modes,
-            # Removed mock fields: experience, rating, languages, next_availability, fee
-        })
-        
-    # Apply mode filter (mocked)
-    if mode:
-        results = [d for d in results if mode.title() in d['modes']]
-        
-    return results
+    return specialty_list()
+
+
+def _filter_doctors(specialty=None, query=None, mode=None, page=None, per_page=None):
+    """Doctors matching the booking wizard filters; returns (doctors, total)"""
+    return search_doctors(specialty, query, mode, page=page, per_page=per_page)
 
 
 def _slot_map_for_doctor(doctor_id, date_obj):
-    taken_slots = {
-        appt.appointment_time.strftime('%H:%M')
-        for appt in Appointment.query.filter(
-            Appointment.doctor_id == doctor_id,
-            Appointment.appointment_date == date_obj,
-            Appointment.status.in_(['pending', 'upcoming', 'rescheduled', 'completed'])
-        ).all()
-    }
-    slots = {}
-    for period, times in APPOINTMENT_SLOT_TEMPLATE.items():
-        slots[period] = [
-            {
-                'time': slot_time,
-                'available': slot_time not in taken_slots
-            }
-            for slot_time in times
-        ]
-    return slots
+    return slot_map(doctor_id, date_obj)
 
 
 @app.route('/appointments')
@@ -10862,10 +11441,11 @@ def appointments_overview():
 def appointments_select_specialty():
     from flask import jsonify
 
+    specialties = _specialty_list()
     return jsonify({
         'success': True,
-        'specialties': _specialty_list(),
-        'defaultSpecialty': _specialty_list()[0] if _specialty_list() else None
+        'specialties': specialties,
+        'defaultSpecialty': specialties[0] if specialties else None
     })
 
 
@@ -10877,14 +11457,26 @@ def appointments_doctors():
     specialty = request.args.get('specialty')
     mode = request.args.get('mode')
     query = request.args.get('query')
-    matched = _filter_doctors(specialty, query, mode)
+    # The booking wizard lists every match; API callers may page with ?page=&per_page=
+    page = request.args.get('page', type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    matched, total = _filter_doctors(specialty, query, mode, page=page, per_page=per_page)
     doctors = []
     for doc in matched:
-        doctor_copy = dict(doc)
-        doctor_copy['availableModes'] = doc.get('modes', [])
-        doctors.append(doctor_copy)
-
-    return jsonify({'success': True, 'doctors': doctors})
+        doc['availableModes'] = doc.get('modes', [])
+        doctors.append(doc)
+
+    result = {'success': True, 'doctors': doctors}
+    if page is not None:
+        page = max(page, 1)
+        per_page = max(1, min(per_page, 100))
+        result['pagination'] = {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'has_next': page * per_page < total
+        }
+    return jsonify(result)
 
 
 @app.route('/appointments/select-slot')
@@ -10945,6 +11537,13 @@ def appointments_book():
     if attachments and not isinstance(attachments, list):
         return jsonify({'success': False, 'message': 'Attachments must be a list'}), 400
 
+    # Claim the slot first; the claim and the appointment commit together
+    try:
+        claim_slot(data['doctorId'], appt_date, appt_time)
+    except SlotUnavailable as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'message': str(e)}), 409
+
     appointment = Appointment(
         reference_code=generate_appointment_code(),
         user_id=user.id,
@@ -10973,8 +11572,14 @@ def appointments_book():
         qr_code_data=data.get('qrCodeData')
     )
 
-    db.session.add(appointment)
-    db.session.commit()
+    try:
+        db.session.add(appointment)
+        db.session.flush()
+        attach_appointment(appointment.doctor_id, appt_date, appt_time, appointment.id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
 
     return jsonify({'success': True, 'appointment': serialize_appointment(appointment)})
 
@@ -11037,11 +11642,24 @@ def appointments_reschedule(appointment_id):
         return jsonify({'success': False, 'message': 'New date and time are required'}), 400
 
     try:
-        appointment.appointment_date = datetime.strptime(new_date, '%Y-%m-%d').date()
-        appointment.appointment_time = datetime.strptime(new_time, '%H:%M').time()
+        target_date = datetime.strptime(new_date, '%Y-%m-%d').date()
+        target_time = datetime.strptime(new_time, '%H:%M').time()
     except ValueError:
         return jsonify({'success': False, 'message': 'Invalid date/time supplied'}), 400
 
+    if appointment.status == 'cancelled':
+        return jsonify({'success': False, 'message': 'Cancelled appointments cannot be rescheduled'}), 400
+
+    if (target_date, target_time) != (appointment.appointment_date, appointment.appointment_time):
+        try:
+            move_slot(appointment.doctor_id, appointment.appointment_date, appointment.appointment_time,
+                      target_date, target_time, appointment.id)
+        except SlotUnavailable as e:
+            db.session.rollback()
+            return jsonify({'success': False, 'message': str(e)}), 409
+
+    appointment.appointment_date = target_date
+    appointment.appointment_time = target_time
     appointment.status = 'rescheduled'
     db.session.commit()
 
@@ -11059,6 +11677,8 @@ def appointments_cancel(appointment_id):
     if not appointment:
         return jsonify({'success': False, 'message': 'Appointment not found'}), 404
 
+    if appointment.status != 'cancelled':
+        release_slot(appointment.doctor_id, appointment.appointment_date, appointment.appointment_time, appointment.id)
     appointment.status = 'cancelled'
     db.session.commit()
 
@@ -12449,225 +13069,48 @@ def api_assign_task():
 
 @app.route('/api/facility/<int:facility_id>/analytics')
 def api_facility_analytics(facility_id):
-    """Comprehensive analytics data for facility dashboard - production ready"""
+    """Analytics for the facility dashboard, served from today's snapshot (?refresh=1 recomputes)"""
     try:
-        from datetime import date, datetime, timedelta
-        from sqlalchemy import func
-        
-        today = date.today()
-        
         facility = Facility.query.get(facility_id)
         if not facility:
             return jsonify({'success': False, 'error': 'Facility not found'}), 404
-        
-        # Get health workers for this facility
-        workers = User.query.filter_by(facility_id=facility_id, user_type='health_worker').all()
-        worker_ids = [w.id for w in workers]
-        worker_map = {w.id: w.full_name or w.first_name or 'Unknown' for w in workers}
-        
-        # === POPULATION HEALTH DISTRIBUTION ===
-        total_patients = 0
-        pregnant_count = 0
-        ncd_count = 0
-        children_under_5 = 0
-        elderly_count = 0
-        healthy_count = 0
-        
-        # Risk Distribution
-        risk_high = 0
-        risk_medium = 0
-        risk_low = 0
-        
-        # Villages
-        villages = set()
-        village_stats = {}
-        
-        if worker_ids:
-            # Get households and members
-            households = Household.query.filter(Household.health_worker_id.in_(worker_ids)).all()
-            
-            for h in households:
-                if h.village:
-                    villages.add(h.village)
-                    if h.village not in village_stats:
-                        village_stats[h.village] = {'households': 0, 'members': 0, 'high_risk': 0}
-                    village_stats[h.village]['households'] += 1
-                    village_stats[h.village]['members'] += h.total_members or 0
-                
-                # Risk distribution from households
-                if h.risk_level == 'high':
-                    risk_high += 1
-                elif h.risk_level == 'medium':
-                    risk_medium += 1
-                else:
-                    risk_low += 1
-                
-                # Condition counts from households
-                if h.has_pregnant_woman:
-                    pregnant_count += 1
-                if h.has_child_under_5:
-                    children_under_5 += 1
-                if h.has_elderly:
-                    elderly_count += 1
-                if h.has_ncd_patient:
-                    ncd_count += 1
-            
-            # Count clients/patients
-            clients = User.query.filter(
-                User.user_type == 'client',
-                User.assigned_health_worker_id.in_(worker_ids)
-            ).all()
-            
-            total_patients = len(clients)
-            
-            for c in clients:
-                if c.is_pregnant:
-                    pregnant_count += 1
-                if c.has_ncd:
-                    ncd_count += 1
-                if c.is_high_risk:
-                    risk_high += 1
-            
-            # Calculate healthy (not in special categories)
-            healthy_count = max(0, total_patients - pregnant_count - ncd_count)
-        
-        # Health distribution for chart
-        health_distribution = {
-            'healthy': healthy_count,
-            'pregnant': pregnant_count,
-            'ncd': ncd_count,
-            'children_under_5': children_under_5,
-            'elderly': elderly_count
-        }
-        
-        # === VISIT TRENDS (Last 7 days) ===
-        visit_trends = []
-        for i in range(6, -1, -1):
-            check_date = today - timedelta(days=i)
-            day_name = check_date.strftime('%a')
-            
-            # Count visits from ClientVisit or DailyVisit
-            visit_count = 0
-            if worker_ids:
-                visit_count = ClientVisit.query.filter(
-                    ClientVisit.health_worker_id.in_(worker_ids),
-                    func.date(ClientVisit.visit_date) == check_date
-                ).count()
-            
-            visit_trends.append({
-                'day': day_name,
-                'date': check_date.isoformat(),
-                'visits': visit_count
-            })
-        
-        # === WORKER PERFORMANCE ===
-        worker_performance = []
-        for w in workers:
-            h_count = Household.query.filter_by(health_worker_id=w.id).count()
-            
-            # Visits today
-            visits_today = ClientVisit.query.filter(
-                ClientVisit.health_worker_id == w.id,
-                func.date(ClientVisit.visit_date) == today
-            ).count()
-            
-            # Visits this week
-            week_start = today - timedelta(days=today.weekday())
-            visits_week = ClientVisit.query.filter(
-                ClientVisit.health_worker_id == w.id,
-                func.date(ClientVisit.visit_date) >= week_start
-            ).count()
-            
-            # Visits this month
-            month_start = date(today.year, today.month, 1)
-            visits_month = ClientVisit.query.filter(
-                ClientVisit.health_worker_id == w.id,
-                func.date(ClientVisit.visit_date) >= month_start
-            ).count()
-            
-            # Patient count
-            patient_count = User.query.filter(
-                User.user_type == 'client',
-                User.assigned_health_worker_id == w.id
-            ).count()
-            
-            # High risk assigned
-            high_risk_assigned = Household.query.filter(
-                Household.health_worker_id == w.id,
-                Household.risk_level == 'high'
-            ).count()
-            
-            # Calculate score (simple performance metric)
-            score = min(100, round((visits_week * 5 + h_count * 2 + patient_count * 3) / max(1, (h_count + patient_count)) * 10))
-            
-            worker_performance.append({
-                'id': w.id,
-                'name': worker_map.get(w.id, 'Unknown'),
-                'households': h_count,
-                'patients': patient_count,
-                'visits_today': visits_today,
-                'visits_week': visits_week,
-                'visits_month': visits_month,
-                'high_risk': high_risk_assigned,
-                'score': score
-            })
-        
-        # Sort by score descending
-        worker_performance.sort(key=lambda x: x['score'], reverse=True)
-        
-        # Add ranking
-        for i, wp in enumerate(worker_performance):
-            wp['rank'] = i + 1
-        
-        # === VILLAGE COVERAGE ===
-        village_coverage = []
-        for village, stats in village_stats.items():
-            village_coverage.append({
-                'name': village,
-                'households': stats['households'],
-                'members': stats['members'],
-                'high_risk': stats['high_risk']
-            })
-        village_coverage.sort(key=lambda x: x['households'], reverse=True)
-        
-        # === SUMMARY STATS ===
-        total_households = sum(wp['households'] for wp in worker_performance)
-        total_visits_today = sum(wp['visits_today'] for wp in worker_performance)
-        total_visits_week = sum(wp['visits_week'] for wp in worker_performance)
-        total_visits_month = sum(wp['visits_month'] for wp in worker_performance)
-        
-        return jsonify({
-            'success': True,
-            'summary': {
-                'total_workers': len(workers),
-                'total_patients': total_patients,
-                'total_households': total_households,
-                'total_villages': len(villages),
-                'visits_today': total_visits_today,
-                'visits_week': total_visits_week,
-                'visits_month': total_visits_month,
-                'high_risk_households': risk_high
-            },
-            'health_distribution': health_distribution,
-            'risk_distribution': {
-                'high': risk_high,
-                'medium': risk_medium,
-                'low': risk_low
-            },
-            'visit_trends': visit_trends,
-            'worker_performance': worker_performance,
-            'village_coverage': village_coverage[:10],  # Top 10
-            'facility': {
-                'id': facility.id,
-                'name': facility.name
-            }
-        })
+
+        analytics, computed_at = current_facility_analytics(
+            facility_id, force=request.args.get('refresh') in ('1', 'true')
+        )
+        return jsonify(dict(
+            analytics,
+            success=True,
+            facility={'id': facility.id, 'name': facility.name},
+            generated_at=computed_at.isoformat() + 'Z'
+        ))
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/facility/<int:facility_id>/analytics/history')
+def api_facility_analytics_history(facility_id):
+    """Daily analytics series from stored snapshots (?days=30&metrics=total_patients,high_risk)"""
+    facility = Facility.query.get(facility_id)
+    if not facility:
+        return jsonify({'success': False, 'error': 'Facility not found'}), 404
+
+    days = request.args.get('days', 30, type=int)
+    metrics = [m for m in request.args.get('metrics', '').split(',') if m] or FACILITY_TREND_METRICS
+    unknown = [m for m in metrics if m not in FACILITY_TREND_METRICS]
+    if unknown:
+        return jsonify({'success': False, 'error': f"Unknown metrics: {', '.join(unknown)}"}), 400
+
+    return jsonify({
+        'success': True,
+        'facility': {'id': facility.id, 'name': facility.name},
+        'metrics': list(metrics),
+        'series': facility_analytics_history(facility_id, days, metrics)
+    })
+
+
 @app.route('/api/facility/<int:facility_id>/inventory')
 def api_facility_inventory(facility_id):
     """Get inventory items for facility with stats"""
@@ -12800,60 +13243,21 @@ def api_update_inventory_stock(facility_id, item_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
-@app.route('/api/facility/<int:facility_id>/opd-queue')
-def api_facility_opd_queue(facility_id):
-    """Get today's OPD queue for facility"""
+@app.route('/api/facility/<int:facility_id>/inventory/forecast')
+@login_required
+def api_facility_inventory_forecast(facility_id):
+    """Days of stock remaining and reorder suggestions for a facility's inventory"""
     try:
-        from datetime import date
-        today = date.today()
-        
         facility = Facility.query.get(facility_id)
         if not facility:
             return jsonify({'success': False, 'error': 'Facility not found'}), 404
         
-        # Get today's queue
-        queue_items = OPDQueue.query.filter_by(
-            facility_id=facility_id,
-            queue_date=today
-        ).order_by(
-            # Priority order: emergency first, then urgent, then routine
-            db.case(
-                (OPDQueue.priority == 'emergency', 1),
-                (OPDQueue.priority == 'urgent', 2),
-                else_=3
-            ),
-            OPDQueue.registered_at
-        ).all()
-        
-        waiting = [q for q in queue_items if q.status == 'waiting']
-        in_consultation = [q for q in queue_items if q.status == 'in_consultation']
-        completed = [q for q in queue_items if q.status == 'completed']
-        
-        result = []
-        for q in queue_items:
-            result.append({
-                'id': q.id,
-                'token_number': q.token_number,
-                'patient_name': q.patient_name,
-                'member_id': q.member_id,
-                'reason': q.reason,
-                'priority': q.priority,
-                'status': q.status,
-                'registered_at': q.registered_at.strftime('%H:%M') if q.registered_at else None,
-                'called_at': q.called_at.strftime('%H:%M') if q.called_at else None,
-                'completed_at': q.completed_at.strftime('%H:%M') if q.completed_at else None
-            })
-        
+        statuses = [s for s in request.args.get('status', '').split(',') if s] or None
+        rows = stock_forecasts_for('facility', facility_ids=[facility_id], statuses=statuses)
         return jsonify({
             'success': True,
-            'stats': {
-                'total': len(queue_items),
-                'waiting': len(waiting),
-                'in_consultation': len(in_consultation),
-                'completed': len(completed)
-            },
-            'queue': result,
-            'current_patient': result[0] if in_consultation else None
+            'summary': stock_forecast_summary(rows),
+            'forecasts': [stock_forecast_dict(r) for r in rows]
         })
     except Exception as e:
         import traceback
@@ -12861,13 +13265,46 @@ def api_facility_opd_queue(facility_id):
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/facility/<int:facility_id>/opd-queue')
+def api_facility_opd_queue(facility_id):
+    """Get today's OPD queue for facility (served from the live in-memory queue)"""
+    try:
+        facility = Facility.query.get(facility_id)
+        if not facility:
+            return jsonify({'success': False, 'error': 'Facility not found'}), 404
+        
+        return jsonify({'success': True, **queue_state(facility_id)})
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/facility/<int:facility_id>/opd-queue/stream')
+@login_required
+def api_facility_opd_queue_stream(facility_id):
+    """Server-sent events for the OPD queue: snapshot, then token/call/complete updates"""
+    facility = Facility.query.get(facility_id)
+    if not facility:
+        return jsonify({'success': False, 'error': 'Facility not found'}), 404
+    
+    # Patient names stream for as long as the connection stays open: only the
+    # facility's own staff and its block admin may subscribe
+    is_staff = current_user.facility_id == facility_id
+    is_block_admin = current_user.user_type == 'block_admin' and facility.block_id == current_user.block_id
+    if not (is_staff or is_block_admin):
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    
+    initial_state = queue_state(facility_id)
+    db.session.remove()  # Don't hold a pooled connection for the life of the stream
+    return event_stream_response(facility_id, initial_state)
+
+
 @app.route('/api/facility/<int:facility_id>/opd-queue/add', methods=['POST'])
 @login_required
 def api_opd_add_patient(facility_id):
     """Add patient to OPD queue"""
     try:
-        from datetime import date
-        today = date.today()
         data = request.get_json()
         
         member_id = data.get('member_id')
@@ -12878,39 +13315,19 @@ def api_opd_add_patient(facility_id):
         if not member:
             return jsonify({'success': False, 'error': 'Member not found'}), 404
         
-        # Generate token number for today
-        last_token = OPDQueue.query.filter_by(
-            facility_id=facility_id,
-            queue_date=today
-        ).order_by(OPDQueue.id.desc()).first()
-        
-        if last_token:
-            last_num = int(last_token.token_number.split('-')[1])
-            new_num = last_num + 1
-        else:
-            new_num = 1
-        
-        token_number = f"OPD-{new_num:03d}"
-        
-        queue_entry = OPDQueue(
-            facility_id=facility_id,
-            member_id=member_id,
-            token_number=token_number,
-            patient_name=member.name,
+        # Token is reserved from the facility's daily counter in the same transaction
+        queue_entry, estimated_wait = add_opd_patient(
+            facility_id, member,
             reason=data.get('reason', 'General checkup'),
-            priority=data.get('priority', 'routine'),
-            status='waiting',
-            queue_date=today
+            priority=data.get('priority', 'routine')
         )
         
-        db.session.add(queue_entry)
-        db.session.commit()
-        
         return jsonify({
             'success': True,
             'message': 'Patient added to queue',
-            'token_number': token_number,
-            'queue_id': queue_entry.id
+            'token_number': queue_entry.token_number,
+            'queue_id': queue_entry.id,
+            'estimated_wait_minutes': estimated_wait
         })
     except Exception as e:
         db.session.rollback()
@@ -12926,11 +13343,11 @@ def api_opd_call_patient(facility_id, queue_id):
         if not entry or entry.facility_id != facility_id:
             return jsonify({'success': False, 'error': 'Queue entry not found'}), 404
         
-        entry.status = 'in_consultation'
-        entry.called_at = datetime.utcnow()
-        db.session.commit()
+        call_opd_patient(entry)
         
         return jsonify({'success': True, 'message': f'Calling {entry.patient_name}'})
+    except QueueConflict as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -12946,12 +13363,11 @@ def api_opd_complete_patient(facility_id, queue_id):
         if not entry or entry.facility_id != facility_id:
             return jsonify({'success': False, 'error': 'Queue entry not found'}), 404
         
-        entry.status = 'completed'
-        entry.completed_at = datetime.utcnow()
-        entry.notes = data.get('notes', '')
-        db.session.commit()
+        complete_opd_patient(entry, data.get('notes', ''))
         
         return jsonify({'success': True, 'message': 'Consultation completed'})
+    except QueueConflict as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
     except Exception as e:
         db.session.rollback()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -13023,9 +13439,8 @@ def api_search_members(facility_id):
 @app.route('/api/facility/<int:facility_id>/maternal')
 @app.route('/api/facility/<int:facility_id>/maternal-health')
 def api_facility_maternal_health(facility_id):
-    """Comprehensive maternal health data for facility dashboard - production ready"""
+    """Maternal health data for the facility dashboard, served from the ANC cohort"""
     try:
-        from datetime import date, timedelta
         today = date.today()
         
         facility = Facility.query.get(facility_id)
@@ -13034,316 +13449,17 @@ def api_facility_maternal_health(facility_id):
         
         # Get health workers for this facility
         workers = User.query.filter_by(facility_id=facility_id, user_type='health_worker').all()
-        worker_ids = [w.id for w in workers]
         worker_map = {w.id: w.full_name or w.first_name or 'Unknown' for w in workers}
         worker_list = [{'id': w.id, 'name': w.full_name or w.first_name or 'Unknown'} for w in workers]
         
-        pregnant_women = []
-        trimester_1 = 0
-        trimester_2 = 0
-        trimester_3 = 0
-        high_risk_count = 0
-        due_this_month = 0
-        anc_compliant = 0
-        
-        def get_trimester(week):
-            if not week:
-                return None
-            if week <= 12:
-                return 1
-            elif week <= 27:
-                return 2
-            else:
-                return 3
-        
-        def calculate_edd(lmp_date=None, pregnancy_week=None):
-            """Calculate Expected Delivery Date"""
-            if lmp_date:
-                return lmp_date + timedelta(days=280)
-            elif pregnancy_week:
-                weeks_remaining = 40 - pregnancy_week
-                return today + timedelta(weeks=weeks_remaining)
-            return None
-        
-        def check_anc_compliance(week, anc_count):
-            """Check if ANC visits are on track"""
-            if not week:
-                return False
-            # Expected ANC: 1st visit by week 12, then monthly
-            if week <= 12:
-                return anc_count >= 1
-            elif week <= 20:
-                return anc_count >= 2
-            elif week <= 28:
-                return anc_count >= 3
-            else:
-                return anc_count >= 4
-        
-        if worker_ids:
-            # Get pregnant women from household members
-            households = Household.query.filter(Household.health_worker_id.in_(worker_ids)).all()
-            household_map = {h.id: h for h in households}
-            
-            for h in households:
-                members = HouseholdMember.query.filter_by(household_id=h.id, is_pregnant=True).all()
-                for m in members:
-                    week = m.pregnancy_week or 20  # Default to week 20 if not set
-                    trimester = get_trimester(week)
-                    
-                    # Count trimesters
-                    if trimester == 1:
-                        trimester_1 += 1
-                    elif trimester == 2:
-                        trimester_2 += 1
-                    elif trimester == 3:
-                        trimester_3 += 1
-                    
-                    # High risk check
-                    is_high_risk = m.is_high_risk or (m.age and (m.age < 18 or m.age > 35)) or week > 36
-                    if is_high_risk:
-                        high_risk_count += 1
-                    
-                    # Expected delivery date
-                    edd = m.expected_delivery_date or calculate_edd(pregnancy_week=week)
-                    
-                    # Check if due this month
-                    if edd and edd.year == today.year and edd.month == today.month:
-                        due_this_month += 1
-                    
-                    # ANC compliance (mock - assume average visits based on week)
-                    anc_count = max(1, week // 8)  # Rough estimate
-                    is_compliant = check_anc_compliance(week, anc_count)
-                    if is_compliant:
-                        anc_compliant += 1
-                    
-                    risk_reason = m.risk_reason
-                    if not risk_reason and is_high_risk:
-                        if m.age and m.age < 18:
-                            risk_reason = "Teenage pregnancy"
-                        elif m.age and m.age > 35:
-                            risk_reason = "Advanced maternal age"
-                        elif week > 36:
-                            risk_reason = "Late pregnancy"
-                    
-                    pregnant_women.append({
-                        'id': m.id,
-                        'name': m.name,
-                        'age': m.age,
-                        'village': h.village,
-                        'phone': h.phone,
-                        'pregnancy_week': week,
-                        'trimester': trimester,
-                        'expected_delivery_date': edd.isoformat() if edd else None,
-                        'is_high_risk': is_high_risk,
-                        'risk_reason': risk_reason,
-                        'anc_visits': anc_count,
-                        'is_anc_compliant': is_compliant,
-                        'last_visit_date': h.last_visit_date.isoformat() if h.last_visit_date else None,
-                        'worker_id': h.health_worker_id,
-                        'worker_name': worker_map.get(h.health_worker_id, 'Unknown'),
-                        'source': 'household'
-                    })
-            
-            # Also get pregnant clients (User table)
-            clients = User.query.filter(
-                User.user_type == 'client',
-                User.assigned_health_worker_id.in_(worker_ids),
-                User.is_pregnant == True
-            ).all()
-            
-            for c in clients:
-                week = c.pregnancy_week or 20
-                trimester = get_trimester(week)
-                
-                if trimester == 1:
-                    trimester_1 += 1
-                elif trimester == 2:
-                    trimester_2 += 1
-                elif trimester == 3:
-                    trimester_3 += 1
-                
-                is_high_risk = c.is_high_risk
-                if c.dob:
-                    age = (today - c.dob).days // 365
-                    is_high_risk = is_high_risk or age < 18 or age > 35
-                else:
-                    age = None
-                
-                if is_high_risk:
-                    high_risk_count += 1
-                
-                edd = c.expected_delivery_date or calculate_edd(pregnancy_week=week)
-                
-                if edd and edd.year == today.year and edd.month == today.month:
-                    due_this_month += 1
-                
-                anc_count = max(1, week // 8)
-                is_compliant = check_anc_compliance(week, anc_count)
-                if is_compliant:
-                    anc_compliant += 1
-                
-                risk_reason = c.risk_reason
-                if not risk_reason and is_high_risk:
-                    if age and age < 18:
-                        risk_reason = "Teenage pregnancy"
-                    elif age and age > 35:
-                        risk_reason = "Advanced maternal age"
-                
-                pregnant_women.append({
-                    'id': c.id,
-                    'name': c.full_name or f"{c.first_name or ''} {c.last_name or ''}".strip(),
-                    'age': age,
-                    'village': c.village,
-                    'phone': c.mobile,
-                    'pregnancy_week': week,
-                    'trimester': trimester,
-                    'expected_delivery_date': edd.isoformat() if edd else None,
-                    'is_high_risk': is_high_risk,
-                    'risk_reason': risk_reason,
-                    'anc_visits': anc_count,
-                    'is_anc_compliant': is_compliant,
-                    'last_visit_date': None,
-                    'worker_id': c.assigned_health_worker_id,
-                    'worker_name': worker_map.get(c.assigned_health_worker_id, 'Unknown'),
-                    'source': 'client'
-                })
-        
-        # Sort by risk (high risk first), then by EDD
-        pregnant_women.sort(key=lambda x: (not x['is_high_risk'], x['expected_delivery_date'] or '9999-12-31'))
-        
-        total = len(pregnant_women)
-        
-        # === PNC (Postnatal Care) DATA ===
-        # Track women who recently delivered (within last 42 days / 6 weeks)
-        postnatal_women = []
-        pnc_count = 0
-        pnc_high_risk = 0
-        pnc_compliant = 0
-        
-        # Check for PNC assessments in the last 6 weeks
-        if worker_ids:
-            pnc_cutoff = today - timedelta(days=42)
-            
-            # Get PNC assessments
-            pnc_assessments = HealthAssessment.query.filter(
-                HealthAssessment.health_worker_id.in_(worker_ids),
-                HealthAssessment.assessment_type == 'PNC',
-                HealthAssessment.created_at >= pnc_cutoff
-            ).order_by(HealthAssessment.created_at.desc()).all()
-            
-            # Group by patient to avoid duplicates
-            seen_patients = set()
-            for a in pnc_assessments:
-                if a.patient_id and a.patient_id not in seen_patients:
-                    seen_patients.add(a.patient_id)
-                    
-                    # Get patient info
-                    patient = User.query.get(a.patient_id)
-                    if patient:
-                        delivery_date = a.created_at.date() if a.created_at else None
-                        days_since_delivery = (today - delivery_date).days if delivery_date else 0
-                        
-                        # PNC weeks
-                        pnc_week = days_since_delivery // 7 + 1 if days_since_delivery >= 0 else 1
-                        
-                        # Risk assessment
-                        is_high_risk = a.risk_level == 'high' if hasattr(a, 'risk_level') else False
-                        
-                        if is_high_risk:
-                            pnc_high_risk += 1
-                        
-                        # PNC compliance (at least 2 visits in first week, then weekly)
-                        pnc_visits = HealthAssessment.query.filter(
-                            HealthAssessment.patient_id == a.patient_id,
-                            HealthAssessment.assessment_type == 'PNC',
-                            HealthAssessment.created_at >= pnc_cutoff
-                        ).count()
-                        
-                        is_compliant = pnc_visits >= min(pnc_week + 1, 4)  # Expected visits based on week
-                        if is_compliant:
-                            pnc_compliant += 1
-                        
-                        pnc_count += 1
-                        
-                        postnatal_women.append({
-                            'id': patient.id,
-                            'name': patient.full_name or f"{patient.first_name or ''} {patient.last_name or ''}".strip(),
-                            'age': None,
-                            'village': patient.village,
-                            'phone': patient.mobile,
-                            'delivery_date': delivery_date.isoformat() if delivery_date else None,
-                            'days_since_delivery': days_since_delivery,
-                            'pnc_week': pnc_week,
-                            'pnc_visits': pnc_visits,
-                            'is_pnc_compliant': is_compliant,
-                            'is_high_risk': is_high_risk,
-                            'risk_reason': a.clinical_notes if is_high_risk else None,
-                            'worker_id': a.health_worker_id,
-                            'worker_name': worker_map.get(a.health_worker_id, 'Unknown'),
-                            'last_visit_date': a.created_at.strftime('%Y-%m-%d') if a.created_at else None
-                        })
-            
-            # Also check household members with delivery_date in last 6 weeks
-            for h in households:
-                members = HouseholdMember.query.filter(
-                    HouseholdMember.household_id == h.id,
-                    HouseholdMember.is_pregnant == False  # No longer pregnant
-                ).all()
-                
-                for m in members:
-                    # Check if they had a recent delivery (use expected_delivery_date)
-                    if m.expected_delivery_date and m.expected_delivery_date >= pnc_cutoff and m.expected_delivery_date <= today:
-                        if m.id not in seen_patients:
-                            seen_patients.add(m.id)
-                            
-                            delivery_date = m.expected_delivery_date
-                            days_since_delivery = (today - delivery_date).days if delivery_date else 0
-                            pnc_week = days_since_delivery // 7 + 1 if days_since_delivery >= 0 else 1
-                            
-                            pnc_count += 1
-                            
-                            postnatal_women.append({
-                                'id': m.id,
-                                'name': m.name,
-                                'age': m.age,
-                                'village': h.village,
-                                'phone': h.phone,
-                                'delivery_date': delivery_date.isoformat() if delivery_date else None,
-                                'days_since_delivery': days_since_delivery,
-                                'pnc_week': pnc_week,
-                                'pnc_visits': 0,  # Unknown
-                                'is_pnc_compliant': False,
-                                'is_high_risk': m.is_high_risk or False,
-                                'risk_reason': m.risk_reason,
-                                'worker_id': h.health_worker_id,
-                                'worker_name': worker_map.get(h.health_worker_id, 'Unknown'),
-                                'last_visit_date': h.last_visit_date.isoformat() if h.last_visit_date else None,
-                                'source': 'household'
-                            })
-        
-        # Sort PNC by days since delivery (recent first)
-        postnatal_women.sort(key=lambda x: x.get('days_since_delivery', 0))
+        ensure_anc_cohort()
+        scope = anc_scope(facility_id=facility_id)
         
         return jsonify({
             'success': True,
-            'summary': {
-                'total_pregnant': total,
-                'high_risk': high_risk_count,
-                'high_risk_percent': round((high_risk_count / total * 100) if total > 0 else 0, 1),
-                'due_this_month': due_this_month,
-                'anc_compliant': anc_compliant,
-                'anc_compliant_percent': round((anc_compliant / total * 100) if total > 0 else 0, 1),
-                'trimester_1': trimester_1,
-                'trimester_2': trimester_2,
-                'trimester_3': trimester_3,
-                # PNC Summary
-                'total_pnc': pnc_count,
-                'pnc_high_risk': pnc_high_risk,
-                'pnc_compliant': pnc_compliant,
-                'pnc_compliant_percent': round((pnc_compliant / pnc_count * 100) if pnc_count > 0 else 0, 1)
-            },
-            'pregnant_women': pregnant_women,
-            'postnatal_women': postnatal_women,
+            'summary': anc_cohort_summary(scope, today),
+            'pregnant_women': [pregnancy_dict(e, worker_map, today) for e in active_pregnancies(scope, today)],
+            'postnatal_women': [postnatal_dict(e, worker_map, today) for e in recent_deliveries(scope, today)],
             'workers': worker_list,
             'facility': {
                 'id': facility.id,
@@ -13822,22 +13938,27 @@ def api_block_admin_supply_stats():
                 FacilityInventory.facility_id.in_(facility_ids)
             ).all()
             
+            # Burn-rate forecasts decide critical/low (days of stock left, not just current vs min)
+            forecasts = {f.item_id: f for f in stock_forecasts_for('facility', facility_ids=facility_ids)}
+            
             for inv in inventory_items:
-                # Determine stock status
                 stock_pct = inv.stock_percentage or 0
-                if stock_pct <= 10:
+                fc = forecasts.get(inv.id)
+                fc_status = fc.status if fc else ('out' if (inv.current_stock or 0) <= 0 else 'ok')
+                if fc_status in ('out', 'critical'):
                     status = 'critical'
                     critical_count += 1
+                    runs_out = 'out of stock' if fc_status == 'out' else f'runs out in ~{fc.days_remaining:g} days'
                     alerts.append({
                         'type': 'critical',
                         'icon': '🚨',
-                        'message': f'{inv.name} critically low at {facility_map.get(inv.facility_id, "Unknown")}',
-                        'action': 'Order immediately'
+                        'message': f'{inv.item_name} {runs_out} at {facility_map.get(inv.facility_id, "Unknown")}',
+                        'action': f'Order {fc.reorder_qty} {inv.unit or "units"} now' if fc and fc.reorder_qty else 'Order immediately'
                     })
-                elif stock_pct <= 30:
+                elif fc_status == 'reorder':
                     status = 'low'
                     low_count += 1
-                elif stock_pct > 100:
+                elif (inv.current_stock or 0) > (inv.maximum_stock or 0) > 0:
                     status = 'overstock'
                     overstock_count += 1
                 else:
@@ -13855,24 +13976,29 @@ def api_block_admin_supply_stats():
                         alerts.append({
                             'type': 'warning',
                             'icon': '⏰',
-                            'message': f'{inv.name} expires in {days_to_expiry} days',
+                            'message': f'{inv.item_name} expires in {days_to_expiry} days',
                             'action': 'Use or redistribute'
                         })
                 
                 items.append({
                     'id': inv.id,
-                    'name': inv.name,
+                    'name': inv.item_name,
                     'category': inv.category,
                     'facility': facility_map.get(inv.facility_id, 'Unknown'),
                     'facility_id': inv.facility_id,
-                    'current_qty': inv.current_quantity or 0,
-                    'min_qty': inv.minimum_quantity or 0,
-                    'max_qty': inv.maximum_quantity or 100,
+                    'current_qty': inv.current_stock or 0,
+                    'min_qty': inv.minimum_stock or 0,
+                    'max_qty': inv.maximum_stock or 100,
                     'stock_pct': stock_pct,
                     'status': status,
                     'days_left': days_to_expiry,
                     'expiry': inv.expiry_date.strftime('%d %b %Y') if inv.expiry_date else 'N/A',
-                    'unit': inv.unit or 'units'
+                    'unit': inv.unit or 'units',
+                    'daily_use': fc.daily_burn if fc else 0,
+                    'days_of_stock': fc.days_remaining if fc else None,
+                    'stockout_date': fc.stockout_date.isoformat() if fc and fc.stockout_date else None,
+                    'reorder_qty': fc.reorder_qty if fc else 0,
+                    'reorder_by': fc.reorder_by.isoformat() if fc and fc.reorder_by else None
                 })
         
         # Generate demand forecast (simple projection based on current data)
@@ -13896,6 +14022,10 @@ def api_block_admin_supply_stats():
             'items': items,
             'alerts': alerts[:10],  # Limit to 10 alerts
             'forecast': forecast,
+            'reorder': sorted(
+                [i for i in items if i['reorder_qty']],
+                key=lambda i: (i['days_of_stock'] is None, i['days_of_stock'] or 0)
+            )[:20],
             'facilities': [{'id': f.id, 'name': f.name} for f in facilities]
         })
     except Exception as e:
@@ -13904,6 +14034,41 @@ def api_block_admin_supply_stats():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/block-admin/supply-forecast')
+@login_required
+def api_block_admin_supply_forecast():
+    """Reorder suggestions across the block's facilities (and its workers' kits with ?source=worker)"""
+    try:
+        if current_user.user_type != 'block_admin':
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+        
+        my_block = current_user.block_id
+        if not my_block:
+            return jsonify({'success': True, 'summary': {}, 'forecasts': []})
+        
+        source = request.args.get('source', 'facility')
+        if source not in ('facility', 'worker'):
+            return jsonify({'success': False, 'error': 'Invalid source'}), 400
+        statuses = [s for s in request.args.get('status', '').split(',') if s] or None
+        
+        rows = stock_forecasts_for(source, block_id=my_block, statuses=statuses)
+        facility_map = {f.id: f.name for f in Facility.query.filter_by(block_id=my_block).all()}
+        forecasts = []
+        for r in rows:
+            entry = stock_forecast_dict(r)
+            entry['facility'] = facility_map.get(r.facility_id, 'Unknown')
+            forecasts.append(entry)
+        return jsonify({
+            'success': True,
+            'summary': stock_forecast_summary(rows),
+            'forecasts': forecasts
+        })
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 # ==================== BLOCK ADMIN: OUTREACH INTELLIGENCE PAGE ====================
 
 @app.route('/api/block-admin/outreach-stats')
@@ -14171,19 +14336,22 @@ def api_block_admin_ai_alerts():
                 FacilityInventory.facility_id.in_(facility_ids)
             ).all()
             
+            forecasts = {f.item_id: f for f in stock_forecasts_for('facility', facility_ids=facility_ids)}
+            
             for inv in low_stock_items:
-                stock_pct = inv.stock_percentage or 0
-                if stock_pct <= 20:  # Critical or low stock
-                    severity = 'critical' if stock_pct <= 10 else 'high'
+                fc = forecasts.get(inv.id)
+                if fc and fc.status != 'ok':  # Runs out within lead time + safety stock, or below minimum
+                    severity = 'critical' if fc.status in ('out', 'critical') else 'high'
+                    runway = f'~{fc.days_remaining:g} days of stock left' if fc.days_remaining is not None else 'below minimum level'
                     alerts.append({
                         'id': alert_id,
                         'type': 'supply',
                         'severity': severity,
-                        'title': f'Low Stock: {inv.name}',
-                        'description': f'Only {inv.current_quantity or 0} {inv.unit or "units"} remaining ({stock_pct}% of capacity)',
+                        'title': f'Low Stock: {inv.item_name}',
+                        'description': f'Only {inv.current_stock or 0} {inv.unit or "units"} remaining ({runway})',
                         'village': facility_map.get(inv.facility_id, 'Unknown Facility'),
                         'affected_count': 1,
-                        'recommended_action': 'Reorder immediately',
+                        'recommended_action': f'Reorder {fc.reorder_qty} {inv.unit or "units"}' if fc.reorder_qty else 'Reorder immediately',
                         'created_at': 'Now',
                         'acknowledged': False
                     })
@@ -14198,10 +14366,10 @@ def api_block_admin_ai_alerts():
                             'id': alert_id,
                             'type': 'supply',
                             'severity': severity,
-                            'title': f'Expiring Soon: {inv.name}',
-                            'description': f'{inv.current_quantity or 0} units expiring in {days_to_expiry} days',
+                            'title': f'Expiring Soon: {inv.item_name}',
+                            'description': f'{inv.current_stock or 0} units expiring in {days_to_expiry} days',
                             'village': facility_map.get(inv.facility_id, 'Unknown Facility'),
-                            'affected_count': inv.current_quantity or 0,
+                            'affected_count': inv.current_stock or 0,
                             'recommended_action': 'Use or redistribute before expiry',
                             'created_at': f'{days_to_expiry}d to expiry',
                             'acknowledged': False
@@ -14466,12 +14634,15 @@ def api_block_admin_block_performance():
             'immunization': round(coverage_pct * 0.9)  # Approximation
         }
         
-        # Maternal breakdown
+        # Maternal breakdown (ANC cohort)
+        ensure_anc_cohort()
+        cohort = anc_cohort_summary(anc_scope(block_ids=[my_block]), today)
         maternal = {
-            'total_pregnant': sum(1 for m in members if m.is_pregnant),
+            'total_pregnant': cohort['total_pregnant'],
             'total_lactating': sum(1 for m in members if m.is_lactating),
-            'high_risk': sum(1 for m in members if m.is_pregnant and m.chronic_conditions),
-            'anc_done': sum(1 for m in members if m.is_pregnant)  # Placeholder
+            'high_risk': cohort['high_risk'],
+            'anc_done': cohort['anc_compliant'],
+            'due_next_14_days': cohort['due_next_14_days']
         }
         
         # Child breakdown
@@ -14505,6 +14676,47 @@ def api_block_admin_block_performance():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _maternal_cohort_payload(scope, worker_ids):
+    """Summary plus due-soon and high-risk lists for a block/district maternal view"""
+    try:
+        due_within = max(0, min(int(request.args.get('due_within', ANC_DUE_SOON_DAYS)), 280))
+    except (TypeError, ValueError):
+        due_within = ANC_DUE_SOON_DAYS
+    today = date.today()
+    ensure_anc_cohort()
+    workers = User.query.filter(User.id.in_(worker_ids)).all() if worker_ids else []
+    worker_map = {w.id: w.full_name or w.first_name or 'Unknown' for w in workers}
+    due_soon = active_pregnancies(scope, today, due_within=due_within, limit=ANC_LIST_LIMIT)
+    high_risk = active_pregnancies(scope, today, high_risk_only=True, limit=ANC_LIST_LIMIT)
+    return {
+        'success': True,
+        'summary': anc_cohort_summary(scope, today),
+        'due_within_days': due_within,
+        'due_soon': [pregnancy_dict(e, worker_map, today) for e in due_soon],
+        'high_risk': [pregnancy_dict(e, worker_map, today) for e in high_risk]
+    }
+
+
+@app.route('/api/block-admin/maternal-cohort')
+@login_required
+def api_block_admin_maternal_cohort():
+    """Block maternal dashboard: ANC cohort summary, EDD-due list (?due_within=14), high-risk list"""
+    try:
+        if current_user.user_type != 'block_admin':
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+        
+        my_block = current_user.block_id
+        if not my_block:
+            return jsonify({'success': False, 'error': 'No block assigned'}), 400
+        
+        worker_ids = [w.id for w in User.query.filter_by(user_type='health_worker', block_id=my_block).all()]
+        return jsonify(_maternal_cohort_payload(anc_scope(block_ids=[my_block]), worker_ids))
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 # ==================== BLOCK ADMIN: PHC COMPARISON PAGE ====================
 
 @app.route('/api/block-admin/phc-comparison')
@@ -14806,22 +15018,46 @@ def api_block_admin_reports_center():
             {'id': 'household_coverage', 'name': 'Household Coverage', 'icon': 'fa-home', 'color': '#007bff', 'frequency': 'Weekly'},
             {'id': 'worker_performance', 'name': 'Worker Performance', 'icon': 'fa-users', 'color': '#28a745', 'frequency': 'Monthly'},
             {'id': 'supply_status', 'name': 'Supply Status', 'icon': 'fa-boxes', 'color': '#ffc107', 'frequency': 'Weekly'},
-            {'id': 'health_camps', 'name': 'Health Camps', 'icon': 'fa-campground', 'color': '#17a2b8', 'frequency': 'Monthly'},
             {'id': 'maternal_health', 'name': 'Maternal Health', 'icon': 'fa-baby', 'color': '#e83e8c', 'frequency': 'Monthly'},
             {'id': 'immunization', 'name': 'Immunization Status', 'icon': 'fa-syringe', 'color': '#6f42c1', 'frequency': 'Weekly'}
         ]
+        type_lookup = {t['id']: t for t in report_types}
+        
+        # Summary from the report queue/store, aggregated in SQL
+        month_ago = datetime.utcnow() - timedelta(days=30)
+        totals = db.session.query(
+            func.count(GeneratedReport.id),
+            func.sum(db.case((GeneratedReport.created_at >= month_ago, 1), else_=0)),
+            func.sum(db.case((GeneratedReport.status.in_(['queued', 'processing']), 1), else_=0)),
+            func.sum(db.case((GeneratedReport.is_scheduled == True, 1), else_=0)),
+            func.sum(db.case((GeneratedReport.status == 'ready', GeneratedReport.file_size_bytes), else_=0))
+        ).filter(GeneratedReport.block_id == current_user.block_id).one()
+        total_reports, this_month, pending, scheduled_count, storage_bytes = totals
         
-        # Summary (empty - no Report model yet)
         summary = {
-            'total_reports_generated': 0,
-            'reports_this_month': 0,
-            'scheduled_reports': 0,
-            'pending_exports': 0,
-            'storage_used': '0 MB'
+            'total_reports_generated': total_reports or 0,
+            'reports_this_month': int(this_month or 0),
+            'scheduled_reports': int(scheduled_count or 0),
+            'pending_exports': int(pending or 0),
+            'storage_used': f'{(storage_bytes or 0) / (1024 * 1024):.1f} MB'
         }
         
-        # Recent reports (empty - no Report model yet)
-        recent_reports = []
+        # Recent reports
+        format_labels = {'pdf': 'PDF', 'excel': 'Excel', 'csv': 'CSV', 'json': 'API'}
+        recent = GeneratedReport.query.filter_by(
+            block_id=current_user.block_id
+        ).order_by(GeneratedReport.created_at.desc()).limit(10).all()
+        recent_reports = [{
+            'id': r.id,
+            'type_name': r.report_name or r.report_type,
+            'type_icon': type_lookup.get(r.report_type, {}).get('icon'),
+            'type_color': type_lookup.get(r.report_type, {}).get('color'),
+            'generated_at': r.generated_at.strftime('%d %b %Y, %H:%M') if r.status == 'ready' and r.generated_at else '-',
+            'export_format': format_labels.get(r.export_format, (r.export_format or '').upper()),
+            'file_size': r.file_size or '-',
+            'status': r.status,
+            'download_url': f'/api/block-admin/reports/{r.id}/download' if r.status == 'ready' else None
+        } for r in recent]
         
         # Scheduled reports (empty - no scheduled report model yet)
         scheduled_reports = []
@@ -15007,10 +15243,26 @@ def api_block_admin_list_tasks():
     
     try:
         my_block = current_user.block_id
-        tasks = BlockTask.query.filter_by(block_id=my_block).order_by(BlockTask.created_at.desc()).all()
+        query = BlockTask.query.filter_by(block_id=my_block)
+        if request.args.get('status'):
+            query = query.filter(BlockTask.status == request.args.get('status'))
+        if request.args.get('priority'):
+            query = query.filter(BlockTask.priority == request.args.get('priority'))
+        
+        # Newest first; ids are assigned in creation order
+        try:
+            result = keyset_paginate(
+                query.options(db.joinedload(BlockTask.assigned_to)),
+                [SortKey(BlockTask.id, desc=True)],
+                cursor=request.args.get('cursor'),
+                per_page=request.args.get('per_page', 100),
+                count_mode=request.args.get('count', 'none')
+            )
+        except InvalidCursor as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         tasks_data = []
-        for t in tasks:
+        for t in result.items:
             worker_name = None
             if t.assigned_to:
                 worker_name = t.assigned_to.full_name or t.assigned_to.email
@@ -15033,21 +15285,26 @@ def api_block_admin_list_tasks():
                 'notes': t.notes
             })
         
-        # Summary stats
+        # Summary stats for the whole block (grouped counts, independent of the page)
+        status_counts = dict(db.session.query(BlockTask.status, db.func.count(BlockTask.id)).filter(
+            BlockTask.block_id == my_block).group_by(BlockTask.status).all())
+        priority_counts = dict(db.session.query(BlockTask.priority, db.func.count(BlockTask.id)).filter(
+            BlockTask.block_id == my_block).group_by(BlockTask.priority).all())
         summary = {
-            'total': len(tasks_data),
-            'pending': len([t for t in tasks_data if t['status'] == 'pending']),
-            'in_progress': len([t for t in tasks_data if t['status'] == 'in_progress']),
-            'completed': len([t for t in tasks_data if t['status'] == 'completed']),
-            'overdue': len([t for t in tasks_data if t['status'] == 'overdue']),
-            'critical': len([t for t in tasks_data if t['priority'] == 'critical']),
-            'high': len([t for t in tasks_data if t['priority'] == 'high'])
+            'total': sum(status_counts.values()),
+            'pending': status_counts.get('pending', 0),
+            'in_progress': status_counts.get('in_progress', 0),
+            'completed': status_counts.get('completed', 0),
+            'overdue': status_counts.get('overdue', 0),
+            'critical': priority_counts.get('critical', 0),
+            'high': priority_counts.get('high', 0)
         }
         
         return jsonify({
             'success': True,
             'tasks': tasks_data,
-            'summary': summary
+            'summary': summary,
+            'pagination': result.to_dict()
         })
     except Exception as e:
         import traceback
@@ -15448,14 +15705,16 @@ def api_block_admin_list_reports():
                 'status': r.status,
                 'download_count': r.download_count,
                 'generated_at': r.generated_at.strftime('%d %b %Y, %H:%M') if r.generated_at else None,
-                'generated_by_type': r.generated_by_type
+                'generated_by_type': r.generated_by_type,
+                'expires_at': r.expires_at.strftime('%d %b %Y') if r.expires_at else None,
+                'download_url': f'/api/block-admin/reports/{r.id}/download' if r.status == 'ready' else None
             })
         
         # Summary
         summary = {
             'total_reports': len(reports_data),
             'reports_this_month': len([r for r in reports if r.generated_at and (datetime.now() - r.generated_at).days <= 30]),
-            'pending': len([r for r in reports_data if r['status'] == 'processing']),
+            'pending': len([r for r in reports_data if r['status'] in ('queued', 'processing')]),
             'ready': len([r for r in reports_data if r['status'] == 'ready'])
         }
         
@@ -15473,67 +15732,62 @@ def api_block_admin_list_reports():
 @app.route('/api/block-admin/reports/generate', methods=['POST'])
 @login_required
 def api_block_admin_generate_report():
-    """Generate a new report"""
+    """Queue a new report for generation"""
     if current_user.user_type != 'block_admin':
         return jsonify({'success': False, 'error': 'Unauthorized'}), 403
     
     try:
-        data = request.get_json()
-        
-        # Generate report ID
-        rpt_count = GeneratedReport.query.filter_by(block_id=current_user.block_id).count()
-        report_id = f"RPT-{rpt_count + 1:04d}"
+        data = request.get_json() or {}
         
         report_type = data.get('report_type', 'household_coverage')
-        export_format = data.get('export_format', 'pdf')
-        
-        # Report type names
-        type_names = {
-            'household_coverage': 'Household Coverage Report',
-            'worker_performance': 'Worker Performance Report',
-            'supply_status': 'Supply Status Report',
-            'health_camps': 'Health Camps Report',
-            'maternal_health': 'Maternal Health Report',
-            'immunization': 'Immunization Report'
-        }
+        if REPORT_TYPES.get(report_type, {}).get('scope') != 'block':
+            return jsonify({'success': False, 'error': f'Unsupported report type: {report_type}'}), 400
         
-        # Parse date range
+        export_format = normalize_report_format(data.get('export_format', 'pdf'))
+        if not export_format:
+            return jsonify({'success': False, 'error': 'Export format must be one of: pdf, csv, excel, json'}), 400
+        
+        # Parse date range (defaults to the report type's period)
         date_start = None
         date_end = None
         if data.get('date_start'):
             date_start = datetime.strptime(data['date_start'], '%Y-%m-%d').date()
         if data.get('date_end'):
             date_end = datetime.strptime(data['date_end'], '%Y-%m-%d').date()
+        date_start, date_end = default_period(report_type, date_start, date_end)
+        if date_start > date_end:
+            return jsonify({'success': False, 'error': 'Start date must be before end date'}), 400
         
-        # Simulate file generation (in real app, would generate actual PDF/Excel)
-        file_size = f"{random.uniform(0.5, 3.0):.1f} MB"
+        # Generate report ID
+        rpt_count = GeneratedReport.query.filter_by(block_id=current_user.block_id).count()
+        report_id = f"RPT-{rpt_count + 1:04d}"
         
         new_report = GeneratedReport(
             report_id=report_id,
             report_type=report_type,
-            report_name=type_names.get(report_type, report_type),
+            report_name=REPORT_TYPES[report_type]['name'],
             export_format=export_format,
             date_range_start=date_start,
             date_range_end=date_end,
-            file_path=f"/reports/{report_id}.{export_format}",
-            file_size=file_size,
-            status='ready',  # In real app, would be 'processing' first
+            status='queued',
             block_id=current_user.block_id,
             generated_by_id=current_user.id,
-            generated_by_type='manual',
-            generated_at=datetime.utcnow(),
-            expires_at=datetime.utcnow() + timedelta(days=30)
+            generated_by_type='manual'
         )
-        
         db.session.add(new_report)
+        enqueue_report(new_report, 'block', current_user.block_id)
         db.session.commit()
+        kick_embedded_worker()
         
         return jsonify({
             'success': True,
-            'message': f'Report generated successfully',
+            'message': 'Report queued for generation',
+            'id': new_report.id,
             'report_id': report_id,
-            'file_size': file_size
-        })
+            'status': new_report.status
+        }), 202
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Dates must be in YYYY-MM-DD format'}), 400
     except Exception as e:
         db.session.rollback()
         import traceback
@@ -15541,10 +15795,31 @@ def api_block_admin_generate_report():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _send_generated_report(report):
+    """Serve a report file from the report store (or explain why it cannot be)"""
+    if report.status in ('queued', 'processing'):
+        return jsonify({'success': False, 'error': 'Report is still being generated', 'status': report.status}), 409
+    if report.status == 'failed':
+        return jsonify({'success': False, 'error': 'Report generation failed', 'status': report.status}), 409
+    
+    path = report_file_path(report)
+    if report.status == 'expired' or not path or not os.path.exists(path):
+        return jsonify({'success': False, 'error': 'Report has expired', 'status': 'expired'}), 410
+    
+    GeneratedReport.query.filter_by(id=report.id).update({
+        'download_count': func.coalesce(GeneratedReport.download_count, 0) + 1
+    }, synchronize_session=False)
+    db.session.commit()
+    
+    extension, mimetype = REPORT_FORMATS.get(report.export_format, ('bin', 'application/octet-stream'))
+    return send_file(path, mimetype=mimetype, as_attachment=True,
+                     download_name=f"{report.report_id}.{extension}")
+
+
 @app.route('/api/block-admin/reports/<int:report_id>/download', methods=['GET'])
 @login_required
 def api_block_admin_download_report(report_id):
-    """Mark report as downloaded (increment count)"""
+    """Download a generated report file"""
     if current_user.user_type != 'block_admin':
         return jsonify({'success': False, 'error': 'Unauthorized'}), 403
     
@@ -15553,16 +15828,9 @@ def api_block_admin_download_report(report_id):
         if not report or report.block_id != current_user.block_id:
             return jsonify({'success': False, 'error': 'Report not found'}), 404
         
-        report.download_count += 1
-        db.session.commit()
-        
-        # In real app, would return actual file
-        return jsonify({
-            'success': True,
-            'message': f'Downloading {report.report_name}',
-            'file_path': report.file_path
-        })
+        return _send_generated_report(report)
     except Exception as e:
+        db.session.rollback()
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -15859,6 +16127,7 @@ def district_admin_dashboard():
 
 @app.route('/api/district-admin/dashboard-stats')
 @login_required
+@use_read_replica
 def api_district_admin_dashboard_stats():
     """Get aggregated KPI statistics for District Admin dashboard"""
     if current_user.user_type != 'district_admin':
@@ -16033,6 +16302,34 @@ def api_district_admin_blocks():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/district-admin/maternal-cohort')
+@login_required
+def api_district_admin_maternal_cohort():
+    """District maternal dashboard: ANC cohort across the district's blocks, with per-block summaries"""
+    if current_user.user_type != 'district_admin':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    
+    try:
+        blocks = Block.query.filter_by(district=current_user.district_name).all() if current_user.district_name else []
+        block_ids = [b.block_id for b in blocks]
+        
+        worker_ids = [w.id for w in User.query.filter(
+            User.user_type == 'health_worker',
+            User.block_id.in_(block_ids)
+        ).all()] if block_ids else []
+        payload = _maternal_cohort_payload(anc_scope(block_ids=block_ids), worker_ids)
+        payload['blocks'] = [{
+            'block_id': b.block_id,
+            'name': b.name,
+            'summary': anc_cohort_summary(anc_scope(block_ids=[b.block_id]))
+        } for b in blocks]
+        return jsonify(payload)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/district-admin/block-ranking')
 @login_required
 def api_district_admin_block_ranking():
@@ -16755,6 +17052,7 @@ def api_district_admin_epidemiology_map():
 
 @app.route('/api/district-admin/comparative-analytics')
 @login_required
+@use_read_replica
 def api_district_admin_comparative_analytics():
     """Comparative analytics between blocks"""
     if current_user.user_type != 'district_admin':
@@ -16823,7 +17121,7 @@ def api_district_admin_reports():
             # List reports (from GeneratedReport table, filtered by district)
             reports = GeneratedReport.query.filter_by(
                 generated_by_id=current_user.id
-            ).order_by(GeneratedReport.generated_at.desc()).all()
+            ).order_by(GeneratedReport.created_at.desc()).all()
             
             reports_data = []
             for r in reports:
@@ -16833,8 +17131,12 @@ def api_district_admin_reports():
                     'name': r.report_name,
                     'type': r.report_type,
                     'status': r.status,
-                    'generated_at': r.generated_at.isoformat() if r.generated_at else None,
-                    'download_count': r.download_count
+                    'export_format': r.export_format,
+                    'file_size': r.file_size,
+                    'generated_at': r.generated_at.isoformat() if r.generated_at and r.status == 'ready' else None,
+                    'expires_at': r.expires_at.isoformat() if r.expires_at else None,
+                    'download_count': r.download_count,
+                    'download_url': f'/api/district-admin/reports/{r.id}/download' if r.status == 'ready' else None
                 })
             
             return jsonify({
@@ -16842,10 +17144,18 @@ def api_district_admin_reports():
                 'reports': reports_data
             })
         
-        else:  # POST - Generate new report
-            data = request.get_json()
+        else:  # POST - Queue a new report
+            data = request.get_json() or {}
             report_type = data.get('type', 'monthly')
-            report_name = data.get('name', f'District Report - {datetime.now().strftime("%B %Y")}')
+            if REPORT_TYPES.get(report_type, {}).get('scope') != 'district':
+                return jsonify({'success': False, 'error': f'Unsupported report type: {report_type}'}), 400
+            
+            export_format = normalize_report_format(data.get('format', 'pdf'))
+            if not export_format:
+                return jsonify({'success': False, 'error': 'Export format must be one of: pdf, csv, excel, json'}), 400
+            
+            report_name = data.get('name') or f'District Report - {datetime.now().strftime("%B %Y")}'
+            date_start, date_end = default_period(report_type)
             
             # Generate report ID
             import random
@@ -16856,25 +17166,53 @@ def api_district_admin_reports():
                 report_id=report_id,
                 report_name=report_name,
                 report_type=report_type,
+                export_format=export_format,
+                date_range_start=date_start,
+                date_range_end=date_end,
                 block_id=current_user.district_id,  # Using district_id here
                 generated_by_id=current_user.id,
-                status='completed',
-                generated_at=datetime.utcnow()
+                generated_by_type='manual',
+                status='queued'
             )
             db.session.add(new_report)
+            enqueue_report(new_report, 'district', current_user.district_id,
+                           {'district_name': current_user.district_name})
             db.session.commit()
+            kick_embedded_worker()
             
             return jsonify({
                 'success': True,
-                'message': 'Report generated successfully',
+                'message': 'Report queued for generation',
                 'report': {
                     'id': new_report.id,
                     'report_id': report_id,
                     'name': report_name,
-                    'type': report_type
+                    'type': report_type,
+                    'status': new_report.status
                 }
-            })
+            }), 202
+    except Exception as e:
+        db.session.rollback()
+        import traceback
+        traceback.print_exc()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/district-admin/reports/<int:report_id>/download', methods=['GET'])
+@login_required
+def api_district_admin_download_report(report_id):
+    """Download a generated district report file"""
+    if current_user.user_type != 'district_admin':
+        return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+    
+    try:
+        report = GeneratedReport.query.get(report_id)
+        if not report or report.generated_by_id != current_user.id:
+            return jsonify({'success': False, 'error': 'Report not found'}), 404
+        
+        return _send_generated_report(report)
     except Exception as e:
+        db.session.rollback()
         import traceback
         traceback.print_exc()
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -17307,6 +17645,7 @@ def api_block_admin_geo_health_data():
 
 @app.route('/api/global-admin/disease-trends')
 @login_required
+@use_read_replica
 def api_global_admin_disease_trends():
     """Get AI-powered disease trends data"""
     if current_user.user_type != 'global_admin':
@@ -17374,6 +17713,7 @@ def api_global_admin_disease_trends():
 
 @app.route('/api/global-admin/screening-trends')
 @login_required
+@use_read_replica
 def api_global_admin_screening_trends():
     """Get screening trends and coverage data"""
     if current_user.user_type != 'global_admin':
@@ -17888,23 +18228,14 @@ def add_blood_donation():
         )
         db.session.add(donation)
         
-        # Automatically add to inventory
-        inventory = BloodInventory.query.filter_by(
-            blood_bank_id=current_user.id,
-            blood_group=blood_group,
-            component_type='Whole Blood' 
-        ).first()
-        
-        if not inventory:
-            inventory = BloodInventory(
-                blood_bank_id=current_user.id,
-                blood_group=blood_group,
-                component_type='Whole Blood',
-                units_available=0
+        # Donated bags become available units; the availability index follows on flush
+        group = normalise_blood_group(blood_group)
+        if group:
+            add_blood_units(
+                current_user.id, group, units,
+                expiry_date=donation_date + timedelta(days=WHOLE_BLOOD_SHELF_DAYS),
+                notes=f'Donation {donation_date.isoformat()}'
             )
-            db.session.add(inventory)
-            
-        inventory.units_available += units
         
         db.session.commit()
         return jsonify({'success': True, 'message': 'Donation recorded and inventory updated'})
@@ -17913,10 +18244,275 @@ def add_blood_donation():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+# Doctor directory read model for appointment search
+init_doctor_directory(db, {
+    'User': User,
+    'DoctorDirectoryEntry': DoctorDirectoryEntry
+})
+
+# Blood availability index for the public blood search
+init_blood_index(db, {
+    'User': User,
+    'BloodUnit': BloodUnit,
+    'BloodInventory': BloodInventory
+})
+
+# Eligible-donor index for client blood requests
+init_donor_matching(db, {
+    'User': User,
+    'BloodDonorIndexEntry': BloodDonorIndexEntry
+})
+
+# Ranked organ match lists for open organ requests
+init_organ_matching(db, {
+    'User': User,
+    'OrganPledge': OrganPledge,
+    'OrganRequest': OrganRequest,
+    'OrganMatch': OrganMatch
+})
+
+# Batch-tracked pharmacy stock and request reservations
+init_pharmacy_stock(db, {
+    'User': User,
+    'Inventory': Inventory,
+    'InventoryBatch': InventoryBatch,
+    'PharmacyRequest': PharmacyRequest,
+    'PharmacyReservation': PharmacyReservation,
+    'PharmacyStockIndex': PharmacyStockIndex
+})
+
+# Facility analytics snapshots for the facility dashboard
+init_facility_analytics(db, {
+    'User': User,
+    'Facility': Facility,
+    'Household': Household,
+    'ClientVisit': ClientVisit,
+    'FacilityAnalyticsSnapshot': FacilityAnalyticsSnapshot
+})
+
+# Insurer links and claim read model for the insurance dashboard
+init_insurer_claims(db, {
+    'User': User,
+    'Insurance': Insurance,
+    'InsuranceClaim': InsuranceClaim,
+    'InsuranceCompany': InsuranceCompany,
+    'ClaimDocument': ClaimDocument,
+    'InsurerClaim': InsurerClaim
+})
+
+# Fraud scores for claims as they are submitted
+init_fraud_scoring(db, {
+    'Insurance': Insurance,
+    'InsuranceClaim': InsuranceClaim,
+    'FraudDetection': FraudDetection
+})
+
+# Pre-auth SLA deadlines, stamped on creation and swept when they pass
+init_preauth_sla(app, db, {
+    'InsuranceCompany': InsuranceCompany,
+    'CashlessPreAuth': CashlessPreAuth,
+    'PreAuthSlaAlert': PreAuthSlaAlert
+})
+
+# Insurance audit events: buffered writer over monthly tables/partitions
+init_audit_log(app, db)
+
+# Consent answers cached per (grantee, patient, scope), dropped when consents change
+init_consent_cache(app, db, {
+    'ConsentManagement': ConsentManagement,
+    'MNCEmployee': MNCEmployee,
+    'MNCConsent': MNCConsent,
+    'DataSharingPermission': DataSharingPermission
+})
+
+# MNC vaccination compliance, recalculated per MNC in bulk
+init_vaccination_compliance(db, {
+    'MNCEmployee': MNCEmployee,
+    'Vaccination': Vaccination,
+    'MNCVaccinationPolicy': MNCVaccinationPolicy,
+    'EmployeeVaccinationCompliance': EmployeeVaccinationCompliance,
+    'MNCVaccinationRecord': MNCVaccinationRecord,
+    'VaccineCode': VaccineCode,
+    'VaccinationAlert': VaccinationAlert,
+    'VaccinationAlertRun': VaccinationAlertRun
+})
+
+# Employee summaries kept in step with assessments, vaccinations and policies
+init_mnc_directory(db, {
+    'User': User,
+    'MNCEmployee': MNCEmployee,
+    'FitnessAssessment': FitnessAssessment,
+    'Vaccination': Vaccination,
+    'MNCVaccinationPolicy': MNCVaccinationPolicy,
+    'EmployeeVaccinationCompliance': EmployeeVaccinationCompliance,
+    'MNCVaccinationRecord': MNCVaccinationRecord,
+    'MNCEmployeeSummary': MNCEmployeeSummary
+})
+
+# Incident cube cells recounted when incidents are created, closed or edited
+init_incident_cube(db, {
+    'MNCEmployee': MNCEmployee,
+    'WorkplaceIncident': WorkplaceIncident,
+    'WorkplaceIncidentCube': WorkplaceIncidentCube
+})
+
+# Consumption ledger and reorder forecasts for facility/worker stock
+init_stock_forecast(db, {
+    'User': User,
+    'Facility': Facility,
+    'FacilityInventory': FacilityInventory,
+    'InventoryItem': InventoryItem,
+    'StockMovement': StockMovement,
+    'StockForecast': StockForecast
+})
+
+# Pregnancy tracking rows kept in step with assessments and maternal profiles
+init_anc_cohort(db, {
+    'User': User,
+    'Household': Household,
+    'HouseholdMember': HouseholdMember,
+    'HealthAssessment': HealthAssessment,
+    'AncCohortEntry': AncCohortEntry
+})
+
+# Live OPD queue for facility dashboards and waiting-room displays
+init_opd_queue(app, db, {
+    'OPDQueue': OPDQueue,
+    'OPDTokenCounter': OPDTokenCounter
+})
+
+# Slot inventory for client appointment booking
+init_slot_inventory(db, {
+    'Appointment': Appointment,
+    'DoctorSlot': DoctorSlot,
+    'User': User
+}, APPOINTMENT_SLOT_TEMPLATE)
+
+# Report job pipeline for the block/district Reports Centers
+init_report_jobs(app, db, {
+    'User': User,
+    'Block': Block,
+    'District': District,
+    'Facility': Facility,
+    'FacilityInventory': FacilityInventory,
+    'Household': Household,
+    'HouseholdMember': HouseholdMember,
+    'HomeVisit': HomeVisit,
+    'WorkerTask': WorkerTask,
+    'WorkerAttendance': WorkerAttendance,
+    'ImmunizationRecord': ImmunizationRecord,
+    'HealthReferral': HealthReferral,
+    'GeneratedReport': GeneratedReport,
+    'ReportJob': ReportJob
+})
+
+
 # Initialize database
 with app.app_context():
     db.create_all()
     
+    # Insurer key columns on existing policy/claim tables (added and backfilled once)
+    try:
+        migrated = migrate_insurer_links()
+        if migrated:
+            print(f"Insurer links migrated: {migrated}")
+    except Exception as e:
+        db.session.rollback()
+        print(f"Error migrating insurer links: {e}")
+    
+    try:
+        ensure_fraud_indexes()
+    except Exception as e:
+        print(f"Error creating fraud scoring indexes: {e}")
+    
+    # Pre-auth SLA deadline column/queue indexes on existing databases
+    try:
+        migrated = migrate_preauth_deadlines()
+        if migrated:
+            print(f"Pre-auth SLA deadlines migrated: {migrated}")
+    except Exception as e:
+        print(f"Error migrating pre-auth SLA deadlines: {e}")
+    
+    # Move pre-partitioning insurance audit rows into the monthly storage
+    try:
+        migrated = migrate_legacy_audit()
+        if migrated:
+            print(f"Insurance audit log migrated: {migrated}")
+    except Exception as e:
+        print(f"Error migrating insurance audit log: {e}")
+    
+    # Seed the vaccine-code table and the compliance lookup indexes
+    try:
+        seeded = ensure_vaccine_codes()
+        if seeded:
+            print(f"Vaccine codes seeded: {seeded}")
+    except Exception as e:
+        print(f"Error seeding vaccine codes: {e}")
+    
+    # One open vaccination alert per compliance row (resolves older duplicates first)
+    try:
+        duplicates = ensure_alert_constraints()
+        if duplicates:
+            print(f"Duplicate vaccination alerts resolved: {duplicates}")
+    except Exception as e:
+        print(f"Error adding vaccination alert constraints: {e}")
+    
+    # Ranked match lists for organ requests opened before the lists existed
+    try:
+        built = ensure_organ_matches()
+        if built:
+            print(f"Organ match lists built: {built}")
+    except Exception as e:
+        print(f"Error building organ match lists: {e}")
+    
+    # Reorder forecasts for stock items recorded before the forecasts existed
+    try:
+        built = ensure_stock_forecasts()
+        if built:
+            print(f"Stock forecasts built: {built}")
+    except Exception as e:
+        print(f"Error building stock forecasts: {e}")
+    
+    # Opening batches and routing index for pharmacy stock recorded before batches existed
+    try:
+        built = ensure_pharmacy_stock()
+        if built:
+            print(f"Pharmacy stock index built: {built}")
+    except Exception as e:
+        print(f"Error building pharmacy stock index: {e}")
+    
+    # Blood stock aggregates for units recorded before the availability index existed
+    try:
+        built = ensure_blood_index()
+        if built:
+            print(f"Blood availability index built: {built}")
+    except Exception as e:
+        print(f"Error building blood availability index: {e}")
+    
+    # Eligible-donor index rows for donors registered before the index existed
+    try:
+        built = ensure_donor_index()
+        if built:
+            print(f"Blood donor index built: {built}")
+    except Exception as e:
+        print(f"Error building blood donor index: {e}")
+    
+    # Directory rows for doctors recorded before the booking read model existed
+    try:
+        built = ensure_doctor_directory()
+        if built:
+            print(f"Doctor directory built: {built}")
+    except Exception as e:
+        print(f"Error building doctor directory: {e}")
+    
+    # Incident lookup indexes, and the incident cube for incidents recorded before it
+    try:
+        built = ensure_incident_cube()
+        if built:
+            print(f"Incident cube built: {built}")
+    except Exception as e:
+        print(f"Error building incident cube: {e}")
+    
     # Fix Family History Schema if incorrect
     try:
         from sqlalchemy import text, inspect
@@ -17936,25 +18532,20 @@ with app.app_context():
 
 @app.route('/blood/search')
 def blood_search():
-    blood_group = request.args.get('blood_group')
-    city = request.args.get('city')
+    blood_group = normalise_blood_group(request.args.get('blood_group'))
+    city = request.args.get('city', '').strip()
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    radius = request.args.get('radius', 25, type=int)
     
-    # Join BloodInventory with User (Blood Bank) to get location details
-    query = db.session.query(BloodInventory, User).join(User, BloodInventory.blood_bank_id == User.id)
-    
-    if blood_group:
-        query = query.filter(BloodInventory.blood_group == blood_group)
-        
-    if city:
-        query = query.filter(User.city.ilike(f'%{city}%'))
-        
-    # Only show where units > 0 and component is Whole Blood (default for public search usually)
-    # Or maybe show all components. Let's show all.
-    query = query.filter(BloodInventory.units_available > 0)
-    
-    results = query.all()
+    # Served from the availability index: nearest first when a location is given
+    results = []
+    if blood_group or city or (lat is not None and lng is not None):
+        results = search_blood_availability(blood_group, lat, lng, radius, city)
     
-    return render_template('blood_availability.html', results=results, search_params={'blood_group': blood_group, 'city': city})
+    return render_template('blood_availability.html', results=results, search_params={
+        'blood_group': blood_group, 'city': city, 'lat': lat, 'lng': lng, 'radius': radius
+    })
 
 
 # ==================== HEALTH WORKER DASHBOARD APIs ====================
@@ -19432,8 +20023,11 @@ def inventory_list():
             InventoryItem.item_name
         ).all()
         
+        forecasts = {f.item_id: f for f in stock_forecasts_for('worker', worker_id=current_user.id)}
+        
         result = []
         for item in items:
+            fc = forecasts.get(item.id)
             result.append({
                 'id': item.id,
                 'item_name': item.item_name,
@@ -19448,7 +20042,10 @@ def inventory_list():
                 'notes': item.notes,
                 'created_at': item.created_at.isoformat() if item.created_at else None,
                 'is_low_stock': item.quantity <= item.min_stock_level if item.min_stock_level else False,
-                'total_value': item.quantity * item.unit_price
+                'total_value': item.quantity * item.unit_price,
+                'days_remaining': fc.days_remaining if fc else None,
+                'reorder_qty': fc.reorder_qty if fc else 0,
+                'forecast_status': fc.status if fc else None
             })
         
         return jsonify({'success': True, 'items': result})
@@ -23127,6 +23724,7 @@ def national_admin_dashboard():
 
 @app.route('/api/national-admin/dashboard-stats')
 @login_required
+@use_read_replica
 def api_national_admin_dashboard_stats():
     """Get dashboard statistics for National Admin"""
     try:
@@ -23750,8 +24348,7 @@ def api_national_admin_get_all_users():
         user_type = request.args.get('user_type', '')
         state_filter = request.args.get('state', '')
         search = request.args.get('search', '').strip().lower()
-        page = int(request.args.get('page', 1))
-        per_page = int(request.args.get('per_page', 50))
+        page = request.args.get('page', 1, type=int)
         
         # Define admin types to fetch
         admin_types = ['state_admin', 'district_admin', 'block_admin', 'facility_admin', 'health_worker']
@@ -23778,22 +24375,28 @@ def api_national_admin_get_all_users():
                 (User.uid.ilike(f'%{search}%'))
             )
         
-        # Order by user_type hierarchy, then name
+        # Order by user_type hierarchy, then name (id breaks ties so the cursor is stable)
+        type_rank = {t: i for i, t in enumerate(admin_types, start=1)}
         type_order = db.case(
-            (User.user_type == 'state_admin', 1),
-            (User.user_type == 'district_admin', 2),
-            (User.user_type == 'block_admin', 3),
-            (User.user_type == 'facility_admin', 4),
-            (User.user_type == 'health_worker', 5),
-            else_=6
+            *[(User.user_type == t, rank) for t, rank in type_rank.items()],
+            else_=len(admin_types) + 1
         )
-        query = query.order_by(type_order, User.full_name)
-        
-        # Get total count
-        total = query.count()
+        sort_keys = [
+            SortKey(type_order, name='type_order', value=lambda u: type_rank.get(u.user_type, len(admin_types) + 1)),
+            SortKey(db.func.coalesce(User.full_name, ''), name='full_name', value=lambda u: u.full_name or ''),
+            SortKey(User.id)
+        ]
         
-        # Paginate
-        users = query.offset((page - 1) * per_page).limit(per_page).all()
+        try:
+            result = keyset_paginate(
+                query, sort_keys,
+                cursor=request.args.get('cursor'),
+                per_page=request.args.get('per_page', 50),
+                count_mode=request.args.get('count', 'exact')
+            )
+        except InvalidCursor as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        users = result.items
         
         # Build user list with location info
         user_list = []
@@ -23827,18 +24430,22 @@ def api_national_admin_get_all_users():
         states = State.query.order_by(State.name).all()
         state_options = [{'id': s.id, 'name': s.name} for s in states]
         
-        # Get user type counts
-        type_counts = {}
-        for t in admin_types:
-            type_counts[t] = User.query.filter_by(user_type=t).count()
+        # Get user type counts (one grouped query)
+        type_counts = {t: 0 for t in admin_types}
+        for t, n in db.session.query(User.user_type, db.func.count(User.id)).filter(
+                User.user_type.in_(admin_types)).group_by(User.user_type).all():
+            type_counts[t] = n
         
         return jsonify({
             'success': True,
             'users': user_list,
-            'total': total,
+            'total': result.total,
             'page': page,
-            'per_page': per_page,
-            'total_pages': (total + per_page - 1) // per_page,
+            'per_page': result.per_page,
+            'total_pages': result.pages,
+            'next_cursor': result.next_cursor,
+            'prev_cursor': result.prev_cursor,
+            'pagination': result.to_dict(page),
             'state_options': state_options,
             'type_counts': type_counts
         })
@@ -24231,6 +24838,7 @@ def api_national_admin_update_emergency(emergency_id):
 
 @app.route('/api/national-admin/emergency-stats', methods=['GET'])
 @login_required
+@use_read_replica
 def api_national_admin_emergency_stats():
     """Get emergency dashboard statistics"""
     try:
@@ -24355,6 +24963,7 @@ def api_national_admin_disease_reports():
 
 @app.route('/api/national-admin/disease-stats', methods=['GET'])
 @login_required
+@use_read_replica
 def api_national_admin_disease_stats():
     """Get disease surveillance statistics"""
     try:
@@ -24890,6 +25499,7 @@ def api_national_admin_update_settings():
 
 @app.route('/api/state-admin/dashboard-stats')
 @login_required
+@use_read_replica
 def api_state_admin_dashboard_stats():
     """Get dashboard statistics for State Admin"""
     try:
@@ -25907,6 +26517,7 @@ def api_state_admin_epidemiology_map():
 
 @app.route('/api/state-admin/comparative-analytics')
 @login_required
+@use_read_replica
 def api_state_admin_comparative_analytics():
     """Get comparative analytics for districts"""
     try:
@@ -28488,6 +29099,36 @@ def client_create_blood_request():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@app.route('/api/client/blood-requests/<request_id>/donor-matches', methods=['GET'])
+@login_required
+def client_blood_request_donor_matches(request_id):
+    """Ranked eligible donors for a blood request (contact details for blood banks only)"""
+    try:
+        blood_request = ClientBloodRequest.query.filter_by(request_id=request_id).first()
+        if not blood_request:
+            return jsonify({'success': False, 'error': 'Request not found'}), 404
+        
+        is_blood_bank = current_user.user_type == 'blood_bank'
+        if blood_request.user_id != current_user.id and not is_blood_bank:
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+        
+        limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+        matches = match_blood_donors(blood_request, limit=limit)
+        
+        return jsonify({
+            'success': True,
+            'request_id': blood_request.request_id,
+            'blood_group_needed': blood_request.blood_group_needed,
+            'donors': [
+                donor_candidate_dict(entry, user, blood_request.blood_group_needed,
+                                     blood_request.hospital_city, include_contact=is_blood_bank)
+                for entry, user in matches
+            ]
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/api/client/donor-profile', methods=['GET'])
 @login_required
 def get_donor_profile():
@@ -28753,6 +29394,53 @@ def create_organ_request():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+def _doctor_treats_organ_request(organ_request):
+    """Hospital doctor at the request's treating/transplant hospital, or with OTP access to the patient"""
+    if current_user.user_type != 'hospital_doctor':
+        return False
+    facility = (current_user.facility_name or '').strip().lower()
+    hospitals = {(name or '').strip().lower() for name in (organ_request.treating_hospital, organ_request.transplant_hospital)}
+    if facility and facility in hospitals:
+        return True
+    patient_uid = session.get('doctor_view_patient_uid')
+    return bool(patient_uid) and db.session.get(User, organ_request.user_id).uid == patient_uid
+
+
+@app.route('/api/client/organ-requests/<request_id>/matches', methods=['GET'])
+@login_required
+def get_organ_request_matches(request_id):
+    """Ranked pledge candidates for an organ request (requester or the treating hospital's doctors)"""
+    try:
+        organ_request = OrganRequest.query.filter_by(request_id=request_id).first()
+        if not organ_request:
+            return jsonify({'success': False, 'error': 'Request not found'}), 404
+        
+        if organ_request.user_id != current_user.id and not _doctor_treats_organ_request(organ_request):
+            return jsonify({'success': False, 'error': 'Unauthorized'}), 403
+        
+        matches = ranked_organ_matches(organ_request)
+        
+        return jsonify({
+            'success': True,
+            'request_id': organ_request.request_id,
+            'organ_needed': organ_request.organ_needed,
+            'matches': [{
+                'rank': m.rank,
+                'pledge_id': m.pledge.pledge_id,
+                'pledge_type': m.pledge.pledge_type,
+                'score': m.score,
+                'hla_mismatches': m.hla_mismatches,
+                'abo_identical': m.abo_identical,
+                'crossmatch_positive': m.crossmatch_positive,
+                'consent_verified': m.pledge.consent_verified,
+                'computed_at': m.computed_at.isoformat() if m.computed_at else None
+            } for m in matches]
+        })
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 # ==================== PHASE 14: INSURANCE & FINANCIAL DATA API ENDPOINTS ====================
 
 @app.route('/api/client/insurances', methods=['GET'])
@@ -29381,6 +30069,25 @@ def init_default_roles():
 
 # ==================== PHASE 16C: SECURITY & AUDIT LOG APIs ====================
 
+@app.route('/api/admin/system/db-pool')
+@login_required
+def api_admin_db_pool_status():
+    """Connection pool metrics (checked-out, overflow, wait time) for the primary and replica engines"""
+    if current_user.user_type != 'global_admin':
+        return jsonify({'success': False, 'error': 'Access denied'}), 403
+    
+    engines = {'primary': pool_status(db.engine)}
+    for key, engine in db.engines.items():
+        if key is not None:
+            engines[key] = pool_status(engine)
+    
+    return jsonify({
+        'success': True,
+        'profile': app.config.get('DB_PROFILE'),
+        'engines': engines
+    })
+
+
 @app.route('/api/admin/security/login-logs')
 @login_required
 def api_security_login_logs():
@@ -29392,8 +30099,11 @@ def api_security_login_logs():
             return jsonify({'success': False, 'error': 'Access denied'}), 403
         
         # Parse filters
-        page = request.args.get('page', 1, type=int)
+        if 'page' in request.args:
+            return jsonify({'success': False, 'error': 'page is not supported; pass next_cursor/prev_cursor as cursor'}), 400
         per_page = min(request.args.get('per_page', 50, type=int), 100)
+        cursor = request.args.get('cursor')
+        count_mode = request.args.get('count', 'approximate')
         status_filter = request.args.get('status')  # success, failed
         days = request.args.get('days', 7, type=int)
         
@@ -29420,12 +30130,19 @@ def api_security_login_logs():
         if status_filter:
             query = query.filter(LoginLog.status == status_filter)
         
-        # Get results
-        pagination = query.order_by(LoginLog.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        # Get results (newest first; ids follow created_at for append-only logs)
+        try:
+            pagination = keyset_paginate(query, [SortKey(LoginLog.id, desc=True)], cursor=cursor,
+                                         per_page=per_page, count_mode=count_mode, max_per_page=100)
+        except InvalidCursor as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        user_ids = {log.user_id for log in pagination.items if log.user_id}
+        users_by_id = {u.id: u for u in User.query.filter(User.id.in_(user_ids)).all()} if user_ids else {}
         
         logs = []
         for log in pagination.items:
-            user = User.query.get(log.user_id) if log.user_id else None
+            user = users_by_id.get(log.user_id)
             logs.append({
                 'id': log.id,
                 'user_id': log.user_id,
@@ -29450,12 +30167,7 @@ def api_security_login_logs():
         return jsonify({
             'success': True,
             'logs': logs,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages
-            },
+            'pagination': pagination.to_dict(),
             'stats': {
                 'total_success': total_success,
                 'total_failed': total_failed,
@@ -29475,8 +30187,11 @@ def api_security_api_logs():
         if current_user.user_type not in allowed_types:
             return jsonify({'success': False, 'error': 'Access denied'}), 403
         
-        page = request.args.get('page', 1, type=int)
+        if 'page' in request.args:
+            return jsonify({'success': False, 'error': 'page is not supported; pass next_cursor/prev_cursor as cursor'}), 400
         per_page = min(request.args.get('per_page', 50, type=int), 100)
+        cursor = request.args.get('cursor')
+        count_mode = request.args.get('count', 'approximate')
         days = request.args.get('days', 1, type=int)
         endpoint_filter = request.args.get('endpoint')
         
@@ -29496,7 +30211,11 @@ def api_security_api_logs():
         if endpoint_filter:
             query = query.filter(APILog.endpoint.like(f'%{endpoint_filter}%'))
         
-        pagination = query.order_by(APILog.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        try:
+            pagination = keyset_paginate(query, [SortKey(APILog.id, desc=True)], cursor=cursor,
+                                         per_page=per_page, count_mode=count_mode, max_per_page=100)
+        except InvalidCursor as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
         logs = []
         for log in pagination.items:
@@ -29520,12 +30239,7 @@ def api_security_api_logs():
         return jsonify({
             'success': True,
             'logs': logs,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages
-            },
+            'pagination': pagination.to_dict(),
             'stats': {
                 'total_calls': total_calls,
                 'avg_response_ms': round(avg_response, 1),
@@ -29789,8 +30503,11 @@ def api_security_access_logs():
         if current_user.user_type not in allowed_types:
             return jsonify({'success': False, 'error': 'Access denied'}), 403
         
-        page = request.args.get('page', 1, type=int)
+        if 'page' in request.args:
+            return jsonify({'success': False, 'error': 'page is not supported; pass next_cursor/prev_cursor as cursor'}), 400
         per_page = min(request.args.get('per_page', 50, type=int), 100)
+        cursor = request.args.get('cursor')
+        count_mode = request.args.get('count', 'approximate')
         days = request.args.get('days', 7, type=int)
         resource_type = request.args.get('resource_type')
         action = request.args.get('action')
@@ -29813,11 +30530,18 @@ def api_security_access_logs():
         if action:
             query = query.filter(AccessLog.action == action)
         
-        pagination = query.order_by(AccessLog.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
+        try:
+            pagination = keyset_paginate(query, [SortKey(AccessLog.id, desc=True)], cursor=cursor,
+                                         per_page=per_page, count_mode=count_mode, max_per_page=100)
+        except InvalidCursor as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        
+        user_ids = {log.user_id for log in pagination.items if log.user_id}
+        users_by_id = {u.id: u for u in User.query.filter(User.id.in_(user_ids)).all()} if user_ids else {}
         
         logs = []
         for log in pagination.items:
-            user = User.query.get(log.user_id) if log.user_id else None
+            user = users_by_id.get(log.user_id)
             logs.append({
                 'id': log.id,
                 'user_id': log.user_id,
@@ -29833,12 +30557,7 @@ def api_security_access_logs():
         return jsonify({
             'success': True,
             'logs': logs,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': pagination.total,
-                'pages': pagination.pages
-            }
+            'pagination': pagination.to_dict()
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -30656,6 +31375,7 @@ def api_deactivate_national_admin(admin_id):
 
 @app.route('/api/regional-admin/dashboard-stats', methods=['GET'])
 @login_required
+@use_read_replica
 def api_regional_admin_dashboard_stats():
     """Get dashboard statistics for Regional Admin"""
     if current_user.user_type != 'regional_admin':
@@ -31057,8 +31777,16 @@ def api_regional_admin_all_users():
         if type_filter:
             query = query.filter(User.user_type == type_filter)
         
-        # Limit to 100 for performance
-        users = query.limit(100).all()
+        try:
+            result = keyset_paginate(
+                query, [SortKey(User.id)],
+                cursor=request.args.get('cursor'),
+                per_page=request.args.get('per_page', 100),
+                count_mode=request.args.get('count', 'approximate')
+            )
+        except InvalidCursor as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        users = result.items
         
         user_list = [{
             'id': u.id,
@@ -31071,7 +31799,14 @@ def api_regional_admin_all_users():
             'created_at': u.created_at.isoformat() if u.created_at else None
         } for u in users]
         
-        return jsonify({'success': True, 'users': user_list, 'total': len(user_list)})
+        return jsonify({
+            'success': True,
+            'users': user_list,
+            'total': result.total if result.total is not None else len(user_list),
+            'next_cursor': result.next_cursor,
+            'prev_cursor': result.prev_cursor,
+            'pagination': result.to_dict()
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -31518,6 +32253,7 @@ def api_regional_admin_resolve_alert(alert_id):
 
 @app.route('/api/global-admin/stats', methods=['GET'])
 @login_required
+@use_read_replica
 def api_global_admin_dashboard_stats():
     """Get dashboard statistics for Global Admin - Real database counts"""
     if current_user.user_type != 'global_admin':
@@ -31708,6 +32444,7 @@ def continent_admin_dashboard():
 
 @app.route('/api/continent-admin/dashboard-stats', methods=['GET'])
 @login_required
+@use_read_replica
 def api_continent_admin_dashboard_stats():
     """Get dashboard statistics for Continent Admin"""
     if current_user.user_type != 'continent_admin':
@@ -32335,7 +33072,6 @@ def api_continent_admin_all_users():
     try:
         continent_id = current_user.continent_id
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         user_type_filter = request.args.get('user_type', '')
         
         # Get regional admins in this continent
@@ -32355,11 +33091,17 @@ def api_continent_admin_all_users():
         if user_type_filter:
             query = query.filter(User.user_type == user_type_filter)
         
-        # Get total count
-        total = query.count()
-        
-        # Paginate
-        users = query.order_by(User.created_at.desc()).offset((page - 1) * per_page).limit(per_page).all()
+        # Newest first; ids are assigned in creation order
+        try:
+            result = keyset_paginate(
+                query, [SortKey(User.id, desc=True)],
+                cursor=request.args.get('cursor'),
+                per_page=request.args.get('per_page', 20),
+                count_mode=request.args.get('count', 'approximate')
+            )
+        except InvalidCursor as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        users = result.items
         
         return jsonify({
             'success': True,
@@ -32374,10 +33116,13 @@ def api_continent_admin_all_users():
                 'is_verified': u.is_verified,
                 'created_at': u.created_at.isoformat() if u.created_at else None
             } for u in users],
-            'total': total,
+            'total': result.total,
             'page': page,
-            'per_page': per_page,
-            'total_pages': (total + per_page - 1) // per_page
+            'per_page': result.per_page,
+            'total_pages': result.pages,
+            'next_cursor': result.next_cursor,
+            'prev_cursor': result.prev_cursor,
+            'pagination': result.to_dict(page)
         })
     except Exception as e:
         import traceback
@@ -33085,15 +33830,23 @@ def api_global_admin_all_users():
     
     try:
         page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)
         user_type = request.args.get('type', None)
         
         query = User.query
         if user_type:
             query = query.filter_by(user_type=user_type)
         
-        users = query.order_by(User.created_at.desc()).limit(per_page).offset((page - 1) * per_page).all()
-        total = query.count()
+        # Newest first; ids are assigned in creation order
+        try:
+            result = keyset_paginate(
+                query, [SortKey(User.id, desc=True)],
+                cursor=request.args.get('cursor'),
+                per_page=request.args.get('per_page', 50),
+                count_mode=request.args.get('count', 'approximate')
+            )
+        except InvalidCursor as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        users = result.items
         
         users_data = [{
             'id': u.id,
@@ -33110,9 +33863,12 @@ def api_global_admin_all_users():
             'success': True,
             'users': users_data,
             'count': len(users_data),
-            'total': total,
+            'total': result.total,
             'page': page,
-            'per_page': per_page
+            'per_page': result.per_page,
+            'next_cursor': result.next_cursor,
+            'prev_cursor': result.prev_cursor,
+            'pagination': result.to_dict(page)
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
@@ -33692,6 +34448,7 @@ def api_global_admin_user_roles():
 
 @app.route('/api/global-admin/analytics-extended')
 @login_required
+@use_read_replica
 def api_global_admin_analytics_extended():
     """Get extended analytics data for Global Admin dashboard - Production Ready"""
     if current_user.user_type != 'global_admin':
@@ -33737,68 +34494,51 @@ def api_global_admin_analytics_extended():
 @app.route('/api/global-admin/export-report/<report_type>')
 @login_required
 def api_global_admin_export_report(report_type):
-    """Export reports for Global Admin dashboard - Production Ready"""
+    """Export reports for Global Admin dashboard - streamed, uncapped (?format=csv|csv.gz|xlsx)"""
     if current_user.user_type != 'global_admin':
         return jsonify({'success': False, 'error': 'Unauthorized'}), 403
     
     try:
-        import csv
-        import io
-        
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        if report_type == 'users':
-            writer.writerow(['UID', 'Name', 'Email', 'Type', 'Country', 'State', 'Status', 'Created'])
-            users = User.query.limit(1000).all()
-            for u in users:
-                writer.writerow([
-                    u.uid, u.full_name or '', u.email, u.user_type,
-                    u.country or '', u.state or '', 'Active' if u.is_active else 'Inactive',
-                    u.created_at.strftime('%Y-%m-%d') if u.created_at else ''
-                ])
-        
-        elif report_type == 'facilities':
-            writer.writerow(['ID', 'Name', 'Type', 'State', 'District', 'Status'])
-            facilities = Facility.query.limit(1000).all()
-            for f in facilities:
-                writer.writerow([
-                    f.id, f.name, getattr(f, 'facility_type', ''),
-                    getattr(f, 'state', ''), getattr(f, 'district', ''),
-                    'Active' if getattr(f, 'is_active', True) else 'Inactive'
-                ])
-        
-        elif report_type == 'health':
-            writer.writerow(['Type', 'Patient', 'Date', 'Status'])
+        export_format = normalize_export_format(request.args.get('format', 'csv'))
+    except ExportFormatError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    if report_type == 'users':
+        sheets = [('Users', ['UID', 'Name', 'Email', 'Type', 'Country', 'State', 'Status', 'Created'],
+                   iter_query(User.query.order_by(User.id), lambda u: [
+                       u.uid, u.full_name or '', u.email, u.user_type,
+                       u.country or '', u.state or '', 'Active' if u.is_active else 'Inactive',
+                       u.created_at.strftime('%Y-%m-%d') if u.created_at else ''
+                   ]))]
+    
+    elif report_type == 'facilities':
+        sheets = [('Facilities', ['ID', 'Name', 'Type', 'State', 'District', 'Status'],
+                   iter_query(Facility.query.order_by(Facility.id), lambda f: [
+                       f.id, f.name, getattr(f, 'facility_type', ''),
+                       getattr(f, 'state', ''), getattr(f, 'district', ''),
+                       'Active' if getattr(f, 'is_active', True) else 'Inactive'
+                   ]))]
+    
+    elif report_type == 'health':
+        def health_rows():
             # Vaccinations
-            vaccinations = Vaccination.query.limit(500).all()
-            for v in vaccinations:
-                writer.writerow([
-                    'Vaccination', v.user_id, 
-                    v.date_administered.strftime('%Y-%m-%d') if hasattr(v, 'date_administered') and v.date_administered else '',
-                    v.status if hasattr(v, 'status') else 'completed'
-                ])
+            yield from iter_query(Vaccination.query.order_by(Vaccination.id), lambda v: [
+                'Vaccination', v.user_id,
+                v.vaccination_date.strftime('%Y-%m-%d') if v.vaccination_date else '',
+                v.status or 'completed'
+            ])
             # Disease Registry
-            diseases = DiseaseRegistry.query.limit(500).all()
-            for d in diseases:
-                writer.writerow([
-                    f'Disease: {d.disease_type}', d.patient_id,
-                    d.diagnosis_date.strftime('%Y-%m-%d') if d.diagnosis_date else '',
-                    d.treatment_status or ''
-                ])
-        
-        else:
-            return jsonify({'success': False, 'error': 'Invalid report type'})
-        
-        output.seek(0)
-        return send_file(
-            io.BytesIO(output.getvalue().encode('utf-8')),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'{report_type}_report_{datetime.utcnow().strftime("%Y%m%d")}.csv'
-        )
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)})
+            yield from iter_query(DiseaseRegistry.query.order_by(DiseaseRegistry.id), lambda d: [
+                f'Disease: {d.disease_type}', d.patient_id,
+                d.diagnosis_date.strftime('%Y-%m-%d') if d.diagnosis_date else '',
+                d.treatment_status or ''
+            ])
+        sheets = [('Health', ['Type', 'Patient', 'Date', 'Status'], health_rows())]
+    
+    else:
+        return jsonify({'success': False, 'error': 'Invalid report type'})
+    
+    return stream_export(sheets, f'{report_type}_report_{datetime.utcnow().strftime("%Y%m%d")}', export_format)
 
 
 @app.route('/api/global-admin/settings', methods=['GET', 'POST'])
@@ -9,6 +9,33 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///a3_health_card.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     
+    # Database runtime: pool profile (development, production, worker) and
+    # optional read replica used by read-only admin analytics endpoints
+    DB_PROFILE = os.environ.get('DB_PROFILE') or 'development'
+    REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+    
+    # Reports Center job pipeline: 'embedded' drains the queue from a background
+    # thread in the web process, 'external' leaves it to
+    # `python -m services.report_jobs worker`. Files default to instance/reports.
+    REPORT_WORKER_MODE = os.environ.get('REPORT_WORKER_MODE') or 'embedded'
+    REPORT_STORE_DIR = os.environ.get('REPORT_STORE_DIR')
+    REPORT_RETENTION_DAYS = int(os.environ.get('REPORT_RETENTION_DAYS') or 30)
+    
+    # Cashless pre-auth SLA sweeper: 'embedded' runs it as a background thread
+    # in the web process, 'external' leaves it to
+    # `python -m services.preauth_sla sweep --loop`.
+    PREAUTH_SLA_SWEEPER = os.environ.get('PREAUTH_SLA_SWEEPER') or 'embedded'
+    
+    # Insurance audit events are stored per month; months older than this are
+    # archived (gzip JSON lines, default instance/audit_archive) and dropped by
+    # `python -m services.audit_log retention`.
+    INSURANCE_AUDIT_RETENTION_MONTHS = int(os.environ.get('INSURANCE_AUDIT_RETENTION_MONTHS') or 36)
+    INSURANCE_AUDIT_ARCHIVE_DIR = os.environ.get('INSURANCE_AUDIT_ARCHIVE_DIR')
+    
+    # Consent checks are cached per process; changes made by this process take
+    # effect at once, changes made by other workers within this many seconds.
+    CONSENT_CACHE_TTL_SECONDS = int(os.environ.get('CONSENT_CACHE_TTL_SECONDS') or 60)
+    
     # Flask-Mail SMTP Configuration
     MAIL_SERVER = os.environ.get('MAIL_SERVER') or 'smtp.gmail.com'
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 587)
@@ -1,151 +1,545 @@
 """
-SQLite to PostgreSQL Data Migration Script v3
+SQLite to PostgreSQL Data Migration Script v4
 ==============================================
-Fixed: Boolean conversion, transaction handling per row
+Bulk, parallel and resumable migration driven by the SQLAlchemy metadata.
+
+- Table order comes from the foreign keys declared on the models; tables that
+  do not depend on each other are copied in parallel.
+  Tables that reference each other (users <-> facilities) load one nullable
+  foreign key as NULL and fill it in once every table is copied.
+- Values are converted from the target column types (Boolean, DateTime, Date,
+  JSON, ...) instead of guessing from column names.
+- Rows are streamed from SQLite in rowid order and written in chunks with
+  COPY (psycopg2) or executemany (any other driver).
+- Progress is checkpointed per table inside the target database, in the same
+  transaction as each chunk, so an interrupted run resumes where it stopped;
+  --restart empties the target tables and clears their checkpoints first.
+- Tables the services create with raw SQL instead of models (the monthly
+  ``insurance_audit_events_YYYYMM`` tables) are created on the target by
+  their service and copied after the model tables. Other source tables
+  without a model are listed and not copied.
+- Primary key sequences are reset at the end and a throughput report printed.
+
+Usage:
+    python migrate_data.py [--sqlite PATH] [--chunk-size 5000] [--workers 4]
+                           [--tables users,login_logs] [--restart] [--no-copy]
 """
 
-import sqlite3
+import argparse
+import csv
+import io
+import json
 import os
+import sqlite3
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, datetime
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-def convert_value(value, is_boolean_column=False):
-    """Convert SQLite values to PostgreSQL compatible values"""
-    if value is None:
+from sqlalchemy import and_, bindparam, text, types as sa_types
+
+from services import audit_log
+
+DEFAULT_SQLITE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'a3_health_card.db')
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_WORKERS = 4
+CHECKPOINT_TABLE = 'migration_checkpoints'
+
+_print_lock = threading.Lock()
+
+
+def log(message):
+    """Thread-safe print used by the worker threads"""
+    with _print_lock:
+        print(message, flush=True)
+
+
+# ==================== TYPE CONVERSION ====================
+
+def _parse_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    if isinstance(value, (int, float)):
+        return datetime.utcfromtimestamp(value)
+    text = str(value).strip()
+    if not text:
         return None
-    if is_boolean_column or (isinstance(value, int) and value in (0, 1)):
-        # Could be a boolean stored as int
-        return bool(value) if is_boolean_column else value
-    return value
-
-def migrate_data():
-    """Migrate all data from SQLite to PostgreSQL"""
-    
-    sqlite_path = os.path.join(os.path.dirname(__file__), 'instance', 'a3_health_card.db')
-    
+    try:
+        return datetime.fromisoformat(text.replace('Z', '+00:00'))
+    except ValueError:
+        return text  # Let PostgreSQL try to parse unusual formats
+
+
+def _parse_date(value):
+    if isinstance(value, date):
+        return value
+    parsed = _parse_datetime(value)
+    return parsed.date() if isinstance(parsed, datetime) else parsed
+
+
+def _to_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 't', 'true', 'y', 'yes', 'on')
+    return bool(value)
+
+
+def _to_json_text(value):
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('utf-8')
+    if isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def build_converter(column):
+    """Return a function converting a raw SQLite value for the given model column"""
+    col_type = column.type
+    if isinstance(col_type, sa_types.Boolean):
+        return _to_bool
+    if isinstance(col_type, sa_types.DateTime):
+        return _parse_datetime
+    if isinstance(col_type, sa_types.Date):
+        return _parse_date
+    if isinstance(col_type, sa_types.JSON):
+        return _to_json_text
+    if isinstance(col_type, sa_types.Integer):
+        return lambda v: int(v) if isinstance(v, str) and v.strip().lstrip('-').isdigit() else v
+    if isinstance(col_type, (sa_types.Float, sa_types.Numeric)):
+        return lambda v: float(v) if isinstance(v, str) and v.strip() != '' else v
+    return None
+
+
+def convert_row(row, converters):
+    """Convert one SQLite row using the per-column converters"""
+    out = []
+    for value, converter in zip(row, converters):
+        if value is None or converter is None:
+            out.append(value)
+        else:
+            out.append(converter(value))
+    return out
+
+
+# ==================== DEPENDENCY PLANNING ====================
+
+def _reaches(graph, start, target):
+    seen, stack = set(), [start]
+    while stack:
+        name = stack.pop()
+        if name == target:
+            return True
+        if name not in seen:
+            seen.add(name)
+            stack.extend(graph[name])
+    return False
+
+
+def plan_table_levels(metadata, only_tables=None):
+    """
+    Group tables into dependency levels from the model foreign keys.
+    Every table in a level only references tables from earlier levels, so the
+    tables of one level can be copied in parallel.
+
+    Tables that reference each other (users <-> facilities) are ordered by
+    deferring one nullable foreign key of each cycle: its columns are loaded
+    as NULL and filled in by restore_deferred() once every level is copied.
+    Returns (levels, {table name: [deferred column names]}).
+    """
+    graph = {name: set() for name in metadata.tables}
+    edges = {}  # (table, referenced table) -> referencing columns
+    for table in metadata.tables.values():
+        for fkc in table.foreign_key_constraints:
+            parent = fkc.referred_table.name
+            if parent != table.name and parent in graph:
+                graph[table.name].add(parent)
+                edges.setdefault((table.name, parent), []).extend(fkc.columns)
+
+    deferred = {}
+    while True:
+        cyclic = [(child, parent) for child in sorted(graph) for parent in sorted(graph[child])
+                  if _reaches(graph, parent, child)]
+        if not cyclic:
+            break
+        breakable = [edge for edge in cyclic if all(c.nullable for c in edges[edge])]
+        if not breakable:
+            raise ValueError(f"Foreign key cycle without a nullable column: {cyclic}")
+        child, parent = breakable[0]
+        graph[child].discard(parent)
+        deferred.setdefault(child, []).extend(c.name for c in edges[(child, parent)])
+
+    depth = {}
+
+    def depth_of(name):
+        if name not in depth:
+            depth[name] = 1 + max((depth_of(p) for p in graph[name]), default=-1)
+        return depth[name]
+
+    levels = {}
+    for name in sorted(metadata.tables):
+        if only_tables and name not in only_tables:
+            continue
+        levels.setdefault(depth_of(name), []).append(metadata.tables[name])
+    planned = {t.name for level in levels.values() for t in level}
+    return [levels[k] for k in sorted(levels)], {k: v for k, v in deferred.items() if k in planned}
+
+
+def plan_service_tables(sqlite_path, metadata, only_tables=None):
+    """
+    Source tables created by the services with raw SQL, so absent from the
+    model metadata. Returns (tables to copy, created on the target; tables
+    owning their id sequences; source tables that are not copied).
+    """
+    src = sqlite3.connect(sqlite_path)
+    try:
+        names = [r[0] for r in src.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+    finally:
+        src.close()
+
+    tables, owners, unlisted = [], {}, []
+    for name in names:
+        if name in metadata.tables or name == CHECKPOINT_TABLE or (only_tables and name not in only_tables):
+            continue
+        key = audit_log.table_month(name)
+        if key is None:
+            unlisted.append(name)
+            continue
+        table, owner = audit_log.month_load_tables(key)  # Partition of the parent on PostgreSQL
+        tables.append(table)
+        owners[owner.name] = owner
+    return tables, list(owners.values()), unlisted
+
+
+# ==================== CHECKPOINTS ====================
+
+def ensure_checkpoint_table(engine):
+    with engine.begin() as conn:
+        conn.exec_driver_sql(
+            f'CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} ('
+            'table_name VARCHAR(200) PRIMARY KEY, '
+            'last_rowid BIGINT NOT NULL DEFAULT 0, '
+            'rows_copied BIGINT NOT NULL DEFAULT 0, '
+            'completed BOOLEAN NOT NULL DEFAULT FALSE, '
+            'updated_at TIMESTAMP)'
+        )
+
+
+def load_checkpoints(engine):
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(
+            f'SELECT table_name, last_rowid, rows_copied, completed FROM {CHECKPOINT_TABLE}'
+        ).fetchall()
+    return {r[0]: {'last_rowid': r[1], 'rows_copied': r[2], 'completed': bool(r[3])} for r in rows}
+
+
+def reset_targets(engine, tables):
+    """Empty the target tables (dependents first) and drop their checkpoints, for --restart"""
+    names = [t.name for t in tables]
+    if not names:
+        return
+    with engine.begin() as conn:
+        if engine.dialect.name == 'postgresql':
+            conn.exec_driver_sql('TRUNCATE ' + ', '.join(f'"{name}"' for name in names))
+        else:
+            for table in reversed(tables):
+                conn.execute(table.delete())
+        conn.execute(
+            text(f'DELETE FROM {CHECKPOINT_TABLE} WHERE table_name IN :names')
+            .bindparams(bindparam('names', expanding=True)),
+            {'names': names}
+        )
+
+
+def _save_checkpoint(cursor, paramstyle, table_name, last_rowid, rows_copied, completed):
+    ph = '%s' if paramstyle in ('format', 'pyformat') else '?'
+    cursor.execute(f'DELETE FROM {CHECKPOINT_TABLE} WHERE table_name = {ph}', (table_name,))
+    cursor.execute(
+        f'INSERT INTO {CHECKPOINT_TABLE} (table_name, last_rowid, rows_copied, completed, updated_at) '
+        f'VALUES ({ph}, {ph}, {ph}, {ph}, {ph})',
+        (table_name, last_rowid, rows_copied, completed, datetime.utcnow())
+    )
+
+
+# ==================== CHUNK WRITERS ====================
+
+def _copy_value(value):
+    if value is None:
+        return r'\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(value).hex()
+    return str(value)
+
+
+def write_chunk_copy(cursor, table_name, columns, rows):
+    """Write a chunk with PostgreSQL COPY ... FROM STDIN (CSV)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for row in rows:
+        writer.writerow([_copy_value(v) for v in row])
+    buffer.seek(0)
+    col_list = ', '.join(f'"{c}"' for c in columns)
+    cursor.copy_expert(
+        f'COPY "{table_name}" ({col_list}) FROM STDIN WITH (FORMAT csv, NULL \'\\N\')',
+        buffer
+    )
+
+
+def write_chunk_executemany(cursor, paramstyle, table_name, columns, rows):
+    """Write a chunk with a single executemany INSERT"""
+    ph = '%s' if paramstyle in ('format', 'pyformat') else '?'
+    col_list = ', '.join(f'"{c}"' for c in columns)
+    placeholders = ', '.join([ph] * len(columns))
+    cursor.executemany(f'INSERT INTO "{table_name}" ({col_list}) VALUES ({placeholders})', rows)
+
+
+# ==================== TABLE MIGRATION ====================
+
+def migrate_table(engine, sqlite_path, table, checkpoint, chunk_size, use_copy, deferred=()):
+    """Stream one table from SQLite into the target database, chunk by chunk; ``deferred`` columns stay NULL"""
+    started = time.time()
+    stats = {'table': table.name, 'rows': 0, 'seconds': 0.0, 'status': 'ok', 'error': None}
+
+    if checkpoint and checkpoint['completed']:
+        stats['status'] = 'skipped'
+        return stats
+
+    src = sqlite3.connect(sqlite_path)
+    raw = engine.raw_connection()
+    try:
+        src_columns = {r[1] for r in src.execute(f'PRAGMA table_info("{table.name}")').fetchall()}
+        if not src_columns:
+            stats['status'] = 'missing'
+            return stats
+
+        columns = [c for c in table.columns if c.name in src_columns and c.name not in deferred]
+        col_names = [c.name for c in columns]
+        converters = [build_converter(c) for c in columns]
+        select_cols = ', '.join(f'"{c}"' for c in col_names)
+
+        paramstyle = engine.dialect.paramstyle
+        copy_ok = use_copy and engine.dialect.name == 'postgresql'
+        last_rowid = checkpoint['last_rowid'] if checkpoint else 0
+        rows_copied = checkpoint['rows_copied'] if checkpoint else 0
+        if last_rowid:
+            log(f"   ↻ {table.name}: resuming after rowid {last_rowid} ({rows_copied} rows already copied)")
+
+        while True:
+            batch = src.execute(
+                f'SELECT rowid, {select_cols} FROM "{table.name}" WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                (last_rowid, chunk_size)
+            ).fetchall()
+            if not batch:
+                break
+
+            rows = [convert_row(r[1:], converters) for r in batch]
+            cursor = raw.cursor()
+            try:
+                if copy_ok:
+                    write_chunk_copy(cursor, table.name, col_names, rows)
+                else:
+                    write_chunk_executemany(cursor, paramstyle, table.name, col_names, rows)
+                last_rowid = batch[-1][0]
+                rows_copied += len(rows)
+                _save_checkpoint(cursor, paramstyle, table.name, last_rowid, rows_copied, False)
+                raw.commit()
+            except Exception:
+                raw.rollback()
+                raise
+            finally:
+                cursor.close()
+            stats['rows'] += len(rows)
+
+        cursor = raw.cursor()
+        _save_checkpoint(cursor, paramstyle, table.name, last_rowid, rows_copied, True)
+        raw.commit()
+        cursor.close()
+    except Exception as e:
+        stats['status'] = 'failed'
+        stats['error'] = str(e)[:200]
+    finally:
+        raw.close()
+        src.close()
+        stats['seconds'] = time.time() - started
+
+    return stats
+
+
+def restore_deferred(engine, sqlite_path, table, deferred, chunk_size):
+    """Fill in the deferred foreign key columns of a table once every level is loaded"""
+    src = sqlite3.connect(sqlite_path)
+    try:
+        src_columns = {r[1] for r in src.execute(f'PRAGMA table_info("{table.name}")').fetchall()}
+        keys = list(table.primary_key.columns)
+        columns = [table.c[name] for name in deferred if name in src_columns]
+        if not columns or not all(k.name in src_columns for k in keys):
+            return 0
+        converters = [build_converter(c) for c in keys + columns]
+        params = [f'key_{k.name}' for k in keys] + [f'value_{c.name}' for c in columns]
+        update = table.update().where(
+            and_(*(k == bindparam(f'key_{k.name}') for k in keys))
+        ).values({c.name: bindparam(f'value_{c.name}') for c in columns})
+
+        select_cols = ', '.join(f'"{c.name}"' for c in keys + columns)
+        linked = ' OR '.join(f'"{c.name}" IS NOT NULL' for c in columns)
+        result = src.execute(f'SELECT {select_cols} FROM "{table.name}" WHERE {linked}')
+        restored = 0
+        while True:
+            batch = result.fetchmany(chunk_size)
+            if not batch:
+                return restored
+            with engine.begin() as conn:
+                conn.execute(update, [dict(zip(params, convert_row(r, converters))) for r in batch])
+            restored += len(batch)
+    finally:
+        src.close()
+
+
+# ==================== SEQUENCES ====================
+
+def reset_sequences(engine, tables):
+    """Move every serial primary key sequence past the migrated ids"""
+    if engine.dialect.name != 'postgresql':
+        return 0
+    reset = 0
+    with engine.begin() as conn:
+        for table in tables:
+            serial = table.autoincrement_column
+            if serial is None:
+                continue
+            col = serial.name
+            seq = conn.exec_driver_sql(
+                'SELECT pg_get_serial_sequence(%(t)s, %(c)s)', {'t': f'"{table.name}"', 'c': col}
+            ).scalar()
+            if not seq:
+                continue
+            conn.exec_driver_sql(
+                f'SELECT setval(%(s)s, COALESCE(MAX("{col}"), 1), MAX("{col}") IS NOT NULL) FROM "{table.name}"',
+                {'s': seq}
+            )
+            reset += 1
+    return reset
+
+
+# ==================== DRIVER ====================
+
+def print_report(results, elapsed):
+    print("\n📈 Throughput report")
+    print(f"   {'table':<40} {'rows':>10} {'secs':>8} {'rows/s':>10}  status")
+    total_rows = 0
+    for r in sorted(results, key=lambda x: -x['rows']):
+        rate = r['rows'] / r['seconds'] if r['seconds'] else 0
+        total_rows += r['rows']
+        print(f"   {r['table']:<40} {r['rows']:>10} {r['seconds']:>8.2f} {rate:>10.0f}  {r['status']}")
+        if r['error']:
+            print(f"      ❌ {r['error']}")
+    overall = total_rows / elapsed if elapsed else 0
+    print(f"\n   Total: {total_rows} rows in {elapsed:.2f}s ({overall:.0f} rows/s)")
+
+
+def migrate_data(sqlite_path=DEFAULT_SQLITE_PATH, chunk_size=DEFAULT_CHUNK_SIZE, workers=DEFAULT_WORKERS,
+                 only_tables=None, restart=False, use_copy=True):
+    """Migrate all model tables from SQLite to the configured database"""
+
     if not os.path.exists(sqlite_path):
         print(f"❌ SQLite database not found: {sqlite_path}")
         return False
-    
+
     print(f"📂 SQLite database: {sqlite_path}")
-    
-    # Connect to SQLite  
-    sqlite_conn = sqlite3.connect(sqlite_path)
-    sqlite_conn.row_factory = sqlite3.Row
-    sqlite_cursor = sqlite_conn.cursor()
-    
-    # Check SQLite data
-    sqlite_cursor.execute("SELECT COUNT(*) FROM users")
-    print(f"📊 Users in SQLite: {sqlite_cursor.fetchone()[0]}")
-    
+
     from app import app, db
-    from sqlalchemy import inspect
-    
-    # Known boolean columns in the schema
-    boolean_columns = {
-        'is_verified', 'is_active', 'is_locked', 'is_trusted', 'is_admin',
-        'is_deleted', 'is_approved', 'is_emergency', 'is_completed', 'is_read',
-        'is_public', 'is_primary', 'email_verified', 'phone_verified',
-        'two_factor_enabled', 'notifications_enabled', 'consent_given',
-        'data_sharing', 'success', 'verified', 'active', 'enabled', 'locked'
-    }
-    
+
     with app.app_context():
-        # Get table info from PostgreSQL to understand structure
-        inspector = inspect(db.engine)
-        
-        # Migrate users table first
-        print("\n📋 Migrating users table...")
-        
-        sqlite_cursor.execute("SELECT * FROM users")
-        rows = sqlite_cursor.fetchall()
-        columns = [desc[0] for desc in sqlite_cursor.description]
-        
-        success_count = 0
-        
-        for row in rows:
-            try:
-                row_dict = {}
-                for i, col in enumerate(columns):
-                    value = row[i]
-                    # Convert boolean columns
-                    if col.lower() in boolean_columns or col.startswith('is_') or col.endswith('_enabled') or col.endswith('_verified'):
-                        if value is not None:
-                            value = bool(value)
-                    row_dict[col] = value
-                
-                # Build INSERT
-                cols = ', '.join([f'"{c}"' for c in columns])
-                placeholders = ', '.join([f':{c}' for c in columns])
-                sql = f'INSERT INTO "users" ({cols}) VALUES ({placeholders})'
-                
-                db.session.execute(db.text(sql), row_dict)
-                db.session.commit()  # Commit each row
-                success_count += 1
-                print(f"   ✅ User {row_dict.get('email', 'unknown')} migrated")
-                
-            except Exception as e:
-                db.session.rollback()
-                print(f"   ❌ Error: {str(e)[:60]}")
-        
-        print(f"\n   Total users migrated: {success_count}")
-        
-        # Verify
-        result = db.session.execute(db.text('SELECT COUNT(*) FROM users')).scalar()
-        print(f"\n✅ Verification - Users in PostgreSQL: {result}")
-        
-        # Now migrate other tables (logs) - optional
-        if result > 0:
-            print("\n📋 Migrating log tables...")
-            
-            log_tables = ['login_logs', 'api_logs', 'session_logs', 'device_fingerprints', 'admin_login_history']
-            
-            for table_name in log_tables:
+        engine = db.engine
+        print(f"🎯 Target: {engine.url.render_as_string(hide_password=True)}")
+
+        ensure_checkpoint_table(engine)
+        levels, deferred = plan_table_levels(db.metadata, only_tables)
+        service_tables, sequence_owners, unlisted = plan_service_tables(sqlite_path, db.metadata, only_tables)
+        if service_tables:
+            levels.append(service_tables)  # No foreign keys; copied after the model tables
+        print(f"🗺️  {sum(len(l) for l in levels)} tables in {len(levels)} dependency levels")
+        for name, columns in sorted(deferred.items()):
+            print(f"🔗 {name}: {', '.join(columns)} filled in after all levels (foreign key cycle)")
+        if unlisted:
+            print(f"⚠️  Not migrated (no model or service table): {', '.join(unlisted)}")
+
+        if restart:
+            reset_targets(engine, [t for level in levels for t in level])
+            print("🧹 Target tables emptied and checkpoints cleared")
+        checkpoints = load_checkpoints(engine)
+
+        started = time.time()
+        results = []
+        failed = False
+        for index, level in enumerate(levels):
+            print(f"\n📋 Level {index}: {', '.join(t.name for t in level)}")
+            with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+                futures = [
+                    pool.submit(migrate_table, engine, sqlite_path, table,
+                                checkpoints.get(table.name), chunk_size, use_copy, deferred.get(table.name, ()))
+                    for table in level
+                ]
+                for future in as_completed(futures):
+                    stats = future.result()
+                    results.append(stats)
+                    if stats['status'] == 'ok':
+                        log(f"   ✅ {stats['table']}: {stats['rows']} rows in {stats['seconds']:.2f}s")
+                    elif stats['status'] == 'failed':
+                        failed = True
+                        log(f"   ❌ {stats['table']}: {stats['error']}")
+            if failed:
+                # Dependent tables would only hit foreign key errors; re-run to resume.
+                print("\n⚠️  Stopping before dependent levels; re-run to resume from the checkpoints.")
+                break
+
+        if not failed and deferred:
+            print("\n🔗 Deferred foreign keys")
+            tables = {t.name: t for level in levels for t in level}
+            for name, columns in sorted(deferred.items()):
                 try:
-                    sqlite_cursor.execute(f"SELECT * FROM {table_name}")
-                    rows = sqlite_cursor.fetchall()
-                    
-                    if not rows:
-                        continue
-                    
-                    columns = [desc[0] for desc in sqlite_cursor.description]
-                    migrated = 0
-                    
-                    for row in rows:
-                        try:
-                            row_dict = {}
-                            for i, col in enumerate(columns):
-                                value = row[i]
-                                if col.lower() in boolean_columns or col.startswith('is_') or col.endswith('_enabled'):
-                                    if value is not None:
-                                        value = bool(value)
-                                row_dict[col] = value
-                            
-                            cols = ', '.join([f'"{c}"' for c in columns])
-                            placeholders = ', '.join([f':{c}' for c in columns])
-                            sql = f'INSERT INTO "{table_name}" ({cols}) VALUES ({placeholders})'
-                            
-                            db.session.execute(db.text(sql), row_dict)
-                            db.session.commit()
-                            migrated += 1
-                        except:
-                            db.session.rollback()
-                    
-                    if migrated > 0:
-                        print(f"   ✅ {table_name}: {migrated} records")
-                        
+                    count = restore_deferred(engine, sqlite_path, tables[name], columns, chunk_size)
+                    print(f"   ✅ {name}: {count} rows linked")
                 except Exception as e:
-                    db.session.rollback()
-    
-    sqlite_conn.close()
-    print("\n" + "="*50)
-    print("  Migration Complete!")
-    print("="*50)
-    return True
+                    # Idempotent: a re-run fills the columns in again
+                    failed = True
+                    print(f"   ❌ {name}: {str(e)[:200]}")
+
+        elapsed = time.time() - started
+        if not failed:
+            count = reset_sequences(engine, [t for level in levels for t in level] + sequence_owners)
+            print(f"\n🔢 Reset {count} primary key sequences")
+        print_report(results, elapsed)
+
+    print("\n" + "=" * 50)
+    print("  Migration Complete!" if not failed else "  Migration Incomplete")
+    print("=" * 50)
+    return not failed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Migrate the SQLite database to PostgreSQL')
+    parser.add_argument('--sqlite', default=DEFAULT_SQLITE_PATH, help='Path to the source SQLite database')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE, help='Rows per chunk')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Tables copied in parallel')
+    parser.add_argument('--tables', default='', help='Comma separated subset of tables to migrate')
+    parser.add_argument('--restart', action='store_true', help='Empty the target tables and clear their checkpoints')
+    parser.add_argument('--no-copy', action='store_true', help='Use executemany instead of COPY')
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
+    args = parse_args()
     print("=" * 50)
-    print("  SQLite → PostgreSQL Migration v3")
+    print("  SQLite → PostgreSQL Migration v4")
     print("=" * 50)
-    migrate_data()
+    tables = {t.strip() for t in args.tables.split(',') if t.strip()} or None
+    ok = migrate_data(args.sqlite, args.chunk_size, args.workers, tables, args.restart, not args.no_copy)
+    sys.exit(0 if ok else 1)
@@ -107,6 +107,11 @@ def create_insurance_models(db):
     class CashlessPreAuth(db.Model):
         """Cashless pre-authorization requests from hospitals"""
         __tablename__ = 'cashless_pre_auth'
+        __table_args__ = (
+            # Deadline queue swept by services/preauth_sla.py
+            db.Index('ix_cashless_pre_auth_sla_queue', 'approval_status', 'sla_breach', 'sla_deadline'),
+            db.Index('ix_cashless_pre_auth_company_sla', 'insurance_company_id', 'approval_status', 'sla_deadline'),
+        )
         
         id = db.Column(db.Integer, primary_key=True)
         
@@ -154,6 +159,7 @@ def create_insurance_models(db):
         enhancement_reason = db.Column(db.Text)
         
         # SLA Tracking
+        sla_deadline = db.Column(db.DateTime)  # request_date + insurer sla_hours, set on creation
         sla_breach = db.Column(db.Boolean, default=False)
         response_time_hours = db.Column(db.Float)
         
@@ -167,6 +173,24 @@ def create_insurance_models(db):
         hospital = db.relationship('User', foreign_keys=[hospital_id], backref='pre_auth_requests')
 
 
+    class PreAuthSlaAlert(db.Model):
+        """Breach alerts written by the pre-auth SLA sweeper"""
+        __tablename__ = 'preauth_sla_alerts'
+        
+        id = db.Column(db.Integer, primary_key=True)
+        insurance_company_id = db.Column(db.Integer, db.ForeignKey('insurance_companies.id'), nullable=False, index=True)
+        pre_auth_pk = db.Column(db.Integer, db.ForeignKey('cashless_pre_auth.id'), nullable=False, unique=True)
+        pre_auth_id = db.Column(db.String(50))
+        
+        sla_deadline = db.Column(db.DateTime)
+        breached_at = db.Column(db.DateTime, default=datetime.utcnow)
+        
+        is_acknowledged = db.Column(db.Boolean, default=False)
+        acknowledged_at = db.Column(db.DateTime)
+        
+        created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
     class ClaimReview(db.Model):
         """Insurance claim review and decision tracking"""
         __tablename__ = 'claim_reviews'
@@ -212,7 +236,7 @@ def create_insurance_models(db):
         id = db.Column(db.Integer, primary_key=True)
         
         # Reference
-        claim_id = db.Column(db.Integer, db.ForeignKey('insurance_claims.id'), nullable=False)
+        claim_id = db.Column(db.Integer, db.ForeignKey('insurance_claims.id'), nullable=False, index=True)
         pre_auth_id = db.Column(db.Integer, db.ForeignKey('cashless_pre_auth.id'))
         
         # Fraud Score
@@ -326,8 +350,51 @@ def create_insurance_models(db):
         insurance_company = db.relationship('InsuranceCompany', backref='policyholders')
 
 
+    class InsurerClaim(db.Model):
+        """Per-insurer claim read model (see services/insurer_claims.py)"""
+        __tablename__ = 'insurer_claims'
+        __table_args__ = (
+            db.Index('ix_insurer_claims_company_queue', 'insurance_company_id', 'submitted_day', 'claim_pk'),
+            db.Index('ix_insurer_claims_company_status_queue', 'insurance_company_id', 'status', 'submitted_day', 'claim_pk'),
+            db.Index('ix_insurer_claims_company_claim_date', 'insurance_company_id', 'claim_date'),
+        )
+        
+        id = db.Column(db.Integer, primary_key=True)
+        claim_pk = db.Column(db.Integer, db.ForeignKey('insurance_claims.id', ondelete='CASCADE'), nullable=False, unique=True)
+        insurance_company_id = db.Column(db.Integer, db.ForeignKey('insurance_companies.id'))
+        
+        # Claim identity
+        claim_id = db.Column(db.String(50))
+        policy_id = db.Column(db.Integer)
+        policy_number = db.Column(db.String(100))
+        user_id = db.Column(db.Integer, index=True)
+        client_name = db.Column(db.String(200))
+        client_uid = db.Column(db.String(50))
+        hospital_name = db.Column(db.String(200))
+        claim_type = db.Column(db.String(50))
+        treatment_type = db.Column(db.String(100))
+        diagnosis = db.Column(db.String(200))
+        
+        # Amounts
+        total_bill_amount = db.Column(db.Float)
+        claimed_amount = db.Column(db.Float)
+        approved_amount = db.Column(db.Float)
+        
+        # Status & dates
+        status = db.Column(db.String(30))
+        claim_date = db.Column(db.Date)
+        submitted_date = db.Column(db.Date)
+        processed_date = db.Column(db.Date)
+        settled_date = db.Column(db.Date)
+        submitted_day = db.Column(db.Integer, nullable=False, default=0)  # date.toordinal() of submitted (else claim) date
+        settlement_days = db.Column(db.Integer)
+        document_count = db.Column(db.Integer, default=0)
+        
+        updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
     class AuditLog(db.Model):
-        """Comprehensive audit log for insurance company actions"""
+        """Comprehensive audit log for insurance company actions (pre-partitioning rows; new events go to services/audit_log.py)"""
         __tablename__ = 'insurance_audit_logs'
         
         id = db.Column(db.Integer, primary_key=True)
@@ -367,9 +434,11 @@ def create_insurance_models(db):
         'InsuranceCompany': InsuranceCompany,
         'ConsentManagement': ConsentManagement,
         'CashlessPreAuth': CashlessPreAuth,
+        'PreAuthSlaAlert': PreAuthSlaAlert,
         'ClaimReview': ClaimReview,
         'FraudDetection': FraudDetection,
         'ClaimDocument': ClaimDocument,
         'PolicyholderDirectory': PolicyholderDirectory,
+        'InsurerClaim': InsurerClaim,
         'AuditLog': AuditLog
     }
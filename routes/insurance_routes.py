@@ -7,8 +7,17 @@ from flask_login import login_required, current_user
 from functools import wraps
 from datetime import datetime, timedelta
 from sqlalchemy import func, and_, or_
+from sqlalchemy.orm import joinedload
 import uuid
 
+from services.insurer_claims import claims_page, claim_dict
+from services.audit_log import record_audit, query_events
+from services.preauth_sla import (
+    sla_counts, ensure_sweeper, remaining_hours, open_alerts, acknowledge_alerts
+)
+from services.consent_cache import check_insurance_consent, bulk_check as bulk_check_consent
+from services.pagination import InvalidCursor
+
 insurance_bp = Blueprint('insurance', __name__, url_prefix='/insurance')
 
 # Models and db will be set via init function
@@ -17,15 +26,17 @@ _db = None
 User = None
 Insurance = None
 InsuranceClaim = None
+InsurerClaim = None
 
 def init_blueprint(db, models):
     """Initialize blueprint with db and models"""
-    global _models, _db, User, Insurance, InsuranceClaim
+    global _models, _db, User, Insurance, InsuranceClaim, InsurerClaim
     _models = models
     _db = db
     User = models.get('User')
     Insurance = models.get('Insurance')
     InsuranceClaim = models.get('InsuranceClaim')
+    InsurerClaim = models.get('InsurerClaim')
 
 # Decorator for insurance company authentication
 def insurance_required(f):
@@ -42,9 +53,8 @@ def insurance_required(f):
 
 
 def log_audit(action_type, action_category, target_type=None, target_id=None, patient_id=None, consent_id=None, details=None):
-    """Helper function to log insurance company actions"""
-    AuditLog = _models.get('AuditLog')
-    audit = AuditLog(
+    """Helper function to log insurance company actions (buffered; never commits the request session)"""
+    record_audit(
         user_id=current_user.id,
         user_role=current_user.user_type,
         user_name=current_user.full_name,
@@ -59,22 +69,11 @@ def log_audit(action_type, action_category, target_type=None, target_id=None, pa
         ip_address=request.remote_addr,
         user_agent=request.user_agent.string
     )
-    _db.session.add(audit)
-    _db.session.commit()
 
 
 def check_consent(patient_id, insurance_company_id):
-    """Check if valid consent exists"""
-    ConsentManagement = _models.get('ConsentManagement')
-    consent = _db.session.query(ConsentManagement).filter_by(
-        patient_id=patient_id,
-        insurance_company_id=insurance_company_id,
-        status='Active'
-    ).filter(
-        ConsentManagement.consent_expiry_date > datetime.utcnow()
-    ).first()
-    
-    return consent
+    """Check if valid consent exists (cached; returns the grant with its consent id)"""
+    return check_insurance_consent(patient_id, insurance_company_id)
 
 
 # ==================== DASHBOARD ROUTES ====================
@@ -101,55 +100,45 @@ def get_dashboard_stats():
     
     # Get total active policies
     total_policies = _db.session.query(Insurance).filter_by(
-        provider_name=insurance_company.company_name,
+        insurance_company_id=insurance_company.id,
         status='Active'
     ).count()
     
     # Get active policyholders
     active_policyholders = _db.session.query(func.count(func.distinct(Insurance.user_id))).filter_by(
-        provider_name=insurance_company.company_name,
+        insurance_company_id=insurance_company.id,
         status='Active'
     ).scalar()
     
-    # Claims statistics
+    # Claims statistics (one pass over this insurer's claim read rows)
     today = datetime.utcnow().date()
     month_start = datetime.utcnow().replace(day=1).date()
     
-    claims_today = _db.session.query(InsuranceClaim).join(Insurance).filter(
-        Insurance.provider_name == insurance_company.company_name,
-        func.date(InsuranceClaim.claim_date) == today
-    ).count()
-    
-    claims_month = _db.session.query(InsuranceClaim).join(Insurance).filter(
-        Insurance.provider_name == insurance_company.company_name,
-        func.date(InsuranceClaim.claim_date) >= month_start
-    ).count()
-    
-    claims_approved = _db.session.query(InsuranceClaim).join(Insurance).filter(
-        Insurance.provider_name == insurance_company.company_name,
-        InsuranceClaim.status.in_(['Approved', 'Settled'])
-    ).count()
-    
-    claims_rejected = _db.session.query(InsuranceClaim).join(Insurance).filter(
-        Insurance.provider_name == insurance_company.company_name,
-        InsuranceClaim.status == 'Rejected'
-    ).count()
-    
-    claims_under_review = _db.session.query(InsuranceClaim).join(Insurance).filter(
-        Insurance.provider_name == insurance_company.company_name,
-        InsuranceClaim.status.in_(['Submitted', 'Under Review'])
-    ).count()
-    
-    # Cashless requests
-    CashlessPreAuth = _models.get('CashlessPreAuth')
-    cashless_pending = _db.session.query(CashlessPreAuth).filter_by(
-        insurance_company_id=insurance_company.id,
-        approval_status='Pending'
-    ).count()
+    def count_when(condition):
+        return func.coalesce(func.sum(_db.case((condition, 1), else_=0)), 0)
+    
+    (claims_today, claims_month, claims_approved, claims_rejected, claims_under_review,
+     missing_docs, high_value_claims) = _db.session.query(
+        count_when(InsurerClaim.claim_date == today),
+        count_when(InsurerClaim.claim_date >= month_start),
+        count_when(InsurerClaim.status.in_(['Approved', 'Settled'])),
+        count_when(InsurerClaim.status == 'Rejected'),
+        count_when(InsurerClaim.status.in_(['Submitted', 'Under Review'])),
+        count_when(and_(InsurerClaim.status == 'Under Review', InsurerClaim.document_count == 0)),
+        count_when(and_(InsurerClaim.claimed_amount > 100000, InsurerClaim.status == 'Submitted'))
+    ).filter(InsurerClaim.insurance_company_id == insurance_company.id).one()
+    
+    # Cashless requests (breach flags are kept current by the SLA sweeper)
+    ensure_sweeper()
+    preauth_sla = sla_counts(insurance_company.id)
+    cashless_pending = preauth_sla['pending']
     
     # Fraud flags
     FraudDetection = _models.get('FraudDetection')
-    fraud_flags = _db.session.query(FraudDetection).filter(
+    fraud_flags = _db.session.query(FraudDetection).join(
+        InsuranceClaim, FraudDetection.claim_id == InsuranceClaim.id
+    ).filter(
+        InsuranceClaim.insurance_company_id == insurance_company.id,
         FraudDetection.risk_level.in_(['High', 'Critical']),
         FraudDetection.investigation_status != 'Completed'
     ).count()
@@ -158,11 +147,6 @@ def get_dashboard_stats():
     alerts = []
     
     # Missing documents
-    missing_docs = _db.session.query(InsuranceClaim).join(Insurance).filter(
-        Insurance.provider_name == insurance_company.company_name,
-        InsuranceClaim.status == 'Under Review',
-        ~InsuranceClaim.claim_documents.any()
-    ).count()
     if missing_docs > 0:
         alerts.append({
             'type': 'warning',
@@ -172,7 +156,7 @@ def get_dashboard_stats():
     
     # Policies expiring soon (within 30 days)
     expiring_soon = _db.session.query(Insurance).filter(
-        Insurance.provider_name == insurance_company.company_name,
+        Insurance.insurance_company_id == insurance_company.id,
         Insurance.status == 'Active',
         Insurance.end_date <= (datetime.utcnow().date() + timedelta(days=30))
     ).count()
@@ -184,11 +168,6 @@ def get_dashboard_stats():
         })
     
     # High-value claims (>1 lakh)
-    high_value_claims = _db.session.query(InsuranceClaim).join(Insurance).filter(
-        Insurance.provider_name == insurance_company.company_name,
-        InsuranceClaim.claimed_amount > 100000,
-        InsuranceClaim.status == 'Submitted'
-    ).count()
     if high_value_claims > 0:
         alerts.append({
             'type': 'warning',
@@ -197,17 +176,19 @@ def get_dashboard_stats():
         })
     
     # SLA breaches
-    sla_breach = _db.session.query(CashlessPreAuth).filter_by(
-        insurance_company_id=insurance_company.id,
-        sla_breach=True,
-        approval_status='Pending'
-    ).count()
+    sla_breach = preauth_sla['breached']
     if sla_breach > 0:
         alerts.append({
             'type': 'danger',
             'message': f'{sla_breach} pre-auth requests exceeded SLA',
             'action': 'View Pre-Auth'
         })
+    if preauth_sla['due_soon'] > 0:
+        alerts.append({
+            'type': 'warning',
+            'message': f"{preauth_sla['due_soon']} pre-auth requests reach their SLA deadline within 4 hours",
+            'action': 'View Pre-Auth'
+        })
     
     return jsonify({
         'total_policies': total_policies,
@@ -218,6 +199,8 @@ def get_dashboard_stats():
         'claims_rejected': claims_rejected,
         'claims_under_review': claims_under_review,
         'cashless_pending': cashless_pending,
+        'cashless_sla_breached': preauth_sla['breached'],
+        'cashless_sla_due_soon': preauth_sla['due_soon'],
         'fraud_flags': fraud_flags,
         'alerts': alerts
     })
@@ -239,7 +222,7 @@ def get_policyholders():
     
     # Query policies
     query = _db.session.query(Insurance).filter_by(
-        provider_name=insurance_company.company_name
+        insurance_company_id=insurance_company.id
     )
     
     if status and status != 'All':
@@ -250,7 +233,7 @@ def get_policyholders():
             or_(
                 Insurance.policy_number.ilike(f'%{search}%'),
                 Insurance.user_id.in_(
-                    _db.session.query(current_user.id).filter(
+                    _db.session.query(User.id).filter(
                         User.full_name.ilike(f'%{search}%')
                     )
                 )
@@ -259,11 +242,13 @@ def get_policyholders():
     
     policies = query.all()
     
+    # Check consent for every policyholder in one call
+    consents = bulk_check_consent('insurance', insurance_company.id, [p.user_id for p in policies])
+    
     # Build response with limited info
     policyholders = []
     for policy in policies:
-        # Check consent
-        consent = check_consent(policy.user_id, insurance_company.id)
+        consent = consents[policy.user_id]
         
         # Only include basic info
         user_obj = _db.session.query(User).get(policy.user_id)
@@ -296,7 +281,7 @@ def get_policy_details(policy_number):
     
     policy = _db.session.query(Insurance).filter_by(
         policy_number=policy_number,
-        provider_name=insurance_company.company_name
+        insurance_company_id=insurance_company.id
     ).first()
     
     if not policy:
@@ -403,6 +388,7 @@ def add_policy_for_client():
         policy = Insurance(
             user_id=client_id,
             provider_name=insurance_company.company_name,
+            insurance_company_id=insurance_company.id,
             provider_type='Private',
             policy_number=policy_number,
             policy_name=data.get('policy_name'),
@@ -450,69 +436,26 @@ def get_claims():
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
     
-    # Query claims - use company name or current user's company_name
-    company_name = insurance_company.company_name or current_user.company_name
-    query = _db.session.query(InsuranceClaim).join(Insurance).filter(
-        Insurance.provider_name == company_name
-    )
-    
-    if status and status != 'All':
-        query = query.filter(InsuranceClaim.status == status)
-    
-    if date_from:
-        query = query.filter(InsuranceClaim.claim_date >= datetime.strptime(date_from, '%Y-%m-%d'))
-    
-    if date_to:
-        query = query.filter(InsuranceClaim.claim_date <= datetime.strptime(date_to, '%Y-%m-%d'))
-    
-    claims = query.order_by(InsuranceClaim.submitted_date.desc()).all()
+    # One keyset page from the read model; SLA hours remaining are computed in SQL
+    try:
+        page = claims_page(
+            insurance_company,
+            status=status if status and status != 'All' else None,
+            date_from=datetime.strptime(date_from, '%Y-%m-%d').date() if date_from else None,
+            date_to=datetime.strptime(date_to, '%Y-%m-%d').date() if date_to else None,
+            sla=request.args.get('sla') or None,
+            cursor=request.args.get('cursor'),
+            per_page=request.args.get('per_page', 50),
+            count_mode=request.args.get('count', 'none')
+        )
+    except (InvalidCursor, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
     
-    # Build response
-    claims_list = []
-    for claim in claims:
-        user_obj = _db.session.query(User).get(claim.user_id)
-        
-        # Calculate SLA countdown - handle date vs datetime
-        sla_hours = insurance_company.sla_hours if insurance_company.sla_hours else 48
-        sla_remaining = None
-        if claim.submitted_date and claim.status in ['Submitted', 'Under Review']:
-            try:
-                # Convert date to datetime if needed
-                if hasattr(claim.submitted_date, 'hour'):
-                    submitted_dt = claim.submitted_date
-                else:
-                    submitted_dt = datetime.combine(claim.submitted_date, datetime.min.time())
-                hours_elapsed = (datetime.utcnow() - submitted_dt).total_seconds() / 3600
-                sla_remaining = sla_hours - hours_elapsed
-            except Exception:
-                sla_remaining = None
-        
-        # Format submission date safely
-        submission_date_str = None
-        if claim.submitted_date:
-            try:
-                if hasattr(claim.submitted_date, 'strftime'):
-                    submission_date_str = claim.submitted_date.strftime('%Y-%m-%d')
-            except Exception:
-                submission_date_str = str(claim.submitted_date)
-        
-        claims_list.append({
-            'claim_id': claim.claim_id,
-            'policy_number': claim.insurance.policy_number,
-            'client_name': user_obj.full_name if user_obj else 'Unknown',
-            'hospital_name': claim.hospital_name,
-            'claim_type': claim.claim_type,
-            'claimed_amount': claim.claimed_amount,
-            'approved_amount': claim.approved_amount,
-            'status': claim.status,
-            'submission_date': submission_date_str,
-            'assigned_reviewer': None,  # Reviews feature not implemented yet
-            'sla_remaining_hours': round(sla_remaining, 1) if sla_remaining else None
-        })
+    claims_list = [claim_dict(claim, sla_remaining) for claim, sla_remaining in page.items]
     
     log_audit('Viewed Claims List', 'Claim Processing')
     
-    return jsonify({'claims': claims_list})
+    return jsonify({'claims': claims_list, 'pagination': page.to_dict()})
 
 
 @insurance_bp.route('/api/claim/<claim_id>')
@@ -523,7 +466,10 @@ def get_claim_details(claim_id):
     InsuranceCompany = _models.get('InsuranceCompany')
     insurance_company = _db.session.query(InsuranceCompany).filter_by(user_id=current_user.id).first()
     
-    claim = _db.session.query(InsuranceClaim).filter_by(claim_id=claim_id).first()
+    claim = _db.session.query(InsuranceClaim).filter_by(
+        claim_id=claim_id,
+        insurance_company_id=insurance_company.id
+    ).first()
     
     if not claim:
         return jsonify({'error': 'Claim not found'}), 404
@@ -600,7 +546,10 @@ def review_claim(claim_id):
     InsuranceCompany = _models.get('InsuranceCompany')
     insurance_company = _db.session.query(InsuranceCompany).filter_by(user_id=current_user.id).first()
     
-    claim = _db.session.query(InsuranceClaim).filter_by(claim_id=claim_id).first()
+    claim = _db.session.query(InsuranceClaim).filter_by(
+        claim_id=claim_id,
+        insurance_company_id=insurance_company.id
+    ).first()
     
     if not claim:
         return jsonify({'success': False, 'error': 'Claim not found'}), 404
@@ -687,30 +636,40 @@ def get_cashless_requests():
     
     status = request.args.get('status', 'Pending')
     
+    ensure_sweeper()
     CashlessPreAuth = _models.get('CashlessPreAuth')
-    query = _db.session.query(CashlessPreAuth).filter_by(insurance_company_id=insurance_company.id)
+    query = _db.session.query(CashlessPreAuth).options(
+        joinedload(CashlessPreAuth.policy),
+        joinedload(CashlessPreAuth.patient),
+        joinedload(CashlessPreAuth.hospital)
+    ).filter_by(insurance_company_id=insurance_company.id)
     
     if status and status != 'All':
         query = query.filter_by(approval_status=status)
     
-    requests = query.order_by(CashlessPreAuth.request_date.desc()).all()
+    # Pending requests are a deadline queue: most urgent first
+    if status == 'Pending':
+        query = query.order_by(CashlessPreAuth.sla_deadline.asc(), CashlessPreAuth.id.asc())
+    else:
+        query = query.order_by(CashlessPreAuth.request_date.desc())
+    requests = query.all()
     
+    now = datetime.utcnow()
     requests_list = []
     for req in requests:
-        patient = _db.session.query(User).get(req.patient_id)
-        hospital = _db.session.query(User).get(req.hospital_id)
-        
         requests_list.append({
             'pre_auth_id': req.pre_auth_id,
             'policy_number': req.policy.policy_number,
-            'patient_name': patient.full_name,
-            'hospital_name': hospital.full_name,
+            'patient_name': req.patient.full_name,
+            'hospital_name': req.hospital.full_name,
             'diagnosis_category': req.diagnosis_category,
             'estimated_cost': req.estimated_cost,
             'requested_amount': req.requested_amount,
             'approved_amount': req.approved_amount,
             'approval_status': req.approval_status,
             'request_date': req.request_date.strftime('%Y-%m-%d %H:%M'),
+            'sla_deadline': req.sla_deadline.strftime('%Y-%m-%d %H:%M') if req.sla_deadline else None,
+            'sla_remaining_hours': remaining_hours(req, now),
             'sla_breach': req.sla_breach
         })
     
@@ -809,6 +768,38 @@ def approve_cashless_request(pre_auth_id):
     return jsonify({'success': True, 'message': 'Pre-authorization decision submitted'})
 
 
+@insurance_bp.route('/api/cashless-sla/alerts')
+@insurance_required
+def get_cashless_sla_alerts():
+    """Unacknowledged pre-auth SLA breach alerts"""
+    InsuranceCompany = _models.get('InsuranceCompany')
+    insurance_company = _db.session.query(InsuranceCompany).filter_by(user_id=current_user.id).first()
+    if not insurance_company:
+        return jsonify({'alerts': [], 'message': 'Insurance company profile not found'})
+    
+    ensure_sweeper()
+    return jsonify({'alerts': [{
+        'id': alert.id,
+        'pre_auth_id': alert.pre_auth_id,
+        'sla_deadline': alert.sla_deadline.strftime('%Y-%m-%d %H:%M') if alert.sla_deadline else None,
+        'breached_at': alert.breached_at.strftime('%Y-%m-%d %H:%M') if alert.breached_at else None
+    } for alert in open_alerts(insurance_company.id)]})
+
+
+@insurance_bp.route('/api/cashless-sla/alerts/acknowledge', methods=['POST'])
+@insurance_required
+def acknowledge_cashless_sla_alerts():
+    """Acknowledge the given (or all) pre-auth SLA alerts"""
+    InsuranceCompany = _models.get('InsuranceCompany')
+    insurance_company = _db.session.query(InsuranceCompany).filter_by(user_id=current_user.id).first()
+    if not insurance_company:
+        return jsonify({'success': False, 'message': 'Insurance company profile not found'}), 404
+    
+    data = request.get_json(silent=True) or {}
+    count = acknowledge_alerts(insurance_company.id, data.get('alert_ids'))
+    return jsonify({'success': True, 'acknowledged': count})
+
+
 # ==================== FRAUD DETECTION ====================
 
 @insurance_bp.route('/api/fraud/monitor')
@@ -817,22 +808,28 @@ def get_fraud_cases():
     """Get fraud detection cases"""
     risk_level = request.args.get('risk_level', 'All')
     
+    InsuranceCompany = _models.get('InsuranceCompany')
+    insurance_company = _db.session.query(InsuranceCompany).filter_by(user_id=current_user.id).first()
+    if not insurance_company:
+        return jsonify({'cases': [], 'message': 'Insurance company profile not found'})
+    
+    # Scores are written by services/fraud_scoring.py; the claim reference comes from the same join
     FraudDetection = _models.get('FraudDetection')
-    query = _db.session.query(FraudDetection)
+    query = _db.session.query(FraudDetection, InsuranceClaim.claim_id).join(
+        InsuranceClaim, FraudDetection.claim_id == InsuranceClaim.id
+    ).filter(InsuranceClaim.insurance_company_id == insurance_company.id)
     
     if risk_level and risk_level != 'All':
-        query = query.filter_by(risk_level=risk_level)
+        query = query.filter(FraudDetection.risk_level == risk_level)
     
     query = query.filter(FraudDetection.investigation_status != 'Completed')
     
-    cases = query.order_by(FraudDetection.fraud_risk_score.desc()).all()
+    cases = query.order_by(FraudDetection.fraud_risk_score.desc()).limit(500).all()  # Worklist: highest scores first
     
     cases_list = []
-    for case in cases:
-        claim = _db.session.query(InsuranceClaim).get(case.claim_id)
-        
+    for case, claim_ref in cases:
         cases_list.append({
-            'claim_id': claim.claim_id,
+            'claim_id': claim_ref,
             'fraud_risk_score': case.fraud_risk_score,
             'risk_level': case.risk_level,
             'indicators': case.indicators,
@@ -857,35 +854,26 @@ def get_claims_analytics():
     InsuranceCompany = _models.get('InsuranceCompany')
     insurance_company = _db.session.query(InsuranceCompany).filter_by(user_id=current_user.id).first()
     
+    mine = InsurerClaim.insurance_company_id == insurance_company.id
+    
     # Claims by disease category
     claims_by_category = _db.session.query(
-        InsuranceClaim.diagnosis,
-        func.count(InsuranceClaim.id).label('count'),
-        func.sum(InsuranceClaim.claimed_amount).label('total_amount')
-    ).join(Insurance).filter(
-        Insurance.provider_name == insurance_company.company_name
-    ).group_by(InsuranceClaim.diagnosis).all()
+        InsurerClaim.diagnosis,
+        func.count(InsurerClaim.id).label('count'),
+        func.sum(InsurerClaim.claimed_amount).label('total_amount')
+    ).filter(mine).group_by(InsurerClaim.diagnosis).all()
     
     # Average settlement time
-    avg_settlement = _db.session.query(
-        func.avg(
-            func.julianday(InsuranceClaim.settled_date) - func.julianday(InsuranceClaim.submitted_date)
-        )
-    ).join(Insurance).filter(
-        Insurance.provider_name == insurance_company.company_name,
-        InsuranceClaim.settled_date.isnot(None)
+    avg_settlement = _db.session.query(func.avg(InsurerClaim.settlement_days)).filter(
+        mine,
+        InsurerClaim.settlement_days.isnot(None)
     ).scalar() or 0
     
     # Approval vs rejection ratio
-    total_processed = _db.session.query(InsuranceClaim).join(Insurance).filter(
-        Insurance.provider_name == insurance_company.company_name,
-        InsuranceClaim.status.in_(['Approved', 'Rejected', 'Settled'])
-    ).count()
-    
-    approved_count = _db.session.query(InsuranceClaim).join(Insurance).filter(
-        Insurance.provider_name == insurance_company.company_name,
-        InsuranceClaim.status.in_(['Approved', 'Settled'])
-    ).count()
+    total_processed, approved_count = _db.session.query(
+        func.coalesce(func.sum(_db.case((InsurerClaim.status.in_(['Approved', 'Rejected', 'Settled']), 1), else_=0)), 0),
+        func.coalesce(func.sum(_db.case((InsurerClaim.status.in_(['Approved', 'Settled']), 1), else_=0)), 0)
+    ).filter(mine).one()
     
     approval_ratio = (approved_count / total_processed * 100) if total_processed > 0 else 0
     
@@ -915,32 +903,27 @@ def get_audit_logs():
     date_to = request.args.get('date_to')
     action_type = request.args.get('action_type')
     
-    AuditLog = _models.get('AuditLog')
-    query = _db.session.query(AuditLog).filter(
-        AuditLog.user_id == current_user.id
+    # Monthly audit storage: only the months in the date range are read
+    logs = query_events(
+        user_id=current_user.id,
+        action_type=action_type,
+        action_category=request.args.get('action_category'),
+        patient_id=request.args.get('patient_id', type=int),
+        date_from=datetime.strptime(date_from, '%Y-%m-%d') if date_from else None,
+        date_to=datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None,
+        limit=1000
     )
     
-    if date_from:
-        query = query.filter(AuditLog.timestamp >= datetime.strptime(date_from, '%Y-%m-%d'))
-    
-    if date_to:
-        query = query.filter(AuditLog.timestamp <= datetime.strptime(date_to, '%Y-%m-%d'))
-    
-    if action_type:
-        query = query.filter(AuditLog.action_type.ilike(f'%{action_type}%'))
-    
-    logs = query.order_by(AuditLog.timestamp.desc()).limit(1000).all()
-    
     logs_list = [{
-        'id': log.id,
-        'user_name': log.user_name,
-        'user_role': log.user_role,
-        'action_type': log.action_type,
-        'action_category': log.action_category,
-        'target_type': log.target_type,
-        'consent_used': 'Yes' if log.consent_id else 'No',
-        'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
-        'ip_address': log.ip_address
+        'id': log['id'],
+        'user_name': log['user_name'],
+        'user_role': log['user_role'],
+        'action_type': log['action_type'],
+        'action_category': log['action_category'],
+        'target_type': log['target_type'],
+        'consent_used': 'Yes' if log['consent_id'] else 'No',
+        'timestamp': log['timestamp'].strftime('%Y-%m-%d %H:%M:%S'),
+        'ip_address': log['ip_address']
     } for log in logs]
     
     return jsonify({'logs': logs_list})
@@ -5,11 +5,21 @@ Handles corporate employer health monitoring, compliance, and audit trails
 from flask import Blueprint, render_template, jsonify, request, redirect, url_for, flash, send_file
 from flask_login import login_required, current_user
 from datetime import datetime, date, timedelta
-from sqlalchemy import or_
+from sqlalchemy import func, case
+from sqlalchemy.orm import joinedload
 import json
 import io
 import csv
 
+from services.export_engine import stream_export, iter_query
+from services.consent_cache import check_mnc_consent
+from services.vaccination_compliance import recalculate_compliance, generate_alerts, policy_spec, applies_to
+from services.mnc_directory import (
+    ensure_directory, directory_page, directory_dict, health_trends, compliance_report, fitness_counts
+)
+from services.incident_cube import DIMENSIONS as INCIDENT_DIMENSIONS, drill_down, incident_totals, month_comparison, weekly_trend
+from services.pagination import InvalidCursor
+
 # Blueprint definition
 mnc_bp = Blueprint('mnc', __name__)
 
@@ -104,43 +114,14 @@ def api_mnc_dashboard_stats():
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
     
     try:
-        # Get MNC employees
-        mnc_employees = MNCEmployee.query.filter_by(
-            mnc_id=current_user.id,
-            verification_status='Verified'
-        ).all()
-        
-        total_enrolled = len(mnc_employees)
-        
-        # Get fitness statistics from linked clients
-        fit_for_duty = 0
-        under_review = 0
-        temporarily_unfit = 0
-        fit_with_restrictions = 0
-        
-        for mnc_emp in mnc_employees:
-            if mnc_emp.client_id:
-                # Get latest fitness assessment
-                fitness = FitnessAssessment.query.filter_by(
-                    client_id=mnc_emp.client_id,
-                    is_valid=True
-                ).order_by(FitnessAssessment.assessment_date.desc()).first()
-                
-                if fitness:
-                    if fitness.fitness_status == 'Fit':
-                        fit_for_duty += 1
-                    elif fitness.fitness_status == 'Fit with Restrictions':
-                        fit_with_restrictions += 1
-                    elif fitness.fitness_status == 'Review Required':
-                        under_review += 1
-                    elif fitness.fitness_status == 'Temporarily Unfit':
-                        temporarily_unfit += 1
-                else:
-                    # No assessment = needs review
-                    under_review += 1
-            else:
-                # Not linked to client = needs review
-                under_review += 1
+        # Fitness statistics from the employee summaries
+        ensure_directory()
+        fitness = fitness_counts(current_user.id)
+        total_enrolled = fitness['total']
+        fit_for_duty = fitness['fit']
+        fit_with_restrictions = fitness['fit_with_restrictions']
+        temporarily_unfit = fitness['temporarily_unfit']
+        under_review = fitness['under_review']
         
         # Count pending verifications
         pending_verifications = MNCEmployee.query.filter_by(
@@ -157,6 +138,10 @@ def api_mnc_dashboard_stats():
             MNCEmployee.consent_expiry > datetime.utcnow()
         ).count()
         
+        # Incident figures from the incident cube
+        incidents = incident_totals(current_user.id)
+        incident_months = month_comparison(current_user.id)
+        
         return jsonify({
             'success': True,
             'stats': {
@@ -165,7 +150,10 @@ def api_mnc_dashboard_stats():
                 'under_review': under_review,
                 'temporarily_unfit': temporarily_unfit,
                 'pending_verifications': pending_verifications,
-                'consent_expiring': consent_expiring
+                'consent_expiring': consent_expiring,
+                'open_incidents': incidents['open'],
+                'incidents_this_month': incident_months['this_month']['count'],
+                'incidents_last_month': incident_months['last_month']['count']
             }
         })
     except Exception as e:
@@ -181,111 +169,25 @@ def api_mnc_employees():
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
     
     try:
-        search = request.args.get('search', '').strip()
-        department = request.args.get('department', '')
-        fitness_filter = request.args.get('fitness_status', '')
-        
-        # Get MNC employees
-        query = MNCEmployee.query.filter_by(
-            mnc_id=current_user.id,
-            verification_status='Verified'
+        ensure_directory()
+        page = directory_page(
+            current_user.id,
+            search=request.args.get('search', '').strip(),
+            department=request.args.get('department', ''),
+            fitness_status=request.args.get('fitness_status', ''),
+            uid=request.args.get('uid', '').strip(),
+            cursor=request.args.get('cursor'),
+            per_page=request.args.get('per_page', 50, type=int)
         )
         
-        # Apply search filter
-        if search:
-            query = query.filter(
-                or_(
-                    MNCEmployee.employee_id.ilike(f'%{search}%'),
-                    MNCEmployee.full_name.ilike(f'%{search}%'),
-                    MNCEmployee.email.ilike(f'%{search}%')
-                )
-            )
-        
-        # Apply department filter
-        if department:
-            query = query.filter_by(department=department)
-        
-        mnc_employees = query.all()
-        
-        result = []
-        for mnc_emp in mnc_employees:
-            # Get client data if linked
-            emp_data = {
-                'id': mnc_emp.id,
-                'employee_id': mnc_emp.employee_id,
-                'uid': None,
-                'name': mnc_emp.full_name,
-                'age': None,
-                'gender': None,
-                'department': mnc_emp.department or 'Not Assigned',
-                'job_role': mnc_emp.job_role or 'Employee',
-                'fitness_status': 'Review Required',
-                'last_health_review': None,
-                'vaccination_compliance': 0  # Add vaccination compliance percentage
-            }
-            
-            # Get vaccination compliance - calculate percentage based on policies
-            vaccination_compliance = 0
-            if EmployeeVaccinationCompliance and MNCVaccinationPolicy:
-                try:
-                    # Get all active policies
-                    active_policies = MNCVaccinationPolicy.query.filter_by(
-                        mnc_id=current_user.id,
-                        is_active=True
-                    ).all()
-                    
-                    if active_policies:
-                        # Get compliance records for this employee
-                        compliance_records = EmployeeVaccinationCompliance.query.filter_by(
-                            employee_id=mnc_emp.id
-                        ).all()
-                        
-                        # Count how many policies are compliant
-                        compliant_count = sum(1 for c in compliance_records if c.compliance_status == 'Compliant')
-                        total_policies = len(active_policies)
-                        
-                        # Calculate percentage
-                        vaccination_compliance = round((compliant_count / total_policies * 100), 1) if total_policies > 0 else 0
-                except Exception as e:
-                    print(f"Error calculating vaccination compliance: {e}")
-                    pass
-            
-            emp_data['vaccination_compliance'] = vaccination_compliance
-            
-            if mnc_emp.client_id:
-                client = User.query.get(mnc_emp.client_id)
-                if client:
-                    emp_data['uid'] = client.uid
-                    emp_data['gender'] = client.gender
-                    
-                    # Calculate age
-                    if client.dob:
-                        today = date.today()
-                        emp_data['age'] = today.year - client.dob.year - (
-                            (today.month, today.day) < (client.dob.month, client.dob.day)
-                        )
-                    
-                    # Get latest fitness assessment
-                    fitness = FitnessAssessment.query.filter_by(
-                        client_id=client.id,
-                        is_valid=True
-                    ).order_by(FitnessAssessment.assessment_date.desc()).first()
-                    
-                    if fitness:
-                        emp_data['fitness_status'] = fitness.fitness_status
-                        emp_data['last_health_review'] = fitness.assessment_date.strftime('%Y-%m-%d')
-            
-            # Apply fitness filter
-            if fitness_filter and emp_data['fitness_status'] != fitness_filter:
-                continue
-            
-            result.append(emp_data)
-        
         return jsonify({
             'success': True,
-            'employees': result,
-            'total': len(result)
+            'employees': [directory_dict(row) for row in page.items],
+            'total': page.total,
+            'pagination': page.to_dict()
         })
+    except InvalidCursor:
+        return jsonify({'success': False, 'message': 'Invalid cursor'}), 400
     except Exception as e:
         print(f"Error loading employees: {e}")
         return jsonify({'success': False, 'message': 'Error loading employees'}), 500
@@ -831,8 +733,8 @@ def api_mnc_employee_medical_details(employee_id):
             mnc_id=current_user.id
         ).first_or_404()
         
-        # Check consent status
-        if mnc_emp.consent_status != 'Active':
+        # Check consent status (and expiry)
+        if not check_mnc_consent(current_user.id, mnc_emp.id):
             return jsonify({
                 'success': False, 
                 'message': 'Employee has not provided active consent for medical data access'
@@ -1000,125 +902,13 @@ def api_mnc_health_trends():
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
     
     try:
-        # Get all verified employees
-        mnc_employees = MNCEmployee.query.filter_by(
-            mnc_id=current_user.id,
-            verification_status='Verified'
-        ).all()
-        
-        total_count = len(mnc_employees)
-        
-        health_trends = {
-            'fitness_distribution': {
-                'Fit': 0,
-                'Fit with Restrictions': 0,
-                'Temporarily Unfit': 0,
-                'Review Required': 0
-            },
-            'age_distribution': {
-                '18-25': 0,
-                '26-35': 0,
-                '36-45': 0,
-                '46-55': 0,
-                '56+': 0
-            },
-            'vaccination_coverage': {
-                'compliant': 0,
-                'partial': 0,
-                'non_compliant': 0
-            },
-            'department_distribution': {}
-        }
-        
-        for mnc_emp in mnc_employees:
-            # Department distribution
-            dept = mnc_emp.department or 'Unassigned'
-            health_trends['department_distribution'][dept] = health_trends['department_distribution'].get(dept, 0) + 1
-            
-            if mnc_emp.client_id:
-                client = User.query.get(mnc_emp.client_id)
-                if client:
-                    # Age distribution
-                    if client.dob:
-                        age = date.today().year - client.dob.year
-                        if 18 <= age <= 25:
-                            health_trends['age_distribution']['18-25'] += 1
-                        elif 26 <= age <= 35:
-                            health_trends['age_distribution']['26-35'] += 1
-                        elif 36 <= age <= 45:
-                            health_trends['age_distribution']['36-45'] += 1
-                        elif 46 <= age <= 55:
-                            health_trends['age_distribution']['46-55'] += 1
-                        else:
-                            health_trends['age_distribution']['56+'] += 1
-                    
-                    # Fitness distribution
-                    fitness = FitnessAssessment.query.filter_by(
-                        client_id=client.id,
-                        is_valid=True
-                    ).order_by(FitnessAssessment.assessment_date.desc()).first()
-                    
-                    if fitness:
-                        status = fitness.fitness_status
-                        if status in health_trends['fitness_distribution']:
-                            health_trends['fitness_distribution'][status] += 1
-                        else:
-                            health_trends['fitness_distribution']['Review Required'] += 1
-                    else:
-                        health_trends['fitness_distribution']['Review Required'] += 1
-                    
-                    # Vaccination coverage - using new compliance system with ACTIVE policies only
-                    active_policies = MNCVaccinationPolicy.query.filter_by(
-                        mnc_id=current_user.id,
-                        is_active=True
-                    ).all()
-                    active_policy_ids = [p.id for p in active_policies]
-                    
-                    if active_policy_ids:
-                        employee_compliance = EmployeeVaccinationCompliance.query.filter(
-                            EmployeeVaccinationCompliance.employee_id == mnc_emp.id,
-                            EmployeeVaccinationCompliance.policy_id.in_(active_policy_ids)
-                        ).all()
-                        
-                        if employee_compliance:
-                            compliant_count = sum(1 for c in employee_compliance if c.compliance_status == 'Compliant')
-                            partial_count = sum(1 for c in employee_compliance if c.compliance_status == 'Partially Compliant')
-                            applicable_policies = len([p for p in active_policies if is_policy_applicable(p, mnc_emp)])
-                            
-                            if compliant_count == applicable_policies and applicable_policies > 0:
-                                health_trends['vaccination_coverage']['compliant'] += 1
-                            elif compliant_count > 0 or partial_count > 0:
-                                health_trends['vaccination_coverage']['partial'] += 1
-                            else:
-                                health_trends['vaccination_coverage']['non_compliant'] += 1
-                        else:
-                            health_trends['vaccination_coverage']['non_compliant'] += 1
-                    else:
-                        # Fallback to simple vaccination count if no active policies
-                        vac_count = Vaccination.query.filter_by(
-                            user_id=client.id,
-                            status='Completed'
-                        ).count()
-                        
-                        # Check MNC-uploaded verified records
-                        mnc_vac_count = MNCVaccinationRecord.query.filter_by(
-                            employee_id=mnc_emp.id,
-                            verification_status='Verified'
-                        ).count()
-                        
-                        total_vac = vac_count + mnc_vac_count
-                        
-                        if total_vac >= 3:
-                            health_trends['vaccination_coverage']['compliant'] += 1
-                        elif total_vac > 0:
-                            health_trends['vaccination_coverage']['partial'] += 1
-                        else:
-                            health_trends['vaccination_coverage']['non_compliant'] += 1
+        ensure_directory()
+        total_count, trends = health_trends(current_user.id)
         
         return jsonify({
             'success': True,
             'total_employees': total_count,
-            'health_trends': health_trends
+            'health_trends': trends
         })
     except Exception as e:
         print(f"Error loading health trends: {e}")
@@ -1133,18 +923,16 @@ def api_mnc_incidents():
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
     
     try:
-        incidents = WorkplaceIncident.query.filter_by(
+        incidents = WorkplaceIncident.query.options(
+            joinedload(WorkplaceIncident.employee)
+        ).filter_by(
             mnc_id=current_user.id
         ).order_by(WorkplaceIncident.incident_date.desc()).all()
         
         result = []
         for incident in incidents:
             # Get employee name if linked
-            employee_name = None
-            if incident.employee_id:
-                mnc_emp = MNCEmployee.query.get(incident.employee_id)
-                if mnc_emp:
-                    employee_name = mnc_emp.full_name
+            employee_name = incident.employee.full_name if incident.employee else None
             
             # Extract GPS coordinates if stored
             latitude = None
@@ -1175,13 +963,44 @@ def api_mnc_incidents():
         return jsonify({
             'success': True,
             'incidents': result,
-            'total': len(result)
+            'total': len(result),
+            'summary': incident_totals(current_user.id)
         })
     except Exception as e:
         print(f"Error loading incidents: {e}")
         return jsonify({'success': False, 'message': 'Error loading incidents'}), 500
 
 
+@mnc_bp.route('/api/mnc/incidents/analytics', methods=['GET'])
+@login_required
+def api_mnc_incident_analytics():
+    """Incident drill-down and trends from the incident cube"""
+    if current_user.user_type != 'mnc':
+        return jsonify({'success': False, 'message': 'Unauthorized'}), 403
+    
+    try:
+        group_by = [g.strip() for g in request.args.get('group_by', '').split(',') if g.strip()]
+        filters = {name: request.args.get(name) for name in INCIDENT_DIMENSIONS if request.args.get(name)}
+        start = datetime.strptime(request.args['from'], '%Y-%m-%d').date() if request.args.get('from') else None
+        end = datetime.strptime(request.args['to'], '%Y-%m-%d').date() + timedelta(days=1) if request.args.get('to') else None
+        weeks = min(max(request.args.get('weeks', 12, type=int), 1), 104)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be YYYY-MM-DD'}), 400
+    
+    try:
+        return jsonify({
+            'success': True,
+            'group_by': group_by,
+            'filters': filters,
+            'cells': drill_down(current_user.id, group_by, filters, start, end),
+            'month_comparison': month_comparison(current_user.id, request.args.get('compare'), filters),
+            'weekly_trend': weekly_trend(current_user.id, weeks, filters)
+        })
+    except Exception as e:
+        print(f"Error loading incident analytics: {e}")
+        return jsonify({'success': False, 'message': 'Error loading incident analytics'}), 500
+
+
 @mnc_bp.route('/api/mnc/incidents', methods=['POST'])
 @login_required
 def api_mnc_create_incident():
@@ -1351,68 +1170,14 @@ def api_mnc_compliance_report():
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
     
     try:
-        mnc_employees = MNCEmployee.query.filter_by(
-            mnc_id=current_user.id,
-            verification_status='Verified'
-        ).all()
-        
-        total = len(mnc_employees)
-        
-        fitness_certified = 0
-        certifications_expiring = 0
-        vaccination_compliant = 0
-        health_check_overdue = 0
-        
-        thirty_days_from_now = date.today() + timedelta(days=30)
-        
-        for mnc_emp in mnc_employees:
-            if mnc_emp.client_id:
-                # Check fitness certification
-                fitness = FitnessAssessment.query.filter_by(
-                    client_id=mnc_emp.client_id,
-                    is_valid=True
-                ).order_by(FitnessAssessment.assessment_date.desc()).first()
-                
-                if fitness:
-                    if fitness.certificate_expiry_date and fitness.certificate_expiry_date > date.today():
-                        fitness_certified += 1
-                        
-                        # Check if expiring in 30 days
-                        if fitness.certificate_expiry_date <= thirty_days_from_now:
-                            certifications_expiring += 1
-                    
-                    # Check if review is overdue
-                    if fitness.next_review_date and fitness.next_review_date < date.today():
-                        health_check_overdue += 1
-                
-                # Check vaccination compliance using new compliance system
-                employee_compliance = EmployeeVaccinationCompliance.query.filter_by(
-                    employee_id=mnc_emp.id,
-                    compliance_status='Compliant'
-                ).first()
-                
-                if employee_compliance:
-                    vaccination_compliant += 1
-                else:
-                    # Fallback to basic check if no compliance record exists
-                    vac_count = Vaccination.query.filter_by(
-                        user_id=mnc_emp.client_id,
-                        status='Completed'
-                    ).count()
-                    
-                    if vac_count >= 2:  # Basic compliance threshold
-                        vaccination_compliant += 1
-        
+        ensure_directory()
         report = {
             'generated_at': datetime.utcnow().isoformat(),
-            'company_name': current_user.mnc_name,
-            'total_employees': total,
-            'fitness_certified': fitness_certified,
-            'pending_certification': total - fitness_certified,
-            'certifications_expiring_30_days': certifications_expiring,
-            'vaccination_compliant': vaccination_compliant,
-            'health_check_overdue': health_check_overdue
+            'company_name': current_user.mnc_name
         }
+        report.update(compliance_report(current_user.id))
+        report['incidents'] = incident_totals(current_user.id)
+        report['incidents']['month_comparison'] = month_comparison(current_user.id, 'severity')
         
         return jsonify({
             'success': True,
@@ -1755,220 +1520,142 @@ def generate_audit_pdf():
     )
 
 
+def _report_info_sheet(title):
+    """Title block shared by the streamed MNC reports"""
+    return ('Report', None, [
+        [title],
+        [f'Company: {current_user.mnc_name}'],
+        [f'Generated: {datetime.now().strftime("%Y-%m-%d %H:%M")}']
+    ])
+
+
 def generate_vaccination_excel():
-    """Generate vaccination compliance report as CSV"""
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    MNCVaccinationPolicy = models.get('MNCVaccinationPolicy')
-    EmployeeVaccinationCompliance = models.get('EmployeeVaccinationCompliance')
-    MNCVaccinationRecord = models.get('MNCVaccinationRecord')
+    """Generate vaccination compliance report (streamed; ?format=xlsx|csv|csv.gz)"""
+    export_format = request.args.get('format', 'xlsx')
     
-    # Header
-    writer.writerow(['Vaccination Compliance Report'])
-    writer.writerow([f'Company: {current_user.mnc_name}'])
-    writer.writerow([f'Generated: {datetime.now().strftime("%Y-%m-%d %H:%M")}'])
-    writer.writerow([])
-    
-    # Try to use new system, but handle gracefully if tables don't exist
-    try:
-        # Get active policies first
-        active_policies = []
-        if MNCVaccinationPolicy:
-            active_policies = MNCVaccinationPolicy.query.filter_by(
-                mnc_id=current_user.id,
-                is_active=True
-            ).all()
-        
-        # Policies section
-        writer.writerow(['Active Vaccination Policies'])
-        writer.writerow(['Policy Name', 'Vaccine Name', 'Required Doses', 'Mandatory', 'Booster Frequency', 'Grace Period', 'Compliance Deadline', 'Target Departments'])
-        
-        if active_policies:
-            for policy in active_policies:
-                writer.writerow([
-                    policy.policy_name,
-                    policy.vaccine_name,
-                    policy.required_doses,
-                    'Yes' if policy.is_mandatory else 'No',
-                    f'{policy.booster_frequency_months} months' if policy.booster_frequency_months else 'N/A',
-                    f'{policy.grace_period_days} days' if policy.grace_period_days else 'N/A',
-                    policy.compliance_deadline.strftime('%Y-%m-%d') if policy.compliance_deadline else 'N/A',
-                    policy.specific_departments or 'All Departments'
-                ])
-        else:
-            writer.writerow(['No active policies configured'])
-        
-        writer.writerow([])
-        writer.writerow([])
-        
-        # Employee compliance section
-        writer.writerow(['Employee Vaccination Compliance'])
-        writer.writerow(['Employee ID', 'Name', 'Department', 'Job Role', 'Compliance %', 'Compliant Vaccines', 'Total Required', 'MNC Uploaded', 'Has Exemption', 'Status'])
-        
-        mnc_employees = MNCEmployee.query.filter_by(
-            mnc_id=current_user.id,
-            verification_status='Verified'
-        ).all()
-        
-        if mnc_employees:
-            for emp in mnc_employees:
-                # Get compliance records for ACTIVE policies only
-                compliance_records = []
-                active_policy_ids = [p.id for p in active_policies]
-                
-                if EmployeeVaccinationCompliance and active_policy_ids:
-                    compliance_records = EmployeeVaccinationCompliance.query.filter(
-                        EmployeeVaccinationCompliance.employee_id == emp.id,
-                        EmployeeVaccinationCompliance.policy_id.in_(active_policy_ids)
-                    ).all()
-                
-                # Calculate compliance based on active policies
-                compliant_count = sum(1 for c in compliance_records if c.compliance_status == 'Compliant')
-                total_policies = len(active_policies) if active_policies else 0
-                compliance_pct = round((compliant_count / total_policies * 100), 1) if total_policies > 0 else 0
-                
-                # Check exemptions
-                has_exemption = any(c.has_exemption for c in compliance_records) if compliance_records else False
-                
-                # Get MNC uploaded records count
-                uploaded_count = 0
-                if MNCVaccinationRecord:
-                    uploaded_count = MNCVaccinationRecord.query.filter_by(
-                        employee_id=emp.id,
-                        verification_status='Verified'
-                    ).count()
-                
-                # Determine status
-                if has_exemption:
-                    status = 'Exempted'
-                elif compliance_pct >= 100:
-                    status = 'Fully Compliant'
-                elif compliance_pct > 0:
-                    status = 'Partially Compliant'
-                else:
-                    status = 'Non-Compliant'
-                
-                writer.writerow([
-                    emp.employee_id,
-                    emp.full_name,
-                    emp.department or 'N/A',
-                    emp.job_role or 'N/A',
-                    f'{compliance_pct}%',
-                    compliant_count,
-                    total_policies,
-                    uploaded_count,
-                    'Yes' if has_exemption else 'No',
-                    status
-                ])
+    # Active policies (a handful per MNC)
+    active_policies = MNCVaccinationPolicy.query.filter_by(
+        mnc_id=current_user.id,
+        is_active=True
+    ).order_by(MNCVaccinationPolicy.id).all()
+    active_policy_ids = [p.id for p in active_policies]
+    total_policies = len(active_policies)
+    
+    policy_rows = [[
+        policy.policy_name,
+        policy.vaccine_name,
+        policy.required_doses,
+        'Yes' if policy.is_mandatory else 'No',
+        f'{policy.booster_frequency_months} months' if policy.booster_frequency_months else 'N/A',
+        f'{policy.grace_period_days} days' if policy.grace_period_days else 'N/A',
+        policy.compliance_deadline.strftime('%Y-%m-%d') if policy.compliance_deadline else 'N/A',
+        policy.specific_departments or 'All Departments'
+    ] for policy in active_policies] or [['No active policies configured']]
+    
+    # Per-employee compliance and uploaded-record counts, aggregated in SQL
+    compliance = db.session.query(
+        EmployeeVaccinationCompliance.employee_id.label('employee_id'),
+        func.sum(case((EmployeeVaccinationCompliance.compliance_status == 'Compliant', 1), else_=0)).label('compliant'),
+        func.max(case((EmployeeVaccinationCompliance.has_exemption == True, 1), else_=0)).label('exempt')
+    ).filter(
+        EmployeeVaccinationCompliance.policy_id.in_(active_policy_ids)
+    ).group_by(EmployeeVaccinationCompliance.employee_id).subquery()
+    
+    uploaded = db.session.query(
+        MNCVaccinationRecord.employee_id.label('employee_id'),
+        func.count(MNCVaccinationRecord.id).label('uploaded')
+    ).filter(
+        MNCVaccinationRecord.mnc_id == current_user.id,
+        MNCVaccinationRecord.verification_status == 'Verified'
+    ).group_by(MNCVaccinationRecord.employee_id).subquery()
+    
+    employees = db.session.query(
+        MNCEmployee, compliance.c.compliant, compliance.c.exempt, uploaded.c.uploaded
+    ).outerjoin(
+        compliance, compliance.c.employee_id == MNCEmployee.id
+    ).outerjoin(
+        uploaded, uploaded.c.employee_id == MNCEmployee.id
+    ).filter(
+        MNCEmployee.mnc_id == current_user.id,
+        MNCEmployee.verification_status == 'Verified'
+    ).order_by(MNCEmployee.id)
+    
+    def employee_row(row):
+        emp, compliant_count, exempt, uploaded_count = row
+        compliant_count = int(compliant_count or 0)
+        has_exemption = bool(exempt)
+        compliance_pct = round((compliant_count / total_policies * 100), 1) if total_policies > 0 else 0
+        
+        if has_exemption:
+            status = 'Exempted'
+        elif compliance_pct >= 100:
+            status = 'Fully Compliant'
+        elif compliance_pct > 0:
+            status = 'Partially Compliant'
         else:
-            writer.writerow(['No verified employees found'])
-    
-    except Exception as e:
-        # Fallback if tables don't exist
-        writer.writerow(['Vaccination system not yet configured'])
-        writer.writerow([f'Note: {str(e)}'])
-        writer.writerow([])
-        writer.writerow(['Using basic vaccination data from existing records'])
-        writer.writerow([])
-        
-        # Use basic vaccination data from existing tables
-        writer.writerow(['Employee Vaccination Records'])
-        writer.writerow(['Employee ID', 'Name', 'Department', 'Total Vaccinations', 'Completed', 'Pending', 'Status'])
-        
-        mnc_employees = MNCEmployee.query.filter_by(
-            mnc_id=current_user.id,
-            verification_status='Verified'
-        ).all()
-        
-        for mnc_emp in mnc_employees:
-            if mnc_emp.client_id:
-                total_vac = Vaccination.query.filter_by(user_id=mnc_emp.client_id).count()
-                completed_vac = Vaccination.query.filter_by(user_id=mnc_emp.client_id, status='Completed').count()
-                pending_vac = Vaccination.query.filter_by(user_id=mnc_emp.client_id, status='Pending').count()
-                status = 'Compliant' if completed_vac >= 2 else 'Incomplete'
-            else:
-                total_vac = 0
-                completed_vac = 0
-                pending_vac = 0
-                status = 'Unknown'
-            
-            writer.writerow([
-                mnc_emp.employee_id,
-                mnc_emp.full_name,
-                mnc_emp.department or 'N/A',
-                total_vac,
-                completed_vac,
-                pending_vac,
-                status
-            ])
-    
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=f'vaccination_report_{datetime.now().strftime("%Y%m%d")}.csv'
-    )
+            status = 'Non-Compliant'
+        
+        return [
+            emp.employee_id,
+            emp.full_name,
+            emp.department or 'N/A',
+            emp.job_role or 'N/A',
+            f'{compliance_pct}%',
+            compliant_count,
+            total_policies,
+            int(uploaded_count or 0),
+            'Yes' if has_exemption else 'No',
+            status
+        ]
+    
+    sheets = [
+        _report_info_sheet('Vaccination Compliance Report'),
+        ('Active Vaccination Policies',
+         ['Policy Name', 'Vaccine Name', 'Required Doses', 'Mandatory', 'Booster Frequency', 'Grace Period', 'Compliance Deadline', 'Target Departments'],
+         policy_rows),
+        ('Employee Vaccination Compliance',
+         ['Employee ID', 'Name', 'Department', 'Job Role', 'Compliance %', 'Compliant Vaccines', 'Total Required', 'MNC Uploaded', 'Has Exemption', 'Status'],
+         iter_query(employees, employee_row))
+    ]
+    return stream_export(sheets, f'vaccination_report_{datetime.now().strftime("%Y%m%d")}', export_format)
 
 
 def generate_fitness_excel():
-    """Generate fitness assessment report as CSV"""
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Header
-    writer.writerow(['Fitness Assessment Report'])
-    writer.writerow([f'Company: {current_user.mnc_name}'])
-    writer.writerow([f'Generated: {datetime.now().strftime("%Y-%m-%d %H:%M")}'])
-    writer.writerow([])
-    
-    # Assessment data
-    writer.writerow(['Employee ID', 'Name', 'Department', 'Assessment Date', 'Type', 'Status', 'Restrictions', 'Certificate #', 'Expiry Date', 'Next Review', 'Re-assessment Reason', 'Valid'])
-    
-    mnc_employees = MNCEmployee.query.filter_by(
-        mnc_id=current_user.id,
-        verification_status='Verified'
-    ).all()
-    
-    employee_ids = [emp.client_id for emp in mnc_employees if emp.client_id]
-    
-    if employee_ids:
-        assessments = FitnessAssessment.query.filter(
-            FitnessAssessment.client_id.in_(employee_ids)
-        ).order_by(FitnessAssessment.assessment_date.desc()).all()
-        
-        for assessment in assessments:
-            employee = MNCEmployee.query.filter_by(
-                client_id=assessment.client_id,
-                mnc_id=current_user.id
-            ).first()
-            
-            if employee:
-                writer.writerow([
-                    employee.employee_id,
-                    employee.full_name,
-                    employee.department or 'N/A',
-                    assessment.assessment_date.strftime('%Y-%m-%d'),
-                    assessment.assessment_type or 'N/A',
-                    assessment.fitness_status,
-                    assessment.restrictions or 'None',
-                    assessment.certificate_number or 'N/A',
-                    assessment.certificate_expiry_date.strftime('%Y-%m-%d') if assessment.certificate_expiry_date else 'N/A',
-                    assessment.next_review_date.strftime('%Y-%m-%d') if assessment.next_review_date else 'N/A',
-                    assessment.invalidation_reason or 'N/A',
-                    'Yes' if assessment.is_valid else 'No (Re-assessed)'
-                ])
-    else:
-        writer.writerow(['No fitness assessments found for registered employees'])
-    
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode('utf-8')),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name=f'fitness_assessment_report_{datetime.now().strftime("%Y%m%d")}.csv'
-    )
+    """Generate fitness assessment report (streamed; ?format=xlsx|csv|csv.gz)"""
+    export_format = request.args.get('format', 'xlsx')
+    
+    # Assessments joined to the employee record in one streamed query
+    assessments = db.session.query(FitnessAssessment, MNCEmployee).join(
+        MNCEmployee, MNCEmployee.client_id == FitnessAssessment.client_id
+    ).filter(
+        MNCEmployee.mnc_id == current_user.id,
+        MNCEmployee.verification_status == 'Verified'
+    ).order_by(FitnessAssessment.assessment_date.desc(), FitnessAssessment.id.desc())
+    
+    def assessment_row(row):
+        assessment, employee = row
+        return [
+            employee.employee_id,
+            employee.full_name,
+            employee.department or 'N/A',
+            assessment.assessment_date.strftime('%Y-%m-%d'),
+            assessment.assessment_type or 'N/A',
+            assessment.fitness_status,
+            assessment.restrictions or 'None',
+            assessment.certificate_number or 'N/A',
+            assessment.certificate_expiry_date.strftime('%Y-%m-%d') if assessment.certificate_expiry_date else 'N/A',
+            assessment.next_review_date.strftime('%Y-%m-%d') if assessment.next_review_date else 'N/A',
+            assessment.invalidation_reason or 'N/A',
+            'Yes' if assessment.is_valid else 'No (Re-assessed)'
+        ]
+    
+    sheets = [
+        _report_info_sheet('Fitness Assessment Report'),
+        ('Fitness Assessments',
+         ['Employee ID', 'Name', 'Department', 'Assessment Date', 'Type', 'Status', 'Restrictions', 'Certificate #', 'Expiry Date', 'Next Review', 'Re-assessment Reason', 'Valid'],
+         iter_query(assessments, assessment_row))
+    ]
+    return stream_export(sheets, f'fitness_assessment_report_{datetime.now().strftime("%Y%m%d")}', export_format)
 
 
 # ==================== FITNESS ASSESSMENT ROUTES ====================
@@ -2499,20 +2186,20 @@ def api_delete_vaccination_policy(policy_id):
         policy.updated_by_id = current_user.id
         policy.updated_at = datetime.utcnow()
 
+        # Remove alerts related to this policy (they point at its compliance records)
+        if VaccinationAlert and EmployeeVaccinationCompliance:
+            VaccinationAlert.query.filter(VaccinationAlert.compliance_id.in_(
+                db.session.query(EmployeeVaccinationCompliance.id).filter_by(policy_id=policy.id)
+            )).delete(synchronize_session=False)
+
         # Remove compliance records for this policy since it's no longer active
         if EmployeeVaccinationCompliance:
             EmployeeVaccinationCompliance.query.filter_by(policy_id=policy.id).delete()
 
-        # Remove alerts related to this policy
-        if VaccinationAlert:
-            VaccinationAlert.query.filter_by(policy_id=policy_id).delete()
-
         db.session.commit()
 
         # Recalculate compliance for remaining active policies since this policy was removed
-        active_policies = MNCVaccinationPolicy.query.filter_by(mnc_id=current_user.id, is_active=True).all()
-        for p in active_policies:
-            calculate_compliance_for_policy(p.id)
+        refresh_compliance(current_user.id)
 
         # Regenerate alerts for remaining policies
         generate_vaccination_alerts(current_user.id)
@@ -2610,7 +2297,7 @@ def api_get_vaccination_compliance():
             })
         
         # Get recent alerts
-        alerts = VaccinationAlert.query.filter_by(
+        alerts = VaccinationAlert.query.options(joinedload(VaccinationAlert.employee)).filter_by(
             mnc_id=current_user.id,
             is_active=True,
             is_resolved=False
@@ -2745,30 +2432,15 @@ def api_calculate_all_compliance():
         return jsonify({'success': False, 'message': 'Unauthorized'}), 403
     
     try:
-        employees = MNCEmployee.query.filter_by(
-            mnc_id=current_user.id,
-            verification_status='Verified'
-        ).all()
-        
-        policies = MNCVaccinationPolicy.query.filter_by(
-            mnc_id=current_user.id,
-            is_active=True
-        ).all()
-        
-        updated_count = 0
-        for employee in employees:
-            for policy in policies:
-                if is_policy_applicable(policy, employee):
-                    update_employee_compliance(employee, policy)
-                    updated_count += 1
+        counts = recalculate_compliance(current_user.id)
         
         # Generate new alerts
         generate_vaccination_alerts(current_user.id)
         
         return jsonify({
             'success': True,
-            'message': f'Compliance recalculated for {len(employees)} employees across {len(policies)} policies',
-            'records_updated': updated_count
+            'message': f'Compliance recalculated for {counts["employees"]} employees across {counts["policies"]} policies',
+            'records_updated': counts['evaluated']
         })
     except Exception as e:
         print(f"Error calculating compliance: {e}")
@@ -2779,22 +2451,7 @@ def api_calculate_all_compliance():
 
 def is_policy_applicable(policy, employee):
     """Check if a vaccination policy applies to an employee"""
-    if policy.applies_to_all:
-        return True
-    
-    # Check department-specific policies
-    if policy.specific_departments:
-        departments = json.loads(policy.specific_departments)
-        if employee.department in departments:
-            return True
-    
-    # Check role-specific policies
-    if policy.specific_roles:
-        roles = json.loads(policy.specific_roles)
-        if employee.job_role in roles:
-            return True
-    
-    return False
+    return applies_to(policy_spec(policy), employee.department, employee.job_role)
 
 
 def calculate_compliance_for_policy(policy_id):
@@ -2803,162 +2460,22 @@ def calculate_compliance_for_policy(policy_id):
     if not policy:
         return
     
-    employees = MNCEmployee.query.filter_by(
-        mnc_id=policy.mnc_id,
-        verification_status='Verified'
-    ).all()
-    
-    for employee in employees:
-        if is_policy_applicable(policy, employee):
-            update_employee_compliance(employee, policy)
+    refresh_compliance(policy.mnc_id, policy_ids=[policy.id])
 
 
-def update_employee_compliance(employee, policy):
-    """Update or create compliance record for an employee and policy"""
+def refresh_compliance(mnc_id, policy_ids=None, employee_ids=None):
+    """Bulk-recalculate compliance rows; failures are logged so the caller's change stands"""
     try:
-        # Check if compliance record exists
-        compliance = EmployeeVaccinationCompliance.query.filter_by(
-            employee_id=employee.id,
-            policy_id=policy.id
-        ).first()
-        
-        # Get employee's vaccination records from system
-        doses_completed = 0
-        last_dose_date = None
-        next_dose_due = None
-        
-        if employee.client_id:
-            vaccinations = Vaccination.query.filter_by(
-                user_id=employee.client_id
-            ).filter(
-                Vaccination.vaccine_name.ilike(f'%{policy.vaccine_name}%')
-            ).order_by(Vaccination.vaccination_date.desc()).all()
-            
-            doses_completed = len([v for v in vaccinations if v.status == 'Completed'])
-            if vaccinations:
-                last_dose_date = vaccinations[0].vaccination_date
-                if vaccinations[0].next_due_date:
-                    next_dose_due = vaccinations[0].next_due_date
-        
-        # Also check MNC-uploaded verified records
-        mnc_records = MNCVaccinationRecord.query.filter_by(
-            employee_id=employee.id,
-            verification_status='Verified'
-        ).filter(
-            MNCVaccinationRecord.vaccine_name.ilike(f'%{policy.vaccine_name}%')
-        ).order_by(MNCVaccinationRecord.vaccination_date.desc()).all()
-        
-        if mnc_records:
-            doses_completed += len(mnc_records)
-            # Use the most recent date between system and MNC records
-            if mnc_records[0].vaccination_date:
-                if not last_dose_date or mnc_records[0].vaccination_date > last_dose_date:
-                    last_dose_date = mnc_records[0].vaccination_date
-            if mnc_records[0].next_dose_due:
-                if not next_dose_due or mnc_records[0].next_dose_due < next_dose_due:
-                    next_dose_due = mnc_records[0].next_dose_due
-        
-        # Determine compliance status
-        compliance_status = 'Non-Compliant'
-        if doses_completed >= policy.required_doses:
-            compliance_status = 'Compliant'
-        elif doses_completed > 0:
-            compliance_status = 'Partially Compliant'
-        
-        # Check if overdue
-        is_overdue = False
-        days_until_due = None
-        if next_dose_due:
-            days_until_due = (next_dose_due - date.today()).days
-            is_overdue = days_until_due < 0
-        elif policy.compliance_deadline:
-            days_until_due = (policy.compliance_deadline - date.today()).days
-            is_overdue = days_until_due < 0 and compliance_status != 'Compliant'
-        
-        if compliance:
-            # Update existing record
-            compliance.compliance_status = compliance_status
-            compliance.doses_completed = doses_completed
-            compliance.doses_required = policy.required_doses
-            compliance.last_dose_date = last_dose_date
-            compliance.next_dose_due_date = next_dose_due
-            compliance.is_overdue = is_overdue
-            compliance.days_until_due = days_until_due
-            compliance.last_checked_at = datetime.utcnow()
-            compliance.updated_at = datetime.utcnow()
-        else:
-            # Create new record
-            compliance = EmployeeVaccinationCompliance(
-                employee_id=employee.id,
-                policy_id=policy.id,
-                compliance_status=compliance_status,
-                doses_completed=doses_completed,
-                doses_required=policy.required_doses,
-                last_dose_date=last_dose_date,
-                next_dose_due_date=next_dose_due,
-                is_overdue=is_overdue,
-                days_until_due=days_until_due,
-                last_checked_at=datetime.utcnow()
-            )
-            db.session.add(compliance)
-        
-        db.session.commit()
+        return recalculate_compliance(mnc_id, policy_ids=policy_ids, employee_ids=employee_ids)
     except Exception as e:
-        db.session.rollback()
         print(f"Error updating compliance: {e}")
+        return None
 
 
-def generate_vaccination_alerts(mnc_id):
-    """Generate alerts for due/overdue vaccinations"""
+def generate_vaccination_alerts(mnc_id, full=False):
+    """Generate alerts for due/overdue vaccinations (incremental, new alerts only)"""
     try:
-        # Get all non-compliant records
-        compliance_records = EmployeeVaccinationCompliance.query.join(MNCEmployee).filter(
-            MNCEmployee.mnc_id == mnc_id,
-            EmployeeVaccinationCompliance.compliance_status.in_(['Non-Compliant', 'Partially Compliant']),
-            EmployeeVaccinationCompliance.has_exemption == False
-        ).all()
-        
-        for record in compliance_records:
-            # Check if alert already exists
-            existing_alert = VaccinationAlert.query.filter_by(
-                compliance_id=record.id,
-                is_active=True,
-                is_resolved=False
-            ).first()
-            
-            if existing_alert:
-                continue  # Skip if alert already exists
-            
-            # Determine alert type and severity
-            alert_type = 'Due Soon'
-            severity = 'Info'
-            message = f"{record.employee.full_name} needs to complete {record.policy.vaccine_name} vaccination"
-            
-            if record.is_overdue:
-                alert_type = 'Overdue'
-                severity = 'Critical'
-                message = f"{record.employee.full_name} is overdue for {record.policy.vaccine_name} vaccination"
-            elif record.days_until_due and record.days_until_due <= 7:
-                severity = 'Warning'
-                message = f"{record.employee.full_name}'s {record.policy.vaccine_name} vaccination is due in {record.days_until_due} days"
-            elif record.days_until_due and record.days_until_due <= 30:
-                severity = 'Info'
-            
-            # Create alert
-            alert = VaccinationAlert(
-                mnc_id=mnc_id,
-                employee_id=record.employee_id,
-                compliance_id=record.id,
-                alert_type=alert_type,
-                severity=severity,
-                vaccine_name=record.policy.vaccine_name,
-                alert_message=message,
-                due_date=record.next_dose_due_date,
-                days_overdue=abs(record.days_until_due) if record.is_overdue and record.days_until_due else None
-            )
-            db.session.add(alert)
-        
-        db.session.commit()
+        return generate_alerts(mnc_id, full=full)
     except Exception as e:
         db.session.rollback()
         print(f"Error generating alerts: {e}")
@@ -3233,7 +2750,7 @@ def verify_vaccination_record(record_id):
         
         # Recalculate compliance if verified
         if action == 'verify':
-            update_employee_compliance(record.employee_id, current_user.id)
+            refresh_compliance(current_user.id, employee_ids=[record.employee_id])
         
         return jsonify({
             'success': True,
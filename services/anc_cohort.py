@@ -0,0 +1,653 @@
+"""
+ANC Cohort
+Per-pregnancy tracking rows behind the facility, block and district maternal dashboards.
+
+``anc_cohort`` holds one row per pregnancy, for pregnant clients (``users``)
+and pregnant household members: dating (LMP/EDD), risk flags, ANC/PNC visit
+counts, the responsible worker and that worker's facility and block. Rows are
+kept in step by a session flush hook: saving an ANC/PNC assessment, editing a
+maternal profile or a household member, or moving a worker updates them in
+the same transaction.
+
+Gestational age is never stored. Rows are anchored on an LMP (recorded,
+derived from the EDD, or from the week given at registration) so trimester,
+"due in the next N days" and "late pregnancy" are plain range conditions on
+the indexed ``lmp_date`` / ``edd`` columns and stay correct as weeks pass.
+
+A row ends as ``delivered`` when a PNC assessment is recorded or the woman is
+no longer marked pregnant close to term (``closed`` otherwise); delivered rows
+feed the 42-day postnatal lists::
+
+    python -m services.anc_cohort rebuild
+"""
+import json
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, func, or_, select, inspect as sa_inspect
+
+from services.runtime import ServiceRuntime, cli_app
+
+TERM_DAYS = 280
+DEFAULT_WEEK = 20  # Assumed when nothing dates the pregnancy (as the dashboards always have)
+LATE_PREGNANCY_WEEK = 37  # Week 37 onwards counts as high risk
+TERM_WINDOW_DAYS = 84  # No longer pregnant within 12 weeks of EDD -> delivered, else closed
+PNC_DAYS = 42
+DUE_SOON_DAYS = 14
+LIST_LIMIT = 100
+
+# (up to week, ANC visits expected by then)
+ANC_SCHEDULE = ((12, 1), (20, 2), (28, 3))
+ANC_EXPECTED_AFTER = 4
+
+CLIENT_FIELDS = (
+    'user_type', 'is_pregnant', 'lmp_date', 'expected_delivery_date', 'pregnancy_week', 'is_high_risk',
+    'risk_reason', 'pregnancy_risk_factors', 'dob', 'full_name', 'first_name', 'last_name', 'village',
+    'mobile', 'assigned_health_worker_id', 'gravida', 'para',
+)
+WORKER_FIELDS = ('facility_id', 'block_id')
+MEMBER_FIELDS = (
+    'is_pregnant', 'pregnancy_week', 'expected_delivery_date', 'is_high_risk', 'risk_reason',
+    'age', 'name', 'household_id', 'user_id',
+)
+HOUSEHOLD_FIELDS = ('health_worker_id', 'village', 'phone', 'last_visit_date')
+DATING_FIELDS = ('pregnancy_week',)  # Re-anchor the LMP only when the week itself was edited
+
+_runtime = ServiceRuntime()
+
+
+def init_anc_cohort(db, models):
+    """Register the db and model classes and install the sync hook"""
+    _runtime.init(db, models)
+    _runtime.listen('after_flush', _collect_cohort_changes, 'User', 'HouseholdMember', 'Household', 'HealthAssessment')
+
+
+_m = _runtime.model
+_t = _runtime.table
+
+
+# ==================== DATING ====================
+
+def gestational_week(lmp_date, today=None):
+    if not lmp_date:
+        return None
+    return max(1, ((today or date.today()) - lmp_date).days // 7)
+
+
+def trimester(week):
+    if not week:
+        return None
+    return 1 if week <= 12 else 2 if week <= 27 else 3
+
+
+def anc_expected(week):
+    for upto, visits in ANC_SCHEDULE:
+        if week <= upto:
+            return visits
+    return ANC_EXPECTED_AFTER
+
+
+def _lmp_before(weeks, today):
+    """LMP on or before this date <=> at least ``weeks`` completed weeks today"""
+    return today - timedelta(days=weeks * 7)
+
+
+def _parse_date(value):
+    if not value:
+        return None
+    if isinstance(value, date):
+        return value
+    try:
+        return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+    except ValueError:
+        return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _dating(profile, assessment, existing, week_changed, today):
+    """(lmp, edd, source) from the best evidence available"""
+    if profile['lmp']:
+        return profile['lmp'], profile['lmp'] + timedelta(days=TERM_DAYS), 'lmp'
+    if profile['edd']:
+        return profile['edd'] - timedelta(days=TERM_DAYS), profile['edd'], 'edd'
+    if assessment:
+        if assessment['lmp']:
+            return assessment['lmp'], assessment['lmp'] + timedelta(days=TERM_DAYS), 'lmp'
+        if assessment['edd']:
+            return assessment['edd'] - timedelta(days=TERM_DAYS), assessment['edd'], 'edd'
+        if assessment['week']:
+            lmp = assessment['on'] - timedelta(weeks=assessment['week'])
+            return lmp, lmp + timedelta(days=TERM_DAYS), 'week'
+    if profile['week'] and (week_changed or existing is None):
+        lmp = today - timedelta(weeks=profile['week'])
+        return lmp, lmp + timedelta(days=TERM_DAYS), 'week'
+    if existing is not None:
+        return existing.lmp_date, existing.edd, existing.dating_source
+    lmp = today - timedelta(weeks=DEFAULT_WEEK)
+    return lmp, lmp + timedelta(days=TERM_DAYS), 'default'
+
+
+# ==================== SOURCES ====================
+
+def _age(dob, today):
+    if not dob:
+        return None
+    return today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
+
+
+def _client_profile(conn, user_id, today):
+    u = _t('User')
+    row = conn.execute(select(
+        u.c.user_type, u.c.is_pregnant, u.c.lmp_date, u.c.expected_delivery_date, u.c.pregnancy_week,
+        u.c.is_high_risk, u.c.risk_reason, u.c.pregnancy_risk_factors, u.c.dob, u.c.full_name,
+        u.c.first_name, u.c.last_name, u.c.village, u.c.mobile, u.c.assigned_health_worker_id,
+        u.c.gravida, u.c.para
+    ).where(u.c.id == user_id)).first()
+    if row is None or row.user_type != 'client':
+        return None
+    return {
+        'pregnant': bool(row.is_pregnant),
+        'lmp': row.lmp_date,
+        'edd': row.expected_delivery_date,
+        'week': row.pregnancy_week,
+        'flagged': bool(row.is_high_risk),
+        'risk_reason': row.risk_reason,
+        'risk_factors': row.pregnancy_risk_factors,
+        'age': _age(row.dob, today),
+        'name': row.full_name or f"{row.first_name or ''} {row.last_name or ''}".strip(),
+        'village': row.village,
+        'phone': row.mobile,
+        'worker_id': row.assigned_health_worker_id,
+        'patient_user_id': user_id,
+        'gravida': row.gravida,
+        'para': row.para,
+        'last_visit_date': None,
+    }
+
+
+def _member_profile(conn, member_id, today):
+    m, h = _t('HouseholdMember'), _t('Household')
+    row = conn.execute(select(
+        m.c.is_pregnant, m.c.pregnancy_week, m.c.expected_delivery_date, m.c.is_high_risk, m.c.risk_reason,
+        m.c.age, m.c.name, m.c.user_id, h.c.health_worker_id, h.c.village, h.c.phone, h.c.last_visit_date
+    ).select_from(m.join(h, m.c.household_id == h.c.id)).where(m.c.id == member_id)).first()
+    if row is None:
+        return None
+    return {
+        'pregnant': bool(row.is_pregnant),
+        'lmp': None,
+        'edd': row.expected_delivery_date,
+        'week': row.pregnancy_week,
+        'flagged': bool(row.is_high_risk),
+        'risk_reason': row.risk_reason,
+        'risk_factors': None,
+        'age': row.age,
+        'name': row.name,
+        'village': row.village,
+        'phone': row.phone,
+        'worker_id': row.health_worker_id,
+        'patient_user_id': row.user_id,  # Assessments are recorded against the linked client
+        'gravida': None,
+        'para': None,
+        'last_visit_date': row.last_visit_date,
+    }
+
+
+def _latest_assessment(conn, patient_user_id, since):
+    """Dating and risk recorded on the most recent ANC assessment since ``since``"""
+    a = _t('HealthAssessment')
+    rows = conn.execute(select(a.c.pregnancy_data, a.c.created_at).where(
+        a.c.patient_id == patient_user_id,
+        a.c.assessment_type == 'ANC',
+        a.c.created_at >= since
+    ).order_by(a.c.created_at.desc()).limit(5)).all()
+    for payload, created_at in rows:
+        try:
+            data = json.loads(payload or '{}')
+        except ValueError:
+            continue
+        found = {
+            'lmp': _parse_date(data.get('last_menstrual_period')),
+            'edd': _parse_date(data.get('edd')),
+            'week': _int(data.get('gestational_week')),
+            'high_risk': str(data.get('risk_level') or '').lower() == 'high',
+            'gravida': _int(data.get('gravida')),
+            'para': _int(data.get('para')),
+            'on': created_at.date() if created_at else date.today(),
+        }
+        if found['lmp'] or found['edd'] or found['week'] or found['high_risk']:
+            return found
+    return None
+
+
+def _visits(conn, patient_user_id, kind, since, until=None):
+    """(count, last date, earliest payload list) of ANC/PNC assessments in a window"""
+    a = _t('HealthAssessment')
+    conditions = [a.c.patient_id == patient_user_id, a.c.assessment_type == kind, a.c.created_at >= since]
+    if until:
+        conditions.append(a.c.created_at < until)
+    count, last = conn.execute(select(func.count(a.c.id), func.max(a.c.created_at)).where(*conditions)).one()
+    return count, last.date() if last else None
+
+
+def _pnc_delivery(conn, patient_user_id, since):
+    """Delivery date evidenced by PNC assessments after ``since`` (recorded date, else first PNC)"""
+    a = _t('HealthAssessment')
+    rows = conn.execute(select(a.c.pregnancy_data, a.c.created_at).where(
+        a.c.patient_id == patient_user_id,
+        a.c.assessment_type == 'PNC',
+        a.c.created_at >= since
+    ).order_by(a.c.created_at)).all()
+    if not rows:
+        return None
+    for payload, _ in rows:
+        try:
+            recorded = _parse_date(json.loads(payload or '{}').get('delivery_date'))
+        except ValueError:
+            recorded = None
+        if recorded:
+            return recorded
+    return rows[0].created_at.date()
+
+
+def _worker_location(conn, worker_id):
+    if not worker_id:
+        return None, None
+    u = _t('User')
+    row = conn.execute(select(u.c.facility_id, u.c.block_id).where(u.c.id == worker_id)).first()
+    return (row.facility_id, row.block_id) if row else (None, None)
+
+
+# ==================== SYNC ====================
+
+def _since(dt):
+    return datetime.combine(dt, datetime.min.time())
+
+
+def _sync(conn, subject_type, subject_id, week_changed=False, today=None):
+    """Bring one subject's latest cohort row in line with its profile and assessments"""
+    today = today or date.today()
+    table = _t('AncCohortEntry')
+    load = _client_profile if subject_type == 'client' else _member_profile
+    profile = load(conn, subject_id, today)
+    latest = conn.execute(select(table).where(
+        table.c.subject_type == subject_type, table.c.subject_id == subject_id
+    ).order_by(table.c.id.desc()).limit(1)).first()
+    active = latest if latest is not None and latest.status == 'active' else None
+
+    if profile is None:
+        if active is not None:
+            conn.execute(table.update().where(table.c.id == active.id).values(
+                status='closed', updated_at=datetime.utcnow()
+            ))
+        return
+
+    patient = profile['patient_user_id']
+    episode_floor = today - timedelta(days=TERM_DAYS + PNC_DAYS)
+    assessment = _latest_assessment(conn, patient, _since(episode_floor)) if patient else None
+    lmp, edd, source = _dating(profile, assessment, active, week_changed, today)
+
+    if active is None:
+        ended = latest.delivery_date or (latest.updated_at.date() if latest.updated_at else None) if latest else None
+        if profile['pregnant']:
+            if ended and lmp <= ended:
+                return  # Still the pregnancy that already ended (profile not yet updated)
+        elif subject_type == 'member' and profile['edd'] and today - timedelta(days=PNC_DAYS) <= profile['edd'] <= today:
+            if latest is not None:
+                return
+            lmp, edd, source = profile['edd'] - timedelta(days=TERM_DAYS), profile['edd'], 'edd'
+        elif not (patient and latest is None and _pnc_delivery(conn, patient, _since(today - timedelta(days=PNC_DAYS)))):
+            return
+
+    # Status: still pregnant, or delivered/closed
+    delivery = _pnc_delivery(conn, patient, _since(lmp)) if patient else None
+    if delivery:
+        status = 'delivered'
+    elif profile['pregnant']:
+        status = 'active'
+    elif edd and (edd - today).days <= TERM_WINDOW_DAYS:
+        status, delivery = 'delivered', min(edd, today)
+    else:
+        status = 'closed'
+
+    anc, last_anc = _visits(conn, patient, 'ANC', _since(lmp), _since(delivery) if delivery else None) if patient else (0, None)
+    pnc, last_pnc = _visits(conn, patient, 'PNC', _since(delivery)) if patient and delivery else (0, None)
+
+    flagged = profile['flagged'] or bool(assessment and assessment['high_risk'])
+    age = profile['age']
+    reason = profile['risk_reason']
+    if age is not None and (age < 18 or age > 35):
+        flagged = True
+        reason = reason or ('Teenage pregnancy' if age < 18 else 'Advanced maternal age')
+    if assessment and assessment['high_risk']:
+        reason = reason or 'Flagged high risk at ANC'
+
+    facility_id, block_id = _worker_location(conn, profile['worker_id'])
+    values = {
+        'subject_type': subject_type,
+        'subject_id': subject_id,
+        'patient_user_id': patient,
+        'health_worker_id': profile['worker_id'],
+        'facility_id': facility_id,
+        'block_id': block_id,
+        'name': profile['name'],
+        'age': age,
+        'village': profile['village'],
+        'phone': profile['phone'],
+        'lmp_date': lmp,
+        'edd': edd,
+        'dating_source': source,
+        'is_high_risk': flagged,
+        'risk_reason': reason,
+        'risk_factors': profile['risk_factors'],
+        'gravida': profile['gravida'] or (assessment and assessment['gravida']),
+        'para': profile['para'] or (assessment and assessment['para']),
+        'anc_visits': anc,
+        'last_anc_date': last_anc,
+        'pnc_visits': pnc,
+        'last_pnc_date': last_pnc,
+        'last_visit_date': max(d for d in (profile['last_visit_date'], last_anc, last_pnc, date.min) if d) or None,
+        'status': status,
+        'delivery_date': delivery if status == 'delivered' else None,
+        'updated_at': datetime.utcnow(),
+    }
+    if values['last_visit_date'] == date.min:
+        values['last_visit_date'] = None
+    if active is not None:
+        conn.execute(table.update().where(table.c.id == active.id).values(**values))
+    else:
+        conn.execute(table.insert().values(created_at=datetime.utcnow(), **values))
+
+
+def _move_worker(conn, worker_id):
+    table = _t('AncCohortEntry')
+    facility_id, block_id = _worker_location(conn, worker_id)
+    conn.execute(table.update().where(table.c.health_worker_id == worker_id).values(
+        facility_id=facility_id, block_id=block_id
+    ))
+
+
+def _changed(obj, fields):
+    state = sa_inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+def _collect_cohort_changes(session, flush_context):
+    """Resync cohort rows for every maternal source touched by this flush"""
+    User, Member, Household, Assessment = _m('User'), _m('HouseholdMember'), _m('Household'), _m('HealthAssessment')
+
+    clients, members, households, workers, linked_users = {}, {}, set(), set(), set()
+    for obj in list(session.new) + list(session.dirty):
+        is_new = obj in session.new
+        if isinstance(obj, User) and obj.id is not None:
+            if obj.user_type == 'client' and (is_new and obj.is_pregnant or not is_new and _changed(obj, CLIENT_FIELDS)):
+                clients[obj.id] = clients.get(obj.id, False) or is_new or _changed(obj, DATING_FIELDS)
+            elif obj.user_type == 'health_worker' and not is_new and _changed(obj, WORKER_FIELDS):
+                workers.add(obj.id)
+        elif isinstance(obj, Member) and obj.id is not None:
+            if is_new and (obj.is_pregnant or obj.expected_delivery_date) or not is_new and _changed(obj, MEMBER_FIELDS):
+                members[obj.id] = members.get(obj.id, False) or is_new or _changed(obj, DATING_FIELDS)
+        elif isinstance(obj, Household) and not is_new and _changed(obj, HOUSEHOLD_FIELDS):
+            households.add(obj.id)
+        elif isinstance(obj, Assessment) and is_new and obj.assessment_type in ('ANC', 'PNC') and obj.patient_id:
+            linked_users.add(obj.patient_id)
+    for obj in session.deleted:
+        if isinstance(obj, Member) and obj.id is not None:
+            members.setdefault(obj.id, False)
+        elif isinstance(obj, Assessment) and obj.assessment_type in ('ANC', 'PNC') and obj.patient_id:
+            linked_users.add(obj.patient_id)
+
+    if not (clients or members or households or workers or linked_users):
+        return
+
+    conn = session.connection()
+    m = _t('HouseholdMember')
+    if households:
+        for (member_id,) in conn.execute(select(m.c.id).where(m.c.household_id.in_(households))):
+            members.setdefault(member_id, False)
+    if linked_users:
+        for user_id in linked_users:
+            clients.setdefault(user_id, False)
+        for (member_id,) in conn.execute(select(m.c.id).where(m.c.user_id.in_(linked_users))):
+            members.setdefault(member_id, False)
+
+    for user_id, week_changed in clients.items():
+        _sync(conn, 'client', user_id, week_changed)
+    for member_id, week_changed in members.items():
+        _sync(conn, 'member', member_id, week_changed)
+    for worker_id in workers:
+        _move_worker(conn, worker_id)
+
+
+# ==================== BOOTSTRAP ====================
+
+def _source_subjects(only_missing):
+    """(subject_type, id) for every pregnancy source, optionally only those with no cohort row"""
+    db, User, Member, Entry = _runtime['db'], _m('User'), _m('HouseholdMember'), _m('AncCohortEntry')
+    Assessment = _m('HealthAssessment')
+    today = date.today()
+    pnc_since = _since(today - timedelta(days=PNC_DAYS))
+
+    clients = db.session.query(User.id).filter(User.user_type == 'client', or_(
+        User.is_pregnant == True,
+        User.id.in_(db.session.query(Assessment.patient_id).filter(
+            Assessment.assessment_type == 'PNC', Assessment.created_at >= pnc_since
+        ))
+    ))
+    members = db.session.query(Member.id).filter(or_(
+        Member.is_pregnant == True,
+        Member.expected_delivery_date.between(today - timedelta(days=PNC_DAYS), today)
+    ))
+    if only_missing:
+        clients = clients.filter(~db.session.query(Entry.id).filter(
+            Entry.subject_type == 'client', Entry.subject_id == User.id
+        ).exists())
+        members = members.filter(~db.session.query(Entry.id).filter(
+            Entry.subject_type == 'member', Entry.subject_id == Member.id
+        ).exists())
+    return [('client', i) for (i,) in clients] + [('member', i) for (i,) in members]
+
+
+def rebuild_cohort(only_missing=False):
+    """Sync every pregnancy source (new rows are dated from the current profiles)"""
+    db = _runtime['db']
+    subjects = _source_subjects(only_missing)
+    conn = db.session.connection()
+    for subject_type, subject_id in subjects:
+        _sync(conn, subject_type, subject_id)
+    # Rows whose subject stopped being a source (no longer pregnant, deleted) settle too
+    if not only_missing:
+        table = _t('AncCohortEntry')
+        seen = set(subjects)
+        for row in conn.execute(select(table.c.subject_type, table.c.subject_id).where(table.c.status == 'active')):
+            if (row.subject_type, row.subject_id) not in seen:
+                _sync(conn, row.subject_type, row.subject_id)
+    db.session.commit()
+    return {'subjects': len(subjects)}
+
+
+def ensure_cohort():
+    """Add rows for pregnancies recorded before the cohort existed (once per process)"""
+    _runtime.once('cohort', lambda: _source_subjects(only_missing=True) and rebuild_cohort(only_missing=True))
+
+
+# ==================== QUERIES ====================
+
+def _late_pregnancy(today):
+    Entry = _m('AncCohortEntry')
+    return Entry.lmp_date <= _lmp_before(LATE_PREGNANCY_WEEK, today)
+
+
+def _high_risk(today):
+    Entry = _m('AncCohortEntry')
+    return or_(Entry.is_high_risk == True, _late_pregnancy(today))
+
+
+def _anc_compliant(today):
+    """ANC visits on schedule for the current gestational week, as one SQL condition"""
+    Entry = _m('AncCohortEntry')
+    clauses, newer_than = [], None
+    for upto, visits in ANC_SCHEDULE:
+        bound = _lmp_before(upto + 1, today)  # Fewer than upto+1 completed weeks <=> week <= upto
+        window = Entry.lmp_date > bound if newer_than is None else and_(Entry.lmp_date > bound, Entry.lmp_date <= newer_than)
+        clauses.append(and_(window, Entry.anc_visits >= visits))
+        newer_than = bound
+    clauses.append(and_(Entry.lmp_date <= newer_than, Entry.anc_visits >= ANC_EXPECTED_AFTER))
+    return or_(*clauses)
+
+
+def scope_filter(facility_id=None, block_ids=None):
+    """Cohort rows for a facility, or for a set of blocks"""
+    Entry = _m('AncCohortEntry')
+    if facility_id is not None:
+        return Entry.facility_id == facility_id
+    return Entry.block_id.in_(block_ids or [])
+
+
+def cohort_summary(scope, today=None):
+    """Headline maternal counts for a scope, computed in SQL"""
+    db, Entry = _runtime['db'], _m('AncCohortEntry')
+    today = today or date.today()
+    month_start = today.replace(day=1)
+    next_month = (month_start + timedelta(days=32)).replace(day=1)
+
+    def count(condition):
+        return func.coalesce(func.sum(db.case((condition, 1), else_=0)), 0)
+
+    total, t1, t2, high, due_month, due_soon, compliant = db.session.query(
+        func.count(Entry.id),
+        count(Entry.lmp_date > _lmp_before(13, today)),
+        count(and_(Entry.lmp_date <= _lmp_before(13, today), Entry.lmp_date > _lmp_before(28, today))),
+        count(_high_risk(today)),
+        count(and_(Entry.edd >= month_start, Entry.edd < next_month)),
+        count(and_(Entry.edd >= today, Entry.edd <= today + timedelta(days=DUE_SOON_DAYS))),
+        count(_anc_compliant(today)),
+    ).filter(scope, Entry.status == 'active').one()
+
+    pnc_total, pnc_high, pnc_visits_ok = db.session.query(
+        func.count(Entry.id),
+        count(Entry.is_high_risk == True),
+        # At least min(PNC week + 1, 4) visits; PNC week = days since delivery // 7 + 1
+        count(or_(
+            Entry.pnc_visits >= 4,
+            and_(Entry.pnc_visits == 3, Entry.delivery_date > today - timedelta(days=14)),
+            and_(Entry.pnc_visits == 2, Entry.delivery_date > today - timedelta(days=7)),
+        )),
+    ).filter(scope, Entry.status == 'delivered', Entry.delivery_date >= today - timedelta(days=PNC_DAYS)).one()
+
+    return {
+        'total_pregnant': total,
+        'high_risk': high,
+        'high_risk_percent': round(high / total * 100, 1) if total else 0,
+        'due_this_month': due_month,
+        'due_next_14_days': due_soon,
+        'anc_compliant': compliant,
+        'anc_compliant_percent': round(compliant / total * 100, 1) if total else 0,
+        'trimester_1': t1,
+        'trimester_2': t2,
+        'trimester_3': total - t1 - t2,
+        'total_pnc': pnc_total,
+        'pnc_high_risk': pnc_high,
+        'pnc_compliant': pnc_visits_ok,
+        'pnc_compliant_percent': round(pnc_visits_ok / pnc_total * 100, 1) if pnc_total else 0,
+    }
+
+
+def _risk_reason(entry, week):
+    if entry.risk_reason:
+        return entry.risk_reason
+    if week and week >= LATE_PREGNANCY_WEEK:
+        return 'Late pregnancy'
+    return None
+
+
+def pregnancy_dict(entry, worker_names=None, today=None):
+    today = today or date.today()
+    week = gestational_week(entry.lmp_date, today)
+    high_risk = bool(entry.is_high_risk or (week and week >= LATE_PREGNANCY_WEEK))
+    return {
+        'id': entry.subject_id,
+        'name': entry.name,
+        'age': entry.age,
+        'village': entry.village,
+        'phone': entry.phone,
+        'pregnancy_week': week,
+        'trimester': trimester(week),
+        'expected_delivery_date': entry.edd.isoformat() if entry.edd else None,
+        'days_to_edd': (entry.edd - today).days if entry.edd else None,
+        'is_high_risk': high_risk,
+        'risk_reason': _risk_reason(entry, week) if high_risk else entry.risk_reason,
+        'anc_visits': entry.anc_visits,
+        'is_anc_compliant': bool(week) and entry.anc_visits >= anc_expected(week),
+        'last_visit_date': entry.last_visit_date.isoformat() if entry.last_visit_date else None,
+        'worker_id': entry.health_worker_id,
+        'worker_name': (worker_names or {}).get(entry.health_worker_id, 'Unknown'),
+        'source': 'household' if entry.subject_type == 'member' else 'client',
+    }
+
+
+def postnatal_dict(entry, worker_names=None, today=None):
+    today = today or date.today()
+    days = (today - entry.delivery_date).days
+    pnc_week = days // 7 + 1 if days >= 0 else 1
+    return {
+        'id': entry.subject_id,
+        'name': entry.name,
+        'age': entry.age,
+        'village': entry.village,
+        'phone': entry.phone,
+        'delivery_date': entry.delivery_date.isoformat(),
+        'days_since_delivery': days,
+        'pnc_week': pnc_week,
+        'pnc_visits': entry.pnc_visits,
+        'is_pnc_compliant': entry.pnc_visits >= min(pnc_week + 1, 4),
+        'is_high_risk': bool(entry.is_high_risk),
+        'risk_reason': entry.risk_reason,
+        'worker_id': entry.health_worker_id,
+        'worker_name': (worker_names or {}).get(entry.health_worker_id, 'Unknown'),
+        'last_visit_date': entry.last_visit_date.isoformat() if entry.last_visit_date else None,
+        'source': 'household' if entry.subject_type == 'member' else 'client',
+    }
+
+
+def active_pregnancies(scope, today=None, due_within=None, high_risk_only=False, limit=None):
+    """Active rows in a scope; ``due_within`` days narrows to an EDD range (soonest first)"""
+    db, Entry = _runtime['db'], _m('AncCohortEntry')
+    today = today or date.today()
+    query = Entry.query.filter(scope, Entry.status == 'active')
+    if due_within is not None:
+        query = query.filter(Entry.edd >= today, Entry.edd <= today + timedelta(days=due_within))
+    if high_risk_only:
+        query = query.filter(_high_risk(today))
+    query = query.order_by(db.case((_high_risk(today), 0), else_=1), Entry.edd, Entry.id)
+    return query.limit(limit).all() if limit else query.all()
+
+
+def recent_deliveries(scope, today=None, limit=None):
+    """Delivered rows still inside the 42-day postnatal window, most recent first"""
+    Entry = _m('AncCohortEntry')
+    today = today or date.today()
+    query = Entry.query.filter(
+        scope, Entry.status == 'delivered',
+        Entry.delivery_date >= today - timedelta(days=PNC_DAYS),
+        Entry.delivery_date <= today
+    ).order_by(Entry.delivery_date.desc(), Entry.id)
+    return query.limit(limit).all() if limit else query.all()
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='ANC cohort tools')
+    parser.add_argument('command', choices=['rebuild'])
+    args = parser.parse_args()
+
+    app, service = cli_app('services.anc_cohort')
+
+    with app.app_context():
+        print(f"✅ Cohort synced: {service.rebuild_cohort()}")
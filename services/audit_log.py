@@ -0,0 +1,412 @@
+"""
+Insurance Audit Log
+Append-only, buffered and month-partitioned storage for insurance company audit events.
+
+``record_audit()`` only appends the event to an in-process buffer, so read
+endpoints (claims list, fraud monitor, policy details) no longer commit an
+audit row inside the request. A background flusher writes the buffer every
+FLUSH_SECONDS, or as soon as BATCH_SIZE events are waiting, with one
+multi-row INSERT per month; the buffer is also flushed at interpreter exit.
+
+Events are stored per calendar month:
+
+* PostgreSQL: ``insurance_audit_events`` is a range-partitioned table with
+  one partition per month (``insurance_audit_events_YYYYMM``), created ahead
+  of the first write into that month; reads go through the parent and are
+  pruned to the months in the date filter.
+* SQLite: one table per month with the same name pattern; reads walk the
+  months newest first and stop once the page is full.
+
+Every month carries (user_id, timestamp), (action_type, timestamp) and
+(patient_id, timestamp) indexes. Retention archives whole months older than
+INSURANCE_AUDIT_RETENTION_MONTHS to gzip JSON lines and drops them, so
+writes and the recent-history reads never touch old volume; an archive is
+written to a temporary file and only published once its month is dropped.
+Rows from the original ``insurance_audit_logs`` table are moved into the
+partitions in batches, each claimed with DELETE ... RETURNING so workers
+migrating at the same startup never copy a row twice::
+
+    python -m services.audit_log retention [--months 36] [--no-archive]
+    python -m services.audit_log migrate
+"""
+import atexit
+import gzip
+import json
+import os
+import re
+import threading
+from collections import deque
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import (
+    BigInteger, Boolean, Column, DateTime, Index, Integer, JSON, MetaData, String, Table,
+    inspect as sa_inspect, select, text
+)
+
+from services.runtime import ServiceRuntime, cli_app
+
+PARENT_TABLE = 'insurance_audit_events'
+LEGACY_TABLE = 'insurance_audit_logs'
+MONTH_TABLE = re.compile(rf'^{PARENT_TABLE}_(\d{{4}})(\d{{2}})$')
+BATCH_SIZE = 200
+FLUSH_SECONDS = 2.0
+MAX_BUFFER = 50000  # Beyond this the recording request flushes synchronously
+DEFAULT_RETENTION_MONTHS = 36
+MIGRATE_BATCH = 5000
+
+EVENT_FIELDS = (
+    'user_id', 'user_role', 'user_name', 'action_type', 'action_category', 'target_type', 'target_id',
+    'patient_id', 'consent_id', 'consent_valid', 'action_details', 'ip_address', 'user_agent', 'timestamp',
+)
+
+_runtime = ServiceRuntime(tables={}, flusher=None)
+_buffer = deque()
+_buffer_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_table_lock = threading.Lock()
+_flusher_lock = threading.Lock()
+_pending = threading.Event()
+
+
+def init_audit_log(app, db):
+    """Register the app and db used by the writer and install the exit flush"""
+    _runtime.init(db, app=app)
+    atexit.register(_flush_at_exit)
+
+
+def _engine():
+    return _runtime['db'].engine
+
+
+def _is_postgres():
+    return _engine().dialect.name == 'postgresql'
+
+
+# ==================== TABLES ====================
+
+def month_key(moment):
+    return moment.year * 100 + moment.month
+
+
+def _month_bounds(key):
+    start = date(key // 100, key % 100, 1)
+    end = date(start.year + (start.month == 12), start.month % 12 + 1, 1)
+    return start, end
+
+
+def _event_table(name, partitioned=False):
+    metadata = MetaData()
+    return Table(
+        name, metadata,
+        Column('id', BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=True),
+        Column('user_id', Integer, nullable=False),
+        Column('user_role', String(50)),
+        Column('user_name', String(200)),
+        Column('action_type', String(100), nullable=False),
+        Column('action_category', String(50)),
+        Column('target_type', String(50)),
+        Column('target_id', Integer),
+        Column('patient_id', Integer),
+        Column('consent_id', Integer),
+        Column('consent_valid', Boolean),
+        Column('action_details', JSON),
+        Column('ip_address', String(50)),
+        Column('user_agent', String(500)),
+        # Partition key must be part of the primary key on PostgreSQL
+        Column('timestamp', DateTime, nullable=False, primary_key=partitioned),
+        Index(f'ix_{name}_user', 'user_id', 'timestamp'),
+        Index(f'ix_{name}_action', 'action_type', 'timestamp'),
+        Index(f'ix_{name}_patient', 'patient_id', 'timestamp'),
+        **({'postgresql_partition_by': 'RANGE (timestamp)'} if partitioned else {})
+    )
+
+
+def _parent():
+    table = _runtime['tables'].get('parent')
+    if table is None:
+        table = _event_table(PARENT_TABLE, partitioned=True)
+        table.create(_engine(), checkfirst=True)
+        _runtime['tables']['parent'] = table
+    return table
+
+
+def table_for_month(key):
+    """Table to write events of this month into, creating the month (partition) on first use"""
+    tables = _runtime['tables']
+    if key in tables:
+        return tables[key]
+    with _table_lock:
+        if key in tables:
+            return tables[key]
+        name = f'{PARENT_TABLE}_{key}'
+        if _is_postgres():
+            parent = _parent()
+            start, end = _month_bounds(key)
+            with _engine().begin() as conn:
+                conn.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {PARENT_TABLE} "
+                    f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                ))
+            tables[key] = parent  # Inserts route through the parent
+        else:
+            table = _event_table(name)
+            table.create(_engine(), checkfirst=True)
+            tables[key] = table
+        return tables[key]
+
+
+def table_month(name):
+    """Month key of a month table/partition name, else None"""
+    match = MONTH_TABLE.match(name)
+    return int(match.group(1)) * 100 + int(match.group(2)) if match else None
+
+
+def month_load_tables(key):
+    """(month's own table, table owning its id sequence) for bulk loads such as migrate_data.py"""
+    table_for_month(key)
+    month = _event_table(f'{PARENT_TABLE}_{key}')
+    return month, (_parent() if _is_postgres() else month)
+
+
+def stored_months():
+    """Month keys that currently have a table/partition, newest first"""
+    months = (table_month(name) for name in sa_inspect(_engine()).get_table_names())
+    return sorted((key for key in months if key is not None), reverse=True)
+
+
+# ==================== WRITER ====================
+
+def record_audit(**event):
+    """Queue one audit event; it is written by the background flusher"""
+    event = {field: event.get(field) for field in EVENT_FIELDS}
+    event['timestamp'] = event['timestamp'] or datetime.utcnow()
+    with _buffer_lock:
+        _buffer.append(event)
+        size = len(_buffer)
+    if size >= MAX_BUFFER:
+        flush()  # Writer has fallen behind: apply back-pressure to the caller
+    elif size >= BATCH_SIZE:
+        _pending.set()
+    _ensure_flusher()
+
+
+def flush():
+    """Write every buffered event now; returns the number written"""
+    with _flush_lock:
+        with _buffer_lock:
+            events = list(_buffer)
+            _buffer.clear()
+        if not events:
+            return 0
+        by_month = {}
+        for event in events:
+            by_month.setdefault(month_key(event['timestamp']), []).append(event)
+        try:
+            tables = {key: table_for_month(key) for key in by_month}
+            with _engine().begin() as conn:
+                for key, rows in sorted(by_month.items()):
+                    conn.execute(tables[key].insert(), rows)
+        except Exception:
+            with _buffer_lock:
+                _buffer.extendleft(reversed(events))  # Keep them for the next attempt
+            raise
+        return len(events)
+
+
+def _ensure_flusher():
+    app = _runtime['app']
+    thread = _runtime['flusher']
+    if app is None or (thread is not None and thread.is_alive()):
+        return
+    with _flusher_lock:
+        thread = _runtime['flusher']
+        if thread is not None and thread.is_alive():
+            return
+
+        def loop():
+            with app.app_context():
+                while True:
+                    _pending.wait(FLUSH_SECONDS)
+                    _pending.clear()
+                    try:
+                        flush()
+                    except Exception as e:
+                        print(f"Error flushing insurance audit events: {e}")
+
+        thread = threading.Thread(target=loop, name='insurance-audit-flusher', daemon=True)
+        _runtime['flusher'] = thread
+        thread.start()
+
+
+def _flush_at_exit():
+    app = _runtime['app']
+    if app is None or not _buffer:
+        return
+    try:
+        with app.app_context():
+            flush()
+    except Exception as e:
+        print(f"Error flushing insurance audit events at exit: {e}")
+
+
+# ==================== READS ====================
+
+def _filtered(table, user_id, action_type, action_category, patient_id, date_from, date_to):
+    query = select(table)
+    if user_id is not None:
+        query = query.where(table.c.user_id == user_id)
+    if patient_id is not None:
+        query = query.where(table.c.patient_id == patient_id)
+    if action_category:
+        query = query.where(table.c.action_category == action_category)
+    if action_type:
+        query = query.where(table.c.action_type.ilike(f'%{action_type}%'))
+    if date_from:
+        query = query.where(table.c.timestamp >= date_from)
+    if date_to:
+        query = query.where(table.c.timestamp < date_to)
+    return query.order_by(table.c.timestamp.desc(), table.c.id.desc())
+
+
+def query_events(user_id=None, action_type=None, action_category=None, patient_id=None,
+                 date_from=None, date_to=None, limit=1000):
+    """Newest-first audit events; date_from inclusive, date_to exclusive (datetimes)"""
+    flush()  # Make the caller's own recent actions visible
+    if _is_postgres():
+        if not stored_months():
+            return []
+        query = _filtered(_parent(), user_id, action_type, action_category, patient_id, date_from, date_to)
+        with _engine().connect() as conn:
+            return [dict(row._mapping) for row in conn.execute(query.limit(limit))]
+
+    first = month_key(date_from) if date_from else None
+    last = month_key(date_to - timedelta(microseconds=1)) if date_to else None
+    events = []
+    with _engine().connect() as conn:
+        for key in stored_months():
+            if (last is not None and key > last) or (first is not None and key < first):
+                continue
+            query = _filtered(table_for_month(key), user_id, action_type, action_category, patient_id,
+                              date_from, date_to)
+            events.extend(dict(row._mapping) for row in conn.execute(query.limit(limit - len(events))))
+            if len(events) >= limit:
+                break
+    return events
+
+
+# ==================== RETENTION ====================
+
+def _archive_dir():
+    app = _runtime['app']
+    configured = app.config.get('INSURANCE_AUDIT_ARCHIVE_DIR') if app else None
+    return configured or os.path.join(app.instance_path if app else '.', 'audit_archive')
+
+
+def _archive_month(conn, key, directory):
+    """Write the month to a temporary archive; returns (temporary path, rows)"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{PARENT_TABLE}_{key}.jsonl.gz.tmp')
+    table = _event_table(f'{PARENT_TABLE}_{key}')
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8') as archive:
+        result = conn.execution_options(stream_results=True).execute(select(table).order_by(table.c.id))
+        for row in result:
+            archive.write(json.dumps(dict(row._mapping), default=str) + '\n')
+            count += 1
+    return path, count
+
+
+def _publish_archive(temporary, key, directory):
+    """Rename a dropped month's archive into place, next to any earlier archive of that month"""
+    path = os.path.join(directory, f'{PARENT_TABLE}_{key}.jsonl.gz')
+    part = 1
+    while os.path.exists(path):  # The month was recreated by late events after an earlier drop
+        part += 1
+        path = os.path.join(directory, f'{PARENT_TABLE}_{key}-{part}.jsonl.gz')
+    os.replace(temporary, path)
+    return path
+
+
+def apply_retention(months=None, archive=True, today=None):
+    """Archive (gzip JSON lines) and drop every month older than the retention window"""
+    app = _runtime['app']
+    if months is None:
+        months = int((app.config.get('INSURANCE_AUDIT_RETENTION_MONTHS') if app else None) or DEFAULT_RETENTION_MONTHS)
+    today = today or date.today()
+    cutoff_index = today.year * 12 + today.month - 1 - months
+    cutoff = (cutoff_index // 12) * 100 + cutoff_index % 12 + 1  # Oldest month kept
+    flush()
+    directory = _archive_dir()
+    dropped = []
+    for key in sorted(stored_months()):
+        if key >= cutoff:
+            break
+        archived = (None, None)
+        try:
+            with _engine().begin() as conn:
+                if archive:
+                    archived = _archive_month(conn, key, directory)
+                conn.execute(text(f'DROP TABLE {PARENT_TABLE}_{key}'))
+        except Exception:
+            if archived[0] and os.path.exists(archived[0]):
+                os.remove(archived[0])  # The month is still stored; the next run archives it afresh
+            raise
+        _runtime['tables'].pop(key, None)
+        path = _publish_archive(archived[0], key, directory) if archive else None
+        dropped.append({'month': key, 'archive': path, 'rows': archived[1]})
+    return {'kept_from': cutoff, 'dropped': dropped}
+
+
+# ==================== MIGRATION ====================
+
+def migrate_legacy_audit():
+    """Move rows from insurance_audit_logs into the monthly storage (once, in batches)
+
+    Each batch is claimed by deleting it with RETURNING in the transaction that
+    inserts it, so concurrent workers skip (PostgreSQL) or wait for (SQLite)
+    rows another worker has taken instead of copying them again.
+    """
+    if LEGACY_TABLE not in sa_inspect(_engine()).get_table_names():
+        return None
+    legacy = Table(LEGACY_TABLE, MetaData(), autoload_with=_engine())
+    moved = 0
+    while True:
+        with _engine().connect() as conn:
+            batch = conn.execute(
+                select(legacy.c.id, legacy.c.timestamp).order_by(legacy.c.id).limit(MIGRATE_BATCH)
+            ).all()
+        if not batch:
+            break
+        # Months are created up front: on SQLite a second connection cannot create them mid-claim
+        tables = {key: table_for_month(key) for key in {month_key(row.timestamp) for row in batch}}
+        with _engine().begin() as conn:
+            claimed = conn.execute(
+                legacy.delete().where(legacy.c.id.in_([row.id for row in batch])).returning(*legacy.c)
+            ).all()
+            by_month = {}
+            for row in claimed:
+                event = dict(row._mapping)
+                event.pop('id')
+                by_month.setdefault(month_key(event['timestamp']), []).append(event)
+            for key, events in sorted(by_month.items()):
+                conn.execute(tables[key].insert(), events)
+        moved += len(claimed)
+    return {'moved': moved} if moved else None
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Insurance audit log storage')
+    parser.add_argument('command', choices=['retention', 'migrate'])
+    parser.add_argument('--months', type=int, help='Months of audit history to keep')
+    parser.add_argument('--no-archive', action='store_true', help='Drop old months without archiving them')
+    args = parser.parse_args()
+
+    app, service = cli_app('services.audit_log')
+
+    with app.app_context():
+        if args.command == 'migrate':
+            print(f"✅ Legacy audit rows moved: {service.migrate_legacy_audit()}")
+        else:
+            print(f"✅ Audit retention: {service.apply_retention(args.months, archive=not args.no_archive)}")
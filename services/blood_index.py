@@ -0,0 +1,300 @@
+"""
+Blood Availability Index
+Per-bank stock aggregates behind the public "Find Blood" search.
+
+``blood_inventory`` holds one row per blood bank / blood group / component
+with the number of usable units and the earliest expiry. Rows carry the
+bank's coordinates and a grid cell (GRID_DEGREES square) so radius searches
+only read the cells that overlap the search circle, then sort nearest first
+and by units available.
+
+The aggregates are recounted from ``blood_units`` by a session flush hook
+whenever units are added, issued, reserved or deleted, and location columns
+follow the bank's profile. Banks stocked before the index existed are
+counted at startup; the search itself only reads. Expired units are swept
+nightly from cron::
+
+    python -m services.blood_index sweep       # nightly
+    python -m services.blood_index rebuild     # full recount of every bank
+"""
+import math
+from datetime import date, datetime
+
+from sqlalchemy import func, select, inspect as sa_inspect
+
+from services.runtime import ServiceRuntime, cli_app
+
+BLOOD_BANK_USER_TYPE = 'blood_bank'
+BLOOD_GROUPS = ('A+', 'A-', 'B+', 'B-', 'AB+', 'AB-', 'O+', 'O-')
+UNIT_COMPONENT = 'Whole Blood'  # BloodUnit rows are whole-blood bags
+WHOLE_BLOOD_SHELF_DAYS = 35  # CPDA-1 storage
+
+GRID_DEGREES = 0.25  # ~28 km cells
+DEFAULT_RADIUS_KM = 25
+MAX_RADIUS_KM = 200
+EARTH_RADIUS_KM = 6371.0
+
+LOCATION_FIELDS = ('latitude', 'longitude', 'city')
+
+_runtime = ServiceRuntime()
+
+
+def init_blood_index(db, models):
+    """Register the db and model classes and install the sync hook"""
+    _runtime.init(db, models)
+    _runtime.listen('after_flush', _collect_stock_changes, 'BloodUnit', 'User')
+
+
+_m = _runtime.model
+
+
+def normalise_group(value):
+    """'a+', 'A +', or 'A ' (a '+' decoded from a query string) -> 'A+'"""
+    if not value:
+        return None
+    group = value.upper().replace(' ', '')
+    if group not in BLOOD_GROUPS and value.endswith(' '):
+        group += '+'
+    return group if group in BLOOD_GROUPS else None
+
+
+def split_group(group):
+    """'AB-' -> ('AB', '-') as stored on BloodUnit"""
+    return group[:-1], group[-1]
+
+
+def grid_cell(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    return f"{math.floor(latitude / GRID_DEGREES)}:{math.floor(longitude / GRID_DEGREES)}"
+
+
+def _city_key(city):
+    return ' '.join((city or '').split()).lower() or None
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (math.sin((lat2 - lat1) / 2) ** 2
+         + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2)
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+def _location_values(bank):
+    return {
+        'latitude': bank.latitude,
+        'longitude': bank.longitude,
+        'grid_cell': grid_cell(bank.latitude, bank.longitude),
+        'city_key': _city_key(bank.city),
+    }
+
+
+# ==================== MAINTENANCE ====================
+
+def _recount(conn, bank_id, group, today=None):
+    """Recompute one bank/group aggregate from its usable units"""
+    BloodUnit, User = _m('BloodUnit'), _m('User')
+    table = _m('BloodInventory').__table__
+    units = BloodUnit.__table__
+    today = today or date.today()
+    abo, rh = split_group(group)
+
+    count, next_expiry = conn.execute(
+        select(func.count(units.c.id), func.min(units.c.expiry_date)).where(
+            units.c.blood_bank_id == bank_id,
+            units.c.blood_group == abo,
+            units.c.rh_factor == rh,
+            units.c.status == 'Available',
+            units.c.expiry_date >= today
+        )
+    ).one()
+
+    values = {'units_available': count, 'next_expiry': next_expiry, 'last_updated': datetime.utcnow()}
+    match = (
+        (table.c.blood_bank_id == bank_id)
+        & (table.c.blood_group == group)
+        & (table.c.component_type == UNIT_COMPONENT)
+    )
+    if conn.execute(table.update().where(match).values(**values)).rowcount:
+        return
+    if count:
+        bank = conn.execute(
+            select(User.latitude, User.longitude, User.city).where(User.id == bank_id)
+        ).one()
+        conn.execute(table.insert().values(
+            blood_bank_id=bank_id, blood_group=group, component_type=UNIT_COMPONENT,
+            **_location_values(bank), **values
+        ))
+
+
+def _unit_key(unit, state=None):
+    """(bank_id, 'A+') for a unit, optionally as it was before this flush"""
+    if state is None:
+        return unit.blood_bank_id, f"{unit.blood_group}{unit.rh_factor}"
+    old = {}
+    for field in ('blood_bank_id', 'blood_group', 'rh_factor'):
+        history = state.attrs[field].history
+        old[field] = history.deleted[0] if history.deleted else getattr(unit, field)
+    return old['blood_bank_id'], f"{old['blood_group']}{old['rh_factor']}"
+
+
+def _collect_stock_changes(session, flush_context):
+    """Recount the aggregates touched by this flush and follow bank moves"""
+    BloodUnit, User = _m('BloodUnit'), _m('User')
+
+    stale, moved_banks = set(), {}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, BloodUnit):
+            stale.add(_unit_key(obj))
+            if obj in session.dirty:
+                stale.add(_unit_key(obj, sa_inspect(obj)))  # Group or bank edited
+        elif isinstance(obj, User) and obj in session.dirty and obj.user_type == BLOOD_BANK_USER_TYPE:
+            state = sa_inspect(obj)
+            if any(state.attrs[field].history.has_changes() for field in LOCATION_FIELDS):
+                moved_banks[obj.id] = _location_values(obj)
+
+    stale = {(bank_id, group) for bank_id, group in stale if bank_id and normalise_group(group)}
+    if not stale and not moved_banks:
+        return
+
+    conn = session.connection()
+    table = _m('BloodInventory').__table__
+    for bank_id, values in moved_banks.items():
+        conn.execute(table.update().where(table.c.blood_bank_id == bank_id).values(**values))
+    for bank_id, group in stale:
+        _recount(conn, bank_id, group)
+
+
+def add_units(bank_id, group, count, expiry_date, notes=None):
+    """Add ``count`` available whole-blood units for a bank (caller commits)"""
+    BloodUnit = _m('BloodUnit')
+    abo, rh = split_group(group)
+    units = [
+        BloodUnit(blood_bank_id=bank_id, blood_group=abo, rh_factor=rh,
+                  expiry_date=expiry_date, notes=notes, status='Available')
+        for _ in range(count)
+    ]
+    _runtime['db'].session.add_all(units)
+    return units
+
+
+def sweep_expired(today=None):
+    """Mark past-expiry units Expired and recount the affected aggregates"""
+    db, BloodUnit = _runtime['db'], _m('BloodUnit')
+    today = today or date.today()
+    affected = db.session.query(
+        BloodUnit.blood_bank_id, BloodUnit.blood_group, BloodUnit.rh_factor
+    ).filter(
+        BloodUnit.status == 'Available',
+        BloodUnit.expiry_date < today
+    ).distinct().all()
+
+    expired = BloodUnit.query.filter(
+        BloodUnit.status == 'Available',
+        BloodUnit.expiry_date < today
+    ).update({'status': 'Expired'}, synchronize_session=False)
+
+    conn = db.session.connection()
+    keys = {(bank_id, f"{abo}{rh}") for bank_id, abo, rh in affected}
+    for bank_id, group in keys:
+        if normalise_group(group):
+            _recount(conn, bank_id, group, today)
+    db.session.commit()
+    return {'expired_units': expired, 'aggregates_updated': len(keys)}
+
+
+def _unindexed_units_exist():
+    """Available units with no aggregate row (added before the index existed)"""
+    BloodUnit, Entry = _m('BloodUnit'), _m('BloodInventory')
+    indexed = _runtime['db'].session.query(Entry.id).filter(
+        Entry.blood_bank_id == BloodUnit.blood_bank_id,
+        Entry.blood_group == BloodUnit.blood_group + BloodUnit.rh_factor
+    )
+    return BloodUnit.query.filter(BloodUnit.status == 'Available', ~indexed.exists()).first() is not None
+
+
+def ensure_index():
+    """Count units recorded before the index existed (startup); returns the rebuild summary or None"""
+    if _unindexed_units_exist():
+        return rebuild_index()
+    return None
+
+
+def rebuild_index():
+    """Recount every bank/group from blood_units"""
+    db, BloodUnit, Entry = _runtime['db'], _m('BloodUnit'), _m('BloodInventory')
+    keys = {
+        (bank_id, f"{abo}{rh}")
+        for bank_id, abo, rh in db.session.query(
+            BloodUnit.blood_bank_id, BloodUnit.blood_group, BloodUnit.rh_factor
+        ).distinct()
+    }
+    keys |= set(db.session.query(Entry.blood_bank_id, Entry.blood_group).filter(
+        Entry.component_type == UNIT_COMPONENT
+    ))
+    conn = db.session.connection()
+    for bank_id, group in keys:
+        if normalise_group(group):
+            _recount(conn, bank_id, group)
+    db.session.commit()
+    return {'aggregates': len(keys)}
+
+
+# ==================== SEARCH ====================
+
+def _cells_within(latitude, longitude, radius_km):
+    lat_span = radius_km / 111.0
+    lon_span = radius_km / (111.0 * max(math.cos(math.radians(latitude)), 0.01))
+    lat_cells = range(math.floor((latitude - lat_span) / GRID_DEGREES), math.floor((latitude + lat_span) / GRID_DEGREES) + 1)
+    lon_cells = range(math.floor((longitude - lon_span) / GRID_DEGREES), math.floor((longitude + lon_span) / GRID_DEGREES) + 1)
+    return [f"{a}:{b}" for a in lat_cells for b in lon_cells]
+
+
+def search_availability(blood_group=None, latitude=None, longitude=None, radius_km=None, city=None):
+    """
+    Banks with usable stock as [(entry, bank, distance_km)].
+
+    With coordinates: banks within ``radius_km``, nearest first, then most
+    units. Without: optionally narrowed to a city, most units first.
+    """
+    db, Entry, User = _runtime['db'], _m('BloodInventory'), _m('User')
+
+    query = db.session.query(Entry, User).join(User, Entry.blood_bank_id == User.id).filter(
+        Entry.units_available > 0
+    )
+    group = normalise_group(blood_group)
+    if group:
+        query = query.filter(Entry.blood_group == group)
+
+    if latitude is None or longitude is None:
+        if city:
+            query = query.filter(Entry.city_key.startswith(_city_key(city), autoescape=True))
+        rows = query.order_by(Entry.units_available.desc(), Entry.next_expiry).all()
+        return [(entry, bank, None) for entry, bank in rows]
+
+    radius_km = min(float(radius_km or DEFAULT_RADIUS_KM), MAX_RADIUS_KM)
+    rows = query.filter(Entry.grid_cell.in_(_cells_within(latitude, longitude, radius_km))).all()
+
+    results = []
+    for entry, bank in rows:
+        distance = haversine_km(latitude, longitude, entry.latitude, entry.longitude)
+        if distance <= radius_km:
+            results.append((entry, bank, round(distance, 1)))
+    results.sort(key=lambda r: (r[2], -r[0].units_available))
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Blood availability index tools')
+    parser.add_argument('command', choices=['sweep', 'rebuild'])
+    args = parser.parse_args()
+
+    app, service = cli_app('services.blood_index')
+
+    with app.app_context():
+        if args.command == 'sweep':
+            print(f"✅ Expiry sweep: {service.sweep_expired()}")
+        else:
+            print(f"✅ Index rebuilt: {service.rebuild_index()}")
@@ -0,0 +1,361 @@
+"""
+Consent Cache
+In-process evaluation cache for patient consent checks (insurance, MNC, data sharing).
+
+Consent rows change rarely but are checked on every patient-scoped read. Each
+answer is cached under (kind, grantee, patient, scope):
+
+* ``insurance`` - ConsentManagement: an Active consent from the patient to the
+  insurance company that has not passed ``consent_expiry_date``;
+* ``mnc``       - MNCEmployee.consent_status for the employer, or, with a scope
+  (``fitness_status``, ``vaccination_compliance``, ...), an active MNCConsent
+  with that field granted inside its access window;
+* ``sharing``   - DataSharingPermission from grantor to grantee covering the
+  scope (or ``all``) between ``valid_from`` and ``valid_until``.
+
+A positive answer is a ``ConsentGrant(id, expires_at)`` and is dropped when the
+consent itself lapses; every entry is also capped at CONSENT_CACHE_TTL_SECONDS
+so other worker processes see changes made elsewhere. Inside the process,
+creating, changing, revoking or deleting a consent row invalidates the
+patient's entries as soon as it is flushed and again when it commits. Each
+invalidation also bumps the patient's generation, and an answer is only
+cached if the generation it was read under is still current, so a check
+racing a revocation never caches the revoked grant.
+
+List endpoints should use ``bulk_check`` - one IN query for all cache misses.
+
+    python -m services.consent_cache bench --kind insurance --grantee 1
+"""
+import json
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect as sa_inspect, or_
+
+from services.runtime import ServiceRuntime, cli_app
+
+DEFAULT_TTL_SECONDS = 60
+MAX_ENTRIES = 50000
+IN_CHUNK = 500
+KINDS = ('insurance', 'mnc', 'sharing')
+MNC_SCOPES = ('fitness_status', 'chronic_conditions', 'vaccination_compliance', 'work_limitations', 'emergency_contact')
+
+ConsentGrant = namedtuple('ConsentGrant', ['id', 'expires_at'])
+
+_runtime = ServiceRuntime()
+_lock = threading.Lock()
+_entries = OrderedDict()  # (kind, grantee, patient, scope) -> (grant or None, cached_until)
+_by_subject = {}          # (kind, patient) -> set of keys
+_generations = {}         # (kind, patient) or kind -> invalidation count
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+CONSENT_MODELS = ('ConsentManagement', 'MNCConsent', 'MNCEmployee', 'DataSharingPermission')
+
+
+def init_consent_cache(app, db, models):
+    """Register the app, db and consent models and install the invalidation hooks"""
+    _runtime.init(db, models, app)
+    _runtime.listen('after_flush', _collect_changes, *CONSENT_MODELS)
+    _runtime.listen('after_commit', _apply_changes)
+    _runtime.listen('after_rollback', _discard_changes)
+    _runtime.listen('after_bulk_update', _bulk_changed, *CONSENT_MODELS)
+    _runtime.listen('after_bulk_delete', _bulk_changed, *CONSENT_MODELS)
+
+
+_m = _runtime.model
+
+
+def _ttl():
+    app = _runtime['app']
+    seconds = app.config.get('CONSENT_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS) if app else DEFAULT_TTL_SECONDS
+    return timedelta(seconds=seconds)
+
+
+# ==================== CACHE ====================
+
+def _lookup(key, now):
+    """(found, grant) for a live entry; expired entries are dropped on the way"""
+    entry = _entries.get(key)
+    if entry is None:
+        return False, None
+    grant, cached_until = entry
+    if cached_until <= now:
+        _drop(key)
+        return False, None
+    _entries.move_to_end(key)
+    return True, grant
+
+
+def _store(key, grant, now):
+    cached_until = now + _ttl()
+    if grant is not None and grant.expires_at is not None:
+        cached_until = min(cached_until, grant.expires_at)
+    _entries[key] = (grant, cached_until)
+    _entries.move_to_end(key)
+    _by_subject.setdefault((key[0], key[2]), set()).add(key)
+    while len(_entries) > MAX_ENTRIES:
+        _drop(next(iter(_entries)))
+
+
+def _drop(key):
+    _entries.pop(key, None)
+    keys = _by_subject.get((key[0], key[2]))
+    if keys is not None:
+        keys.discard(key)
+        if not keys:
+            del _by_subject[(key[0], key[2])]
+
+
+def invalidate(kind, patient_id=None):
+    """Forget one patient's answers for a kind, or every answer of the kind"""
+    with _lock:
+        _stats['invalidations'] += 1
+        subject = kind if patient_id is None else (kind, patient_id)
+        _generations[subject] = _generations.get(subject, 0) + 1
+        if patient_id is None:
+            for key in [k for k in _entries if k[0] == kind]:
+                _drop(key)
+            return
+        for key in list(_by_subject.get((kind, patient_id), ())):
+            _drop(key)
+
+
+def _generation(kind, patient_id):
+    return _generations.get(kind, 0), _generations.get((kind, patient_id), 0)
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+        _by_subject.clear()
+
+
+def cache_stats():
+    with _lock:
+        return dict(_stats, entries=len(_entries))
+
+
+# ==================== INVALIDATION ====================
+
+def _subjects(obj):
+    """(kind, patient) pairs whose cached answers a change to obj can affect"""
+    models = _runtime['models']
+    for model_name, kind, column in (('ConsentManagement', 'insurance', 'patient_id'),
+                                     ('MNCConsent', 'mnc', 'employee_id'),
+                                     ('MNCEmployee', 'mnc', 'id'),
+                                     ('DataSharingPermission', 'sharing', 'grantor_id')):
+        model = models.get(model_name)
+        if model is None or not isinstance(obj, model):
+            continue
+        history = sa_inspect(obj).attrs[column].history
+        values = set(history.deleted or ()) | {getattr(obj, column)}
+        return {(kind, value) for value in values if value is not None}
+    return set()
+
+
+def _collect_changes(session, flush_context):
+    changed = set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        changed |= _subjects(obj)
+    if changed:
+        # Drop now so this session reads its own writes, and again at commit
+        # in case another request re-cached the old answer in between
+        session.info.setdefault('consent_cache_changes', set()).update(changed)
+        for kind, patient_id in changed:
+            invalidate(kind, patient_id)
+
+
+def _apply_changes(session):
+    for kind, patient_id in session.info.pop('consent_cache_changes', ()):
+        invalidate(kind, patient_id)
+
+
+def _discard_changes(session):
+    session.info.pop('consent_cache_changes', None)
+
+
+def _bulk_changed(context):
+    """Query.update()/delete() bypasses the flush: forget the whole kind"""
+    models = _runtime['models']
+    target = context.mapper.class_
+    for model_name, kind in (('ConsentManagement', 'insurance'), ('MNCConsent', 'mnc'),
+                             ('MNCEmployee', 'mnc'), ('DataSharingPermission', 'sharing')):
+        if models.get(model_name) is target:
+            invalidate(kind)
+            context.session.info.setdefault('consent_cache_changes', set()).add((kind, None))
+
+
+# ==================== EVALUATION ====================
+
+def _fetch(kind, grantee_id, patient_ids, scope, now):
+    """{patient_id: ConsentGrant} for the patients that have a valid consent"""
+    db = _runtime['db']
+    if kind == 'insurance':
+        Consent = _m('ConsentManagement')
+        rows = db.session.query(Consent.patient_id, Consent.id, Consent.consent_expiry_date).filter(
+            Consent.insurance_company_id == grantee_id,
+            Consent.patient_id.in_(patient_ids),
+            Consent.status == 'Active',
+            Consent.consent_expiry_date > now
+        ).all()
+    elif kind == 'mnc' and scope is None:
+        Employee = _m('MNCEmployee')
+        rows = db.session.query(Employee.id, Employee.id, Employee.consent_expiry).filter(
+            Employee.mnc_id == grantee_id,
+            Employee.id.in_(patient_ids),
+            Employee.consent_status == 'Active',
+            or_(Employee.consent_expiry.is_(None), Employee.consent_expiry > now)
+        ).all()
+    elif kind == 'mnc':
+        Employee, Consent = _m('MNCEmployee'), _m('MNCConsent')
+        rows = db.session.query(Consent.employee_id, Consent.id, Consent.access_end_date).join(
+            Employee, Employee.id == Consent.employee_id
+        ).filter(
+            Employee.mnc_id == grantee_id,
+            Consent.employee_id.in_(patient_ids),
+            getattr(Consent, scope).is_(True),
+            Consent.is_active.is_(True),
+            Consent.access_start_date <= now,
+            Consent.access_end_date > now
+        ).all()
+    else:
+        Permission = _m('DataSharingPermission')
+        rows = []
+        for row in db.session.query(
+            Permission.grantor_id, Permission.id, Permission.valid_until, Permission.data_scope
+        ).filter(
+            Permission.grantee_id == grantee_id,
+            Permission.grantor_id.in_(patient_ids),
+            Permission.is_active.is_(True),
+            or_(Permission.valid_from.is_(None), Permission.valid_from <= now),
+            or_(Permission.valid_until.is_(None), Permission.valid_until > now)
+        ):
+            if scope is None or _covers(row.data_scope, scope):
+                rows.append(row[:3])
+
+    grants = {}
+    for patient_id, grant_id, expires_at in rows:
+        current = grants.get(patient_id)
+        # Several valid consents: keep the one that stays valid longest
+        if current is None or (current.expires_at is not None and (expires_at is None or expires_at > current.expires_at)):
+            grants[patient_id] = ConsentGrant(grant_id, expires_at)
+    return grants
+
+
+def _covers(data_scope, scope):
+    try:
+        scopes = json.loads(data_scope) if data_scope else []
+    except (TypeError, ValueError):
+        return False
+    if isinstance(scopes, str):
+        scopes = [scopes]
+    return 'all' in scopes or scope in scopes
+
+
+def bulk_check(kind, grantee_id, patient_ids, scope=None, now=None):
+    """{patient_id: ConsentGrant or None} for many patients, one query for the misses"""
+    if kind not in KINDS:
+        raise ValueError(f"Unknown consent kind: {kind}")
+    if kind == 'mnc' and scope is not None and scope not in MNC_SCOPES:
+        raise ValueError(f"Unknown MNC consent scope: {scope}")
+    now = now or datetime.utcnow()
+    result, missing, read_under = {}, [], {}
+    with _lock:
+        for patient_id in dict.fromkeys(patient_ids):
+            found, grant = _lookup((kind, grantee_id, patient_id, scope), now)
+            if found:
+                _stats['hits'] += 1
+                result[patient_id] = grant
+            else:
+                _stats['misses'] += 1
+                missing.append(patient_id)
+                read_under[patient_id] = _generation(kind, patient_id)
+    for start in range(0, len(missing), IN_CHUNK):
+        chunk = missing[start:start + IN_CHUNK]
+        grants = _fetch(kind, grantee_id, chunk, scope, now)
+        with _lock:
+            for patient_id in chunk:
+                grant = grants.get(patient_id)
+                if _generation(kind, patient_id) == read_under[patient_id]:
+                    _store((kind, grantee_id, patient_id, scope), grant, now)
+                # else: invalidated while fetching, so the answer may be stale
+                result[patient_id] = grant
+    return result
+
+
+def check(kind, grantee_id, patient_id, scope=None, now=None):
+    """ConsentGrant when the grantee may read the patient's data, else None"""
+    return bulk_check(kind, grantee_id, [patient_id], scope, now)[patient_id]
+
+
+def check_insurance_consent(patient_id, insurance_company_id):
+    return check('insurance', insurance_company_id, patient_id)
+
+
+def check_mnc_consent(mnc_id, employee_id, scope=None):
+    return check('mnc', mnc_id, employee_id, scope)
+
+
+def check_data_sharing(grantee_id, grantor_id, scope=None):
+    return check('sharing', grantee_id, grantor_id, scope)
+
+
+# ==================== BENCHMARK ====================
+
+def run_benchmark(kind, grantee_id, rounds=5):
+    """Time uncached single checks against bulk + cached checks for a grantee's patients"""
+    import time
+
+    db = _runtime['db']
+    if kind == 'insurance':
+        Consent = _m('ConsentManagement')
+        patient_ids = [r[0] for r in db.session.query(Consent.patient_id).filter_by(insurance_company_id=grantee_id).distinct()]
+    elif kind == 'mnc':
+        Employee = _m('MNCEmployee')
+        patient_ids = [r[0] for r in db.session.query(Employee.id).filter_by(mnc_id=grantee_id)]
+    else:
+        Permission = _m('DataSharingPermission')
+        patient_ids = [r[0] for r in db.session.query(Permission.grantor_id).filter_by(grantee_id=grantee_id).distinct()]
+    if not patient_ids:
+        return {'patients': 0}
+
+    started = time.perf_counter()
+    for patient_id in patient_ids:
+        clear()
+        check(kind, grantee_id, patient_id)
+    uncached = time.perf_counter() - started
+
+    clear()
+    started = time.perf_counter()
+    first = bulk_check(kind, grantee_id, patient_ids)
+    bulk = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(rounds):
+        for patient_id in patient_ids:
+            assert check(kind, grantee_id, patient_id) == first[patient_id]
+    cached = (time.perf_counter() - started) / rounds
+    return {
+        'patients': len(patient_ids),
+        'granted': sum(1 for grant in first.values() if grant),
+        'uncached_ms': round(uncached * 1000, 2),
+        'bulk_ms': round(bulk * 1000, 2),
+        'cached_ms': round(cached * 1000, 2),
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Consent evaluation cache')
+    parser.add_argument('command', choices=['bench'])
+    parser.add_argument('--kind', choices=KINDS, default='insurance')
+    parser.add_argument('--grantee', type=int, required=True,
+                        help='Insurance company id, MNC user id or grantee user id')
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    app, service = cli_app('services.consent_cache')
+
+    with app.app_context():
+        print(f"✅ Consent checks: {service.run_benchmark(args.kind, args.grantee, args.rounds)}")
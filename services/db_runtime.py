@@ -0,0 +1,379 @@
+"""
+Database Runtime
+Engine/pool configuration per deployment profile, pool metrics, read-replica
+routing for read-only endpoints and per-request write batching.
+
+Usage from app.py (before and after ``SQLAlchemy(app)``)::
+
+    app.config.update(build_engine_config(Config))
+    db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+    init_db_runtime(app, db)
+
+Load test (prints pool usage under concurrency)::
+
+    python -m services.db_runtime --concurrency 50 --iterations 20
+"""
+import os
+import threading
+import time
+from functools import wraps
+
+from flask import g, has_request_context, request
+from flask_sqlalchemy.session import Session as FlaskSQLAlchemySession
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_BIND_KEY = 'replica'
+
+# Pool settings per deployment profile. Environment variables
+# (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE,
+# DB_STATEMENT_TIMEOUT_MS) override individual values.
+ENGINE_PROFILES = {
+    'development': {
+        'pool_size': 5,
+        'max_overflow': 10,
+        'pool_timeout': 30,
+        'pool_recycle': -1,
+        'pool_pre_ping': False,
+        'statement_timeout_ms': None,
+    },
+    'production': {
+        'pool_size': 10,
+        'max_overflow': 20,
+        'pool_timeout': 10,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+        'statement_timeout_ms': 30000,
+    },
+    # Background jobs (migrations, report generation, nightly sweeps):
+    # few connections, long statements allowed.
+    'worker': {
+        'pool_size': 2,
+        'max_overflow': 2,
+        'pool_timeout': 60,
+        'pool_recycle': 1800,
+        'pool_pre_ping': True,
+        'statement_timeout_ms': 600000,
+    },
+}
+
+
+# ==================== POOL METRICS ====================
+
+class PoolMetrics:
+    """Counters collected by MeteredQueuePool"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.peak_checked_out = 0
+
+    def record(self, waited, checked_out):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.peak_checked_out = max(self.peak_checked_out, checked_out)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = self.timeouts = self.peak_checked_out = 0
+            self.total_wait = self.max_wait = 0.0
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that records how long callers wait for a connection"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            conn = super().connect()
+        except Exception as e:
+            if e.__class__.__name__ == 'TimeoutError':
+                self.metrics.record_timeout()
+            raise
+        self.metrics.record(time.perf_counter() - started, self.checkedout())
+        return conn
+
+
+def pool_status(engine):
+    """Snapshot of pool usage for an engine"""
+    pool = engine.pool
+    status = {
+        'pool_class': pool.__class__.__name__,
+        'size': pool.size() if hasattr(pool, 'size') else None,
+        'checked_out': pool.checkedout() if hasattr(pool, 'checkedout') else None,
+        'checked_in': pool.checkedin() if hasattr(pool, 'checkedin') else None,
+        'overflow': pool.overflow() if hasattr(pool, 'overflow') else None,
+    }
+    metrics = getattr(pool, 'metrics', None)
+    if metrics is not None:
+        status.update({
+            'checkouts': metrics.checkouts,
+            'timeouts': metrics.timeouts,
+            'peak_checked_out': metrics.peak_checked_out,
+            'avg_wait_ms': round(metrics.total_wait / metrics.checkouts * 1000, 3) if metrics.checkouts else 0.0,
+            'max_wait_ms': round(metrics.max_wait * 1000, 3),
+        })
+    return status
+
+
+# ==================== ENGINE CONFIGURATION ====================
+
+def _profile_settings(profile):
+    settings = dict(ENGINE_PROFILES.get(profile) or ENGINE_PROFILES['development'])
+    overrides = {
+        'pool_size': 'DB_POOL_SIZE',
+        'max_overflow': 'DB_MAX_OVERFLOW',
+        'pool_timeout': 'DB_POOL_TIMEOUT',
+        'pool_recycle': 'DB_POOL_RECYCLE',
+        'statement_timeout_ms': 'DB_STATEMENT_TIMEOUT_MS',
+    }
+    for key, env_name in overrides.items():
+        value = os.environ.get(env_name)
+        if value:
+            settings[key] = int(value)
+    return settings
+
+
+def build_engine_options(uri, profile='development'):
+    """SQLAlchemy create_engine() options for a database URI and profile"""
+    if uri.startswith('sqlite') and (':memory:' in uri or uri.rstrip('/') in ('sqlite:', 'sqlite:/')):
+        return {}  # Flask-SQLAlchemy uses a StaticPool for in-memory databases
+
+    settings = _profile_settings(profile)
+    options = {
+        'poolclass': MeteredQueuePool,
+        'pool_size': settings['pool_size'],
+        'max_overflow': settings['max_overflow'],
+        'pool_timeout': settings['pool_timeout'],
+        'pool_recycle': settings['pool_recycle'],
+        'pool_pre_ping': settings['pool_pre_ping'],
+    }
+    if uri.startswith('postgresql') and settings['statement_timeout_ms']:
+        options['connect_args'] = {
+            'options': (
+                f"-c statement_timeout={settings['statement_timeout_ms']} "
+                f"-c idle_in_transaction_session_timeout={settings['statement_timeout_ms'] * 2}"
+            )
+        }
+    return options
+
+
+def build_engine_config(config):
+    """Flask config entries for the primary engine and the optional replica bind"""
+    profile = getattr(config, 'DB_PROFILE', 'development')
+    values = {
+        'SQLALCHEMY_ENGINE_OPTIONS': build_engine_options(config.SQLALCHEMY_DATABASE_URI, profile),
+    }
+    replica_uri = getattr(config, 'REPLICA_DATABASE_URL', None)
+    if replica_uri:
+        replica_options = build_engine_options(replica_uri, profile)
+        values['SQLALCHEMY_BINDS'] = {REPLICA_BIND_KEY: dict(replica_options, url=replica_uri)}
+    return values
+
+
+# ==================== READ REPLICA ROUTING ====================
+
+def _replica_requested():
+    return has_request_context() and g.get('db_use_replica', False)
+
+
+class RoutingSession(FlaskSQLAlchemySession):
+    """
+    Session that sends plain reads to the replica bind while a view decorated
+    with @use_read_replica is running. Flushes and DML always go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (
+            bind is None
+            and _replica_requested()
+            and not self._flushing
+            and not isinstance(clause, UpdateBase)
+        ):
+            engine = self._db.engines.get(REPLICA_BIND_KEY)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def use_read_replica(f):
+    """Route the queries of a GET-only view to the read replica (if configured)"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method != 'GET':
+            return f(*args, **kwargs)
+        g.db_use_replica = True
+        try:
+            return f(*args, **kwargs)
+        finally:
+            g.db_use_replica = False
+    return decorated_function
+
+
+# ==================== PER-REQUEST WRITE BATCHING ====================
+
+def defer_write(item):
+    """
+    Queue a bookkeeping write (an ORM object to add, or a callable run against
+    the session) to be committed once at the end of the request instead of
+    committing immediately. Outside a request the write happens right away.
+    """
+    if has_request_context():
+        g.setdefault('db_deferred_writes', []).append(item)
+        return
+    _apply_writes(_runtime['db'], [item])
+
+
+def _apply_writes(db, items):
+    for item in items:
+        if callable(item):
+            item()
+        else:
+            db.session.add(item)
+    db.session.commit()
+
+
+def flush_deferred_writes():
+    """Commit all queued bookkeeping writes in a single transaction"""
+    items = g.pop('db_deferred_writes', None)
+    if not items:
+        return 0
+    db = _runtime['db']
+    try:
+        _apply_writes(db, items)
+    except Exception as e:
+        print(f"Error flushing deferred writes: {e}")
+        db.session.rollback()
+        return 0
+    return len(items)
+
+
+_runtime = {'db': None}
+
+
+def init_db_runtime(app, db):
+    """Attach the runtime to the app so deferred writes can be flushed"""
+    _runtime['db'] = db
+
+    @app.teardown_request
+    def _flush_deferred_on_error(exc):
+        # after_request handlers do not run for unhandled errors; make sure the
+        # queued bookkeeping writes are not silently lost.
+        if exc is not None and g.get('db_deferred_writes'):
+            db.session.rollback()
+            flush_deferred_writes()
+
+
+# ==================== LOAD TEST ====================
+
+def run_load_test(app, db, concurrency=32, iterations=20, hold_ms=20):
+    """
+    Hammer the pool from ``concurrency`` threads, each running ``iterations``
+    short request-like units of work, and report connection usage.
+    """
+    from sqlalchemy import text
+
+    with app.app_context():
+        engine = db.engine
+        metrics = getattr(engine.pool, 'metrics', None)
+        if metrics is not None:
+            metrics.reset()
+
+    waits = []
+    errors = []
+    lock = threading.Lock()
+    peak = {'checked_out': 0, 'overflow': 0}
+    stop = threading.Event()
+
+    def sampler():
+        with app.app_context():
+            pool = db.engine.pool
+            while not stop.is_set():
+                if hasattr(pool, 'checkedout'):
+                    peak['checked_out'] = max(peak['checked_out'], pool.checkedout())
+                    peak['overflow'] = max(peak['overflow'], pool.overflow())
+                time.sleep(0.002)
+
+    def worker():
+        for _ in range(iterations):
+            with app.app_context():
+                started = time.perf_counter()
+                try:
+                    db.session.execute(text('SELECT 1')).scalar()
+                    with lock:
+                        waits.append(time.perf_counter() - started)
+                    time.sleep(hold_ms / 1000.0)
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e)[:120])
+                finally:
+                    db.session.remove()
+
+    monitor = threading.Thread(target=sampler, daemon=True)
+    monitor.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    monitor.join()
+
+    waits.sort()
+
+    def pct(p):
+        return round(waits[min(len(waits) - 1, int(len(waits) * p))] * 1000, 2) if waits else 0.0
+
+    with app.app_context():
+        status = pool_status(db.engine)
+    return {
+        'concurrency': concurrency,
+        'units_of_work': len(waits),
+        'errors': len(errors),
+        'elapsed_s': round(elapsed, 2),
+        'throughput_per_s': round(len(waits) / elapsed, 1) if elapsed else 0,
+        'first_query_ms_p50': pct(0.50),
+        'first_query_ms_p95': pct(0.95),
+        'first_query_ms_max': pct(1.0),
+        'peak_checked_out': peak['checked_out'],
+        'peak_overflow': peak['overflow'],
+        'pool': status,
+        'sample_errors': errors[:3],
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+    parser = argparse.ArgumentParser(description='Database pool load test')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--hold-ms', type=int, default=20, help='Time each unit of work keeps its connection')
+    args = parser.parse_args()
+
+    from app import app, db
+
+    print("=" * 50)
+    print("  Database Pool Load Test")
+    print("=" * 50)
+    report = run_load_test(app, db, args.concurrency, args.iterations, args.hold_ms)
+    print(json.dumps(report, indent=2, default=str))
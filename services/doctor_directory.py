@@ -0,0 +1,307 @@
+"""
+Doctor Directory
+Read model behind the appointment booking wizard's specialty -> doctor steps.
+
+``doctor_directory`` holds one row per hospital doctor with a normalised
+specialty key, lower-cased search text and one boolean column per
+consultation mode, all indexed. Rows are kept in sync from ``users`` by a
+session flush hook, so any change to a doctor's profile (or a user becoming
+or ceasing to be a hospital doctor) updates the directory in the same
+transaction.
+
+Lookups are served from an in-memory snapshot of the table, read on its own
+connection (never the request's session). The snapshot pre-computes the
+ordered doctor list for every (specialty, mode) filter and an n-gram index of
+the search text, so each booking-wizard filter is a dictionary lookup and a
+set intersection. It is rebuilt after a doctor change commits in this
+process, and at most every SNAPSHOT_TTL_SECONDS otherwise (to pick up changes
+made by other processes).
+
+Doctors that predate the directory are added at startup (``ensure_directory``).
+Full rebuild (after bulk imports)::
+
+    python -m services.doctor_directory rebuild
+"""
+import re
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import inspect as sa_inspect, select
+
+from services.runtime import ServiceRuntime, cli_app
+
+DOCTOR_USER_TYPE = 'hospital_doctor'
+SNAPSHOT_TTL_SECONDS = 60
+MAX_PER_PAGE = 100
+GRAM_SIZE = 3  # Search needles up to this long are one lookup; longer ones intersect their n-grams
+
+# Consultation mode label -> DoctorDirectoryEntry column. Doctors offer
+# in-person and video consultations unless their entry says otherwise.
+MODE_COLUMNS = {
+    'in-person': 'offers_in_person',
+    'video': 'offers_video',
+    'home visit': 'offers_home_visit',
+}
+MODE_LABELS = {'in-person': 'In-person', 'video': 'Video', 'home visit': 'Home Visit'}
+DEFAULT_MODES = {'offers_in_person': True, 'offers_video': True, 'offers_home_visit': False}
+
+# Profile fields that feed the directory; other User updates are ignored
+SOURCE_FIELDS = ('user_type', 'full_name', 'first_name', 'last_name', 'specialty', 'facility_name', 'is_active')
+
+_runtime = ServiceRuntime()
+_snapshot = {'data': None, 'built_at': 0.0}
+_snapshot_lock = threading.Lock()
+
+
+def init_doctor_directory(db, models):
+    """Register the db and model classes and install the sync hook"""
+    _runtime.init(db, models)
+    _runtime.listen('after_flush', _collect_doctor_changes, 'User')
+    _runtime.listen('after_commit', _invalidate_after_commit)
+    _runtime.listen('after_rollback', _discard_pending)
+
+
+_m = _runtime.model
+
+
+def normalise_specialty(value):
+    """Canonical specialty key: trimmed, lower-case, single-spaced"""
+    return re.sub(r'\s+', ' ', (value or '').strip()).lower() or None
+
+
+def normalise_mode(value):
+    key = re.sub(r'[\s_]+', ' ', (value or '').strip().lower()).replace('in person', 'in-person')
+    return key if key in MODE_COLUMNS else None
+
+
+def _display_name(user):
+    return user.full_name or ' '.join(p for p in (user.first_name, user.last_name) if p) or 'Doctor'
+
+
+def _entry_values(user):
+    name = _display_name(user)
+    specialty = (user.specialty or '').strip() or None
+    hospital = user.facility_name or None
+    return {
+        'doctor_id': user.id,
+        'name': name,
+        'specialty': specialty,
+        'specialty_key': normalise_specialty(specialty),
+        'hospital': hospital,
+        'search_text': ' '.join(p for p in (name, hospital or '') if p).lower(),
+        'is_active': user.is_active is not False,
+        'updated_at': datetime.utcnow(),
+    }
+
+
+# ==================== SYNC ====================
+
+def _source_changed(user):
+    state = sa_inspect(user)
+    return any(state.attrs[field].history.has_changes() for field in SOURCE_FIELDS)
+
+
+def _collect_doctor_changes(session, flush_context):
+    """Upsert/delete directory rows for doctors touched by this flush"""
+    User = _m('User')
+
+    upserts, removals = {}, set()
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, User) or obj.id is None:
+            continue
+        if obj in session.dirty and not _source_changed(obj):
+            continue
+        if obj.user_type == DOCTOR_USER_TYPE:
+            upserts[obj.id] = _entry_values(obj)
+        else:
+            removals.add(obj.id)  # May have stopped being a doctor
+    for obj in session.deleted:
+        if isinstance(obj, User) and obj.id is not None:
+            removals.add(obj.id)
+
+    if not upserts and not removals:
+        return
+
+    table = _m('DoctorDirectoryEntry').__table__
+    conn = session.connection()
+    for doctor_id, values in upserts.items():
+        updated = conn.execute(
+            table.update().where(table.c.doctor_id == doctor_id).values(**values)
+        ).rowcount
+        if not updated:
+            conn.execute(table.insert().values(**DEFAULT_MODES, **values))
+    if removals:
+        conn.execute(table.delete().where(table.c.doctor_id.in_(removals)))
+    session.info['doctor_directory_dirty'] = True
+
+
+def _invalidate_after_commit(session):
+    if session.info.pop('doctor_directory_dirty', False):
+        invalidate_snapshot()
+
+
+def _discard_pending(session):
+    session.info.pop('doctor_directory_dirty', None)
+
+
+def rebuild_directory():
+    """Resynchronise every directory row from users (keeps configured modes)"""
+    db, User, Entry = _runtime['db'], _m('User'), _m('DoctorDirectoryEntry')
+    table = Entry.__table__
+    doctors = User.query.filter_by(user_type=DOCTOR_USER_TYPE).all()
+    existing = {doctor_id for (doctor_id,) in db.session.query(Entry.doctor_id)}
+
+    for user in doctors:
+        values = _entry_values(user)
+        if user.id in existing:
+            db.session.execute(table.update().where(table.c.doctor_id == user.id).values(**values))
+        else:
+            db.session.execute(table.insert().values(**DEFAULT_MODES, **values))
+
+    stale = existing - {u.id for u in doctors}
+    if stale:
+        db.session.execute(table.delete().where(table.c.doctor_id.in_(stale)))
+    db.session.commit()
+    invalidate_snapshot()
+    return {'doctors': len(doctors), 'removed': len(stale)}
+
+
+# ==================== SNAPSHOT ====================
+
+class DirectorySnapshot:
+    """Immutable in-memory copy of the directory, indexed for the booking wizard"""
+
+    def __init__(self, rows):
+        self.doctors = []
+        self.by_id = {}
+        self.by_filter = {}  # (specialty_key or None, mode or None) -> ordered positions in self.doctors
+        self.grams = {}      # 1..GRAM_SIZE-character substring of search text -> set of positions
+        specialty_names = {}
+        for position, row in enumerate(rows):
+            mode_keys = [mode for mode, column in MODE_COLUMNS.items() if getattr(row, column)]
+            doctor = {
+                'id': str(row.doctor_id),
+                'name': row.name,
+                'specialty': row.specialty or 'General',
+                'hospital': row.hospital or 'Unknown Hospital',
+                'photo': f"https://ui-avatars.com/api/?name={row.name}&background=random",
+                'modes': [MODE_LABELS[mode] for mode in mode_keys],
+            }
+            self.doctors.append(doctor)
+            self.by_id[doctor['id']] = doctor
+            for specialty_key in {None, row.specialty_key}:
+                for mode in [None] + mode_keys:
+                    self.by_filter.setdefault((specialty_key, mode), []).append(position)
+            text = row.search_text or ''
+            for size in range(1, GRAM_SIZE + 1):
+                for start in range(len(text) - size + 1):
+                    self.grams.setdefault(text[start:start + size], set()).add(position)
+            if row.specialty_key:
+                spellings = specialty_names.setdefault(row.specialty_key, {})
+                spellings[row.specialty] = spellings.get(row.specialty, 0) + 1
+        self.search_text = [row.search_text or '' for row in rows]
+        # Show the most common spelling of each specialty, preferring capitalised ones
+        self.specialties = sorted(
+            max(spellings, key=lambda name: (spellings[name], not name.islower()))
+            for spellings in specialty_names.values()
+        )
+
+    def matching(self, needle):
+        """Positions whose search text contains ``needle``"""
+        if len(needle) <= GRAM_SIZE:
+            return self.grams.get(needle, set())
+        grams = sorted((self.grams.get(needle[i:i + GRAM_SIZE], set())
+                        for i in range(len(needle) - GRAM_SIZE + 1)), key=len)
+        candidates = set.intersection(*grams)
+        # N-grams can all match without the whole needle doing so
+        return {p for p in candidates if needle in self.search_text[p]}
+
+
+def _unindexed_doctors_exist():
+    """Doctors that predate the directory (the flush hook only sees later changes)"""
+    Entry, User = _m('DoctorDirectoryEntry'), _m('User')
+    indexed = _runtime['db'].session.query(Entry.id).filter(Entry.doctor_id == User.id)
+    return User.query.filter(User.user_type == DOCTOR_USER_TYPE, ~indexed.exists()).first() is not None
+
+
+def ensure_directory():
+    """Add doctors recorded before the directory existed (startup); returns the rebuild summary or None"""
+    if _unindexed_doctors_exist():
+        return rebuild_directory()
+    return None
+
+
+def _load_snapshot():
+    table = _m('DoctorDirectoryEntry').__table__
+    with _runtime['db'].engine.connect() as conn:
+        rows = conn.execute(
+            select(table).where(table.c.is_active.is_(True)).order_by(table.c.name, table.c.doctor_id)
+        ).all()
+    return DirectorySnapshot(rows)
+
+
+def get_snapshot():
+    snap = _snapshot['data']
+    if snap is not None and time.monotonic() - _snapshot['built_at'] < SNAPSHOT_TTL_SECONDS:
+        return snap
+    with _snapshot_lock:
+        snap = _snapshot['data']
+        if snap is None or time.monotonic() - _snapshot['built_at'] >= SNAPSHOT_TTL_SECONDS:
+            snap = _load_snapshot()
+            _snapshot['data'] = snap
+            _snapshot['built_at'] = time.monotonic()
+    return snap
+
+
+def invalidate_snapshot():
+    _snapshot['built_at'] = 0.0
+
+
+# ==================== LOOKUPS ====================
+
+def specialty_list():
+    """Sorted specialty names that have at least one active doctor"""
+    return list(get_snapshot().specialties)
+
+
+def get_doctor(doctor_id):
+    doctor = get_snapshot().by_id.get(str(doctor_id))
+    return dict(doctor) if doctor else None
+
+
+def search_doctors(specialty=None, query=None, mode=None, page=None, per_page=None):
+    """
+    Filter the directory. Returns (doctors, total): every match, or one page
+    of ``per_page`` (capped at MAX_PER_PAGE) when ``page`` is given.
+    An unknown mode matches nobody; an empty one matches everybody.
+    """
+    snap = get_snapshot()
+    mode_key = normalise_mode(mode) if mode else None
+    if mode and not mode_key:
+        return [], 0
+    positions = snap.by_filter.get((normalise_specialty(specialty) if specialty else None, mode_key), [])
+
+    needle = (query or '').strip().lower()
+    if needle:
+        positions = sorted(snap.matching(needle).intersection(positions))
+
+    total = len(positions)
+    if page is not None:
+        per_page = max(1, min(int(per_page or MAX_PER_PAGE), MAX_PER_PAGE))
+        start = (max(1, int(page)) - 1) * per_page
+        positions = positions[start:start + per_page]
+    return [dict(snap.doctors[p]) for p in positions], total
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Doctor directory tools')
+    parser.add_argument('command', choices=['rebuild'])
+    args = parser.parse_args()
+
+    app, service = cli_app('services.doctor_directory')
+
+    with app.app_context():
+        print(f"✅ Directory rebuilt: {service.rebuild_directory()}")
@@ -0,0 +1,297 @@
+"""
+Blood Donor Matching
+Eligible-donor index and ranked candidate lists for client blood requests.
+
+``blood_donor_index`` holds one row per registered blood donor with the
+normalised blood group, the date the donor is next eligible (last donation
++ DEFERRAL_DAYS), a ``matchable`` flag (consents to contact and marked
+available) and the donor's city key. Rows are
+kept in sync from ``users`` by a session flush hook, so recording a
+donation or editing the donor profile updates the index in the same
+transaction.
+
+Matching a request is one indexed query: red-cell compatible groups from
+COMPATIBLE_DONORS, matchable, eligible today; ranked by exact group, same
+city as the hospital, then the longest-rested donor.
+
+    python -m services.donor_matching rebuild
+    python -m services.donor_matching match BR-2025-00001
+"""
+import re
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, func, inspect as sa_inspect, or_
+
+from services.runtime import ServiceRuntime, cli_app
+
+DEFERRAL_DAYS = 56  # Whole blood
+DEFAULT_MATCH_LIMIT = 50
+DONOR_USER_TYPES = ('blood_donor_recipient',)
+
+# Recipient group -> donor groups whose red cells it can receive
+COMPATIBLE_DONORS = {
+    'O-': ('O-',),
+    'O+': ('O-', 'O+'),
+    'A-': ('O-', 'A-'),
+    'A+': ('O-', 'O+', 'A-', 'A+'),
+    'B-': ('O-', 'B-'),
+    'B+': ('O-', 'O+', 'B-', 'B+'),
+    'AB-': ('O-', 'A-', 'B-', 'AB-'),
+    'AB+': ('O-', 'O+', 'A-', 'A+', 'B-', 'B+', 'AB-', 'AB+'),
+}
+
+# Profile fields that feed the index; other User updates are ignored
+SOURCE_FIELDS = (
+    'user_type', 'donor_uid', 'donor_type', 'blood_group', 'blood_rh', 'last_blood_donation_date',
+    'blood_donation_count', 'donor_availability', 'donor_consent_contact', 'donor_preferred_city',
+    'city', 'is_active',
+)
+
+_runtime = ServiceRuntime()
+
+
+def init_donor_matching(db, models):
+    """Register the db and model classes and install the sync hook"""
+    _runtime.init(db, models)
+    _runtime.listen('after_flush', _collect_donor_changes, 'User')
+
+
+_m = _runtime.model
+
+
+def normalise_blood_group(group, rh=None, unknown_rh='+'):
+    """
+    'B' + '+', 'B+' + None, 'b positive', 'AB' + 'Negative' -> 'B+', 'AB-'.
+    A group without an Rh sign ('B' + None) takes ``unknown_rh``: donors
+    default to positive, which only offers them to Rh-positive recipients
+    (who can receive either); recipients pass '-' so they are only offered
+    Rh-negative donors. Returns None when the ABO group cannot be determined.
+    """
+    text = f"{group or ''} {rh or ''}".upper()
+    abo = re.match(r'\s*(AB|A|B|O)(?![A-Z])', text)  # Not 'Other' or 'Bombay'
+    if not abo:
+        return None
+    rest = text[abo.end():]
+    if '-' in rest or 'NEG' in rest:
+        sign = '-'
+    elif '+' in rest or 'POS' in rest:
+        sign = '+'
+    elif unknown_rh:
+        sign = unknown_rh
+    else:
+        return None
+    return abo.group(1) + sign
+
+
+def _city_key(city):
+    return ' '.join((city or '').split()).lower() or None
+
+
+def is_blood_donor(user):
+    """Registered as a blood donor (signup type, donor profile or donation history)"""
+    return bool(
+        user.user_type in DONOR_USER_TYPES
+        or user.donor_uid
+        or 'blood' in (user.donor_type or '').lower()
+    )
+
+
+def _entry_values(user):
+    group = normalise_blood_group(user.blood_group, user.blood_rh)
+    last = user.last_blood_donation_date
+    return {
+        'user_id': user.id,
+        'blood_group': group,
+        'eligible_from': last + timedelta(days=DEFERRAL_DAYS) if last else None,
+        'matchable': bool(
+            user.donor_consent_contact is not False
+            and (user.donor_availability or 'Available') == 'Available'
+            and user.is_active is not False
+        ),
+        'city_key': _city_key(user.donor_preferred_city or user.city),
+        'donation_count': user.blood_donation_count or 0,
+        'last_donation_date': last,
+        'updated_at': datetime.utcnow(),
+    }
+
+
+def _indexable(user):
+    return is_blood_donor(user) and normalise_blood_group(user.blood_group, user.blood_rh) is not None
+
+
+# ==================== SYNC ====================
+
+def _source_changed(user):
+    state = sa_inspect(user)
+    return any(state.attrs[field].history.has_changes() for field in SOURCE_FIELDS)
+
+
+def _collect_donor_changes(session, flush_context):
+    """Upsert/delete index rows for donors touched by this flush"""
+    User = _m('User')
+
+    upserts, removals = {}, set()
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, User) or obj.id is None:
+            continue
+        if obj in session.dirty and not _source_changed(obj):
+            continue
+        if _indexable(obj):
+            upserts[obj.id] = _entry_values(obj)
+        else:
+            removals.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, User) and obj.id is not None:
+            removals.add(obj.id)
+
+    if not upserts and not removals:
+        return
+
+    table = _m('BloodDonorIndexEntry').__table__
+    conn = session.connection()
+    for user_id, values in upserts.items():
+        if not conn.execute(table.update().where(table.c.user_id == user_id).values(**values)).rowcount:
+            conn.execute(table.insert().values(**values))
+    if removals:
+        conn.execute(table.delete().where(table.c.user_id.in_(removals)))
+
+
+def _donor_candidates():
+    User = _m('User')
+    return User.query.filter(
+        User.blood_group.isnot(None),
+        or_(
+            User.user_type.in_(DONOR_USER_TYPES),
+            User.donor_uid.isnot(None),
+            User.donor_type.ilike('%blood%')
+        )
+    )
+
+
+def _has_abo_group(User):
+    """SQL form of normalise_blood_group(blood_group, blood_rh) is not None"""
+    text = func.upper(func.ltrim(func.coalesce(User.blood_group, '') + ' ' + func.coalesce(User.blood_rh, '')))
+    return or_(*(
+        and_(text.like(f'{abo}%'), ~func.substr(text, len(abo) + 1, 1).between('A', 'Z'))
+        for abo in ('AB', 'A', 'B', 'O')
+    ))
+
+
+def _unindexed_donors_exist():
+    """Donors that predate the index (the flush hook only sees later changes)"""
+    db, User, Entry = _runtime['db'], _m('User'), _m('BloodDonorIndexEntry')
+    indexed = db.session.query(Entry.id).filter(Entry.user_id == User.id)
+    return db.session.query(
+        _donor_candidates().filter(_has_abo_group(User), ~indexed.exists()).exists()
+    ).scalar()
+
+
+def ensure_index():
+    """Index donors registered before the index existed (startup); returns the rebuild summary or None"""
+    if _unindexed_donors_exist():
+        return rebuild_index()
+    return None
+
+
+def rebuild_index():
+    """Resynchronise every index row from users"""
+    db, Entry = _runtime['db'], _m('BloodDonorIndexEntry')
+    table = Entry.__table__
+    donors = [u for u in _donor_candidates().all() if _indexable(u)]
+
+    db.session.execute(table.delete())
+    if donors:
+        db.session.execute(table.insert(), [_entry_values(u) for u in donors])
+    db.session.commit()
+    return {'donors': len(donors)}
+
+
+# ==================== MATCHING ====================
+
+def compatible_groups(recipient_group):
+    return COMPATIBLE_DONORS.get(normalise_blood_group(recipient_group, unknown_rh='-'), ())
+
+
+def match_donors(recipient_group, city=None, on_date=None, limit=DEFAULT_MATCH_LIMIT, exclude_user_ids=()):
+    """
+    Ranked eligible donors for a recipient group as [(entry, user)].
+    Exact group first, then donors in ``city``, then longest since last donation.
+    """
+    db, Entry, User = _runtime['db'], _m('BloodDonorIndexEntry'), _m('User')
+    group = normalise_blood_group(recipient_group, unknown_rh='-')
+    donor_groups = COMPATIBLE_DONORS.get(group)
+    if not donor_groups:
+        return []
+    on_date = on_date or date.today()
+    city_key = _city_key(city)
+
+    query = db.session.query(Entry, User).join(User, Entry.user_id == User.id).filter(
+        Entry.blood_group.in_(donor_groups),
+        Entry.matchable == True,
+        or_(Entry.eligible_from.is_(None), Entry.eligible_from <= on_date)
+    )
+    if exclude_user_ids:
+        query = query.filter(Entry.user_id.notin_(exclude_user_ids))
+
+    ranking = [db.case((Entry.blood_group == group, 0), else_=1)]
+    if city_key:
+        ranking.append(db.case((Entry.city_key == city_key, 0), else_=1))
+    ranking += [Entry.last_donation_date.asc().nulls_first(), Entry.user_id]
+    return query.order_by(*ranking).limit(limit).all()
+
+
+def match_request(blood_request, limit=DEFAULT_MATCH_LIMIT):
+    """Candidates for a ClientBloodRequest (never the requester themself)"""
+    return match_donors(
+        blood_request.blood_group_needed,
+        city=blood_request.hospital_city,
+        limit=limit,
+        exclude_user_ids=(blood_request.user_id,)
+    )
+
+
+def candidate_dict(entry, user, recipient_group=None, city=None, include_contact=False):
+    item = {
+        'donor_uid': user.donor_uid,
+        'name': user.full_name or 'Donor',
+        'blood_group': entry.blood_group,
+        'exact_match': entry.blood_group == normalise_blood_group(recipient_group, unknown_rh='-'),
+        'city': user.donor_preferred_city or user.city,
+        'same_city': bool(city) and entry.city_key == _city_key(city),
+        'donation_count': entry.donation_count,
+        'last_donation_date': entry.last_donation_date.isoformat() if entry.last_donation_date else None,
+    }
+    if include_contact:
+        item['mobile'] = user.mobile
+        item['email'] = user.email
+    return item
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+
+    parser = argparse.ArgumentParser(description='Blood donor matching tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild', help='Rebuild the eligible-donor index from users')
+    match = sub.add_parser('match', help='Print ranked donors for a client blood request')
+    match.add_argument('request_id')
+    match.add_argument('--limit', type=int, default=DEFAULT_MATCH_LIMIT)
+    args = parser.parse_args()
+
+    app, service = cli_app('services.donor_matching')
+    from app import ClientBloodRequest
+
+    with app.app_context():
+        if args.command == 'rebuild':
+            print(f"✅ Donor index rebuilt: {service.rebuild_index()}")
+        else:
+            req = ClientBloodRequest.query.filter_by(request_id=args.request_id).first()
+            if req is None:
+                sys.exit(f'Request {args.request_id} not found')
+            matches = [
+                service.candidate_dict(e, u, req.blood_group_needed, req.hospital_city)
+                for e, u in service.match_request(req, args.limit)
+            ]
+            print(json.dumps(matches, indent=2))
@@ -0,0 +1,396 @@
+"""
+Streaming Export Engine
+Streams report rows from server-side cursors straight into a chunked HTTP
+response, so exports of any size run in constant memory.
+
+Supported formats:
+- ``csv``      plain CSV
+- ``csv.gz``   gzip-compressed CSV
+- ``xlsx``     Excel workbook written as a streamed zip (no extra dependency)
+
+A report is a list of sheets; each sheet is ``(title, header, rows)`` where
+``rows`` is any iterable (typically ``iter_query(...)``). CSV output writes the
+sheets one after another as titled sections; XLSX output writes one worksheet
+per sheet.
+
+Usage inside a route::
+
+    sheets = [('Users', ['UID', 'Name'], iter_query(User.query, lambda u: [u.uid, u.full_name]))]
+    return stream_export(sheets, 'users_report', request.args.get('format', 'csv'))
+
+Memory benchmark (1M rows through every writer)::
+
+    python -m services.export_engine --rows 1000000
+
+The same ceiling is checked by the slow tests in tests/test_export_engine.py
+(``python -m pytest tests/test_export_engine.py --run-slow``).
+"""
+import csv
+import io
+import re
+import zipfile
+import zlib
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+
+from flask import Response, stream_with_context
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'csv.gz': ('application/gzip', 'csv.gz'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+}
+DEFAULT_BATCH_SIZE = 1000
+CHUNK_SIZE = 64 * 1024  # Bytes buffered before a chunk is sent to the client
+
+
+class ExportFormatError(ValueError):
+    """Raised for an unknown export format"""
+
+
+# ==================== ROW SOURCES ====================
+
+def iter_query(query, row_fn, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yield ``row_fn(row)`` for every result of ``query`` using a server-side
+    cursor, ``batch_size`` rows at a time. The session's identity map only
+    holds weak references, so rows are released as soon as they are written.
+    """
+    for row in query.yield_per(batch_size):
+        yield row_fn(row)
+
+
+def _cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.strftime('%Y-%m-%d')
+    return value
+
+
+# ==================== WRITERS ====================
+
+class _ChunkBuffer:
+    """Write-only file object whose contents are drained as HTTP chunks"""
+
+    def __init__(self):
+        self._parts = []
+        self._size = 0
+        self._written = 0
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._parts.append(bytes(data))
+        self._size += len(data)
+        self._written += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._written
+
+    def flush(self):
+        pass
+
+    @property
+    def pending(self):
+        return self._size
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        self._size = 0
+        return data
+
+
+def _csv_text_chunks(sheets):
+    """Yield CSV text in ~CHUNK_SIZE pieces"""
+    text = io.StringIO()
+    writer = csv.writer(text)
+    multi = len(sheets) > 1
+    for index, (title, header, rows) in enumerate(sheets):
+        if multi:
+            if index:
+                writer.writerow([])
+            writer.writerow([title])
+        if header:
+            writer.writerow(header)
+        for row in rows:
+            writer.writerow([_cell_text(v) for v in row])
+            if text.tell() >= CHUNK_SIZE:
+                yield text.getvalue()
+                text.seek(0)
+                text.truncate(0)
+    if text.tell():
+        yield text.getvalue()
+
+
+def write_csv(sheets):
+    """Yield UTF-8 CSV bytes (with BOM so Excel detects the encoding)"""
+    yield '\ufeff'.encode('utf-8')
+    for chunk in _csv_text_chunks(sheets):
+        yield chunk.encode('utf-8')
+
+
+def write_csv_gzip(sheets):
+    """Yield gzip-compressed CSV bytes"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 -> gzip container
+    for chunk in write_csv(sheets):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+_ILLEGAL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, rem = divmod(index - 1, 26)
+        letters = chr(65 + rem) + letters
+    return letters
+
+
+def _xlsx_cell(ref, value):
+    if isinstance(value, bool):
+        return f'<c r="{ref}" t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    text = _cell_text(value)
+    if text == '':
+        return ''
+    text = escape(_ILLEGAL_XML.sub('', str(text)))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_row(row_number, values):
+    cells = ''.join(_xlsx_cell(f'{_column_letter(i)}{row_number}', v) for i, v in enumerate(values))
+    return f'<row r="{row_number}">{cells}</row>'
+
+
+def _sheet_name(title, used):
+    name = re.sub(r'[\[\]:*?/\\]', ' ', title or 'Sheet')[:31].strip() or 'Sheet'
+    base, n = name, 2
+    while name.lower() in used:
+        suffix = f' ({n})'
+        name = base[:31 - len(suffix)] + suffix
+        n += 1
+    used.add(name.lower())
+    return name
+
+
+def write_xlsx(sheets):
+    """
+    Yield an .xlsx workbook. The zip is written to a non-seekable buffer
+    (zipfile then uses data descriptors), so every row leaves memory as soon
+    as its compressed bytes are drained.
+    """
+    buffer = _ChunkBuffer()
+    names = []
+    used = set()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for index, (title, header, rows) in enumerate(sheets, start=1):
+            names.append(_sheet_name(title, used))
+            with zf.open(f'xl/worksheets/sheet{index}.xml', 'w', force_zip64=True) as sheet:
+                sheet.write(
+                    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                    b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                )
+                row_number = 0
+                if header:
+                    row_number += 1
+                    sheet.write(_xlsx_row(row_number, header).encode('utf-8'))
+                pending = []
+                for row in rows:
+                    row_number += 1
+                    pending.append(_xlsx_row(row_number, row))
+                    if len(pending) >= 500:
+                        sheet.write(''.join(pending).encode('utf-8'))
+                        pending = []
+                        if buffer.pending >= CHUNK_SIZE:
+                            yield buffer.drain()
+                if pending:
+                    sheet.write(''.join(pending).encode('utf-8'))
+                sheet.write(b'</sheetData></worksheet>')
+            yield buffer.drain()
+
+        for path, xml in _xlsx_package_parts(names):
+            zf.writestr(path, xml)
+    yield buffer.drain()
+
+
+def _xlsx_package_parts(sheet_names):
+    sheets_ct = ''.join(
+        f'<Override PartName="/xl/worksheets/sheet{i}.xml" '
+        f'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        for i in range(1, len(sheet_names) + 1)
+    )
+    sheets_wb = ''.join(
+        f'<sheet name="{escape(name, {chr(34): "&quot;"})}" sheetId="{i}" r:id="rId{i}"/>'
+        for i, name in enumerate(sheet_names, start=1)
+    )
+    sheets_rels = ''.join(
+        f'<Relationship Id="rId{i}" '
+        f'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{i}.xml"/>'
+        for i in range(1, len(sheet_names) + 1)
+    )
+    styles_rid = len(sheet_names) + 1
+    return [
+        ('[Content_Types].xml',
+         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+         '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+         '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+         '<Default Extension="xml" ContentType="application/xml"/>'
+         '<Override PartName="/xl/workbook.xml" '
+         'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+         '<Override PartName="/xl/styles.xml" '
+         'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+         f'{sheets_ct}</Types>'),
+        ('_rels/.rels',
+         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+         '<Relationship Id="rId1" '
+         'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+         'Target="xl/workbook.xml"/></Relationships>'),
+        ('xl/workbook.xml',
+         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+         '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+         'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+         f'<sheets>{sheets_wb}</sheets></workbook>'),
+        ('xl/_rels/workbook.xml.rels',
+         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+         '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+         f'{sheets_rels}'
+         f'<Relationship Id="rId{styles_rid}" '
+         'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+         'Target="styles.xml"/></Relationships>'),
+        ('xl/styles.xml',
+         '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+         '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+         '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+         '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+         '<borders count="1"><border/></borders>'
+         '<cellStyleXfs count="1"><xf/></cellStyleXfs>'
+         '<cellXfs count="1"><xf xfId="0"/></cellXfs>'
+         '</styleSheet>'),
+    ]
+
+
+WRITERS = {
+    'csv': write_csv,
+    'csv.gz': write_csv_gzip,
+    'xlsx': write_xlsx,
+}
+
+
+# ==================== HTTP ====================
+
+def normalize_format(export_format):
+    fmt = (export_format or 'csv').lower().strip()
+    fmt = {'gz': 'csv.gz', 'csv-gz': 'csv.gz', 'gzip': 'csv.gz', 'excel': 'xlsx'}.get(fmt, fmt)
+    if fmt not in EXPORT_FORMATS:
+        raise ExportFormatError(f'Unsupported export format: {export_format}')
+    return fmt
+
+
+def stream_export(sheets, filename, export_format='csv'):
+    """Chunked download response for ``sheets`` in the requested format"""
+    fmt = normalize_format(export_format)
+    mimetype, extension = EXPORT_FORMATS[fmt]
+    body = WRITERS[fmt](list(sheets))
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+    response.headers['Cache-Control'] = 'no-store'
+    response.headers['X-Accel-Buffering'] = 'no'  # Let nginx pass chunks straight through
+    return response
+
+
+# ==================== MEMORY BENCHMARK ====================
+
+def run_memory_benchmark(rows=1000000, ceiling_mb=32, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Stream ``rows`` rows from a temporary SQLite table through every writer and
+    check the Python heap peak stays under ``ceiling_mb``. Returns a report.
+    """
+    import os
+    import tempfile
+    import time
+    import tracemalloc
+
+    from sqlalchemy import Column, Date, Float, Integer, String, create_engine
+    from sqlalchemy.orm import Session, declarative_base
+
+    Base = declarative_base()
+
+    class ExportRow(Base):
+        __tablename__ = 'export_rows'
+        id = Column(Integer, primary_key=True)
+        name = Column(String(100))
+        email = Column(String(120))
+        score = Column(Float)
+        created = Column(Date)
+
+    handle, path = tempfile.mkstemp(suffix='.db')
+    os.close(handle)
+    engine = create_engine(f'sqlite:///{path}')
+    try:
+        Base.metadata.create_all(engine)
+        today = date.today()
+        with engine.begin() as conn:
+            step = 50000
+            for start in range(0, rows, step):
+                conn.execute(ExportRow.__table__.insert(), [
+                    {'id': i + 1, 'name': f'Employee {i}', 'email': f'user{i}@example.com',
+                     'score': i * 0.5, 'created': today}
+                    for i in range(start, min(start + step, rows))
+                ])
+
+        report = {'rows': rows, 'ceiling_mb': ceiling_mb, 'writers': {}}
+        for fmt, writer in WRITERS.items():
+            with Session(engine) as session:
+                query = session.query(ExportRow).order_by(ExportRow.id)
+                sheet = ('Rows', ['ID', 'Name', 'Email', 'Score', 'Created'],
+                         iter_query(query, lambda r: [r.id, r.name, r.email, r.score, r.created], batch_size))
+                tracemalloc.start()
+                started = time.time()
+                total_bytes = 0
+                for chunk in writer([sheet]):
+                    total_bytes += len(chunk)
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+            peak_mb = peak / (1024 * 1024)
+            report['writers'][fmt] = {
+                'seconds': round(time.time() - started, 2),
+                'output_mb': round(total_bytes / (1024 * 1024), 1),
+                'peak_heap_mb': round(peak_mb, 2),
+                'within_ceiling': peak_mb <= ceiling_mb,
+            }
+        report['passed'] = all(w['within_ceiling'] for w in report['writers'].values())
+        return report
+    finally:
+        engine.dispose()
+        os.remove(path)
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+
+    parser = argparse.ArgumentParser(description='Streaming export memory benchmark')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--ceiling-mb', type=float, default=32)
+    args = parser.parse_args()
+
+    print("=" * 50)
+    print("  Streaming Export Memory Benchmark")
+    print("=" * 50)
+    result = run_memory_benchmark(args.rows, args.ceiling_mb)
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result['passed'] else 1)
@@ -0,0 +1,323 @@
+"""
+Facility Analytics Snapshots
+Daily per-facility analytics computed with grouped SQL and served from a table.
+
+``facility_analytics_snapshots`` holds one row per facility and day: the
+headline counts as columns (for trend lines) and the dashboard payload
+(health/risk distributions, 7-day visit trend, worker ranking, village
+coverage) as JSON. Opening the analytics page serves today's row while it is
+younger than SNAPSHOT_MAX_AGE and recomputes it otherwise; recomputing runs a
+handful of GROUP BY queries over households, clients and visits instead of
+loading them.
+
+Refresh every facility from cron so days without a dashboard visit still get
+a row for the history::
+
+    python -m services.facility_analytics refresh
+    python -m services.facility_analytics refresh --facility 3
+    python -m services.facility_analytics history 3 --days 30
+"""
+import json
+import threading
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from services.runtime import ServiceRuntime, cli_app
+
+SNAPSHOT_MAX_AGE = timedelta(minutes=15)
+TREND_DAYS = 7
+VILLAGE_LIMIT = 10
+DEFAULT_HISTORY_DAYS = 30
+MAX_HISTORY_DAYS = 365
+
+# Snapshot columns available as history series
+TREND_METRICS = (
+    'total_workers', 'total_patients', 'total_households', 'total_villages',
+    'high_risk', 'medium_risk', 'low_risk', 'pregnant', 'ncd', 'children_under_5', 'elderly',
+    'visits_day', 'visits_week', 'visits_month',
+)
+
+_runtime = ServiceRuntime()
+_refresh_locks = {}
+_refresh_locks_guard = threading.Lock()
+
+
+def init_facility_analytics(db, models):
+    """Register the db and model classes"""
+    _runtime.init(db, models)
+
+
+_m = _runtime.model
+
+
+def _flag(column):
+    return func.coalesce(func.sum(_runtime['db'].case((column == True, 1), else_=0)), 0)
+
+
+def _count_when(condition):
+    return func.coalesce(func.sum(_runtime['db'].case((condition, 1), else_=0)), 0)
+
+
+# ==================== COMPUTE ====================
+
+def compute_analytics(facility_id, today=None):
+    """Dashboard analytics for a facility from grouped queries (no snapshot involved)"""
+    db, User, Household, ClientVisit = _runtime['db'], _m('User'), _m('Household'), _m('ClientVisit')
+    today = today or date.today()
+    week_start = today - timedelta(days=today.weekday())
+    month_start = today.replace(day=1)
+    trend_start = today - timedelta(days=TREND_DAYS - 1)
+
+    workers = db.session.query(User.id, User.full_name, User.first_name).filter(
+        User.facility_id == facility_id, User.user_type == 'health_worker'
+    ).all()
+    worker_ids = db.session.query(User.id).filter(
+        User.facility_id == facility_id, User.user_type == 'health_worker'
+    ).scalar_subquery()
+
+    per_worker = {w.id: {
+        'households': 0, 'high_risk': 0, 'patients': 0,
+        'visits_today': 0, 'visits_week': 0, 'visits_month': 0,
+    } for w in workers}
+    totals = dict.fromkeys(('high', 'medium', 'low', 'pregnant', 'ncd', 'children_under_5', 'elderly', 'patients'), 0)
+
+    # Households per worker: counts, risk levels and condition flags
+    for row in db.session.query(
+        Household.health_worker_id,
+        func.count(Household.id),
+        _count_when(Household.risk_level == 'high'),
+        _count_when(Household.risk_level == 'medium'),
+        _flag(Household.has_pregnant_woman),
+        _flag(Household.has_child_under_5),
+        _flag(Household.has_elderly),
+        _flag(Household.has_ncd_patient),
+    ).filter(Household.health_worker_id.in_(worker_ids)).group_by(Household.health_worker_id):
+        worker_id, households, high, medium, pregnant, under_5, elderly, ncd = row
+        per_worker[worker_id]['households'] = households
+        per_worker[worker_id]['high_risk'] = high
+        totals['high'] += high
+        totals['medium'] += medium
+        totals['low'] += households - high - medium
+        totals['pregnant'] += pregnant
+        totals['children_under_5'] += under_5
+        totals['elderly'] += elderly
+        totals['ncd'] += ncd
+
+    # Clients per assigned worker
+    for worker_id, patients, pregnant, ncd, high in db.session.query(
+        User.assigned_health_worker_id,
+        func.count(User.id),
+        _flag(User.is_pregnant),
+        _flag(User.has_ncd),
+        _flag(User.is_high_risk),
+    ).filter(
+        User.user_type == 'client',
+        User.assigned_health_worker_id.in_(worker_ids)
+    ).group_by(User.assigned_health_worker_id):
+        per_worker[worker_id]['patients'] = patients
+        totals['patients'] += patients
+        totals['pregnant'] += pregnant
+        totals['ncd'] += ncd
+        totals['high'] += high
+
+    # Visits per worker and day, from the earliest window start onwards
+    daily = {}
+    for worker_id, visit_date, visits in db.session.query(
+        ClientVisit.health_worker_id, ClientVisit.visit_date, func.count(ClientVisit.id)
+    ).filter(
+        ClientVisit.health_worker_id.in_(worker_ids),
+        ClientVisit.visit_date >= min(week_start, month_start, trend_start)
+    ).group_by(ClientVisit.health_worker_id, ClientVisit.visit_date):
+        stats = per_worker[worker_id]
+        if visit_date == today:
+            stats['visits_today'] += visits
+        if visit_date >= week_start:
+            stats['visits_week'] += visits
+        if visit_date >= month_start:
+            stats['visits_month'] += visits
+        daily[visit_date] = daily.get(visit_date, 0) + visits
+
+    visit_trends = []
+    for offset in range(TREND_DAYS - 1, -1, -1):
+        day = today - timedelta(days=offset)
+        visit_trends.append({'day': day.strftime('%a'), 'date': day.isoformat(), 'visits': daily.get(day, 0)})
+
+    # Villages: coverage per village
+    villages = db.session.query(
+        Household.village,
+        func.count(Household.id),
+        func.coalesce(func.sum(Household.total_members), 0),
+        _count_when(Household.risk_level == 'high'),
+    ).filter(
+        Household.health_worker_id.in_(worker_ids),
+        Household.village.isnot(None),
+        Household.village != ''
+    ).group_by(Household.village).all()
+    village_coverage = sorted(
+        ({'name': name, 'households': households, 'members': members, 'high_risk': high}
+         for name, households, members, high in villages),
+        key=lambda v: v['households'], reverse=True
+    )
+
+    worker_performance = []
+    for w in workers:
+        stats = per_worker[w.id]
+        reach = stats['households'] + stats['patients']
+        score = min(100, round(
+            (stats['visits_week'] * 5 + stats['households'] * 2 + stats['patients'] * 3) / max(1, reach) * 10
+        ))
+        worker_performance.append(dict(stats, id=w.id, name=w.full_name or w.first_name or 'Unknown', score=score))
+    worker_performance.sort(key=lambda x: x['score'], reverse=True)
+    for rank, item in enumerate(worker_performance, start=1):
+        item['rank'] = rank
+
+    return {
+        'summary': {
+            'total_workers': len(workers),
+            'total_patients': totals['patients'],
+            'total_households': sum(s['households'] for s in per_worker.values()),
+            'total_villages': len(villages),
+            'visits_today': sum(s['visits_today'] for s in per_worker.values()),
+            'visits_week': sum(s['visits_week'] for s in per_worker.values()),
+            'visits_month': sum(s['visits_month'] for s in per_worker.values()),
+            'high_risk_households': totals['high'],
+        },
+        'health_distribution': {
+            'healthy': max(0, totals['patients'] - totals['pregnant'] - totals['ncd']),
+            'pregnant': totals['pregnant'],
+            'ncd': totals['ncd'],
+            'children_under_5': totals['children_under_5'],
+            'elderly': totals['elderly'],
+        },
+        'risk_distribution': {'high': totals['high'], 'medium': totals['medium'], 'low': totals['low']},
+        'visit_trends': visit_trends,
+        'worker_performance': worker_performance,
+        'village_coverage': village_coverage[:VILLAGE_LIMIT],
+    }
+
+
+# ==================== SNAPSHOTS ====================
+
+def _snapshot_values(analytics):
+    summary, health, risk = analytics['summary'], analytics['health_distribution'], analytics['risk_distribution']
+    return {
+        'total_workers': summary['total_workers'],
+        'total_patients': summary['total_patients'],
+        'total_households': summary['total_households'],
+        'total_villages': summary['total_villages'],
+        'high_risk': risk['high'],
+        'medium_risk': risk['medium'],
+        'low_risk': risk['low'],
+        'pregnant': health['pregnant'],
+        'ncd': health['ncd'],
+        'children_under_5': health['children_under_5'],
+        'elderly': health['elderly'],
+        'visits_day': summary['visits_today'],
+        'visits_week': summary['visits_week'],
+        'visits_month': summary['visits_month'],
+        'payload': json.dumps(analytics),
+        'computed_at': datetime.utcnow(),
+    }
+
+
+def refresh_snapshot(facility_id, today=None):
+    """Recompute and store a facility's snapshot for the day (commits)"""
+    db, Snapshot = _runtime['db'], _m('FacilityAnalyticsSnapshot')
+    today = today or date.today()
+    analytics = compute_analytics(facility_id, today)
+    values = _snapshot_values(analytics)
+
+    table = Snapshot.__table__
+    match = (table.c.facility_id == facility_id) & (table.c.snapshot_date == today)
+    if not db.session.execute(table.update().where(match).values(**values)).rowcount:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(facility_id=facility_id, snapshot_date=today, **values))
+        except IntegrityError:
+            # Another refresh created today's row first
+            db.session.execute(table.update().where(match).values(**values))
+    db.session.commit()
+    return analytics, values['computed_at']
+
+
+def _facility_lock(facility_id):
+    with _refresh_locks_guard:
+        return _refresh_locks.setdefault(facility_id, threading.Lock())
+
+
+def _fresh_snapshot(facility_id, today, max_age):
+    Snapshot = _m('FacilityAnalyticsSnapshot')
+    row = _runtime['db'].session.query(Snapshot.payload, Snapshot.computed_at).filter_by(
+        facility_id=facility_id, snapshot_date=today
+    ).first()
+    if row and row.payload and row.computed_at and datetime.utcnow() - row.computed_at < max_age:
+        return json.loads(row.payload), row.computed_at
+    return None
+
+
+def current_analytics(facility_id, force=False, max_age=SNAPSHOT_MAX_AGE):
+    """
+    Today's analytics for a facility as (analytics, computed_at): the stored
+    snapshot while it is fresh, otherwise recomputed (once per process at a time).
+    """
+    today = date.today()
+    if not force:
+        cached = _fresh_snapshot(facility_id, today, max_age)
+        if cached:
+            return cached
+    with _facility_lock(facility_id):
+        if not force:
+            cached = _fresh_snapshot(facility_id, today, max_age)  # Refreshed while we waited
+            if cached:
+                return cached
+        return refresh_snapshot(facility_id, today)
+
+
+def analytics_history(facility_id, days=DEFAULT_HISTORY_DAYS, metrics=TREND_METRICS):
+    """Daily series of snapshot columns, oldest first"""
+    Snapshot = _m('FacilityAnalyticsSnapshot')
+    days = max(1, min(int(days), MAX_HISTORY_DAYS))
+    metrics = [m for m in metrics if m in TREND_METRICS] or list(TREND_METRICS)
+    since = date.today() - timedelta(days=days - 1)
+    columns = [getattr(Snapshot, m) for m in metrics]
+    rows = _runtime['db'].session.query(Snapshot.snapshot_date, *columns).filter(
+        Snapshot.facility_id == facility_id,
+        Snapshot.snapshot_date >= since
+    ).order_by(Snapshot.snapshot_date).all()
+    return [dict(zip(metrics, row[1:]), date=row[0].isoformat()) for row in rows]
+
+
+def refresh_all(today=None):
+    """Snapshot every facility (nightly job)"""
+    Facility = _m('Facility')
+    ids = [facility_id for (facility_id,) in _runtime['db'].session.query(Facility.id).order_by(Facility.id)]
+    for facility_id in ids:
+        refresh_snapshot(facility_id, today)
+    return {'facilities': len(ids)}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Facility analytics snapshots')
+    sub = parser.add_subparsers(dest='command', required=True)
+    refresh = sub.add_parser('refresh', help="Recompute today's snapshot (all facilities by default)")
+    refresh.add_argument('--facility', type=int)
+    history = sub.add_parser('history', help='Print the stored daily series for a facility')
+    history.add_argument('facility', type=int)
+    history.add_argument('--days', type=int, default=DEFAULT_HISTORY_DAYS)
+    args = parser.parse_args()
+
+    app, service = cli_app('services.facility_analytics')
+
+    with app.app_context():
+        if args.command == 'refresh':
+            if args.facility:
+                service.refresh_snapshot(args.facility)
+                print(f"✅ Snapshot refreshed for facility {args.facility}")
+            else:
+                print(f"✅ Snapshots refreshed: {service.refresh_all()}")
+        else:
+            print(json.dumps(service.analytics_history(args.facility, args.days), indent=2))
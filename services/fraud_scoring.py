@@ -0,0 +1,486 @@
+"""
+Fraud Scoring
+Rule-weighted fraud risk scores for insurance claims, written to ``fraud_detection``.
+
+Each claim is scored from:
+
+* claim frequency  - the claimant's claims with the same insurer in the last
+  30 days (rapid claims) and 180 days (frequent claimant), counted up to and
+  including the claim date;
+* policy age       - days between policy start and the claim (waiting-period
+  abuse shows up as claims on brand-new policies);
+* amount ratio     - claimed amount against the policy's sum insured;
+* amount outlier   - z-score of the claimed amount within the insurer's claims;
+* hospital outlier - hospitals whose mean claim sits far above the insurer's
+  mean, tested against the standard error for that hospital's claim count.
+
+Insurer and hospital statistics come from one grouped SQL query (count, sum,
+sum of squares). Features and scores are computed with NumPy over a claim
+matrix (one array per feature). New or edited claims are scored by a session
+flush hook as they are submitted; the nightly batch re-scores every claim,
+streaming each insurer's claims in blocks of claimants ordered by (user,
+claim date) so the frequency windows are two ``searchsorted`` calls over the
+block and memory stays flat. Only rows whose score, level or claim frequency
+changed are written::
+
+    python -m services.fraud_scoring rescore [--insurer ID]
+    python -m services.fraud_scoring bench [--claims 1000000]
+"""
+import math
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import and_, bindparam, case, func, select, inspect as sa_inspect, text
+
+from services.runtime import ServiceRuntime, cli_app
+
+RAPID_WINDOW_DAYS = 30
+FREQUENCY_WINDOW_DAYS = 180  # FraudDetection.claim_frequency is "claims in last 6 months"
+RAPID_CLAIMS = 3
+FREQUENT_CLAIMS = 6
+NEW_POLICY_DAYS = 30
+YOUNG_POLICY_DAYS = 90
+HIGH_RATIO = 0.8
+ELEVATED_RATIO = 0.5
+AMOUNT_Z = 3.0
+ELEVATED_AMOUNT_Z = 2.0
+HOSPITAL_Z = 3.0
+MIN_INSURER_CLAIMS = 20  # Below this the insurer statistics are too thin to call outliers
+MIN_HOSPITAL_CLAIMS = 5
+
+# Points per indicator at full strength (sum 100)
+WEIGHTS = {
+    'rapid_claims': 20,
+    'frequent_claimant': 10,
+    'new_policy': 20,
+    'high_sum_insured_ratio': 15,
+    'unusual_amount': 20,
+    'suspicious_hospital': 15,
+}
+LEVELS = ((70, 'Critical'), (50, 'High'), (25, 'Medium'), (0, 'Low'))
+ESCALATE_LEVELS = ('High', 'Critical')
+
+USER_BLOCK = 2000  # Claimants per streamed block in the nightly batch
+WRITE_BATCH = 500
+
+# Declared on the models for new databases; created here for existing ones
+INDEXES = {
+    'ix_insurance_claims_fraud_window': ('insurance_claims', 'insurance_company_id, user_id, claim_date'),
+    'ix_fraud_detection_claim_id': ('fraud_detection', 'claim_id'),
+}
+
+SCORED_FIELDS = ('claimed_amount', 'claim_date', 'hospital_name', 'insurance_id', 'insurance_company_id', 'status')
+
+InsurerStats = namedtuple('InsurerStats', 'count mean std suspicious_hospitals')
+# A claim matrix: one NumPy array per feature, a row per claim (NaN where unknown)
+ClaimFeatures = namedtuple(
+    'ClaimFeatures', 'claim_pk freq_30 freq_180 policy_age_days amount_ratio amount_z suspicious_hospital'
+)
+
+_runtime = ServiceRuntime(stats={})
+
+
+def init_fraud_scoring(db, models):
+    """Register the db and model classes and install the on-submission scoring hook"""
+    _runtime.init(db, models)
+    _runtime.listen('after_flush', _score_submitted_claims, 'InsuranceClaim')
+
+
+_m = _runtime.model
+_t = _runtime.table
+
+
+def ensure_fraud_indexes():
+    """Create the claimant-window and claim lookup indexes when missing"""
+    with _runtime['db'].engine.begin() as conn:
+        for name, (table, columns) in INDEXES.items():
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'))
+
+
+def hospital_key(name):
+    return (name or '').strip().lower()
+
+
+# ==================== SCORING ====================
+
+def score_matrix(m):
+    """(scores 0-100, risk levels, {indicator: strength}) arrays for a claim matrix"""
+    age, ratio, z = m.policy_age_days, m.amount_ratio, m.amount_z  # NaN compares False
+    strength = {
+        'rapid_claims': (m.freq_30 >= RAPID_CLAIMS).astype(float),
+        'frequent_claimant': (m.freq_180 >= FREQUENT_CLAIMS).astype(float),
+        'new_policy': np.select([age < NEW_POLICY_DAYS, age < YOUNG_POLICY_DAYS], [1.0, 0.5], 0.0),
+        'high_sum_insured_ratio': np.select([ratio >= HIGH_RATIO, ratio >= ELEVATED_RATIO], [1.0, 0.5], 0.0),
+        'unusual_amount': np.select([z >= AMOUNT_Z, z >= ELEVATED_AMOUNT_Z], [1.0, 0.5], 0.0),
+        'suspicious_hospital': m.suspicious_hospital.astype(float),
+    }
+    scores = np.round(sum(WEIGHTS[k] * s for k, s in strength.items()), 1)
+    levels = np.select([scores >= floor for floor, _ in LEVELS], [level for _, level in LEVELS], 'Low')
+    return scores, levels, strength
+
+
+def window_counts(user_ids, days, window):
+    """
+    Claims by the same claimant in (day - window, day] for rows sorted by
+    (user, day): a searchsorted over a (claimant rank, day) key.
+    """
+    if not len(days):
+        return np.zeros(0, dtype=np.int64)
+    rank = np.concatenate(([0], np.cumsum(user_ids[1:] != user_ids[:-1])))
+    key = (rank.astype(np.int64) << 32) + days
+    return np.searchsorted(key, key, 'right') - np.searchsorted(key, key - window, 'right')
+
+
+def feature_matrix(claim_pk, day, policy_start, amount, sum_insured, suspicious, freq_30, freq_180, stats):
+    """ClaimFeatures arrays from column arrays (days as ordinals, NaN where unknown)"""
+    ratio = np.full(len(claim_pk), np.nan)
+    np.divide(amount, sum_insured, out=ratio, where=(sum_insured != 0) & ~np.isnan(sum_insured))
+    if stats and stats.count >= MIN_INSURER_CLAIMS and stats.std > 0:
+        amount_z = (amount - stats.mean) / stats.std
+    else:
+        amount_z = np.full(len(claim_pk), np.nan)
+    return ClaimFeatures(
+        claim_pk=claim_pk,
+        freq_30=freq_30,
+        freq_180=freq_180,
+        policy_age_days=day - policy_start,
+        amount_ratio=ratio,
+        amount_z=amount_z,
+        suspicious_hospital=suspicious,
+    )
+
+
+def claim_matrix(claims, stats, freq_30=None, freq_180=None, user_ids=None):
+    """
+    Claim matrix for ``claims``, (claim_pk, claim_date, claimed_amount,
+    hospital_name, policy_start, sum_insured) rows. The frequency windows are
+    either given or computed from ``user_ids`` (rows sorted by user, date).
+    """
+    pk, claim_date, amount, hospital, policy_start, sum_insured = (
+        zip(*claims) if claims else ((),) * 6
+    )
+    day = np.array([d.toordinal() for d in claim_date], dtype=np.int64)
+    if freq_30 is None:
+        users = np.array(user_ids, dtype=np.int64)
+        freq_30 = window_counts(users, day, RAPID_WINDOW_DAYS)
+        freq_180 = window_counts(users, day, FREQUENCY_WINDOW_DAYS)
+    suspicious = stats.suspicious_hospitals if stats else ()
+    return feature_matrix(
+        np.array(pk, dtype=np.int64),
+        day.astype(float),
+        np.array([d.toordinal() if d else np.nan for d in policy_start], dtype=float),
+        np.array(amount, dtype=float),
+        np.array(sum_insured, dtype=float),
+        np.array([hospital_key(h) in suspicious for h in hospital], dtype=bool),
+        np.asarray(freq_30, dtype=np.int64),
+        np.asarray(freq_180, dtype=np.int64),
+        stats,
+    )
+
+
+# ==================== STATISTICS ====================
+
+def _stats_from_groups(groups):
+    """InsurerStats from per-hospital (key, count, sum, sum of squares) groups"""
+    n = sum(g[1] for g in groups)
+    if not n:
+        return InsurerStats(0, 0.0, 0.0, frozenset())
+    total = sum(g[2] or 0 for g in groups)
+    squares = sum(g[3] or 0 for g in groups)
+    mean = total / n
+    std = math.sqrt(max(0.0, squares / n - mean * mean))
+    suspicious = set()
+    if n >= MIN_INSURER_CLAIMS and std > 0:
+        for key, count, amount, _ in groups:
+            if key and count >= MIN_HOSPITAL_CLAIMS:
+                z = (amount / count - mean) / (std / math.sqrt(count))
+                if z >= HOSPITAL_Z:
+                    suspicious.add(key)
+    return InsurerStats(n, mean, std, frozenset(suspicious))
+
+
+def insurer_stats(conn, insurer_ids=None):
+    """{insurer_id: InsurerStats} from one grouped query over claimed amounts"""
+    c = _t('InsuranceClaim')
+    key = func.lower(func.trim(func.coalesce(c.c.hospital_name, '')))
+    query = select(
+        c.c.insurance_company_id, key, func.count(c.c.id), func.sum(c.c.claimed_amount),
+        func.sum(c.c.claimed_amount * c.c.claimed_amount)
+    ).where(
+        c.c.insurance_company_id.isnot(None), c.c.claimed_amount.isnot(None)
+    ).group_by(c.c.insurance_company_id, key)
+    if insurer_ids is not None:
+        query = query.where(c.c.insurance_company_id.in_(insurer_ids))
+    grouped = {}
+    for insurer_id, hospital, count, amount, squares in conn.execute(query):
+        grouped.setdefault(insurer_id, []).append((hospital, count, amount, squares))
+    return {insurer_id: _stats_from_groups(groups) for insurer_id, groups in grouped.items()}
+
+
+def _cached_stats(conn, insurer_id):
+    """Per-process, per-day insurer statistics for on-submission scoring"""
+    today = date.today()
+    cached = _runtime['stats'].get(insurer_id)
+    if cached and cached[0] == today:
+        return cached[1]
+    stats = insurer_stats(conn, [insurer_id]).get(insurer_id)
+    _runtime['stats'][insurer_id] = (today, stats)
+    return stats
+
+
+# ==================== WRITES ====================
+
+def _optional(value, cast):
+    return None if math.isnan(value) else cast(value)
+
+
+def write_scores(conn, m):
+    """
+    Insert or update fraud_detection rows for a scored claim matrix. Existing
+    rows keep their investigation fields; a Not Required row is moved to
+    Pending when its level rises to High/Critical. Returns (inserted, updated).
+    """
+    table = _t('FraudDetection')
+    pks = m.claim_pk.tolist()
+    if not pks:
+        return 0, 0
+    scores, levels, strength = score_matrix(m)
+    scores, levels, freq_180 = scores.tolist(), levels.tolist(), m.freq_180.tolist()
+    flags = {k: (s > 0).tolist() for k, s in strength.items()}
+    ages, ratios, hospitals = m.policy_age_days.tolist(), m.amount_ratio.tolist(), m.suspicious_hospital.tolist()
+    existing = {
+        row.claim_id: row for row in conn.execute(
+            select(table.c.id, table.c.claim_id, table.c.fraud_risk_score, table.c.risk_level,
+                   table.c.claim_frequency, table.c.investigation_status)
+            .where(table.c.claim_id.in_(pks), table.c.pre_auth_id.is_(None))
+        )
+    }
+    now = datetime.utcnow()
+    inserts, updates = [], []
+    for i, claim_pk in enumerate(pks):
+        score, level = scores[i], levels[i]
+        row = existing.get(claim_pk)
+        if row is not None and (row.fraud_risk_score, row.risk_level, row.claim_frequency) == (score, level, freq_180[i]):
+            continue
+        values = {
+            'fraud_risk_score': score,
+            'risk_level': level,
+            'indicators': {k: flag[i] for k, flag in flags.items()},
+            'claim_frequency': freq_180[i],
+            'policy_age_days': _optional(ages[i], int),
+            'hospital_pattern_flag': hospitals[i],
+            'amount_vs_policy_ratio': _optional(ratios[i], lambda r: round(r, 4)),
+            'updated_at': now,
+        }
+        if row is None:
+            values.update(
+                claim_id=claim_pk,
+                investigation_status='Pending' if level in ESCALATE_LEVELS else 'Not Required',
+                flagged_date=now,
+                created_at=now,
+            )
+            inserts.append(values)
+        else:
+            status = row.investigation_status
+            if level in ESCALATE_LEVELS and status in (None, 'Not Required'):
+                status = 'Pending'
+            values.update(row_id=row.id, investigation_status=status)
+            updates.append(values)
+    if inserts:
+        conn.execute(table.insert(), inserts)
+    if updates:
+        conn.execute(
+            table.update().where(table.c.id == bindparam('row_id')).values(
+                **{k: bindparam(k) for k in updates[0] if k != 'row_id'}
+            ),
+            updates
+        )
+    return len(inserts), len(updates)
+
+
+def _rows(m, start, stop):
+    return ClaimFeatures(*(column[start:stop] for column in m))
+
+
+# ==================== ON SUBMISSION ====================
+
+def _claim_rows(conn, claim_pks):
+    c, i = _t('InsuranceClaim'), _t('Insurance')
+    return conn.execute(select(
+        c.c.id, c.c.insurance_company_id, c.c.user_id, c.c.claim_date, c.c.claimed_amount, c.c.hospital_name,
+        i.c.start_date, i.c.sum_insured
+    ).select_from(c.outerjoin(i, c.c.insurance_id == i.c.id)).where(
+        c.c.id.in_(claim_pks), c.c.insurance_company_id.isnot(None), c.c.claim_date.isnot(None)
+    )).all()
+
+
+def _frequency(conn, insurer_id, user_id, claim_date):
+    """(claims in 30 days, claims in 180 days) for one claimant up to claim_date"""
+    c = _t('InsuranceClaim')
+    rapid_from = claim_date - timedelta(days=RAPID_WINDOW_DAYS)
+    freq_30, freq_180 = conn.execute(select(
+        func.coalesce(func.sum(case((c.c.claim_date > rapid_from, 1), else_=0)), 0),
+        func.count(c.c.id)
+    ).where(
+        c.c.insurance_company_id == insurer_id, c.c.user_id == user_id,
+        c.c.claim_date > claim_date - timedelta(days=FREQUENCY_WINDOW_DAYS), c.c.claim_date <= claim_date
+    )).one()
+    return int(freq_30), freq_180
+
+
+def score_claims(conn, claim_pks):
+    """Score these claims now (on submission or edit)"""
+    by_insurer = {}
+    for row in _claim_rows(conn, claim_pks):
+        by_insurer.setdefault(row.insurance_company_id, []).append(row)
+    totals = [0, 0]
+    for insurer_id, rows in by_insurer.items():
+        windows = [_frequency(conn, insurer_id, row.user_id, row.claim_date) for row in rows]
+        m = claim_matrix(
+            [(row.id, row.claim_date, row.claimed_amount, row.hospital_name, row.start_date, row.sum_insured)
+             for row in rows],
+            _cached_stats(conn, insurer_id),
+            freq_30=[w[0] for w in windows], freq_180=[w[1] for w in windows],
+        )
+        for i, count in enumerate(write_scores(conn, m)):
+            totals[i] += count
+    return tuple(totals)
+
+
+def _score_submitted_claims(session, flush_context):
+    Claim = _runtime['models'].get('InsuranceClaim')
+    if Claim is None:
+        return
+    pks = []
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, Claim) or obj.id is None:
+            continue
+        if obj.status in ('Draft', 'Rejected', 'Settled'):
+            continue
+        if obj in session.new or any(_changed(obj, field) for field in SCORED_FIELDS):
+            pks.append(obj.id)
+    if pks:
+        score_claims(session.connection(), pks)
+
+
+def _changed(obj, field):
+    return sa_inspect(obj).attrs[field].history.has_changes()
+
+
+# ==================== NIGHTLY BATCH ====================
+
+def _claimant_blocks(conn, insurer_id):
+    """Sorted distinct claimant ids for an insurer, cut into USER_BLOCK-sized id ranges"""
+    c = _t('InsuranceClaim')
+    users = conn.execute(
+        select(c.c.user_id).where(c.c.insurance_company_id == insurer_id).distinct().order_by(c.c.user_id)
+    ).scalars().all()
+    for start in range(0, len(users), USER_BLOCK):
+        block = users[start:start + USER_BLOCK]
+        yield block[0], block[-1]
+
+
+def rescore_insurer(insurer_id, stats=None):
+    """Re-score every claim of one insurer, one committed block of claimants at a time"""
+    db = _runtime['db']
+    c, i = _t('InsuranceClaim'), _t('Insurance')
+    with db.engine.connect() as conn:
+        if stats is None:
+            stats = insurer_stats(conn, [insurer_id]).get(insurer_id)
+        blocks = list(_claimant_blocks(conn, insurer_id))
+    totals = {'claims': 0, 'inserted': 0, 'updated': 0}
+    for first_user, last_user in blocks:
+        with db.engine.begin() as conn:
+            rows = conn.execute(select(
+                c.c.user_id, c.c.id, c.c.claim_date, c.c.claimed_amount, c.c.hospital_name,
+                i.c.start_date, i.c.sum_insured
+            ).select_from(c.outerjoin(i, c.c.insurance_id == i.c.id)).where(
+                c.c.insurance_company_id == insurer_id, c.c.claim_date.isnot(None),
+                and_(c.c.user_id >= first_user, c.c.user_id <= last_user)
+            ).order_by(c.c.user_id, c.c.claim_date, c.c.id)).all()
+            m = claim_matrix([tuple(row[1:]) for row in rows], stats, user_ids=[row[0] for row in rows])
+            for start in range(0, len(rows), WRITE_BATCH):
+                inserted, updated = write_scores(conn, _rows(m, start, start + WRITE_BATCH))
+                totals['inserted'] += inserted
+                totals['updated'] += updated
+            totals['claims'] += len(rows)
+    _runtime['stats'][insurer_id] = (date.today(), stats)
+    return totals
+
+
+def rescore_all(insurer_ids=None):
+    """Nightly batch: insurer statistics in one query, then a streamed re-score per insurer"""
+    db = _runtime['db']
+    with db.engine.connect() as conn:
+        all_stats = insurer_stats(conn, insurer_ids)
+    return {insurer_id: rescore_insurer(insurer_id, stats) for insurer_id, stats in sorted(all_stats.items())}
+
+
+# ==================== BENCHMARK ====================
+
+def run_benchmark(claims=1000000, claimants=None, hospitals=400, seed=7):
+    """
+    Score a synthetic insurer of ``claims`` claims in memory (windows,
+    features and scores over the claim matrix, no database) and report
+    throughput.
+    """
+    rng = np.random.default_rng(seed)
+    claimants = claimants or max(1, claims // 4)
+    start = (date.today() - timedelta(days=730)).toordinal()
+
+    build_started = time.perf_counter()
+    user = rng.integers(claimants, size=claims)
+    hospital = rng.integers(hospitals, size=claims)
+    amount = np.round(rng.lognormal(10.5, 0.8, size=claims), 2)
+    policy_start = start + rng.integers(700, size=claims)
+    day = policy_start + rng.integers(1, 365, size=claims)
+    order = np.lexsort((day, user))
+    user, hospital, amount, policy_start, day = user[order], hospital[order], amount[order], policy_start[order], day[order]
+    counts = np.bincount(hospital, minlength=hospitals)
+    sums = np.bincount(hospital, weights=amount, minlength=hospitals)
+    squares = np.bincount(hospital, weights=amount * amount, minlength=hospitals)
+    stats = _stats_from_groups([(str(h), int(counts[h]), sums[h], squares[h]) for h in range(hospitals)])
+    suspicious_ids = np.array(sorted(int(h) for h in stats.suspicious_hospitals), dtype=np.int64)
+    build_seconds = time.perf_counter() - build_started
+
+    started = time.perf_counter()
+    m = feature_matrix(
+        np.arange(1, claims + 1), day.astype(float), policy_start.astype(float), amount,
+        np.full(claims, 500000.0), np.isin(hospital, suspicious_ids),
+        window_counts(user, day, RAPID_WINDOW_DAYS), window_counts(user, day, FREQUENCY_WINDOW_DAYS), stats
+    )
+    _, levels, _ = score_matrix(m)
+    seconds = time.perf_counter() - started
+    names, level_counts = np.unique(levels, return_counts=True)
+    found = dict(zip(names.tolist(), level_counts.tolist()))
+    return {
+        'claims': claims,
+        'claimants': claimants,
+        'build_seconds': round(build_seconds, 2),
+        'score_seconds': round(seconds, 2),
+        'claims_per_second': int(claims / seconds) if seconds else None,
+        'levels': {level: found.get(level, 0) for _, level in LEVELS},
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Insurance claim fraud scoring')
+    parser.add_argument('command', choices=['rescore', 'bench'])
+    parser.add_argument('--insurer', type=int, action='append', help='Insurance company id (repeatable)')
+    parser.add_argument('--claims', type=int, default=1000000, help='Synthetic claims for bench')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        print(f"✅ Fraud scoring benchmark: {run_benchmark(args.claims)}")
+        sys.exit(0)
+
+    app, service = cli_app('services.fraud_scoring')
+
+    with app.app_context():
+        for insurer_id, totals in service.rescore_all(args.insurer).items():
+            print(f"✅ Insurer {insurer_id}: {totals}")
@@ -0,0 +1,366 @@
+"""
+Incident Cube
+Pre-aggregated workplace incident counts for MNC dashboards.
+
+``workplace_incident_cube`` holds one count per (MNC, period, department,
+incident type, severity, open/closed). A period is a week (Monday start)
+clipped to its calendar month, so a week that straddles a month boundary is
+two periods: weekly figures sum a week's periods and monthly figures sum a
+month's, both exactly, without touching ``workplace_incidents``.
+
+Cells are kept in step by a session flush hook: creating, closing, editing or
+deleting an incident, or moving an employee to another department, recounts
+the affected periods (one MNC-week-month slice each, read through the
+(mnc_id, incident_date) index) in the same transaction. Department is the
+linked employee's current department ("Unassigned" for incidents without an
+employee); a missing severity counts as "Unspecified"::
+
+    python -m services.incident_cube rebuild
+    python -m services.incident_cube verify     # compare every cell with a raw recount
+"""
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func, select, text, inspect as sa_inspect
+
+from services.runtime import ServiceRuntime, cli_app
+
+DIMENSIONS = ('department', 'incident_type', 'severity', 'status')
+PERIODS = ('week', 'month')
+CLOSED_STATUSES = ('Closed', 'Resolved')
+UNASSIGNED = 'Unassigned'
+UNSPECIFIED = 'Unspecified'
+INCIDENT_FIELDS = ('mnc_id', 'employee_id', 'incident_date', 'incident_type', 'severity', 'status')
+INCIDENT_INDEXES = (
+    ('ix_workplace_incidents_mnc_date', 'mnc_id, incident_date'),
+    ('ix_workplace_incidents_employee', 'employee_id'),
+)
+
+_runtime = ServiceRuntime()
+
+
+def init_incident_cube(db, models):
+    """Register the db and model classes and install the sync hook"""
+    _runtime.init(db, models)
+    _runtime.listen('after_flush', _collect_incident_changes, 'WorkplaceIncident', 'MNCEmployee')
+
+
+_m = _runtime.model
+_t = _runtime.table
+
+
+# ==================== PERIODS ====================
+
+def _as_date(value):
+    return value.date() if isinstance(value, datetime) else value
+
+
+def _month_start(day):
+    return day.replace(day=1)
+
+
+def _next_month(day):
+    return (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def period_of(incident_date):
+    """(period_start, week_start, month_start) of an incident date"""
+    day = _as_date(incident_date)
+    week_start = day - timedelta(days=day.weekday())
+    month_start = _month_start(day)
+    return max(week_start, month_start), week_start, month_start
+
+
+def _period_range(period_start):
+    """[start, end) datetimes covered by a period"""
+    _, week_start, month_start = period_of(period_start)
+    end = min(week_start + timedelta(days=7), _next_month(month_start))
+    return datetime.combine(period_start, datetime.min.time()), datetime.combine(end, datetime.min.time())
+
+
+# ==================== CELLS ====================
+
+def _incident_rows(conn, where):
+    i, e = _t('WorkplaceIncident'), _t('MNCEmployee')
+    return conn.execute(select(
+        i.c.mnc_id, i.c.incident_date, i.c.incident_type, i.c.severity, i.c.status, e.c.department
+    ).select_from(i.outerjoin(e, e.c.id == i.c.employee_id)).where(*where))
+
+
+def _aggregate(rows):
+    """Counter of cell keys -> incidents"""
+    counts = Counter()
+    for row in rows:
+        if row.incident_date is None:
+            continue
+        period_start, _, _ = period_of(row.incident_date)
+        counts[(row.mnc_id, period_start, row.department or UNASSIGNED, row.incident_type,
+                row.severity or UNSPECIFIED, row.status in CLOSED_STATUSES)] += 1
+    return counts
+
+
+def _cell_rows(counts, now):
+    rows = []
+    for (mnc_id, period_start, department, incident_type, severity, is_closed), count in counts.items():
+        _, week_start, month_start = period_of(period_start)
+        rows.append({
+            'mnc_id': mnc_id,
+            'period_start': period_start,
+            'week_start': week_start,
+            'month_start': month_start,
+            'department': department,
+            'incident_type': incident_type,
+            'severity': severity,
+            'is_closed': is_closed,
+            'incident_count': count,
+            'updated_at': now,
+        })
+    return rows
+
+
+def refresh_periods(conn, periods):
+    """Recount (mnc_id, period_start) slices on ``conn``; returns the cells written"""
+    if _runtime['db'] is None or not periods:
+        return 0
+    i, cube = _t('WorkplaceIncident'), _t('WorkplaceIncidentCube')
+    now = datetime.utcnow()
+    written = 0
+    for mnc_id, period_start in sorted(periods):
+        start, end = _period_range(period_start)
+        conn.execute(cube.delete().where(cube.c.mnc_id == mnc_id, cube.c.period_start == period_start))
+        counts = _aggregate(_incident_rows(conn, (
+            i.c.mnc_id == mnc_id, i.c.incident_date >= start, i.c.incident_date < end
+        )))
+        if counts:
+            conn.execute(cube.insert(), _cell_rows(counts, now))
+            written += len(counts)
+    return written
+
+
+# ==================== SYNC ====================
+
+def _old_value(obj, field):
+    history = sa_inspect(obj).attrs[field].history
+    return history.deleted[0] if history.deleted else getattr(obj, field)
+
+
+def _collect_incident_changes(session, flush_context):
+    """Recount every period whose incidents were touched by this flush"""
+    Incident, Employee = _m('WorkplaceIncident'), _m('MNCEmployee')
+    periods, moved = set(), set()
+    dirty, deleted = session.dirty, session.deleted
+    for obj in list(session.new) + list(dirty) + list(deleted):
+        if isinstance(obj, Incident):
+            state = sa_inspect(obj)
+            if obj in dirty and not any(state.attrs[f].history.has_changes() for f in INCIDENT_FIELDS):
+                continue
+            for mnc_id, incident_date in ((obj.mnc_id, obj.incident_date),
+                                          (_old_value(obj, 'mnc_id'), _old_value(obj, 'incident_date'))):
+                if mnc_id is not None and incident_date is not None:
+                    periods.add((mnc_id, period_of(incident_date)[0]))
+        elif isinstance(obj, Employee) and obj.id is not None:
+            if obj in deleted or sa_inspect(obj).attrs['department'].history.has_changes():
+                moved.add(obj.id)
+    if not (periods or moved):
+        return
+
+    conn = session.connection()
+    if moved:
+        i = _t('WorkplaceIncident')
+        for mnc_id, incident_date in conn.execute(
+            select(i.c.mnc_id, i.c.incident_date).where(i.c.employee_id.in_(moved))
+        ):
+            periods.add((mnc_id, period_of(incident_date)[0]))
+    refresh_periods(conn, periods)
+
+
+# ==================== BOOTSTRAP ====================
+
+def rebuild_cube(mnc_id=None):
+    """Recount every cell (of one MNC, or all) from the incident table"""
+    db = _runtime['db']
+    i, cube = _t('WorkplaceIncident'), _t('WorkplaceIncidentCube')
+    conn = db.session.connection()
+    where = (i.c.mnc_id == mnc_id,) if mnc_id is not None else ()
+    counts = _aggregate(_incident_rows(conn, where))
+    conn.execute(cube.delete().where(cube.c.mnc_id == mnc_id) if mnc_id is not None else cube.delete())
+    if counts:
+        conn.execute(cube.insert(), _cell_rows(counts, datetime.utcnow()))
+    db.session.commit()
+    return {'cells': len(counts), 'incidents': sum(counts.values())}
+
+
+def ensure_incident_cube():
+    """
+    Create the incident lookup indexes on existing databases and build the
+    cube when incidents predate it. Returns the rebuild summary, or None.
+    """
+    db = _runtime['db']
+    i, cube = _t('WorkplaceIncident'), _t('WorkplaceIncidentCube')
+    with db.engine.begin() as conn:
+        for name, cols in INCIDENT_INDEXES:
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON workplace_incidents ({cols})'))
+        has_incidents = conn.execute(select(i.c.id).limit(1)).first() is not None
+        has_cells = conn.execute(select(cube.c.id).limit(1)).first() is not None
+    if has_incidents and not has_cells:
+        return rebuild_cube()
+    return None
+
+
+def verify_cube(mnc_id=None):
+    """Cells whose stored count differs from a raw recount: [(key, cube, raw)]"""
+    db = _runtime['db']
+    i, cube = _t('WorkplaceIncident'), _t('WorkplaceIncidentCube')
+    conn = db.session.connection()
+    raw = _aggregate(_incident_rows(conn, (i.c.mnc_id == mnc_id,) if mnc_id is not None else ()))
+    query = select(cube.c.mnc_id, cube.c.period_start, cube.c.department, cube.c.incident_type,
+                   cube.c.severity, cube.c.is_closed, cube.c.incident_count)
+    if mnc_id is not None:
+        query = query.where(cube.c.mnc_id == mnc_id)
+    stored = Counter()
+    for row in conn.execute(query):
+        stored[tuple(row[:6])] += row.incident_count
+    return sorted(
+        ((key, stored.get(key, 0), raw.get(key, 0)) for key in set(stored) | set(raw)
+         if stored.get(key, 0) != raw.get(key, 0)),
+        key=lambda item: tuple(str(part) for part in item[0])
+    )
+
+
+# ==================== QUERIES ====================
+
+def _dimension_column(name):
+    Cube = _m('WorkplaceIncidentCube')
+    if name == 'status':
+        return Cube.is_closed
+    if name in PERIODS:
+        return Cube.week_start if name == 'week' else Cube.month_start
+    return getattr(Cube, name)
+
+
+def _label(name, value):
+    if name == 'status':
+        return 'closed' if value else 'open'
+    if name in PERIODS:
+        return value.isoformat()
+    return value
+
+
+def _filtered(mnc_id, filters=None, start=None, end=None):
+    """Cube query for one MNC narrowed by dimension values and a [start, end) date range"""
+    Cube = _m('WorkplaceIncidentCube')
+    query = _runtime['db'].session.query(Cube).filter(Cube.mnc_id == mnc_id)
+    for name, value in (filters or {}).items():
+        if name not in DIMENSIONS or value in (None, ''):
+            continue
+        if name == 'status':
+            query = query.filter(Cube.is_closed.is_(value == 'closed'))
+        else:
+            query = query.filter(getattr(Cube, name) == value)
+    if start is not None:
+        query = query.filter(Cube.period_start >= start)
+    if end is not None:
+        query = query.filter(Cube.period_start < end)
+    return query
+
+
+def drill_down(mnc_id, group_by=(), filters=None, start=None, end=None):
+    """
+    Incident counts grouped by any of DIMENSIONS and 'week'/'month', narrowed by
+    ``filters`` ({dimension: value}, status 'open'/'closed') and a [start, end)
+    date range (whole periods: a period counts when it starts inside the range).
+    """
+    Cube = _m('WorkplaceIncidentCube')
+    group_by = [name for name in group_by if name in DIMENSIONS + PERIODS]
+    columns = [_dimension_column(name) for name in group_by]
+    query = _filtered(mnc_id, filters, start, end).with_entities(*columns, func.sum(Cube.incident_count))
+    if columns:
+        query = query.group_by(*columns).order_by(*columns)
+    cells = []
+    for row in query:
+        cell = {name: _label(name, value) for name, value in zip(group_by, row)}
+        cell['count'] = int(row[-1] or 0)
+        cells.append(cell)
+    return cells
+
+
+def incident_totals(mnc_id):
+    """Total, open and closed incidents plus per-severity and per-type counts"""
+    totals = {'total': 0, 'open': 0, 'closed': 0, 'by_severity': {}, 'by_type': {}}
+    for cell in drill_down(mnc_id, ('status', 'severity', 'incident_type')):
+        count = cell['count']
+        totals['total'] += count
+        totals[cell['status']] += count
+        totals['by_severity'][cell['severity']] = totals['by_severity'].get(cell['severity'], 0) + count
+        totals['by_type'][cell['incident_type']] = totals['by_type'].get(cell['incident_type'], 0) + count
+    return totals
+
+
+def _change(current, previous):
+    return {
+        'change': current - previous,
+        'change_percent': round((current - previous) / previous * 100, 1) if previous else None,
+    }
+
+
+def month_comparison(mnc_id, dimension=None, filters=None, today=None):
+    """This month against last month, overall and (optionally) per value of one dimension"""
+    this_month = _month_start(today or date.today())
+    last_month = _month_start(this_month - timedelta(days=1))
+    group_by = ('month', dimension) if dimension in DIMENSIONS else ('month',)
+    current, previous = Counter(), Counter()
+    for cell in drill_down(mnc_id, group_by, filters, start=last_month, end=_next_month(this_month)):
+        bucket = current if cell['month'] == this_month.isoformat() else previous
+        bucket[cell.get(dimension)] += cell['count']
+    result = {
+        'this_month': {'start': this_month.isoformat(), 'count': sum(current.values())},
+        'last_month': {'start': last_month.isoformat(), 'count': sum(previous.values())},
+    }
+    result.update(_change(result['this_month']['count'], result['last_month']['count']))
+    if dimension in DIMENSIONS:
+        result['dimension'] = dimension
+        result['breakdown'] = [
+            dict({'value': value, 'this_month': current[value], 'last_month': previous[value]},
+                 **_change(current[value], previous[value]))
+            for value in sorted(set(current) | set(previous), key=str)
+        ]
+    return result
+
+
+def weekly_trend(mnc_id, weeks=12, filters=None, today=None):
+    """Incidents per week for the last ``weeks`` weeks (including empty weeks)"""
+    today = today or date.today()
+    current_week = today - timedelta(days=today.weekday())
+    first_week = current_week - timedelta(weeks=weeks - 1)
+    counts = {cell['week']: cell['count'] for cell in drill_down(
+        mnc_id, ('week',), filters, start=first_week, end=current_week + timedelta(days=7)
+    )}
+    series = []
+    for offset in range(weeks):
+        week = (first_week + timedelta(weeks=offset)).isoformat()
+        series.append({'week_start': week, 'count': counts.get(week, 0)})
+    return series
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='Workplace incident analytics cube')
+    parser.add_argument('command', choices=['rebuild', 'verify'])
+    parser.add_argument('--mnc', type=int, help='Limit to one MNC user id')
+    args = parser.parse_args()
+
+    app, service = cli_app('services.incident_cube')
+
+    with app.app_context():
+        if args.command == 'rebuild':
+            print(f"✅ Incident cube rebuilt: {service.rebuild_cube(args.mnc)}")
+        else:
+            mismatches = service.verify_cube(args.mnc)
+            for key, stored, raw in mismatches[:20]:
+                print(f"   {key}: cube={stored} raw={raw}")
+            if mismatches:
+                print(f"❌ Incident cube: {len(mismatches)} cell(s) differ from the incident table")
+                sys.exit(1)
+            print("✅ Incident cube matches the incident table")
@@ -0,0 +1,456 @@
+"""
+Insurer Claims
+Insurer foreign keys on policies/claims and the per-insurer claim read model.
+
+``insurances.insurance_company_id`` and ``insurance_claims.insurance_company_id``
+link policies and claims to ``insurance_companies`` by an indexed integer key,
+so insurer dashboards no longer match ``Insurance.provider_name`` against the
+company name on every query. New policies are linked from their provider name
+(trimmed, case-insensitive) when the insurer did not set the key itself; claims
+inherit the key of their policy; registering an insurer links the policies that
+already name it.
+
+``insurer_claims`` is a denormalised copy of each claim (insurer, status,
+dates, amounts, policy number, client name, document count) kept in step by a
+session flush hook, so a claim listing is one index range scan on
+(insurance_company_id, submitted_day, claim_pk).
+
+claims_page() serves the insurer claim queue: keyset (cursor) pages newest
+submission first, with SLA hours remaining computed in SQL from the stored
+day number and the insurer's sla_hours, and breached / at-risk filters that
+turn into a range on the same index.
+
+The columns are added and backfilled on startup when missing; the same
+migration can be run (or re-run) by hand::
+
+    python -m services.insurer_claims migrate
+    python -m services.insurer_claims rebuild
+    python -m services.insurer_claims bench [--company ID]
+"""
+import math
+import time
+from datetime import datetime
+
+from sqlalchemy import and_, case, func, select, inspect as sa_inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from services.pagination import keyset_paginate, SortKey
+from services.runtime import ServiceRuntime, cli_app
+
+LINKED_TABLES = ('insurances', 'insurance_claims')
+INDEX_NAMES = {
+    'insurances': 'ix_insurances_insurance_company_id',
+    'insurance_claims': 'ix_insurance_claims_insurance_company_id',
+}
+
+CLAIM_FIELDS = (
+    'insurance_id', 'claim_id', 'claim_date', 'claim_type', 'treatment_type', 'diagnosis', 'hospital_name',
+    'total_bill_amount', 'claimed_amount', 'approved_amount', 'status', 'submitted_date', 'processed_date',
+    'settled_date', 'insurance_company_id', 'user_id',
+)
+POLICY_FIELDS = ('policy_number', 'insurance_company_id')
+
+OPEN_STATUSES = ('Submitted', 'Under Review')  # Statuses the SLA clock runs for
+DEFAULT_SLA_HOURS = 48
+AT_RISK_HOURS = 24  # Matches the dashboard's amber band
+SLA_FILTERS = ('breached', 'at_risk', 'within')
+PAGE_SIZE = 50
+
+_runtime = ServiceRuntime()
+
+
+def init_insurer_claims(db, models):
+    """Register the db and model classes and install the link/sync hooks"""
+    _runtime.init(db, models)
+    _runtime.listen('before_flush', _link_insurers, 'Insurance', 'InsuranceClaim')
+    _runtime.listen('after_flush', _collect_claim_changes,
+                    'InsuranceClaim', 'Insurance', 'ClaimDocument', 'InsuranceCompany', 'User')
+
+
+_m = _runtime.model
+_t = _runtime.table
+
+
+def normalise_insurer(name):
+    return (name or '').strip().lower()
+
+
+# ==================== LINKING ====================
+
+def insurer_id_for(session, provider_name):
+    """Insurance company whose name matches a policy's provider name, or None"""
+    key = normalise_insurer(provider_name)
+    if not key:
+        return None
+    company = _m('InsuranceCompany')
+    with session.no_autoflush:
+        return session.query(company.id).filter(
+            func.lower(func.trim(company.company_name)) == key
+        ).order_by(company.id).limit(1).scalar()
+
+
+def _changed(obj, field):
+    return sa_inspect(obj).attrs[field].history.has_changes()
+
+
+def _link_insurers(session, flush_context, instances):
+    """Set insurance_company_id on new/edited policies and claims before they are written"""
+    Insurance, InsuranceClaim = _m('Insurance'), _m('InsuranceClaim')
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, Insurance):
+            if obj in session.new and obj.insurance_company_id is None or (
+                    obj not in session.new and _changed(obj, 'provider_name') and not _changed(obj, 'insurance_company_id')):
+                obj.insurance_company_id = insurer_id_for(session, obj.provider_name)
+        elif isinstance(obj, InsuranceClaim):
+            if obj in session.new and obj.insurance_company_id is None or (
+                    obj not in session.new and _changed(obj, 'insurance_id')):
+                with session.no_autoflush:
+                    policy = obj.insurance or (session.get(Insurance, obj.insurance_id) if obj.insurance_id else None)
+                obj.insurance_company_id = policy.insurance_company_id if policy else None
+
+
+# ==================== READ MODEL ====================
+
+def _claim_rows(conn, claim_pks):
+    c, i, u, d = _t('InsuranceClaim'), _t('Insurance'), _t('User'), _t('ClaimDocument')
+    documents = select(func.count(d.c.id)).where(d.c.claim_id == c.c.id).scalar_subquery()
+    return conn.execute(select(
+        c.c.id, c.c.insurance_company_id, c.c.claim_id, c.c.insurance_id, i.c.policy_number, c.c.user_id,
+        u.c.full_name, u.c.uid, c.c.hospital_name, c.c.claim_type, c.c.treatment_type, c.c.diagnosis,
+        c.c.total_bill_amount, c.c.claimed_amount, c.c.approved_amount, c.c.status, c.c.claim_date,
+        c.c.submitted_date, c.c.processed_date, c.c.settled_date, documents.label('document_count')
+    ).select_from(
+        c.outerjoin(i, c.c.insurance_id == i.c.id).outerjoin(u, c.c.user_id == u.c.id)
+    ).where(c.c.id.in_(claim_pks))).all()
+
+
+def _row_values(row):
+    settlement_days = None
+    if row.settled_date and row.submitted_date:
+        settlement_days = (row.settled_date - row.submitted_date).days
+    queued_on = row.submitted_date or row.claim_date
+    return {
+        'claim_pk': row.id,
+        'insurance_company_id': row.insurance_company_id,
+        'claim_id': row.claim_id,
+        'policy_id': row.insurance_id,
+        'policy_number': row.policy_number,
+        'user_id': row.user_id,
+        'client_name': row.full_name,
+        'client_uid': row.uid,
+        'hospital_name': row.hospital_name,
+        'claim_type': row.claim_type,
+        'treatment_type': row.treatment_type,
+        'diagnosis': row.diagnosis,
+        'total_bill_amount': row.total_bill_amount,
+        'claimed_amount': row.claimed_amount,
+        'approved_amount': row.approved_amount,
+        'status': row.status,
+        'claim_date': row.claim_date,
+        'submitted_date': row.submitted_date,
+        'processed_date': row.processed_date,
+        'settled_date': row.settled_date,
+        'submitted_day': queued_on.toordinal() if queued_on else 0,
+        'settlement_days': settlement_days,
+        'document_count': row.document_count or 0,
+    }
+
+
+def _sync_claims(conn, claim_pks):
+    """Upsert read rows for these claims; drop rows whose claim no longer exists"""
+    table = _t('InsurerClaim')
+    claim_pks = list(claim_pks)
+    if not claim_pks:
+        return
+    rows = _claim_rows(conn, claim_pks)
+    found = {row.id for row in rows}
+    gone = [pk for pk in claim_pks if pk not in found]
+    if gone:
+        conn.execute(table.delete().where(table.c.claim_pk.in_(gone)))
+    for row in rows:
+        values = _row_values(row)
+        values['updated_at'] = datetime.utcnow()
+        if conn.execute(table.update().where(table.c.claim_pk == row.id).values(**values)).rowcount:
+            continue
+        try:
+            with conn.begin_nested():
+                conn.execute(table.insert().values(**values))
+        except IntegrityError:
+            conn.execute(table.update().where(table.c.claim_pk == row.id).values(**values))
+
+
+def _collect_claim_changes(session, flush_context):
+    """Resync read rows for claims, policies, documents and clients touched by this flush"""
+    Insurance, InsuranceClaim = _m('Insurance'), _m('InsuranceClaim')
+    ClaimDocument, InsuranceCompany, User = _m('ClaimDocument'), _m('InsuranceCompany'), _m('User')
+
+    claim_pks, policy_ids, companies, clients = set(), set(), set(), set()
+    for obj in list(session.new) + list(session.dirty):
+        is_new = obj in session.new
+        if isinstance(obj, InsuranceClaim):
+            if is_new or any(_changed(obj, f) for f in CLAIM_FIELDS):
+                claim_pks.add(obj.id)
+        elif isinstance(obj, Insurance) and not is_new:
+            if any(_changed(obj, f) for f in POLICY_FIELDS):
+                policy_ids.add(obj.id)
+        elif isinstance(obj, ClaimDocument):
+            if is_new or _changed(obj, 'claim_id'):
+                claim_pks.add(obj.claim_id)
+        elif isinstance(obj, InsuranceCompany):
+            if is_new or _changed(obj, 'company_name'):
+                companies.add(obj.id)
+        elif isinstance(obj, User) and not is_new:
+            if _changed(obj, 'full_name') or _changed(obj, 'uid'):
+                clients.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, InsuranceClaim):
+            claim_pks.add(obj.id)
+        elif isinstance(obj, ClaimDocument):
+            claim_pks.add(obj.claim_id)
+
+    if not (claim_pks or policy_ids or companies or clients):
+        return
+    conn = session.connection()
+    policies, claims = _t('Insurance'), _t('InsuranceClaim')
+
+    # A newly registered/renamed insurer picks up the unlinked policies that name it
+    for company_id in companies:
+        name = conn.execute(select(_t('InsuranceCompany').c.company_name).where(
+            _t('InsuranceCompany').c.id == company_id
+        )).scalar()
+        key = normalise_insurer(name)
+        if not key:
+            continue
+        linked = conn.execute(select(policies.c.id).where(
+            policies.c.insurance_company_id.is_(None),
+            func.lower(func.trim(policies.c.provider_name)) == key
+        )).scalars().all()
+        if linked:
+            conn.execute(policies.update().where(policies.c.id.in_(linked)).values(insurance_company_id=company_id))
+            policy_ids.update(linked)
+
+    # Claims follow their policy's insurer
+    if policy_ids:
+        for policy_id in policy_ids:
+            company_id = conn.execute(select(policies.c.insurance_company_id).where(policies.c.id == policy_id)).scalar()
+            conn.execute(claims.update().where(claims.c.insurance_id == policy_id).values(insurance_company_id=company_id))
+        claim_pks.update(conn.execute(select(claims.c.id).where(claims.c.insurance_id.in_(policy_ids))).scalars())
+
+    claim_pks.discard(None)
+    _sync_claims(conn, claim_pks)
+
+    if clients:
+        u, table = _t('User'), _t('InsurerClaim')
+        for user_id in clients:
+            row = conn.execute(select(u.c.full_name, u.c.uid).where(u.c.id == user_id)).first()
+            if row is not None:
+                conn.execute(table.update().where(table.c.user_id == user_id).values(
+                    client_name=row.full_name, client_uid=row.uid
+                ))
+
+
+# ==================== QUERIES ====================
+
+def _clock_hours(now):
+    """``now`` in hours on the submitted_day * 24 scale"""
+    midnight = datetime.combine(now.date(), datetime.min.time())
+    return now.toordinal() * 24 + (now - midnight).total_seconds() / 3600
+
+
+def sla_remaining_expr(sla_hours, now):
+    """SQL hours left before the SLA deadline; NULL for claims whose clock is not running"""
+    row = _m('InsurerClaim')
+    remaining = sla_hours - (_clock_hours(now) - row.submitted_day * 24)
+    return case(
+        (and_(row.status.in_(OPEN_STATUSES), row.submitted_date.isnot(None)), remaining),
+        else_=None
+    )
+
+
+def _sla_condition(sla, sla_hours, now):
+    """
+    Deadline is submitted_day * 24 + sla_hours, so each band is a range on
+    submitted_day and stays on the (insurer, status, submitted_day) index.
+    """
+    row = _m('InsurerClaim')
+    clock = _clock_hours(now)
+    breached_through = math.floor((clock - sla_hours) / 24)
+    at_risk_through = math.floor((clock - sla_hours + AT_RISK_HOURS) / 24)
+    running = and_(row.status.in_(OPEN_STATUSES), row.submitted_date.isnot(None))
+    if sla == 'breached':
+        return and_(running, row.submitted_day <= breached_through)
+    if sla == 'at_risk':
+        return and_(running, row.submitted_day > breached_through, row.submitted_day <= at_risk_through)
+    return and_(running, row.submitted_day > breached_through)
+
+
+def claims_page(company, status=None, date_from=None, date_to=None, sla=None, cursor=None,
+                per_page=PAGE_SIZE, count_mode='none', now=None):
+    """
+    One keyset page of an insurer's claims, newest submission first.
+    Items are (InsurerClaim, sla_remaining_hours) rows.
+    Raises InvalidCursor for a bad cursor and ValueError for an unknown SLA band.
+    """
+    if sla and sla not in SLA_FILTERS:
+        raise ValueError(f"sla must be one of {', '.join(SLA_FILTERS)}")
+    db = _runtime['db']
+    row = _m('InsurerClaim')
+    now = now or datetime.utcnow()
+    sla_hours = company.sla_hours or DEFAULT_SLA_HOURS
+
+    query = db.session.query(row, sla_remaining_expr(sla_hours, now).label('sla_remaining_hours')).filter(
+        row.insurance_company_id == company.id
+    )
+    if status:
+        query = query.filter(row.status == status)
+    if date_from:
+        query = query.filter(row.claim_date >= date_from)
+    if date_to:
+        query = query.filter(row.claim_date <= date_to)
+    if sla:
+        query = query.filter(_sla_condition(sla, sla_hours, now))
+
+    sort_keys = [
+        SortKey(row.submitted_day, desc=True, value=lambda r: r.InsurerClaim.submitted_day),
+        SortKey(row.claim_pk, desc=True, value=lambda r: r.InsurerClaim.claim_pk),
+    ]
+    return keyset_paginate(query, sort_keys, cursor=cursor, per_page=per_page, count_mode=count_mode)
+
+
+def claim_dict(claim, sla_remaining_hours=None):
+    return {
+        'claim_id': claim.claim_id,
+        'policy_number': claim.policy_number,
+        'client_name': claim.client_name or 'Unknown',
+        'hospital_name': claim.hospital_name,
+        'claim_type': claim.claim_type,
+        'claimed_amount': claim.claimed_amount,
+        'approved_amount': claim.approved_amount,
+        'status': claim.status,
+        'submission_date': claim.submitted_date.strftime('%Y-%m-%d') if claim.submitted_date else None,
+        'assigned_reviewer': None,  # Reviews feature not implemented yet
+        'sla_remaining_hours': round(sla_remaining_hours, 1) if sla_remaining_hours is not None else None,
+    }
+
+
+def bench_first_page(company, repeat=20):
+    """Median milliseconds to fetch the first claim page, unfiltered and per SLA band"""
+    timings = {}
+    for sla in (None,) + SLA_FILTERS:
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            page = claims_page(company, sla=sla)
+            [claim_dict(claim, remaining) for claim, remaining in page.items]
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        timings[sla or 'all'] = {'rows': len(page.items), 'median_ms': round(samples[len(samples) // 2], 2)}
+    return timings
+
+
+# ==================== MIGRATION ====================
+
+def _missing_columns(engine):
+    inspector = sa_inspect(engine)
+    tables = set(inspector.get_table_names())
+    return [
+        name for name in LINKED_TABLES
+        if name in tables and 'insurance_company_id' not in {c['name'] for c in inspector.get_columns(name)}
+    ]
+
+
+def backfill_links(conn):
+    """Link unlinked policies by provider name, then copy each policy's insurer onto its claims"""
+    policies = conn.execute(text("""
+        UPDATE insurances SET insurance_company_id = (
+            SELECT ic.id FROM insurance_companies ic
+            WHERE lower(trim(ic.company_name)) = lower(trim(insurances.provider_name))
+            ORDER BY ic.id LIMIT 1
+        )
+        WHERE insurance_company_id IS NULL
+    """)).rowcount
+    claims = conn.execute(text("""
+        UPDATE insurance_claims SET insurance_company_id = (
+            SELECT i.insurance_company_id FROM insurances i WHERE i.id = insurance_claims.insurance_id
+        )
+        WHERE insurance_company_id IS NULL
+           OR insurance_company_id <> (
+               SELECT i.insurance_company_id FROM insurances i WHERE i.id = insurance_claims.insurance_id
+           )
+    """)).rowcount
+    return {'policies_checked': policies, 'claims_checked': claims}
+
+
+def rebuild_read_model():
+    """Recreate every insurer_claims row from the claims table"""
+    db = _runtime['db']
+    conn = db.session.connection()
+    conn.execute(_t('InsurerClaim').delete())
+    pks = conn.execute(select(_t('InsuranceClaim').c.id)).scalars().all()
+    for start in range(0, len(pks), 500):
+        _sync_claims(conn, pks[start:start + 500])
+    db.session.commit()
+    return {'claims': len(pks)}
+
+
+def _read_model_outdated(engine):
+    inspector = sa_inspect(engine)
+    if 'insurer_claims' not in inspector.get_table_names():
+        return False
+    present = {c['name'] for c in inspector.get_columns('insurer_claims')}
+    return not {c.name for c in _t('InsurerClaim').columns} <= present
+
+
+def migrate_insurer_links(force=False):
+    """Add the insurer key columns/indexes when missing, backfill them and fill the read model"""
+    db = _runtime['db']
+    if _read_model_outdated(db.engine):
+        # Derived data only: recreate with the current columns/indexes and refill
+        _t('InsurerClaim').drop(db.engine)
+        _t('InsurerClaim').create(db.engine)
+        force = True
+    missing = _missing_columns(db.engine)
+    if not (missing or force):
+        if db.session.query(_m('InsurerClaim').id).first() is None and db.session.query(_m('InsuranceClaim').id).first() is not None:
+            return {'read_model': rebuild_read_model()}  # Columns exist but the read model was never filled
+        return None
+    with db.engine.begin() as conn:
+        for name in missing:
+            conn.execute(text(
+                f'ALTER TABLE {name} ADD COLUMN insurance_company_id INTEGER REFERENCES insurance_companies(id)'
+            ))
+        for name in LINKED_TABLES:
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS {INDEX_NAMES[name]} ON {name} (insurance_company_id)'))
+        result = backfill_links(conn)
+    result['columns_added'] = missing
+    result['read_model'] = rebuild_read_model()
+    return result
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Insurer link migration and claim read model')
+    parser.add_argument('command', choices=['migrate', 'rebuild', 'bench'])
+    parser.add_argument('--company', type=int, help='Insurance company id for bench (default: most claims)')
+    args = parser.parse_args()
+
+    app, service = cli_app('services.insurer_claims')
+
+    with app.app_context():
+        if args.command == 'migrate':
+            print(f"✅ Insurer links migrated: {service.migrate_insurer_links(force=True)}")
+        elif args.command == 'rebuild':
+            print(f"✅ Read model rebuilt: {service.rebuild_read_model()}")
+        else:
+            company_id = args.company
+            if company_id is None:
+                row = service._m('InsurerClaim')
+                company_id = row.query.with_entities(row.insurance_company_id).filter(
+                    row.insurance_company_id.isnot(None)
+                ).group_by(row.insurance_company_id).order_by(func.count(row.id).desc()).limit(1).scalar()
+            company = service._runtime['db'].session.get(service._m('InsuranceCompany'), company_id) if company_id else None
+            if company is None:
+                parser.error('no insurance company with claims found')
+            for band, result in service.bench_first_page(company).items():
+                print(f"✅ {band:>9}: {result['rows']} rows, median {result['median_ms']} ms")
@@ -0,0 +1,428 @@
+"""
+MNC Directory
+Per-employee summary rows behind the MNC employee directory, health trends,
+compliance report and dashboard counts.
+
+``mnc_employee_summaries`` holds one row per MNC employee: directory fields,
+the linked client's UID, gender and date of birth, the latest valid fitness
+assessment (status, review and certificate dates) and vaccination figures
+(compliance records against the MNC's active policies, completed doses and
+verified uploads). Rows are kept in step by a session flush hook: saving an
+employee, a fitness assessment, a vaccination, an MNC upload, a compliance
+row or a policy, or editing a linked client's profile, re-summarises the
+affected employees in the same transaction. The compliance engine's bulk
+writes refresh the rows themselves (see services/vaccination_compliance.py).
+
+Age is never stored: bands and the directory age come from ``dob`` /
+``birth_year`` at query time, and certificate/review dates are compared
+with today in SQL, so nothing goes stale as days pass::
+
+    python -m services.mnc_directory rebuild
+"""
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, case, func, or_, select, inspect as sa_inspect
+
+from services.pagination import keyset_paginate, SortKey
+from services.runtime import ServiceRuntime, cli_app
+from services.vaccination_compliance import policy_spec, applies_to
+
+FITNESS_STATUSES = ('Fit', 'Fit with Restrictions', 'Temporarily Unfit', 'Review Required')
+AGE_BANDS = ((18, 25, '18-25'), (26, 35, '26-35'), (36, 45, '36-45'), (46, 55, '46-55'))
+AGE_OTHER = '56+'  # Everything outside the bands, as the trends chart always counted it
+LEGACY_COMPLIANT_DOSES = 3  # Trends fallback when the MNC has no active policies
+REPORT_COMPLIANT_DOSES = 2  # Compliance report fallback when no compliance row is Compliant
+CERT_EXPIRING_DAYS = 30
+IN_CHUNK = 500
+USER_FIELDS = ('uid', 'gender', 'dob')
+EMPLOYEE_FIELDS = ('employee_id', 'full_name', 'email', 'department', 'job_role', 'verification_status',
+                   'client_id', 'mnc_id')
+
+_runtime = ServiceRuntime()
+
+
+def init_mnc_directory(db, models):
+    """Register the db and model classes and install the sync hook"""
+    _runtime.init(db, models)
+    _runtime.listen('after_flush', _collect_directory_changes,
+                    'MNCEmployee', 'User', 'FitnessAssessment', 'Vaccination', 'MNCVaccinationRecord',
+                    'EmployeeVaccinationCompliance', 'MNCVaccinationPolicy')
+
+
+_m = _runtime.model
+_t = _runtime.table
+
+
+def _chunks(values):
+    values = list(values)
+    for start in range(0, len(values), IN_CHUNK):
+        yield values[start:start + IN_CHUNK]
+
+
+# ==================== SUMMARY ====================
+
+def _vaccination_band(row, policies):
+    """Trends bucket: compliant / partial / non_compliant (None when no client account)"""
+    if not row['client_linked']:
+        return None
+    if policies:
+        if not row['compliance_records']:
+            return 'non_compliant'
+        if row['policies_compliant'] == row['policies_applicable'] and row['policies_applicable'] > 0:
+            return 'compliant'
+        if row['policies_compliant'] > 0 or row['policies_partial'] > 0:
+            return 'partial'
+        return 'non_compliant'
+    total = row['completed_vaccinations'] + row['verified_uploads']
+    if total >= LEGACY_COMPLIANT_DOSES:
+        return 'compliant'
+    return 'partial' if total > 0 else 'non_compliant'
+
+
+def refresh_employees(conn, employee_ids=None, mnc_ids=None):
+    """Re-summarise employees (by id and/or every employee of some MNCs) on ``conn``"""
+    if _runtime['db'] is None:
+        return 0
+    e, u = _t('MNCEmployee'), _t('User')
+    table = _t('MNCEmployeeSummary')
+    ids = set(employee_ids or ())
+    for chunk in _chunks(mnc_ids or ()):
+        ids.update(conn.execute(select(e.c.id).where(e.c.mnc_id.in_(chunk))).scalars())
+    if not ids:
+        return 0
+
+    now = datetime.utcnow()
+    written = 0
+    for chunk in _chunks(sorted(ids)):
+        employees = conn.execute(select(
+            e.c.id, e.c.mnc_id, e.c.employee_id, e.c.full_name, e.c.email, e.c.department, e.c.job_role,
+            e.c.verification_status, e.c.client_id, u.c.id.label('user_pk'), u.c.uid, u.c.gender, u.c.dob
+        ).select_from(e.outerjoin(u, u.c.id == e.c.client_id)).where(e.c.id.in_(chunk))).all()
+        conn.execute(table.delete().where(table.c.employee_pk.in_(chunk)))
+        if not employees:
+            continue
+
+        client_ids = {row.client_id for row in employees if row.client_id}
+        fitness = _latest_fitness(conn, client_ids)
+        doses = _completed_doses(conn, client_ids)
+        uploads = _verified_uploads(conn, [row.id for row in employees])
+        compliance = _compliance_rows(conn, [row.id for row in employees])
+        policies = _active_policies(conn, {row.mnc_id for row in employees})
+
+        rows = []
+        for emp in employees:
+            mnc_policies = policies.get(emp.mnc_id, [])
+            active_ids = {p.id for p in mnc_policies}
+            records = compliance.get(emp.id, [])
+            active_records = [status for policy_id, status in records if policy_id in active_ids]
+            assessment = fitness.get(emp.client_id) if emp.client_id else None
+            row = {
+                'employee_pk': emp.id,
+                'mnc_id': emp.mnc_id,
+                'employee_code': emp.employee_id,
+                'full_name': emp.full_name,
+                'email': emp.email,
+                'department': emp.department,
+                'job_role': emp.job_role,
+                'verification_status': emp.verification_status,
+                'client_id': emp.client_id,
+                'client_linked': emp.user_pk is not None,
+                'uid': emp.uid,
+                'gender': emp.gender,
+                'dob': emp.dob,
+                'birth_year': emp.dob.year if emp.dob else None,
+                'fitness_status': assessment.fitness_status if assessment else None,
+                'last_review_date': assessment.assessment_date if assessment else None,
+                'certificate_expiry_date': assessment.certificate_expiry_date if assessment else None,
+                'next_review_date': assessment.next_review_date if assessment else None,
+                'policies_active': len(mnc_policies),
+                'policies_applicable': sum(1 for p in mnc_policies if applies_to(p, emp.department, emp.job_role)),
+                'policies_compliant': sum(1 for status in active_records if status == 'Compliant'),
+                'policies_partial': sum(1 for status in active_records if status == 'Partially Compliant'),
+                'compliance_records': len(active_records),
+                'compliant_records': sum(1 for _, status in records if status == 'Compliant'),
+                'completed_vaccinations': doses.get(emp.client_id, 0) if emp.client_id else 0,
+                'verified_uploads': uploads.get(emp.id, 0),
+                'updated_at': now,
+            }
+            # Directory figure: compliant records over the MNC's active policies
+            row['compliance_percent'] = (
+                round(row['compliant_records'] / len(mnc_policies) * 100, 1) if mnc_policies else 0
+            )
+            row['vaccination_band'] = _vaccination_band(row, mnc_policies)
+            rows.append(row)
+        conn.execute(table.insert(), rows)
+        written += len(rows)
+    return written
+
+
+def _latest_fitness(conn, client_ids):
+    f = _t('FitnessAssessment')
+    latest = {}
+    for chunk in _chunks(client_ids):
+        for row in conn.execute(select(
+            f.c.client_id, f.c.fitness_status, f.c.assessment_date, f.c.certificate_expiry_date, f.c.next_review_date
+        ).where(f.c.client_id.in_(chunk), f.c.is_valid.is_(True)).order_by(
+            f.c.client_id, f.c.assessment_date.desc(), f.c.id.desc()
+        )):
+            latest.setdefault(row.client_id, row)
+    return latest
+
+
+def _completed_doses(conn, client_ids):
+    v = _t('Vaccination')
+    counts = {}
+    for chunk in _chunks(client_ids):
+        counts.update(conn.execute(select(v.c.user_id, func.count(v.c.id)).where(
+            v.c.user_id.in_(chunk), v.c.status == 'Completed'
+        ).group_by(v.c.user_id)).all())
+    return counts
+
+
+def _verified_uploads(conn, employee_ids):
+    r = _t('MNCVaccinationRecord')
+    return dict(conn.execute(select(r.c.employee_id, func.count(r.c.id)).where(
+        r.c.employee_id.in_(employee_ids), r.c.verification_status == 'Verified'
+    ).group_by(r.c.employee_id)).all())
+
+
+def _compliance_rows(conn, employee_ids):
+    c = _t('EmployeeVaccinationCompliance')
+    rows = {}
+    for employee_id, policy_id, status in conn.execute(select(
+        c.c.employee_id, c.c.policy_id, c.c.compliance_status
+    ).where(c.c.employee_id.in_(employee_ids))):
+        rows.setdefault(employee_id, []).append((policy_id, status))
+    return rows
+
+
+def _active_policies(conn, mnc_ids):
+    p = _t('MNCVaccinationPolicy')
+    policies = {}
+    for row in conn.execute(select(
+        p.c.mnc_id, p.c.id, p.c.vaccine_name, p.c.required_doses, p.c.compliance_deadline,
+        p.c.applies_to_all, p.c.specific_departments, p.c.specific_roles
+    ).where(p.c.mnc_id.in_(mnc_ids), p.c.is_active.is_(True))):
+        policies.setdefault(row.mnc_id, []).append(policy_spec(row))
+    return policies
+
+
+# ==================== SYNC ====================
+
+def _changed(obj, fields):
+    state = sa_inspect(obj)
+    return any(state.attrs[field].history.has_changes() for field in fields)
+
+
+def _collect_directory_changes(session, flush_context):
+    """Re-summarise every employee whose sources were touched by this flush"""
+    models = _runtime['models']
+    Employee, User, Fitness = models['MNCEmployee'], models['User'], models['FitnessAssessment']
+    Vaccination, Upload = models['Vaccination'], models['MNCVaccinationRecord']
+    Compliance, Policy = models['EmployeeVaccinationCompliance'], models['MNCVaccinationPolicy']
+
+    employees, clients, mncs = set(), set(), set()
+    dirty = session.dirty
+    for obj in list(session.new) + list(dirty) + list(session.deleted):
+        if isinstance(obj, Employee):
+            if obj in dirty and not _changed(obj, EMPLOYEE_FIELDS):
+                continue
+            employees.add(obj.id)
+        elif isinstance(obj, User):
+            if obj in dirty and _changed(obj, USER_FIELDS):
+                clients.add(obj.id)
+        elif isinstance(obj, (Fitness, Vaccination)):
+            clients.add(obj.client_id if isinstance(obj, Fitness) else obj.user_id)
+        elif isinstance(obj, (Upload, Compliance)):
+            employees.add(obj.employee_id)
+        elif isinstance(obj, Policy):
+            mncs.add(obj.mnc_id)
+    employees.discard(None)
+    clients.discard(None)
+    if not (employees or clients or mncs):
+        return
+
+    conn = session.connection()
+    e = _t('MNCEmployee')
+    for chunk in _chunks(clients):
+        employees.update(conn.execute(select(e.c.id).where(e.c.client_id.in_(chunk))).scalars())
+    refresh_employees(conn, employees, mncs)
+
+
+# ==================== BOOTSTRAP ====================
+
+def rebuild_directory(only_missing=False):
+    """Summarise every MNC employee (or only those without a row yet)"""
+    db = _runtime['db']
+    Employee, Summary = _m('MNCEmployee'), _m('MNCEmployeeSummary')
+    query = db.session.query(Employee.id)
+    if only_missing:
+        query = query.filter(~db.session.query(Summary.employee_pk).filter(
+            Summary.employee_pk == Employee.id
+        ).exists())
+    ids = [i for (i,) in query]
+    written = refresh_employees(db.session.connection(), ids) if ids else 0
+    if not only_missing:
+        # Rows left behind by employees removed outside the ORM
+        table = _t('MNCEmployeeSummary')
+        db.session.connection().execute(table.delete().where(
+            table.c.employee_pk.notin_(select(_t('MNCEmployee').c.id))
+        ))
+    db.session.commit()
+    return {'employees': written}
+
+
+def ensure_directory():
+    """Summarise employees recorded before the summary table existed (once per process)"""
+    _runtime.once('directory', lambda: rebuild_directory(only_missing=True))
+
+
+# ==================== QUERIES ====================
+
+def _age(dob, today):
+    if not dob:
+        return None
+    return today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
+
+
+def _verified(mnc_id):
+    Summary = _m('MNCEmployeeSummary')
+    return and_(Summary.mnc_id == mnc_id, Summary.verification_status == 'Verified')
+
+
+def _fitness_or_review():
+    Summary = _m('MNCEmployeeSummary')
+    return func.coalesce(Summary.fitness_status, 'Review Required')
+
+
+def directory_page(mnc_id, search=None, department=None, fitness_status=None, uid=None,
+                   cursor=None, per_page=None, count_mode='exact'):
+    """One page of an MNC's verified employees; raises InvalidCursor for bad cursors"""
+    Summary = _m('MNCEmployeeSummary')
+    query = Summary.query.filter(_verified(mnc_id))
+    if search:
+        query = query.filter(or_(
+            Summary.employee_code.ilike(f'%{search}%'),
+            Summary.full_name.ilike(f'%{search}%'),
+            Summary.email.ilike(f'%{search}%')
+        ))
+    if department:
+        query = query.filter(Summary.department == department)
+    if fitness_status:
+        query = query.filter(_fitness_or_review() == fitness_status)
+    if uid:
+        query = query.filter(Summary.uid == uid)
+    return keyset_paginate(query, [SortKey(Summary.employee_pk)], cursor=cursor, per_page=per_page,
+                           count_mode=count_mode)
+
+
+def directory_dict(row, today=None):
+    today = today or date.today()
+    return {
+        'id': row.employee_pk,
+        'employee_id': row.employee_code,
+        'uid': row.uid,
+        'name': row.full_name,
+        'age': _age(row.dob, today),
+        'gender': row.gender,
+        'department': row.department or 'Not Assigned',
+        'job_role': row.job_role or 'Employee',
+        'fitness_status': (row.fitness_status or 'Review Required') if row.client_linked else 'Review Required',
+        'last_health_review': row.last_review_date.strftime('%Y-%m-%d') if row.client_linked and row.last_review_date else None,
+        'vaccination_compliance': row.compliance_percent if row.policies_active else 0,
+    }
+
+
+def _age_band(birth_year, today):
+    age = today.year - birth_year
+    for low, high, label in AGE_BANDS:
+        if low <= age <= high:
+            return label
+    return AGE_OTHER
+
+
+def health_trends(mnc_id, today=None):
+    """Fitness, age, vaccination and department distributions from one grouped query"""
+    db, Summary = _runtime['db'], _m('MNCEmployeeSummary')
+    today = today or date.today()
+    trends = {
+        'fitness_distribution': dict.fromkeys(FITNESS_STATUSES, 0),
+        'age_distribution': dict.fromkeys([label for _, _, label in AGE_BANDS] + [AGE_OTHER], 0),
+        'vaccination_coverage': {'compliant': 0, 'partial': 0, 'non_compliant': 0},
+        'department_distribution': {},
+    }
+    total = 0
+    columns = (Summary.department, Summary.client_linked, Summary.fitness_status, Summary.birth_year,
+               Summary.vaccination_band)
+    for department, linked, fitness, birth_year, vaccination, count in db.session.query(
+        *columns, func.count(Summary.employee_pk)
+    ).filter(_verified(mnc_id)).group_by(*columns):
+        total += count
+        dept = department or 'Unassigned'
+        trends['department_distribution'][dept] = trends['department_distribution'].get(dept, 0) + count
+        if not linked:
+            continue
+        bucket = fitness if fitness in FITNESS_STATUSES else 'Review Required'
+        trends['fitness_distribution'][bucket] += count
+        if birth_year:
+            trends['age_distribution'][_age_band(birth_year, today)] += count
+        if vaccination:
+            trends['vaccination_coverage'][vaccination] += count
+    return total, trends
+
+
+def compliance_report(mnc_id, today=None):
+    """Fitness certification and vaccination counts from one aggregate query"""
+    db, Summary = _runtime['db'], _m('MNCEmployeeSummary')
+    today = today or date.today()
+    linked = Summary.client_id.isnot(None)
+
+    def count(condition):
+        return func.coalesce(func.sum(case((condition, 1), else_=0)), 0)
+
+    total, certified, expiring, vaccinated, overdue = db.session.query(
+        func.count(Summary.employee_pk),
+        count(and_(linked, Summary.certificate_expiry_date > today)),
+        count(and_(linked, Summary.certificate_expiry_date > today,
+                   Summary.certificate_expiry_date <= today + timedelta(days=CERT_EXPIRING_DAYS))),
+        count(and_(linked, or_(Summary.compliant_records > 0,
+                               Summary.completed_vaccinations >= REPORT_COMPLIANT_DOSES))),
+        count(and_(linked, Summary.next_review_date < today)),
+    ).filter(_verified(mnc_id)).one()
+    return {
+        'total_employees': total,
+        'fitness_certified': int(certified),
+        'pending_certification': total - int(certified),
+        'certifications_expiring_30_days': int(expiring),
+        'vaccination_compliant': int(vaccinated),
+        'health_check_overdue': int(overdue),
+    }
+
+
+def fitness_counts(mnc_id):
+    """Dashboard fitness counts; no assessment or no linked client counts as under review"""
+    db, Summary = _runtime['db'], _m('MNCEmployeeSummary')
+    status = case((Summary.client_id.isnot(None), Summary.fitness_status))
+    counts = dict(db.session.query(status, func.count(Summary.employee_pk)).filter(
+        _verified(mnc_id)
+    ).group_by(status).all())
+    return {
+        'total': sum(counts.values()),
+        'fit': counts.get('Fit', 0),
+        'fit_with_restrictions': counts.get('Fit with Restrictions', 0),
+        'temporarily_unfit': counts.get('Temporarily Unfit', 0),
+        'under_review': counts.get('Review Required', 0) + counts.get(None, 0),
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='MNC employee directory summaries')
+    parser.add_argument('command', choices=['rebuild'])
+    args = parser.parse_args()
+
+    app, service = cli_app('services.mnc_directory')
+
+    with app.app_context():
+        print(f"✅ MNC directory rebuilt: {service.rebuild_directory()}")
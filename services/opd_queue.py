@@ -0,0 +1,415 @@
+"""
+OPD Queue Engine
+Live walk-in queue for facility OPDs.
+
+Each facility's queue for the day is held in memory (loaded from
+``opd_queue`` on first use) as entries plus a priority-ordered waiting list
+(emergency, urgent, routine; then arrival). Dashboard reads are served from
+memory; add/call/complete write through to the table, update the live copy
+and push an event to every open stream for that facility::
+
+    GET /api/facility/<id>/opd-queue/stream    (text/event-stream)
+
+    event: snapshot | token | call | complete
+    data: {"entry": {...}, "stats": {...}, "queue": [...], ...}
+
+Token numbers come from ``opd_token_counters`` (one row per facility/day,
+incremented with a single UPDATE), so concurrent registrations never hand out
+the same token. Wait estimates use the average consultation length seen
+today.
+
+Events are delivered to streams held by the same process. The live copy is
+reloaded from the table every QUEUE_RELOAD_SECONDS, and every open stream is
+sent a fresh snapshot on the same interval, so changes made by other workers
+reach dashboards within that window. A stream that falls SUBSCRIBER_BUFFER
+events behind is closed so the browser reconnects and starts from a snapshot.
+"""
+import bisect
+import json
+import queue as queue_lib
+import threading
+import time
+from datetime import date, datetime
+
+from flask import Response
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from services.runtime import ServiceRuntime
+
+PRIORITY_RANK = {'emergency': 1, 'urgent': 2, 'routine': 3}
+QUEUE_RELOAD_SECONDS = 30
+KEEPALIVE_SECONDS = 15
+SUBSCRIBER_BUFFER = 100
+
+# Used until enough consultations have completed today to measure
+DEFAULT_CONSULT_MINUTES = 10
+CONSULT_SAMPLE_SIZE = 20
+
+_runtime = ServiceRuntime()
+_queues = {}
+_queues_lock = threading.RLock()
+_subscribers = {}
+_subscribers_lock = threading.Lock()
+
+
+class QueueConflict(Exception):
+    """Raised when an entry is not in the state an action expects"""
+
+
+def init_opd_queue(app, db, models):
+    """Register the app, db and model classes"""
+    _runtime.init(db, models, app=app)
+
+
+_m = _runtime.model
+
+
+def _db():
+    return _runtime['db']
+
+
+def _hhmm(value):
+    return value.strftime('%H:%M') if value else None
+
+
+# ==================== LIVE QUEUE ====================
+
+def _entry_dict(row):
+    return {
+        'id': row.id,
+        'token_number': row.token_number,
+        'patient_name': row.patient_name,
+        'member_id': row.member_id,
+        'reason': row.reason,
+        'priority': row.priority or 'routine',
+        'status': row.status or 'waiting',
+        'registered_at': row.registered_at,
+        'called_at': row.called_at,
+        'completed_at': row.completed_at,
+    }
+
+
+def _order_key(entry):
+    return (
+        PRIORITY_RANK.get(entry['priority'], 3),
+        entry['registered_at'] or datetime.min,
+        entry['id'],
+    )
+
+
+class LiveQueue:
+    """One facility's queue for one day"""
+
+    def __init__(self, facility_id, day, rows):
+        self.facility_id = facility_id
+        self.day = day
+        self.loaded_at = time.monotonic()
+        self.entries = {}
+        self.waiting = []  # Sorted order keys of waiting entries
+        for row in rows:
+            self.apply(_entry_dict(row))
+
+    def apply(self, entry):
+        """Insert or replace an entry, keeping the waiting list ordered"""
+        previous = self.entries.get(entry['id'])
+        if previous is not None and previous['status'] == 'waiting':
+            key = _order_key(previous)
+            index = bisect.bisect_left(self.waiting, key)
+            if index < len(self.waiting) and self.waiting[index] == key:
+                self.waiting.pop(index)
+        self.entries[entry['id']] = entry
+        if entry['status'] == 'waiting':
+            bisect.insort(self.waiting, _order_key(entry))
+
+    def average_consult_minutes(self):
+        durations = sorted(
+            ((e['completed_at'], (e['completed_at'] - e['called_at']).total_seconds() / 60)
+             for e in self.entries.values()
+             if e['status'] == 'completed' and e['called_at'] and e['completed_at']),
+            reverse=True
+        )[:CONSULT_SAMPLE_SIZE]
+        if not durations:
+            return DEFAULT_CONSULT_MINUTES
+        return max(1.0, sum(minutes for _, minutes in durations) / len(durations))
+
+    def state(self, now=None):
+        """Dashboard payload: stats, ordered queue with wait estimates, current patient"""
+        now = now or datetime.utcnow()
+        average = self.average_consult_minutes()
+        in_consultation = sorted(
+            (e for e in self.entries.values() if e['status'] == 'in_consultation'),
+            key=lambda e: e['called_at'] or datetime.min
+        )
+        # Time left on the current consultation before the next call
+        head_start = 0.0
+        if in_consultation and in_consultation[-1]['called_at']:
+            elapsed = (now - in_consultation[-1]['called_at']).total_seconds() / 60
+            head_start = max(0.0, average - elapsed)
+
+        waits = {}
+        for position, key in enumerate(self.waiting):
+            waits[key[2]] = (position + 1, round(head_start + position * average))
+
+        stats = {'total': len(self.entries), 'waiting': 0, 'in_consultation': 0, 'completed': 0}
+        items = []
+        for entry in sorted(self.entries.values(), key=_order_key):
+            if entry['status'] in stats:
+                stats[entry['status']] += 1
+            items.append(self._public(entry, waits.get(entry['id'])))
+
+        current = in_consultation[0] if in_consultation else None
+        return {
+            'stats': stats,
+            'queue': items,
+            'current_patient': self._public(current) if current else None,
+            'avg_consult_minutes': round(average, 1),
+        }
+
+    @staticmethod
+    def _public(entry, wait=None):
+        item = {
+            'id': entry['id'],
+            'token_number': entry['token_number'],
+            'patient_name': entry['patient_name'],
+            'member_id': entry['member_id'],
+            'reason': entry['reason'],
+            'priority': entry['priority'],
+            'status': entry['status'],
+            'registered_at': _hhmm(entry['registered_at']),
+            'called_at': _hhmm(entry['called_at']),
+            'completed_at': _hhmm(entry['completed_at']),
+        }
+        if wait is not None:
+            item['position'], item['estimated_wait_minutes'] = wait
+        return item
+
+
+def _load_queue(facility_id, day):
+    OPDQueue = _m('OPDQueue')
+    rows = OPDQueue.query.filter_by(facility_id=facility_id, queue_date=day).all()
+    return LiveQueue(facility_id, day, rows)
+
+
+def get_queue(facility_id):
+    """Today's live queue for a facility, loading or reloading it when stale"""
+    today = date.today()
+    with _queues_lock:
+        live = _queues.get(facility_id)
+        if (live is None or live.day != today
+                or time.monotonic() - live.loaded_at >= QUEUE_RELOAD_SECONDS):
+            live = _load_queue(facility_id, today)
+            _queues[facility_id] = live
+        return live
+
+
+def queue_state(facility_id):
+    with _queues_lock:
+        return get_queue(facility_id).state()
+
+
+def _apply_and_publish(row, event):
+    entry = _entry_dict(row)
+    with _queues_lock:
+        live = get_queue(row.facility_id)
+        if row.queue_date == live.day:
+            live.apply(entry)
+        state = live.state()
+    publish(row.facility_id, event, dict(state, entry=LiveQueue._public(entry)))
+    return state
+
+
+def forget_queue(facility_id=None):
+    """Drop cached queues so the next read reloads from the table"""
+    with _queues_lock:
+        if facility_id is None:
+            _queues.clear()
+        else:
+            _queues.pop(facility_id, None)
+
+
+# ==================== TOKENS ====================
+
+def _seed_token(facility_id, day):
+    """Highest token already issued today (rows that predate the counter)"""
+    OPDQueue = _m('OPDQueue')
+    highest = 0
+    for (token,) in _db().session.query(OPDQueue.token_number).filter_by(facility_id=facility_id, queue_date=day):
+        try:
+            highest = max(highest, int(token.split('-')[1]))
+        except (IndexError, ValueError, AttributeError):
+            continue
+    return highest
+
+
+def _increment_counter(facility_id, day):
+    Counter = _m('OPDTokenCounter')
+    return _db().session.execute(
+        update(Counter).where(
+            Counter.facility_id == facility_id,
+            Counter.queue_date == day
+        ).values(last_token=Counter.last_token + 1)
+    ).rowcount
+
+
+def next_token_number(facility_id, day=None):
+    """
+    Reserve the next token for a facility/day inside the caller's transaction.
+    The counter row stays locked until commit, so concurrent callers queue up
+    behind the increment instead of reading the same "last token".
+    """
+    db, Counter = _db(), _m('OPDTokenCounter')
+    day = day or date.today()
+
+    if not _increment_counter(facility_id, day):
+        try:
+            with db.session.begin_nested():
+                db.session.add(Counter(
+                    facility_id=facility_id, queue_date=day, last_token=_seed_token(facility_id, day)
+                ))
+        except IntegrityError:
+            pass  # Another registration created today's counter first
+        _increment_counter(facility_id, day)
+
+    number = db.session.query(Counter.last_token).filter_by(facility_id=facility_id, queue_date=day).scalar()
+    return f"OPD-{number:03d}"
+
+
+# ==================== ACTIONS ====================
+
+def add_patient(facility_id, member, reason, priority):
+    """Register a walk-in and issue a token (commits)"""
+    db, OPDQueue = _db(), _m('OPDQueue')
+    today = date.today()
+    priority = priority if priority in PRIORITY_RANK else 'routine'
+
+    entry = OPDQueue(
+        facility_id=facility_id,
+        member_id=member.id,
+        token_number=next_token_number(facility_id, today),
+        patient_name=member.name,
+        reason=reason,
+        priority=priority,
+        status='waiting',
+        queue_date=today
+    )
+    db.session.add(entry)
+    db.session.commit()
+    state = _apply_and_publish(entry, 'token')
+    wait = next((q for q in state['queue'] if q['id'] == entry.id), {})
+    return entry, wait.get('estimated_wait_minutes')
+
+
+def _transition(entry, from_statuses, values):
+    OPDQueue = _m('OPDQueue')
+    changed = _db().session.execute(
+        update(OPDQueue).where(
+            OPDQueue.id == entry.id,
+            OPDQueue.status.in_(from_statuses)
+        ).values(**values).execution_options(synchronize_session=False)
+    ).rowcount
+    if changed != 1:
+        _db().session.rollback()
+        _db().session.refresh(entry)
+        raise QueueConflict(f"Token {entry.token_number} is already {(entry.status or '').replace('_', ' ')}")
+    _db().session.commit()
+    _db().session.refresh(entry)
+
+
+def call_patient(entry):
+    """Move a waiting patient into consultation (commits)"""
+    _transition(entry, ('waiting',), {'status': 'in_consultation', 'called_at': datetime.utcnow()})
+    _apply_and_publish(entry, 'call')
+
+
+def complete_patient(entry, notes=''):
+    """Close a consultation (commits)"""
+    _transition(entry, ('in_consultation', 'waiting'), {
+        'status': 'completed', 'completed_at': datetime.utcnow(), 'notes': notes
+    })
+    _apply_and_publish(entry, 'complete')
+
+
+def _fresh_state(facility_id):
+    """Queue state for a stream, outside any request (reloads when the copy is stale)"""
+    with _runtime['app'].app_context():
+        try:
+            return queue_state(facility_id)
+        finally:
+            _db().session.remove()
+
+
+# ==================== EVENTS ====================
+
+class _Channel(queue_lib.Queue):
+    """A stream's event buffer; ``closed`` is set when it is dropped for falling behind"""
+
+    def __init__(self):
+        super().__init__(maxsize=SUBSCRIBER_BUFFER)
+        self.closed = threading.Event()
+
+
+def subscribe(facility_id):
+    channel = _Channel()
+    with _subscribers_lock:
+        _subscribers.setdefault(facility_id, set()).add(channel)
+    return channel
+
+
+def unsubscribe(facility_id, channel):
+    with _subscribers_lock:
+        channels = _subscribers.get(facility_id)
+        if channels is not None:
+            channels.discard(channel)
+            if not channels:
+                _subscribers.pop(facility_id, None)
+
+
+def publish(facility_id, event, data):
+    """Fan an event out to every stream for the facility; drops streams that stopped reading"""
+    message = _sse(event, data)
+    with _subscribers_lock:
+        channels = list(_subscribers.get(facility_id, ()))
+    for channel in channels:
+        try:
+            channel.put_nowait(message)
+        except queue_lib.Full:
+            unsubscribe(facility_id, channel)
+            channel.closed.set()  # Ends that stream so the client reconnects
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def event_stream_response(facility_id, initial_state):
+    """text/event-stream response: a snapshot, then live events, keep-alives and
+    a fresh snapshot every QUEUE_RELOAD_SECONDS"""
+    channel = subscribe(facility_id)
+
+    def body():
+        try:
+            yield 'retry: 3000\n\n'
+            yield _sse('snapshot', initial_state)
+            snapshot_due = time.monotonic() + QUEUE_RELOAD_SECONDS
+            while not channel.closed.is_set():
+                if time.monotonic() >= snapshot_due:
+                    yield _sse('snapshot', _fresh_state(facility_id))
+                    snapshot_due = time.monotonic() + QUEUE_RELOAD_SECONDS
+                    continue
+                wait = min(KEEPALIVE_SECONDS, snapshot_due - time.monotonic())
+                try:
+                    message = channel.get(timeout=max(wait, 0))
+                except queue_lib.Empty:
+                    if time.monotonic() < snapshot_due:
+                        yield ': keep-alive\n\n'
+                    continue
+                if not channel.closed.is_set():
+                    yield message
+        finally:
+            unsubscribe(facility_id, channel)
+
+    response = Response(body(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'  # Let nginx pass events straight through
+    return response
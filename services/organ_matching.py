@@ -0,0 +1,685 @@
+"""
+Organ Matching
+Ranked pledge candidates for open organ requests.
+
+HLA typings ("A2, A24, B7, B44, DR15", "A*02:01 B*07:02 DRB1*15:01", ...)
+are parsed once into ids from an antigen vocabulary. Active pledges are held
+in a pool partitioned by (organ, donor ABO); each segment keeps NumPy columns
+(pledge ids, user ids and a pledges x antigens id matrix), so ranking a
+request is a handful of array operations per compatible segment:
+
+    organ offered  ->  ABO compatible  ->  virtual crossmatch  ->  score
+
+Score starts at 100 and loses MISMATCH_PENALTY points per HLA-A/B/DR
+mismatch (untyped donors or recipients take the full penalty) and
+ABO_NON_IDENTICAL_PENALTY for compatible-but-different ABO. A donor antigen
+listed in the recipient's unacceptable antigens (``antibody_screening``) is
+a positive crossmatch: excluded when the request requires a crossmatch,
+otherwise kept and flagged.
+
+The top MATCH_LIST_SIZE candidates per open request live in
+``organ_matches``. A session flush hook keeps them current: a changed
+request is rescored against the pool; changed pledges are scored against
+every open request and merged into the stored lists, which are read in one
+query per flush. Requests opened before the lists existed are ranked at
+startup (``ensure_matches``) or by ``rebuild``.
+
+    python -m services.organ_matching rebuild
+    python -m services.organ_matching bench --pledges 100000 --requests 200
+"""
+import json
+import re
+import threading
+import time
+from array import array
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import inspect as sa_inspect, select
+
+from services.runtime import ServiceRuntime, cli_app
+
+MATCH_LIST_SIZE = 25
+POOL_RELOAD_SECONDS = 600
+
+ACTIVE_PLEDGE_STATUSES = ('Active',)
+OPEN_REQUEST_STATUSES = ('Pending', 'On Waitlist')
+CLOSED_WAITLIST_STATUSES = ('Matched', 'Transplanted', 'Removed', 'Deceased')
+
+SCORED_LOCI = ('A', 'B', 'DR')
+MISMATCH_PENALTY = {'A': 8, 'B': 8, 'DR': 12}
+MAX_MISMATCHES_PER_LOCUS = 2
+UNTYPED_PENALTY = sum(p * MAX_MISMATCHES_PER_LOCUS for p in MISMATCH_PENALTY.values())
+ABO_NON_IDENTICAL_PENALTY = 5
+
+# ABO codes; organ allocation ignores Rh
+ABO_CODES = {'O': 0, 'A': 1, 'B': 2, 'AB': 3}
+# Recipient ABO code -> bitmask of acceptable donor ABO codes
+ABO_ACCEPTS = {0: 0b0001, 1: 0b0011, 2: 0b0101, 3: 0b1111}
+
+ORGAN_BITS = {
+    'heart': 1 << 0, 'kidney': 1 << 1, 'liver': 1 << 2, 'lung': 1 << 3, 'pancreas': 1 << 4,
+    'intestine': 1 << 5, 'cornea': 1 << 6, 'skin': 1 << 7, 'bone marrow': 1 << 8,
+}
+ORGAN_ALIASES = {
+    'kidneys': 'kidney', 'lungs': 'lung', 'intestines': 'intestine', 'eyes': 'cornea',
+    'eye': 'cornea', 'corneas': 'cornea', 'bone_marrow': 'bone marrow', 'marrow': 'bone marrow',
+}
+
+# Locus must stand alone: DQA1*01 is not A1, DRB3*01 is not B3, Bw4 is no B antigen
+_HLA_TOKEN = re.compile(
+    r'(?<![A-Z0-9])(?:HLA-)?(DRB[1-9]|DQA1|DQB1|DPA1|DPB1|DR|DQ|DP|CW|A|B|C)(?![A-Z])\*?\s*0*(\d+)',
+    re.IGNORECASE
+)
+# Other loci (DQA1, DPA1, DRB3/4/5) keep their own names and are never scored
+_LOCUS_ALIASES = {'DRB1': 'DR', 'DQB1': 'DQ', 'DPB1': 'DP', 'CW': 'C'}
+
+_runtime = ServiceRuntime()
+_vocabulary = {}  # 'A2', 'DQA1*1' -> antigen id
+_antigen_loci = array('b')  # Antigen id -> index into SCORED_LOCI, -1 for other loci
+_vocabulary_lock = threading.Lock()
+_pool = {'data': None, 'loaded_at': 0.0}
+_pool_lock = threading.RLock()
+
+
+def init_organ_matching(db, models):
+    """Register the db and model classes and install the sync hooks"""
+    _runtime.init(db, models)
+    _runtime.listen('after_flush', _collect_organ_changes, 'OrganPledge', 'OrganRequest', 'User')
+    _runtime.listen('after_commit', _settle_pool)
+    _runtime.listen('after_rollback', _discard_pool)
+
+
+_m = _runtime.model
+
+
+# ==================== PARSING ====================
+
+def _antigen_id(locus, number):
+    name = f"{locus}*{number}" if locus[-1].isdigit() else f"{locus}{number}"
+    antigen = _vocabulary.get(name)
+    if antigen is None:
+        with _vocabulary_lock:
+            antigen = _vocabulary.get(name)
+            if antigen is None:
+                antigen = len(_vocabulary)
+                _antigen_loci.append(SCORED_LOCI.index(locus) if locus in SCORED_LOCI else -1)
+                _vocabulary[name] = antigen
+    return antigen
+
+
+def hla_antigens(text):
+    """Parse an HLA typing (serological or molecular, any separators) into sorted antigen ids"""
+    antigens = set()
+    for locus, number in _HLA_TOKEN.findall(text or ''):
+        locus = locus.upper()
+        antigens.add(_antigen_id(_LOCUS_ALIASES.get(locus, locus), int(number)))
+    return tuple(sorted(antigens))
+
+
+def antibody_antigens(raw):
+    """
+    Unacceptable antigens from ``antibody_screening``: a JSON list, a JSON
+    object with ``unacceptable_antigens`` (or ``antibodies``), or plain text.
+    """
+    if not raw:
+        return ()
+    try:
+        data = json.loads(raw)
+    except (TypeError, ValueError):
+        data = raw
+    if isinstance(data, dict):
+        data = data.get('unacceptable_antigens') or data.get('antibodies') or []
+    if isinstance(data, list):
+        data = ' '.join(str(item) for item in data)
+    return hla_antigens(str(data))
+
+
+def abo_code(blood_group):
+    match = re.match(r'\s*(AB|A|B|O)(?![A-Z])', f"{blood_group or ''}".upper())
+    return ABO_CODES[match.group(1)] if match else -1
+
+
+def organ_mask(organs):
+    """JSON list / comma text of organ names -> bitmask"""
+    if not organs:
+        return 0
+    if isinstance(organs, str):
+        try:
+            organs = json.loads(organs)
+        except ValueError:
+            organs = organs.split(',')
+        if isinstance(organs, str):
+            organs = [organs]
+    mask = 0
+    for name in organs:
+        key = ' '.join(str(name).lower().split())
+        mask |= ORGAN_BITS.get(ORGAN_ALIASES.get(key, key), 0)
+    return mask
+
+
+def mismatch_count(donor, recipient):
+    """HLA-A/B/DR mismatches (0-6) and their weighted penalty; (None, UNTYPED_PENALTY) if either side is untyped"""
+    if not donor or not recipient:
+        return None, UNTYPED_PENALTY
+    per_locus = [0] * len(SCORED_LOCI)
+    recipient = set(recipient)
+    for antigen in donor:
+        locus = _antigen_loci[antigen]
+        if locus >= 0 and antigen not in recipient:
+            per_locus[locus] += 1
+    mismatches = penalty = 0
+    for locus, count in zip(SCORED_LOCI, per_locus):
+        count = min(count, MAX_MISMATCHES_PER_LOCUS)
+        mismatches += count
+        penalty += MISMATCH_PENALTY[locus] * count
+    return mismatches, penalty
+
+
+# ==================== PLEDGE POOL ====================
+
+class PledgeSegment:
+    """Pledges offering one organ with one ABO group, in parallel columns"""
+    __slots__ = ('pledge_ids', 'user_ids', 'hla', 'position', '_columns')
+
+    def __init__(self):
+        self.pledge_ids = array('q')
+        self.user_ids = array('q')
+        self.hla = []
+        self.position = {}
+        self._columns = None
+
+    def columns(self):
+        """(pledge ids, user ids, pledges x antigens id matrix padded with -1) as NumPy arrays"""
+        if self._columns is None:
+            width = max((len(hla) for hla in self.hla), default=0) or 1
+            antigens = np.full((len(self.hla), width), -1, dtype=np.int32)
+            for i, hla in enumerate(self.hla):
+                antigens[i, :len(hla)] = hla
+            self._columns = (
+                np.frombuffer(self.pledge_ids, dtype=np.int64).copy(),
+                np.frombuffer(self.user_ids, dtype=np.int64).copy(),
+                antigens,
+            )
+        return self._columns
+
+    def add(self, pledge_id, user_id, hla):
+        self._columns = None
+        i = self.position.get(pledge_id)
+        if i is None:
+            self.position[pledge_id] = len(self.pledge_ids)
+            self.pledge_ids.append(pledge_id)
+            self.user_ids.append(user_id)
+            self.hla.append(hla)
+        else:
+            self.user_ids[i], self.hla[i] = user_id, hla
+
+    def discard(self, pledge_id):
+        """Remove a pledge by moving the last row into its slot"""
+        i = self.position.pop(pledge_id, None)
+        if i is None:
+            return
+        self._columns = None
+        last = len(self.pledge_ids) - 1
+        if i != last:
+            moved = self.pledge_ids[last]
+            self.pledge_ids[i] = moved
+            self.user_ids[i] = self.user_ids[last]
+            self.hla[i] = self.hla[last]
+            self.position[moved] = i
+        self.pledge_ids.pop()
+        self.user_ids.pop()
+        self.hla.pop()
+
+
+class PledgePool:
+    """
+    Active pledges partitioned into (organ bit, donor ABO) segments, so a
+    request only walks the segments it can accept.
+    """
+
+    def __init__(self):
+        self.segments = {}
+        self.pledges = {}  # pledge_id -> (user_id, abo, organs, hla)
+        self.loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.pledges)
+
+    def _keys(self, abo, organs):
+        if abo < 0:
+            return []
+        return [(bit, abo) for bit in ORGAN_BITS.values() if organs & bit]
+
+    def upsert(self, pledge_id, user_id, abo, organs, hla):
+        self.remove(pledge_id)
+        self.pledges[pledge_id] = (user_id, abo, organs, hla)
+        for key in self._keys(abo, organs):
+            segment = self.segments.get(key)
+            if segment is None:
+                segment = self.segments[key] = PledgeSegment()
+            segment.add(pledge_id, user_id, hla)
+
+    def remove(self, pledge_id):
+        previous = self.pledges.pop(pledge_id, None)
+        if previous is not None:
+            for key in self._keys(previous[1], previous[2]):
+                self.segments[key].discard(pledge_id)
+
+    def candidates(self, organ, accepts):
+        """(donor_abo, segment) for every segment a recipient can accept"""
+        for (bit, abo), segment in self.segments.items():
+            if bit & organ and (accepts >> abo) & 1:
+                yield abo, segment
+
+
+class RequestProfile:
+    """Parsed matching parameters for one organ request"""
+    __slots__ = ('request_id', 'user_id', 'organ', 'abo', 'hla', 'unacceptable', 'crossmatch_required')
+
+    def __init__(self, request_id, user_id, organ, abo, hla, unacceptable, crossmatch_required):
+        self.request_id = request_id
+        self.user_id = user_id
+        self.organ = organ
+        self.abo = abo
+        self.hla = frozenset(hla)
+        self.unacceptable = frozenset(unacceptable)
+        self.crossmatch_required = crossmatch_required
+
+
+def _pledge_rows(conn, pledge_ids=None):
+    OrganPledge, User = _m('OrganPledge'), _m('User')
+    stmt = select(
+        OrganPledge.id, OrganPledge.user_id, OrganPledge.organs_pledged, OrganPledge.status,
+        User.blood_group, User.hla_type
+    ).join(User, OrganPledge.user_id == User.id)
+    if pledge_ids is None:
+        stmt = stmt.where(OrganPledge.status.in_(ACTIVE_PLEDGE_STATUSES))
+    else:
+        stmt = stmt.where(OrganPledge.id.in_(pledge_ids))
+    return conn.execute(stmt)
+
+
+def _load_pool(conn):
+    pool = PledgePool()
+    for pledge_id, user_id, organs, _status, blood_group, hla in _pledge_rows(conn):
+        pool.upsert(pledge_id, user_id, abo_code(blood_group), organ_mask(organs), hla_antigens(hla))
+    return pool
+
+
+def _get_pool(conn):
+    with _pool_lock:
+        pool = _pool['data']
+        if pool is None or time.monotonic() - pool.loaded_at >= POOL_RELOAD_SECONDS:
+            pool = _load_pool(conn)
+            _pool['data'] = pool
+        return pool
+
+
+def _open_request_filter(OrganRequest):
+    return (
+        OrganRequest.status.in_(OPEN_REQUEST_STATUSES)
+        & ((OrganRequest.waitlist_status.is_(None)) | OrganRequest.waitlist_status.notin_(CLOSED_WAITLIST_STATUSES))
+    )
+
+
+def _request_profiles(conn, request_ids=None):
+    """Open requests as RequestProfiles (falls back to the requester's profile typing)"""
+    OrganRequest, User = _m('OrganRequest'), _m('User')
+    stmt = select(
+        OrganRequest.id, OrganRequest.user_id, OrganRequest.organ_needed, OrganRequest.blood_group,
+        OrganRequest.hla_type, OrganRequest.antibody_screening, OrganRequest.crossmatch_required,
+        User.blood_group, User.hla_type, User.antibody_screening
+    ).join(User, OrganRequest.user_id == User.id).where(_open_request_filter(OrganRequest))
+    if request_ids is not None:
+        stmt = stmt.where(OrganRequest.id.in_(request_ids))
+    return [
+        RequestProfile(
+            request_id, user_id, organ_mask([organ]), abo_code(group or user_group),
+            hla_antigens(hla or user_hla), antibody_antigens(antibodies or user_antibodies),
+            crossmatch is not False
+        )
+        for (request_id, user_id, organ, group, hla, antibodies, crossmatch,
+             user_group, user_hla, user_antibodies) in conn.execute(stmt)
+    ]
+
+
+# ==================== SCORING ====================
+
+def score_pair(profile, donor_abo, donor_organs, donor_hla):
+    """(score, mismatches, abo_identical, crossmatch_positive) or None if ineligible"""
+    if not donor_organs & profile.organ or donor_abo < 0 or profile.abo < 0:
+        return None
+    if not (ABO_ACCEPTS[profile.abo] >> donor_abo) & 1:
+        return None
+    positive = not profile.unacceptable.isdisjoint(donor_hla)
+    if positive and profile.crossmatch_required:
+        return None
+    mismatches, penalty = mismatch_count(donor_hla, profile.hla)
+    identical = donor_abo == profile.abo
+    if not identical:
+        penalty += ABO_NON_IDENTICAL_PENALTY
+    return max(100 - penalty, 0), mismatches, identical, positive
+
+
+def rank_pool(profile, pool, limit=MATCH_LIST_SIZE):
+    """
+    Top ``limit`` pledges for a request, scored with array operations over
+    each compatible segment's columns. Returns
+    [(score, pledge_id, mismatches, abo_identical, crossmatch_positive)] best
+    first; ties favour older pledges.
+    """
+    if profile.organ == 0 or profile.abo < 0:
+        return []
+    # Lookups by antigen id; the extra last slot is what the -1 padding indexes
+    loci = np.append(np.frombuffer(_antigen_loci, dtype=np.int8), -1)
+    size = len(loci)
+    in_recipient = np.zeros(size, dtype=bool)
+    in_recipient[list(profile.hla)] = True
+    in_recipient[-1] = True
+    unacceptable = np.zeros(size, dtype=bool)
+    unacceptable[list(profile.unacceptable)] = True
+
+    columns = []
+    for donor_abo, segment in pool.candidates(profile.organ, ABO_ACCEPTS[profile.abo]):
+        pledge_ids, user_ids, antigens = segment.columns()
+        if not len(pledge_ids):
+            continue
+        positive = unacceptable[antigens].any(axis=1)
+        eligible = user_ids != profile.user_id
+        if profile.crossmatch_required:
+            eligible &= ~positive
+        missing = ~in_recipient[antigens]
+        antigen_loci = loci[antigens]
+        mismatches = np.zeros(len(pledge_ids), dtype=np.int64)
+        penalty = np.zeros(len(pledge_ids), dtype=np.int64)
+        for code, locus in enumerate(SCORED_LOCI):
+            count = np.minimum((missing & (antigen_loci == code)).sum(axis=1), MAX_MISMATCHES_PER_LOCUS)
+            mismatches += count
+            penalty += MISMATCH_PENALTY[locus] * count
+        typed = (antigens[:, 0] >= 0) & bool(profile.hla)
+        mismatches = np.where(typed, mismatches, -1)
+        penalty = np.where(typed, penalty, UNTYPED_PENALTY)
+        identical = donor_abo == profile.abo
+        base = 100 if identical else 100 - ABO_NON_IDENTICAL_PENALTY
+        columns.append((
+            np.maximum(base - penalty, 0)[eligible], pledge_ids[eligible], mismatches[eligible],
+            np.full(int(eligible.sum()), identical), positive[eligible]
+        ))
+    if not columns:
+        return []
+
+    scores, pledge_ids, mismatches, identical, positive = (np.concatenate(c) for c in zip(*columns))
+    best = np.lexsort((pledge_ids, -scores))[:limit]
+    return [
+        (score, pledge_id, None if mm < 0 else mm, ident, pos)
+        for score, pledge_id, mm, ident, pos in zip(
+            scores[best].tolist(), pledge_ids[best].tolist(), mismatches[best].tolist(),
+            identical[best].tolist(), positive[best].tolist()
+        )
+    ]
+
+
+# ==================== PERSISTENCE ====================
+
+def _write_matches(conn, request_id, ranked):
+    table = _m('OrganMatch').__table__
+    conn.execute(table.delete().where(table.c.request_id == request_id))
+    if ranked:
+        now = datetime.utcnow()
+        conn.execute(table.insert(), [{
+            'request_id': request_id, 'pledge_id': pledge_id, 'score': score,
+            'hla_mismatches': mismatches, 'abo_identical': identical,
+            'crossmatch_positive': positive, 'rank': rank, 'computed_at': now,
+        } for rank, (score, pledge_id, mismatches, identical, positive) in enumerate(ranked, start=1)])
+
+
+def _rescore_requests(conn, pool, request_ids):
+    table = _m('OrganMatch').__table__
+    open_profiles = {p.request_id: p for p in _request_profiles(conn, request_ids)}
+    for request_id in request_ids:
+        profile = open_profiles.get(request_id)
+        if profile is None:
+            conn.execute(table.delete().where(table.c.request_id == request_id))  # Closed or deleted
+        else:
+            _write_matches(conn, request_id, rank_pool(profile, pool))
+
+
+def _stored_lists(conn, request_ids):
+    """{request_id: {pledge_id: (score, mismatches, abo_identical, crossmatch_positive)}} in one query"""
+    table = _m('OrganMatch').__table__
+    lists = {request_id: {} for request_id in request_ids}
+    if request_ids:
+        for row in conn.execute(select(
+            table.c.request_id, table.c.pledge_id, table.c.score, table.c.hla_mismatches,
+            table.c.abo_identical, table.c.crossmatch_positive
+        ).where(table.c.request_id.in_(request_ids))):
+            lists[row[0]][row[1]] = tuple(row[2:])
+    return lists
+
+
+def _ranked(entries):
+    """Stored-list entries as rank_pool output, best first"""
+    return sorted(
+        ((score, pledge_id, mm, ident, pos) for pledge_id, (score, mm, ident, pos) in entries.items()),
+        key=lambda item: (-item[0], item[1])
+    )
+
+
+def _merge_pledges(conn, pool, pledge_ids, profiles):
+    """Fold changed pledges into every open request's list"""
+    lists = _stored_lists(conn, [p.request_id for p in profiles])
+    changed, refill = set(), set()
+    for profile in profiles:
+        entries = lists[profile.request_id]
+        for pledge_id in pledge_ids:
+            held = entries.pop(pledge_id, None) is not None
+            pledge = pool.pledges.get(pledge_id)
+            result = None
+            if pledge is not None and pledge[0] != profile.user_id:
+                result = score_pair(profile, pledge[1], pledge[2], pledge[3])
+            if result is not None:
+                worst = min(((s, -p) for p, (s, *_rest) in entries.items()), default=None)
+                if len(entries) < MATCH_LIST_SIZE or worst < (result[0], -pledge_id):
+                    entries[pledge_id] = result
+                    changed.add(profile.request_id)
+                    if len(entries) > MATCH_LIST_SIZE:
+                        entries.pop(-min((s, -p) for p, (s, *_rest) in entries.items())[1])
+                    continue
+            if held:
+                refill.add(profile.request_id)  # Lost a candidate; someone else may move up
+
+    # Lists that lost a candidate are ranked again against the whole pool
+    table = _m('OrganMatch').__table__
+    conn.execute(table.delete().where(table.c.pledge_id.in_(pledge_ids)))
+    if refill:
+        _rescore_requests(conn, pool, sorted(refill))
+    for request_id in sorted(changed - refill):
+        _write_matches(conn, request_id, _ranked(lists[request_id]))
+
+
+# ==================== SYNC ====================
+
+MATCH_USER_FIELDS = ('blood_group', 'hla_type', 'antibody_screening')
+
+
+def _collect_organ_changes(session, flush_context):
+    """Keep the pool and ranked lists in step with pledges, requests and typings"""
+    OrganPledge, OrganRequest, User = _m('OrganPledge'), _m('OrganRequest'), _m('User')
+
+    pledge_ids, request_ids, user_ids = set(), set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, OrganPledge) and obj.id is not None:
+            pledge_ids.add(obj.id)
+        elif isinstance(obj, OrganRequest) and obj.id is not None:
+            request_ids.add(obj.id)
+        elif isinstance(obj, User) and obj in session.dirty:
+            state = sa_inspect(obj)
+            if any(state.attrs[f].history.has_changes() for f in MATCH_USER_FIELDS):
+                user_ids.add(obj.id)
+    if not (pledge_ids or request_ids or user_ids):
+        return
+
+    conn = session.connection()
+    if user_ids:
+        pledge_ids |= {p for (p,) in conn.execute(select(OrganPledge.id).where(OrganPledge.user_id.in_(user_ids)))}
+        request_ids |= {r for (r,) in conn.execute(select(OrganRequest.id).where(OrganRequest.user_id.in_(user_ids)))}
+
+    session.info['organ_pool_dirty'] = True
+    with _pool_lock:
+        pool = _get_pool(conn)
+        if pledge_ids:
+            current = {row[0]: row for row in _pledge_rows(conn, pledge_ids)}
+            for pledge_id in pledge_ids:
+                row = current.get(pledge_id)
+                if row is None or row[3] not in ACTIVE_PLEDGE_STATUSES:
+                    pool.remove(pledge_id)
+                else:
+                    pool.upsert(row[0], row[1], abo_code(row[4]), organ_mask(row[2]), hla_antigens(row[5]))
+            profiles = [p for p in _request_profiles(conn) if p.request_id not in request_ids]
+            _merge_pledges(conn, pool, sorted(pledge_ids), profiles)
+        if request_ids:
+            _rescore_requests(conn, pool, sorted(request_ids))
+
+
+def _settle_pool(session):
+    session.info.pop('organ_pool_dirty', None)
+
+
+def _discard_pool(session):
+    # The pool already holds this transaction's changes; reload it from the table
+    if session.info.pop('organ_pool_dirty', False):
+        with _pool_lock:
+            _pool['data'] = None
+
+
+# ==================== QUERIES ====================
+
+def ranked_matches(organ_request):
+    """Stored ranked list for a request (kept current by the flush hook)"""
+    OrganMatch = _m('OrganMatch')
+    return OrganMatch.query.filter_by(request_id=organ_request.id).order_by(OrganMatch.rank).all()
+
+
+def ensure_matches():
+    """Rank open requests that have no stored list yet (startup); returns a summary or None"""
+    db, OrganRequest, OrganMatch = _runtime['db'], _m('OrganRequest'), _m('OrganMatch')
+    listed = select(OrganMatch.id).where(OrganMatch.request_id == OrganRequest.id).exists()
+    with db.engine.begin() as conn:
+        request_ids = conn.execute(
+            select(OrganRequest.id).where(_open_request_filter(OrganRequest), ~listed)
+        ).scalars().all()
+        if not request_ids:
+            return None
+        with _pool_lock:
+            _rescore_requests(conn, _get_pool(conn), request_ids)
+    return {'requests': len(request_ids)}
+
+
+def rebuild_matches():
+    """Reload the pool and rescore every open request"""
+    db = _runtime['db']
+    conn = db.session.connection()
+    with _pool_lock:
+        _pool['data'] = None
+        pool = _get_pool(conn)
+        profiles = _request_profiles(conn)
+        conn.execute(_m('OrganMatch').__table__.delete())
+        for profile in profiles:
+            _write_matches(conn, profile.request_id, rank_pool(profile, pool))
+    db.session.commit()
+    return {'pledges': len(pool), 'requests': len(profiles)}
+
+
+# ==================== BENCHMARK ====================
+
+def run_benchmark(pledges=100000, requests=200, seed=7):
+    """
+    In-memory benchmark (no database): parse ``pledges`` synthetic typings into
+    a pool, rank every request against it, then fold single pledge changes
+    into all requests as the flush hook does.
+    """
+    import random
+    import statistics
+
+    rng = random.Random(seed)
+    antigens = {
+        'A': [1, 2, 3, 11, 23, 24, 25, 26, 29, 30, 31, 32, 33, 68, 69, 74],
+        'B': [7, 8, 13, 18, 27, 35, 37, 38, 39, 44, 49, 51, 52, 55, 57, 58, 60, 61, 62, 63],
+        'DR': [1, 3, 4, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16],
+    }
+    organ_names = list(ORGAN_BITS)
+    groups = ['O', 'A', 'B', 'AB']
+
+    def typing():
+        return ', '.join(f"{locus}{rng.choice(values)}" for locus, values in antigens.items() for _ in range(2))
+
+    started = time.perf_counter()
+    pool = PledgePool()
+    for pledge_id in range(1, pledges + 1):
+        pool.upsert(
+            pledge_id, pledge_id, abo_code(rng.choice(groups)),
+            organ_mask(rng.sample(organ_names, rng.randint(1, 4))), hla_antigens(typing())
+        )
+    build_s = time.perf_counter() - started
+
+    profiles = [
+        RequestProfile(
+            -n, -n, ORGAN_BITS[rng.choice(['kidney', 'liver', 'heart', 'cornea'])],
+            abo_code(rng.choice(groups)), hla_antigens(typing()),
+            antibody_antigens(json.dumps({'unacceptable_antigens': [f"B{rng.choice(antigens['B'])}"]})),
+            rng.random() < 0.8
+        )
+        for n in range(1, requests + 1)
+    ]
+
+    timings = []
+    for profile in profiles:
+        t = time.perf_counter()
+        rank_pool(profile, pool)
+        timings.append((time.perf_counter() - t) * 1000)
+
+    t = time.perf_counter()
+    incremental = min(1000, pledges)
+    for pledge_id in range(1, incremental + 1):
+        _user_id, abo, organs, hla = pool.pledges[pledge_id]
+        for profile in profiles:
+            score_pair(profile, abo, organs, hla)
+    per_pledge_ms = (time.perf_counter() - t) * 1000 / incremental
+
+    timings.sort()
+    return {
+        'pledges': pledges,
+        'requests': requests,
+        'pool_build_s': round(build_s, 2),
+        'rank_request_ms': {
+            'mean': round(statistics.mean(timings), 1),
+            'p95': round(timings[int(len(timings) * 0.95) - 1], 1),
+            'max': round(timings[-1], 1),
+        },
+        'pledge_change_vs_all_requests_ms': round(per_pledge_ms, 3),
+        'antigen_vocabulary': len(_vocabulary),
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Organ matching tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild', help='Reload pledges and rescore every open request')
+    bench = sub.add_parser('bench', help='In-memory scoring benchmark')
+    bench.add_argument('--pledges', type=int, default=100000)
+    bench.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        print("=" * 50)
+        print("  Organ Matching Benchmark")
+        print("=" * 50)
+        print(json.dumps(run_benchmark(args.pledges, args.requests), indent=2))
+    else:
+        app, service = cli_app('services.organ_matching')
+
+        with app.app_context():
+            print(f"✅ Matches rebuilt: {service.rebuild_matches()}")
@@ -0,0 +1,244 @@
+"""
+Keyset (cursor) Pagination
+Shared pagination for admin listing endpoints. Pages are addressed by an
+opaque, signed cursor holding the sort-key values of the last row seen, so
+fetching page 1000 is the same indexed range scan as fetching page 1.
+
+Typical use inside a route::
+
+    page = keyset_paginate(
+        query,
+        [SortKey(LoginLog.id, desc=True)],
+        cursor=request.args.get('cursor'),
+        per_page=request.args.get('per_page', 50, type=int),
+        count_mode=request.args.get('count', 'approximate'),
+    )
+    rows = page.items
+    return jsonify({'logs': [...], 'pagination': page.to_dict()})
+"""
+import hashlib
+import json
+
+from flask import current_app
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import and_, or_, select, func, text
+
+DEFAULT_PER_PAGE = 50
+MAX_PER_PAGE = 200
+APPROXIMATE_COUNT_CAP = 10000
+COUNT_MODES = ('exact', 'approximate', 'none')
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor is malformed, tampered with or from another listing"""
+
+
+class SortKey:
+    """
+    One column of the keyset ordering. The last key of a listing must be
+    unique (normally the primary key) so the ordering is total and stable.
+
+    ``value`` extracts the key from a result row; it defaults to the
+    attribute with the column's name, and must be given for expressions.
+    """
+
+    def __init__(self, expr, desc=False, value=None, name=None):
+        self.expr = expr
+        self.desc = desc
+        self.name = name or getattr(expr, 'key', None) or getattr(expr, 'name', None)
+        if value is None:
+            if not self.name:
+                raise ValueError('SortKey on an expression needs a value getter')
+            attr = self.name
+            value = lambda row: getattr(row, attr)
+        self.value = value
+
+    def order_by(self, reverse=False):
+        descending = self.desc != reverse
+        return self.expr.desc() if descending else self.expr.asc()
+
+
+class KeysetPage:
+    """Result of keyset_paginate()"""
+
+    def __init__(self, items, per_page, next_cursor, prev_cursor, total=None, total_is_estimate=False):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    @property
+    def pages(self):
+        if self.total is None:
+            return None
+        return (self.total + self.per_page - 1) // self.per_page
+
+    def to_dict(self, page=None):
+        data = {
+            'per_page': self.per_page,
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+            'has_next': self.has_next,
+            'has_prev': self.has_prev,
+            'total': self.total,
+            'total_is_estimate': self.total_is_estimate,
+            'pages': self.pages,
+        }
+        if page is not None:
+            data['page'] = page  # Client-side page counter, echoed for display only
+        return data
+
+
+# ==================== CURSORS ====================
+
+def _serializer():
+    return URLSafeSerializer(current_app.config['SECRET_KEY'], salt='keyset-cursor')
+
+
+def _fingerprint(sort_keys):
+    spec = '|'.join(f"{k.name}:{'d' if k.desc else 'a'}" for k in sort_keys)
+    return hashlib.sha1(spec.encode()).hexdigest()[:8]
+
+
+def _to_jsonable(value):
+    if hasattr(value, 'isoformat'):
+        return {'__dt__': value.isoformat()}
+    return value
+
+
+def _from_jsonable(value):
+    if isinstance(value, dict) and '__dt__' in value:
+        from datetime import datetime
+        return datetime.fromisoformat(value['__dt__'])
+    return value
+
+
+def encode_cursor(sort_keys, row, direction='next'):
+    """Opaque, signed cursor pointing just after (or before) ``row``"""
+    values = [_to_jsonable(k.value(row)) for k in sort_keys]
+    return _serializer().dumps({'k': _fingerprint(sort_keys), 'd': direction, 'v': values})
+
+
+def decode_cursor(sort_keys, cursor):
+    """Return (direction, values) for a cursor produced by encode_cursor()"""
+    try:
+        data = _serializer().loads(cursor)
+    except BadSignature as e:
+        raise InvalidCursor('Invalid cursor') from e
+    if not isinstance(data, dict) or data.get('k') != _fingerprint(sort_keys):
+        raise InvalidCursor('Cursor does not belong to this listing')
+    values = data.get('v') or []
+    if len(values) != len(sort_keys) or data.get('d') not in ('next', 'prev'):
+        raise InvalidCursor('Malformed cursor')
+    return data['d'], [_from_jsonable(v) for v in values]
+
+
+def _seek_condition(sort_keys, values, reverse):
+    """
+    Rows strictly after ``values`` in the listing order (before, if reverse):
+    (k1 > v1) OR (k1 = v1 AND k2 > v2) OR ... with per-key direction.
+    """
+    clauses = []
+    for i, key in enumerate(sort_keys):
+        descending = key.desc != reverse
+        cmp = key.expr < values[i] if descending else key.expr > values[i]
+        equals = [sort_keys[j].expr == values[j] for j in range(i)]
+        clauses.append(and_(*equals, cmp) if equals else cmp)
+    return or_(*clauses)
+
+
+# ==================== COUNTS ====================
+
+def approximate_count(query, cap=APPROXIMATE_COUNT_CAP):
+    """
+    Cheap row count. On PostgreSQL this is the planner estimate (no scan);
+    elsewhere an exact count that stops after ``cap`` rows.
+    Returns (count, is_estimate).
+    """
+    session = query.session
+    bind = session.get_bind()
+    statement = query.order_by(None).statement
+
+    if bind.dialect.name == 'postgresql':
+        try:
+            compiled = statement.compile(bind=bind, compile_kwargs={'literal_binds': True})
+            # Savepoint, so a failed EXPLAIN leaves the caller's transaction usable
+            with session.begin_nested():
+                plan = session.execute(text(f'EXPLAIN (FORMAT JSON) {compiled}')).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return int(plan[0]['Plan']['Plan Rows']), True
+        except Exception:
+            pass  # Fall back to a capped count below
+
+    capped = statement.limit(cap + 1).subquery()
+    count = session.execute(select(func.count()).select_from(capped)).scalar() or 0
+    if count > cap:
+        return cap, True
+    return count, False
+
+
+# ==================== PAGINATION ====================
+
+def parse_per_page(value, default=DEFAULT_PER_PAGE, maximum=MAX_PER_PAGE):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return max(1, min(value, maximum))
+
+
+def keyset_paginate(query, sort_keys, cursor=None, per_page=DEFAULT_PER_PAGE, count_mode='none',
+                    max_per_page=MAX_PER_PAGE):
+    """
+    Fetch one page of ``query`` ordered by ``sort_keys``.
+
+    ``cursor`` is a next/prev cursor from a previous page (or None for the
+    first page). ``count_mode`` is 'exact', 'approximate' or 'none'.
+    Raises InvalidCursor for bad cursors.
+    """
+    per_page = parse_per_page(per_page, DEFAULT_PER_PAGE, max_per_page)
+    if count_mode not in COUNT_MODES:
+        count_mode = 'none'
+
+    total, is_estimate = None, False
+    if count_mode == 'exact':
+        total = query.order_by(None).count()
+    elif count_mode == 'approximate':
+        total, is_estimate = approximate_count(query)
+
+    direction, values = ('next', None)
+    if cursor:
+        direction, values = decode_cursor(sort_keys, cursor)
+    backwards = direction == 'prev'
+
+    page_query = query.order_by(None)
+    if values is not None:
+        page_query = page_query.filter(_seek_condition(sort_keys, values, reverse=backwards))
+    page_query = page_query.order_by(*[k.order_by(reverse=backwards) for k in sort_keys])
+
+    rows = page_query.limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if backwards:
+        rows.reverse()
+
+    if backwards:
+        has_next, has_prev = values is not None, has_more
+    else:
+        has_next, has_prev = has_more, values is not None
+
+    next_cursor = encode_cursor(sort_keys, rows[-1], 'next') if rows and has_next else None
+    prev_cursor = encode_cursor(sort_keys, rows[0], 'prev') if rows and has_prev else None
+
+    return KeysetPage(rows, per_page, next_cursor, prev_cursor, total, is_estimate)
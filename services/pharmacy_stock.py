@@ -0,0 +1,577 @@
+"""
+Pharmacy Stock Engine
+Batch/expiry tracking, request reservations and stock-aware pharmacy routing.
+
+Each ``inventory`` item is backed by ``inventory_batches`` (one row per
+received lot with its own expiry). ``Inventory.stock_quantity`` and
+``expiry_date`` become derived values: free units in unexpired batches and
+the earliest of their expiries. A session flush hook recounts them whenever
+batches change, and keeps ``pharmacy_stock_index`` (free units per pharmacy
+and normalised medicine name) in step for client routing.
+
+Accepting a ``PharmacyRequest`` parses its medicine lines and reserves them
+first-expiry-first-out. Every decrement is a conditional UPDATE
+(``quantity >= n``), so simultaneous acceptances can never take the same
+units twice; the request's own status change is guarded the same way.
+Rejecting/cancelling puts reserved units back on their batch, completing
+marks them dispensed.
+
+Stock recorded before batches existed gets its opening batches and index
+rows at startup; stock reads and routing never write. Units in batches
+that expire drop out of the totals with the nightly sweep from cron::
+
+    python -m services.pharmacy_stock sweep      # nightly
+    python -m services.pharmacy_stock rebuild
+
+Concurrent acceptance is covered by tests/test_pharmacy_stock.py.
+"""
+import re
+from datetime import date, datetime
+
+from sqlalchemy import func, select, update, inspect as sa_inspect
+
+from services.runtime import ServiceRuntime, cli_app
+
+OPENING_BATCH = 'OPENING'  # Stock recorded before batches were tracked
+MAX_LINE_QUANTITY = 1000
+
+# Request status -> statuses it may be reached from
+REQUEST_TRANSITIONS = {
+    'accepted': ('pending',),
+    'ready': ('accepted',),
+    'completed': ('accepted', 'ready'),
+    'rejected': ('pending', 'accepted', 'ready'),
+    'cancelled': ('pending', 'accepted', 'ready'),
+}
+RELEASING_STATUSES = ('rejected', 'cancelled')
+
+ITEM_FIELDS = ('medicine_name', 'pharmacy_id')
+
+_runtime = ServiceRuntime()
+
+
+class StockConflict(Exception):
+    """Raised when a request is not in the state an action expects"""
+
+
+class InsufficientStock(Exception):
+    """Raised when a request cannot be filled; ``lines`` carries the per-medicine check"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        short = [f"{line['name']} ({line['reserved']}/{line['requested']})" for line in lines if line['short']]
+        super().__init__('Not enough stock for: ' + ', '.join(short))
+
+
+def init_pharmacy_stock(db, models):
+    """Register the db and model classes and install the sync hook"""
+    _runtime.init(db, models)
+    _runtime.listen('after_flush', _collect_stock_changes, 'Inventory', 'InventoryBatch')
+
+
+_m = _runtime.model
+
+
+# ==================== MEDICINE LINES ====================
+
+_UNIT_GAP = re.compile(r'(\d)\s+(mg|mcg|ml|g|iu|%)\b')
+_QTY_TAG = re.compile(r'\(\s*(?:qty|quantity)\s*[:=]?\s*(\d+)\s*\)', re.I)
+_QTY_TRAILING = re.compile(
+    r'\s*(?:x|×|\*|-|:|qty\s*:?|quantity\s*:?)\s*(\d+)\s*'
+    r'(?:tabs?|tablets?|caps?|capsules?|strips?|bottles?|units?|nos?\.?|pcs?)?\s*$', re.I
+)
+_QTY_LEADING = re.compile(r'^\s*(\d+)\s*(?:x|×|\*)\s+', re.I)
+
+
+def medicine_key(name):
+    """'Paracetamol 500 MG', 'paracetamol-500mg' -> 'paracetamol 500mg'"""
+    text = _UNIT_GAP.sub(r'\1\2', (name or '').lower())
+    return ' '.join(re.sub(r'[^a-z0-9%.]+', ' ', text).split()) or None
+
+
+def parse_medicine_lines(text):
+    """
+    Medicine lines from a request's free text as [{'name', 'key', 'quantity'}].
+
+    Understands the dashboard format ('Name (Qty: 10), Other (Qty: 2)') and
+    the usual hand-typed forms ('Name x 10', 'Name - 10 tabs', '2 x Name');
+    lines without a quantity count as one. Repeated medicines are merged.
+    """
+    lines = {}
+    for part in re.split(r'[\n;]|,(?![^()]*\))', text or ''):
+        part = part.strip(' \t-•')
+        if not part:
+            continue
+        quantity = None
+        for pattern in (_QTY_TAG, _QTY_TRAILING, _QTY_LEADING):
+            match = pattern.search(part)
+            if match:
+                quantity = int(match.group(1))
+                part = (part[:match.start()] + ' ' + part[match.end():]).strip()
+                break
+        key = medicine_key(part)
+        if not key:
+            continue
+        quantity = min(max(quantity or 1, 1), MAX_LINE_QUANTITY)
+        if key in lines:
+            lines[key]['quantity'] += quantity
+        else:
+            lines[key] = {'name': part, 'key': key, 'quantity': quantity}
+    return list(lines.values())
+
+
+# ==================== TOTALS & INDEX ====================
+
+def _usable(batches, today):
+    return (batches.c.quantity > 0) & (batches.c.expiry_date.is_(None) | (batches.c.expiry_date >= today))
+
+
+def _recount_item(conn, inventory_id, today=None):
+    """Derive an item's stock_quantity/expiry_date from its batches; returns (pharmacy_id, key)"""
+    items, batches = _m('Inventory').__table__, _m('InventoryBatch').__table__
+    today = today or date.today()
+    row = conn.execute(
+        select(items.c.pharmacy_id, items.c.medicine_name).where(items.c.id == inventory_id)
+    ).first()
+    if row is None:
+        return None
+    quantity, next_expiry = conn.execute(
+        select(func.coalesce(func.sum(batches.c.quantity), 0), func.min(batches.c.expiry_date)).where(
+            batches.c.inventory_id == inventory_id, _usable(batches, today)
+        )
+    ).one()
+    conn.execute(items.update().where(items.c.id == inventory_id).values(
+        stock_quantity=quantity, expiry_date=next_expiry
+    ))
+    return row.pharmacy_id, medicine_key(row.medicine_name)
+
+
+def _recount_key(conn, pharmacy_id, key):
+    """Recompute one pharmacy/medicine index row from the item totals"""
+    items, table = _m('Inventory').__table__, _m('PharmacyStockIndex').__table__
+    rows = [
+        r for r in conn.execute(
+            select(items.c.medicine_name, items.c.stock_quantity, items.c.expiry_date).where(
+                items.c.pharmacy_id == pharmacy_id
+            ).order_by(items.c.id)
+        )
+        if medicine_key(r.medicine_name) == key
+    ]
+    quantity = sum(max(r.stock_quantity or 0, 0) for r in rows)
+    match = (table.c.pharmacy_id == pharmacy_id) & (table.c.medicine_key == key)
+    if not quantity:
+        conn.execute(table.delete().where(match))
+        return
+    expiries = [r.expiry_date for r in rows if r.expiry_date and r.stock_quantity]
+    values = {
+        'medicine_name': rows[0].medicine_name,
+        'quantity_available': quantity,
+        'next_expiry': min(expiries) if expiries else None,
+        'updated_at': datetime.utcnow(),
+    }
+    if not conn.execute(table.update().where(match).values(**values)).rowcount:
+        conn.execute(table.insert().values(pharmacy_id=pharmacy_id, medicine_key=key, **values))
+
+
+def _resync(conn, inventory_ids=(), keys=(), today=None):
+    keys = set(keys)
+    for inventory_id in set(inventory_ids):
+        key = _recount_item(conn, inventory_id, today)
+        if key:
+            keys.add(key)
+    for pharmacy_id, key in keys:
+        if pharmacy_id and key:
+            _recount_key(conn, pharmacy_id, key)
+
+
+def _item_key(item, state=None):
+    """(pharmacy_id, key) for an item, optionally as it was before this flush"""
+    if state is None:
+        return item.pharmacy_id, medicine_key(item.medicine_name)
+    old = {}
+    for field in ITEM_FIELDS:
+        history = state.attrs[field].history
+        old[field] = history.deleted[0] if history.deleted else getattr(item, field)
+    return old['pharmacy_id'], medicine_key(old['medicine_name'])
+
+
+def _collect_stock_changes(session, flush_context):
+    """Recount items whose batches changed and the index rows they feed"""
+    Inventory, InventoryBatch = _m('Inventory'), _m('InventoryBatch')
+
+    item_ids, keys = set(), set()
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, InventoryBatch):
+            if obj.inventory_id is not None:
+                item_ids.add(obj.inventory_id)
+        elif isinstance(obj, Inventory):
+            keys.add(_item_key(obj))
+            if obj in session.dirty:
+                state = sa_inspect(obj)
+                if any(state.attrs[field].history.has_changes() for field in ITEM_FIELDS):
+                    keys.add(_item_key(obj, state))  # Renamed: the old index row shrinks
+
+    if item_ids or keys:
+        _resync(session.connection(), item_ids, keys)
+
+
+def _unbatched_items_exist():
+    """Items with stock but no batches (recorded before batches were tracked)"""
+    Inventory, InventoryBatch = _m('Inventory'), _m('InventoryBatch')
+    batched = _runtime['db'].session.query(InventoryBatch.id).filter(InventoryBatch.inventory_id == Inventory.id)
+    return Inventory.query.filter(Inventory.stock_quantity > 0, ~batched.exists()).first() is not None
+
+
+def _unindexed_pharmacies_exist():
+    Inventory, Entry = _m('Inventory'), _m('PharmacyStockIndex')
+    indexed = _runtime['db'].session.query(Entry.id).filter(Entry.pharmacy_id == Inventory.pharmacy_id)
+    return Inventory.query.filter(Inventory.stock_quantity > 0, ~indexed.exists()).first() is not None
+
+
+def migrate_opening_stock():
+    """Give every unbatched item an OPENING batch holding its recorded stock"""
+    db, Inventory, InventoryBatch = _runtime['db'], _m('Inventory'), _m('InventoryBatch')
+    batched = db.session.query(InventoryBatch.id).filter(InventoryBatch.inventory_id == Inventory.id)
+    items = Inventory.query.filter(Inventory.stock_quantity > 0, ~batched.exists()).all()
+    for item in items:
+        db.session.add(InventoryBatch(
+            inventory_id=item.id, batch_number=OPENING_BATCH, quantity=item.stock_quantity,
+            received_quantity=item.stock_quantity, expiry_date=item.expiry_date,
+            received_at=item.created_at or datetime.utcnow()
+        ))
+    db.session.commit()
+    return len(items)
+
+
+def rebuild_index():
+    """Recount every item from its batches and rebuild the routing index"""
+    db, Inventory = _runtime['db'], _m('Inventory')
+    table = _m('PharmacyStockIndex').__table__
+    migrated = migrate_opening_stock()
+    conn = db.session.connection()
+    conn.execute(table.delete())
+    ids = [item_id for (item_id,) in db.session.query(Inventory.id)]
+    _resync(conn, ids)
+    db.session.commit()
+    return {'items': len(ids), 'opening_batches': migrated}
+
+
+def sweep_expired(today=None):
+    """Recount items whose earliest usable batch has expired (nightly)"""
+    db, Inventory = _runtime['db'], _m('Inventory')
+    today = today or date.today()
+    # expiry_date is derived from the usable batches, so it names exactly the stale items
+    ids = [item_id for (item_id,) in db.session.query(Inventory.id).filter(Inventory.expiry_date < today)]
+    _resync(db.session.connection(), ids, today=today)
+    db.session.commit()
+    return {'items_recounted': len(ids)}
+
+
+def ensure_index():
+    """Opening batches and index rows for stock recorded before they existed (startup); summary or None"""
+    if _unbatched_items_exist() or _unindexed_pharmacies_exist():
+        return rebuild_index()
+    return None
+
+
+# ==================== STOCK EDITS ====================
+
+def receive_batch(item, quantity, expiry_date=None, batch_number=None):
+    """Add a received lot to an item (caller commits)"""
+    InventoryBatch = _m('InventoryBatch')
+    batch = InventoryBatch(
+        inventory_id=item.id, batch_number=batch_number, quantity=quantity,
+        received_quantity=quantity, expiry_date=expiry_date
+    )
+    _runtime['db'].session.add(batch)
+    return batch
+
+
+def _fefo(query, today):
+    InventoryBatch = _m('InventoryBatch')
+    return query.filter(
+        InventoryBatch.quantity > 0,
+        (InventoryBatch.expiry_date.is_(None)) | (InventoryBatch.expiry_date >= today)
+    ).order_by(InventoryBatch.expiry_date.is_(None), InventoryBatch.expiry_date, InventoryBatch.id)
+
+
+def set_stock(item, quantity, expiry_date=None):
+    """
+    Bring an item's free stock to ``quantity`` (manual stock edit, caller commits).
+    Increases become a new batch; decreases are written off first-expiry-first.
+    """
+    InventoryBatch = _m('InventoryBatch')
+    today = date.today()
+    batches = _fefo(InventoryBatch.query.filter_by(inventory_id=item.id), today).all()
+    current = sum(b.quantity for b in batches)
+    if quantity > current:
+        receive_batch(item, quantity - current, expiry_date or item.expiry_date)
+    excess = current - quantity
+    for batch in batches:
+        if excess <= 0:
+            break
+        taken = min(batch.quantity, excess)
+        batch.quantity -= taken
+        excess -= taken
+
+
+def set_expiry(item, expiry_date, today=None):
+    """
+    Move the item's soonest-expiring lot(s), the ones behind its displayed
+    expiry, to ``expiry_date`` (manual edit, caller commits). Returns the
+    number of batches changed; 0 when nothing usable is in stock.
+    """
+    InventoryBatch = _m('InventoryBatch')
+    batches = _fefo(InventoryBatch.query.filter_by(inventory_id=item.id), today or date.today()).all()
+    if not batches:
+        return 0
+    soonest = [b for b in batches if b.expiry_date == batches[0].expiry_date]
+    for batch in soonest:
+        batch.expiry_date = expiry_date
+    return len(soonest)
+
+
+def item_batches(item, today=None):
+    """Batches of an item, soonest expiry first, for the inventory screen"""
+    InventoryBatch = _m('InventoryBatch')
+    today = today or date.today()
+    batches = InventoryBatch.query.filter(
+        InventoryBatch.inventory_id == item.id, InventoryBatch.quantity > 0
+    ).order_by(InventoryBatch.expiry_date.is_(None), InventoryBatch.expiry_date, InventoryBatch.id)
+    return [{
+        'id': b.id,
+        'batch_number': b.batch_number,
+        'quantity': b.quantity,
+        'expiry': b.expiry_date.strftime('%Y-%m-%d') if b.expiry_date else '',
+        'expired': bool(b.expiry_date and b.expiry_date < today),
+    } for b in batches]
+
+
+def reserved_quantity(inventory_id):
+    Reservation = _m('PharmacyReservation')
+    return _runtime['db'].session.query(func.coalesce(func.sum(Reservation.quantity), 0)).filter(
+        Reservation.inventory_id == inventory_id, Reservation.status == 'reserved'
+    ).scalar()
+
+
+# ==================== REQUESTS ====================
+
+def _items_by_key(pharmacy_id, keys):
+    Inventory = _m('Inventory')
+    found = {}
+    for item_id, name in _runtime['db'].session.query(Inventory.id, Inventory.medicine_name).filter_by(pharmacy_id=pharmacy_id):
+        key = medicine_key(name)
+        if key in keys:
+            found.setdefault(key, []).append(item_id)
+    return found
+
+
+def _take(conn, batch_id, wanted):
+    """Decrement one batch by up to ``wanted`` units; returns the units taken"""
+    batches = _m('InventoryBatch').__table__
+    while wanted > 0:
+        available = conn.execute(select(batches.c.quantity).where(batches.c.id == batch_id)).scalar() or 0
+        taken = min(available, wanted)
+        if taken <= 0:
+            return 0
+        if conn.execute(
+            batches.update().where(batches.c.id == batch_id, batches.c.quantity >= taken).values(
+                quantity=batches.c.quantity - taken
+            )
+        ).rowcount:
+            return taken
+        # Another reservation got to this batch between the read and the update; re-read
+    return 0
+
+
+def _guard_status(pharmacy_request, status):
+    """Move a request to ``status`` only from an allowed status (one UPDATE)"""
+    PharmacyRequest = _m('PharmacyRequest')
+    allowed = REQUEST_TRANSITIONS.get(status)
+    if allowed is None:
+        raise ValueError(f"Unknown status '{status}'")
+    changed = _runtime['db'].session.execute(
+        update(PharmacyRequest).where(
+            PharmacyRequest.id == pharmacy_request.id,
+            PharmacyRequest.status.in_(allowed)
+        ).values(status=status, updated_at=datetime.utcnow()).execution_options(synchronize_session=False)
+    ).rowcount
+    if changed != 1:
+        _runtime['db'].session.rollback()
+        _runtime['db'].session.refresh(pharmacy_request)
+        raise StockConflict(f"Request is already {pharmacy_request.status}")
+
+
+def accept_request(pharmacy_request, allow_partial=False, today=None):
+    """
+    Accept a pending request and reserve its medicines first-expiry-first-out
+    (caller commits). Raises InsufficientStock, after rolling back, when any
+    line is short and ``allow_partial`` is not set.
+    """
+    db, Reservation, InventoryBatch = _runtime['db'], _m('PharmacyReservation'), _m('InventoryBatch')
+    today = today or date.today()
+    _guard_status(pharmacy_request, 'accepted')
+
+    # Fixed key order so concurrent acceptances lock batches in the same order
+    lines = sorted(parse_medicine_lines(pharmacy_request.medicine_details), key=lambda line: line['key'])
+    items = _items_by_key(pharmacy_request.pharmacy_id, {l['key'] for l in lines})
+    conn = db.session.connection()
+
+    result, touched = [], set()
+    for line in lines:
+        reserved = 0
+        item_ids = items.get(line['key'], [])
+        if item_ids:
+            candidates = _fefo(
+                db.session.query(InventoryBatch.id, InventoryBatch.inventory_id).filter(
+                    InventoryBatch.inventory_id.in_(item_ids)
+                ), today
+            ).all()
+            for batch_id, inventory_id in candidates:
+                if reserved >= line['quantity']:
+                    break
+                taken = _take(conn, batch_id, line['quantity'] - reserved)
+                if taken:
+                    reserved += taken
+                    touched.add(inventory_id)
+                    db.session.add(Reservation(
+                        request_id=pharmacy_request.id, pharmacy_id=pharmacy_request.pharmacy_id,
+                        inventory_id=inventory_id, batch_id=batch_id,
+                        medicine_name=line['name'], quantity=taken, status='reserved'
+                    ))
+        result.append({
+            'name': line['name'], 'requested': line['quantity'], 'reserved': reserved,
+            'stocked': bool(item_ids), 'short': reserved < line['quantity'],
+        })
+
+    if any(line['short'] for line in result) and not allow_partial:
+        db.session.rollback()
+        db.session.refresh(pharmacy_request)
+        raise InsufficientStock(result)
+
+    _resync(conn, touched, today=today)
+    return result
+
+
+def release_request(pharmacy_request, status='rejected'):
+    """Reject/cancel a request, returning any reserved units to their batches (caller commits)"""
+    db, Reservation = _runtime['db'], _m('PharmacyReservation')
+    batches = _m('InventoryBatch').__table__
+    _guard_status(pharmacy_request, status)
+
+    conn, touched = db.session.connection(), set()
+    for reservation in Reservation.query.filter_by(request_id=pharmacy_request.id, status='reserved'):
+        if reservation.batch_id and conn.execute(
+            batches.update().where(batches.c.id == reservation.batch_id).values(
+                quantity=batches.c.quantity + reservation.quantity
+            )
+        ).rowcount:
+            touched.add(reservation.inventory_id)
+        reservation.status = 'released'
+    _resync(conn, touched)
+
+
+def complete_request(pharmacy_request):
+    """Hand over a request; its reservations become dispensed stock (caller commits)"""
+    Reservation = _m('PharmacyReservation')
+    _guard_status(pharmacy_request, 'completed')
+    Reservation.query.filter_by(request_id=pharmacy_request.id, status='reserved').update(
+        {'status': 'dispensed', 'updated_at': datetime.utcnow()}, synchronize_session=False
+    )
+
+
+def transition_request(pharmacy_request, status, allow_partial=False):
+    """Apply a dashboard status change; returns the reservation lines when accepting"""
+    if status == 'accepted':
+        return accept_request(pharmacy_request, allow_partial)
+    if status in RELEASING_STATUSES:
+        release_request(pharmacy_request, status)
+    elif status == 'completed':
+        complete_request(pharmacy_request)
+    else:
+        _guard_status(pharmacy_request, status)
+    return None
+
+
+def stock_check(pharmacy_request):
+    """
+    Can the pharmacy fill this request? Pending requests are checked against
+    free stock; accepted ones report what was reserved for them.
+    """
+    db, Entry, Reservation = _runtime['db'], _m('PharmacyStockIndex'), _m('PharmacyReservation')
+    lines = parse_medicine_lines(pharmacy_request.medicine_details)
+    if not lines or pharmacy_request.status not in ('pending', 'accepted', 'ready'):
+        return None
+
+    if pharmacy_request.status == 'pending':
+        available = dict(db.session.query(Entry.medicine_key, Entry.quantity_available).filter(
+            Entry.pharmacy_id == pharmacy_request.pharmacy_id,
+            Entry.medicine_key.in_([l['key'] for l in lines])
+        ).all())
+        checked = [{
+            'name': l['name'], 'requested': l['quantity'], 'available': available.get(l['key'], 0),
+            'short': available.get(l['key'], 0) < l['quantity'],
+        } for l in lines]
+    else:
+        held = {}
+        for name, quantity in db.session.query(Reservation.medicine_name, Reservation.quantity).filter(
+            Reservation.request_id == pharmacy_request.id, Reservation.status != 'released'
+        ):
+            held[medicine_key(name)] = held.get(medicine_key(name), 0) + quantity
+        if not held:
+            return None  # Accepted before reservations were tracked
+        checked = [{
+            'name': l['name'], 'requested': l['quantity'], 'reserved': held.get(l['key'], 0),
+            'short': held.get(l['key'], 0) < l['quantity'],
+        } for l in lines]
+    return {'can_fill': not any(l['short'] for l in checked), 'lines': checked}
+
+
+# ==================== ROUTING ====================
+
+def pharmacies_for(lines):
+    """
+    Pharmacies stocking any of ``lines`` as [(pharmacy_id, coverage)], best first:
+    those that can fill everything, then by lines covered and units short.
+    """
+    Entry = _m('PharmacyStockIndex')
+    wanted = {l['key']: l for l in lines}
+    stock = {}
+    for pharmacy_id, key, quantity in _runtime['db'].session.query(
+        Entry.pharmacy_id, Entry.medicine_key, Entry.quantity_available
+    ).filter(Entry.medicine_key.in_(list(wanted)), Entry.quantity_available > 0):
+        stock.setdefault(pharmacy_id, {})[key] = quantity
+
+    ranked = []
+    for pharmacy_id, held in stock.items():
+        covered = sum(1 for key, line in wanted.items() if held.get(key, 0) >= line['quantity'])
+        short_units = sum(max(line['quantity'] - held.get(key, 0), 0) for key, line in wanted.items())
+        ranked.append((pharmacy_id, {
+            'can_fill': covered == len(wanted),
+            'lines_covered': covered,
+            'lines_requested': len(wanted),
+            'missing': [line['name'] for key, line in wanted.items() if held.get(key, 0) < line['quantity']],
+            '_short_units': short_units,
+        }))
+    ranked.sort(key=lambda r: (not r[1]['can_fill'], -r[1]['lines_covered'], r[1]['_short_units'], r[0]))
+    for _, coverage in ranked:
+        coverage.pop('_short_units')
+    return ranked
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Pharmacy stock engine tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('sweep', help='Drop expired batches out of item totals and the index')
+    sub.add_parser('rebuild', help='Recount every item from its batches and rebuild the index')
+    args = parser.parse_args()
+
+    app, service = cli_app('services.pharmacy_stock')
+
+    with app.app_context():
+        if args.command == 'sweep':
+            print(f"✅ Expiry sweep: {service.sweep_expired()}")
+        else:
+            print(f"✅ Index rebuilt: {service.rebuild_index()}")
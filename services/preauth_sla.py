@@ -0,0 +1,284 @@
+"""
+Pre-Auth SLA
+Response deadlines, breach detection and breach alerts for cashless pre-authorisations.
+
+Every ``CashlessPreAuth`` gets ``sla_deadline = request_date + sla_hours`` of
+its insurer when it is created (flush hook). Pending requests form a deadline
+queue on the (approval_status, sla_breach, sla_deadline) index:
+
+* the sweeper takes the head of the queue whose deadline has passed, flips
+  ``sla_breach`` with one conditional UPDATE ... RETURNING and writes one
+  ``preauth_sla_alerts`` row per request it actually flipped in a single
+  multi-row INSERT;
+* a decision recorded after the deadline marks the request breached at once,
+  so approved/rejected history stays accurate without waiting for a sweep.
+
+The sweeper is timer-driven: it sleeps until the earliest pending deadline
+(capped at SWEEP_MAX_SECONDS) and is woken early when a request with a sooner
+deadline is committed. With PREAUTH_SLA_SWEEPER=embedded (default) it runs as a
+daemon thread started by the insurer dashboard; with ``external`` run::
+
+    python -m services.preauth_sla sweep            # one pass
+    python -m services.preauth_sla sweep --loop     # long-running sweeper
+    python -m services.preauth_sla migrate          # add/backfill sla_deadline
+"""
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, bindparam, case, func, inspect as sa_inspect, select, text
+
+from services.runtime import ServiceRuntime, cli_app
+
+DEFAULT_SLA_HOURS = 48
+DUE_SOON_HOURS = 4
+SWEEP_BATCH = 1000
+SWEEP_MAX_SECONDS = 300  # Longest the sweeper sleeps even when no deadline is near
+SWEEP_MIN_SECONDS = 1
+QUEUE_INDEX = ('ix_cashless_pre_auth_sla_queue', 'approval_status, sla_breach, sla_deadline')
+COMPANY_INDEX = ('ix_cashless_pre_auth_company_sla', 'insurance_company_id, approval_status, sla_deadline')
+
+_runtime = ServiceRuntime(sweeper=None)
+_sweeper_lock = threading.Lock()
+_wake = threading.Event()
+
+
+def init_preauth_sla(app, db, models):
+    """Register the app, db and model classes and install the deadline hook"""
+    _runtime.init(db, models, app)
+    _runtime.listen('before_flush', _stamp_deadlines, 'CashlessPreAuth')
+    _runtime.listen('after_commit', _wake_sweeper)
+    _runtime.listen('after_rollback', _drop_wake)
+
+
+_m = _runtime.model
+_t = _runtime.table
+
+
+# ==================== DEADLINES ====================
+
+def deadline_for(request_date, sla_hours):
+    return (request_date or datetime.utcnow()) + timedelta(hours=sla_hours or DEFAULT_SLA_HOURS)
+
+
+def remaining_hours(pre_auth, now=None):
+    """Hours left on a pending request (negative once overdue); None when decided"""
+    if pre_auth.approval_status != 'Pending' or pre_auth.sla_deadline is None:
+        return None
+    return round((pre_auth.sla_deadline - (now or datetime.utcnow())).total_seconds() / 3600, 1)
+
+
+def _stamp_deadlines(session, flush_context, instances):
+    """Deadline on creation; breach flag when a decision lands after the deadline"""
+    PreAuth = _runtime['models'].get('CashlessPreAuth')
+    if PreAuth is None:
+        return
+    now = datetime.utcnow()
+    for obj in session.new:
+        if isinstance(obj, PreAuth) and obj.sla_deadline is None:
+            with session.no_autoflush:
+                company = session.get(_m('InsuranceCompany'), obj.insurance_company_id) if obj.insurance_company_id else None
+            obj.sla_deadline = deadline_for(obj.request_date or now, company.sla_hours if company else None)
+            session.info['preauth_sla_wake'] = True  # A sooner deadline may head the queue once committed
+    for obj in session.dirty:
+        if not isinstance(obj, PreAuth):
+            continue
+        history = sa_inspect(obj).attrs['approval_status'].history
+        if history.has_changes() and 'Pending' in (history.deleted or ()) and obj.approval_status != 'Pending':
+            if obj.sla_deadline is not None and now > obj.sla_deadline:
+                obj.sla_breach = True
+
+
+def _wake_sweeper(session):
+    if session.info.pop('preauth_sla_wake', False):
+        _wake.set()
+
+
+def _drop_wake(session):
+    session.info.pop('preauth_sla_wake', None)
+
+
+# ==================== SWEEP ====================
+
+def sweep(now=None):
+    """Flag pending requests past their deadline and write their alerts; returns the number flagged"""
+    db = _runtime['db']
+    pre_auth, alerts = _t('CashlessPreAuth'), _t('PreAuthSlaAlert')
+    now = now or datetime.utcnow()
+    flagged = 0
+    while True:
+        with db.engine.begin() as conn:
+            due = conn.execute(
+                select(pre_auth.c.id, pre_auth.c.pre_auth_id, pre_auth.c.insurance_company_id, pre_auth.c.sla_deadline)
+                .where(pre_auth.c.approval_status == 'Pending', pre_auth.c.sla_breach.isnot(True),
+                       pre_auth.c.sla_deadline <= now)
+                .order_by(pre_auth.c.sla_deadline)
+                .limit(SWEEP_BATCH)
+            ).all()
+            if not due:
+                return flagged
+            # Conditional: a concurrent sweeper or decision may have got there first,
+            # so only the rows this UPDATE flipped are alerted and counted
+            flipped = set(conn.execute(
+                pre_auth.update()
+                .where(pre_auth.c.id.in_([row.id for row in due]), pre_auth.c.approval_status == 'Pending',
+                       pre_auth.c.sla_breach.isnot(True))
+                .values(sla_breach=True, updated_at=now)
+                .returning(pre_auth.c.id)
+            ).scalars())
+            fresh = [{
+                'insurance_company_id': row.insurance_company_id,
+                'pre_auth_pk': row.id,
+                'pre_auth_id': row.pre_auth_id,
+                'sla_deadline': row.sla_deadline,
+                'breached_at': now,
+                'is_acknowledged': False,
+                'created_at': now,
+            } for row in due if row.id in flipped]
+            if fresh:
+                conn.execute(alerts.insert(), fresh)
+            flagged += len(fresh)
+        if len(due) < SWEEP_BATCH:
+            return flagged
+
+
+def next_deadline():
+    """Earliest deadline still waiting in the queue, or None"""
+    pre_auth = _t('CashlessPreAuth')
+    with _runtime['db'].engine.connect() as conn:
+        return conn.execute(
+            select(func.min(pre_auth.c.sla_deadline))
+            .where(pre_auth.c.approval_status == 'Pending', pre_auth.c.sla_breach.isnot(True))
+        ).scalar()
+
+
+def run_sweeper(once=False):
+    """Sweep, then sleep until the next deadline (or a wake-up); loops unless once"""
+    while True:
+        try:
+            flagged = sweep()
+            if flagged:
+                print(f"Pre-auth SLA sweep: {flagged} request(s) breached")
+            upcoming = next_deadline()
+        except Exception as e:
+            print(f"Error in pre-auth SLA sweep: {e}")
+            upcoming = None
+        finally:
+            _runtime['db'].session.remove()
+        if once:
+            return
+        wait = SWEEP_MAX_SECONDS
+        if upcoming is not None:
+            wait = min(wait, max(SWEEP_MIN_SECONDS, (upcoming - datetime.utcnow()).total_seconds() + 1))
+        _wake.wait(wait)
+        _wake.clear()
+
+
+def ensure_sweeper():
+    """Start the embedded sweeper thread once per process (PREAUTH_SLA_SWEEPER=embedded)"""
+    app = _runtime['app']
+    if app is None or app.config.get('PREAUTH_SLA_SWEEPER', 'embedded') != 'embedded':
+        return False
+    with _sweeper_lock:
+        thread = _runtime['sweeper']
+        if thread is not None and thread.is_alive():
+            return False
+
+        def loop():
+            with app.app_context():
+                run_sweeper()
+
+        thread = threading.Thread(target=loop, name='preauth-sla-sweeper', daemon=True)
+        _runtime['sweeper'] = thread
+        thread.start()
+        return True
+
+
+# ==================== QUERIES ====================
+
+def sla_counts(insurance_company_id, now=None):
+    """Pending, breached and due-soon counts for one insurer from the deadline index"""
+    db = _runtime['db']
+    PreAuth = _m('CashlessPreAuth')
+    now = now or datetime.utcnow()
+    pending, breached, due_soon = db.session.query(
+        func.count(PreAuth.id),
+        func.coalesce(func.sum(case((PreAuth.sla_breach.is_(True), 1), else_=0)), 0),
+        func.coalesce(func.sum(case((and_(
+            PreAuth.sla_breach.isnot(True),
+            PreAuth.sla_deadline > now,
+            PreAuth.sla_deadline <= now + timedelta(hours=DUE_SOON_HOURS)
+        ), 1), else_=0)), 0)
+    ).filter(
+        PreAuth.insurance_company_id == insurance_company_id,
+        PreAuth.approval_status == 'Pending'
+    ).one()
+    return {'pending': pending, 'breached': int(breached), 'due_soon': int(due_soon)}
+
+
+def open_alerts(insurance_company_id, limit=100):
+    Alert = _m('PreAuthSlaAlert')
+    return Alert.query.filter_by(
+        insurance_company_id=insurance_company_id, is_acknowledged=False
+    ).order_by(Alert.breached_at.desc()).limit(limit).all()
+
+
+def acknowledge_alerts(insurance_company_id, alert_ids=None):
+    """Acknowledge some (or all) of an insurer's open alerts in one UPDATE"""
+    db = _runtime['db']
+    Alert = _m('PreAuthSlaAlert')
+    query = Alert.query.filter_by(insurance_company_id=insurance_company_id, is_acknowledged=False)
+    if alert_ids:
+        query = query.filter(Alert.id.in_(alert_ids))
+    count = query.update({'is_acknowledged': True, 'acknowledged_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return count
+
+
+# ==================== MIGRATION ====================
+
+def migrate_preauth_deadlines():
+    """Add sla_deadline and the queue indexes when missing, then backfill deadlines"""
+    db = _runtime['db']
+    inspector = sa_inspect(db.engine)
+    if 'cashless_pre_auth' not in inspector.get_table_names():
+        return None
+    columns = {c['name'] for c in inspector.get_columns('cashless_pre_auth')}
+    added = 'sla_deadline' not in columns
+    pre_auth, company = _t('CashlessPreAuth'), _t('InsuranceCompany')
+    with db.engine.begin() as conn:
+        if added:
+            conn.execute(text('ALTER TABLE cashless_pre_auth ADD COLUMN sla_deadline TIMESTAMP'))
+        for name, cols in (QUEUE_INDEX, COMPANY_INDEX):
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON cashless_pre_auth ({cols})'))
+        missing = conn.execute(
+            select(pre_auth.c.id, pre_auth.c.request_date, company.c.sla_hours)
+            .select_from(pre_auth.outerjoin(company, pre_auth.c.insurance_company_id == company.c.id))
+            .where(pre_auth.c.sla_deadline.is_(None))
+        ).all()
+        if missing:
+            conn.execute(
+                pre_auth.update().where(pre_auth.c.id == bindparam('pk')).values(sla_deadline=bindparam('deadline')),
+                [{'pk': row.id, 'deadline': deadline_for(row.request_date, row.sla_hours)} for row in missing]
+            )
+    if not (added or missing):
+        return None
+    return {'column_added': added, 'backfilled': len(missing)}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Cashless pre-auth SLA sweeper')
+    parser.add_argument('command', choices=['sweep', 'migrate'])
+    parser.add_argument('--loop', action='store_true', help='Keep sweeping at each deadline')
+    args = parser.parse_args()
+
+    app, service = cli_app('services.preauth_sla')
+
+    with app.app_context():
+        if args.command == 'migrate':
+            print(f"✅ Pre-auth deadlines: {service.migrate_preauth_deadlines()}")
+        elif args.loop:
+            service.run_sweeper()
+        else:
+            print(f"✅ Pre-auth SLA sweep: {service.sweep()} request(s) breached")
@@ -0,0 +1,881 @@
+"""
+Report Job Pipeline
+Queued generation of Reports Center documents for block and district admins.
+
+A request to generate a report creates a ``GeneratedReport`` row (status
+``queued``) and a ``ReportJob`` row. Workers claim jobs with a conditional
+UPDATE, so any number of worker processes can share the queue:
+
+    queued -> processing -> ready        (file written to the report store)
+                         -> queued       (retry with backoff)
+                         -> failed       (attempts exhausted)
+    ready  -> expired                    (file removed once expires_at passes)
+
+Reports are computed from the database with the aggregation done in SQL and
+written as PDF (reportlab), CSV, Excel or JSON.
+
+Run workers outside the web process (set REPORT_WORKER_MODE=external)::
+
+    python -m services.report_jobs worker            # poll forever
+    python -m services.report_jobs worker --once     # drain the queue and exit
+    python -m services.report_jobs cleanup           # expire old report files
+
+With the default REPORT_WORKER_MODE=embedded a long-lived background thread
+in the web process does the same: it is woken as soon as a report is
+requested and otherwise polls every EMBEDDED_POLL_SECONDS, which picks up
+retries whose backoff has passed and runs the hourly expiry cleanup.
+"""
+import json
+import os
+import socket
+import threading
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import and_, case, func, or_, select, update
+from werkzeug.utils import secure_filename
+
+from services.export_engine import WRITERS as EXPORT_WRITERS, iter_query
+from services.runtime import ServiceRuntime, cli_app
+
+JOB_MAX_ATTEMPTS = 3
+JOB_RETRY_BASE_SECONDS = 30
+JOB_LOCK_TIMEOUT = timedelta(minutes=15)  # Processing jobs older than this are requeued
+DEFAULT_RETENTION_DAYS = 30
+CLEANUP_INTERVAL_SECONDS = 3600
+EMBEDDED_POLL_SECONDS = 30
+
+# Output formats: export_format value -> (file extension, mimetype)
+REPORT_FORMATS = {
+    'pdf': ('pdf', 'application/pdf'),
+    'csv': ('csv', 'text/csv'),
+    'excel': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'json': ('json', 'application/json'),
+}
+FORMAT_ALIASES = {'xlsx': 'excel', 'api': 'json'}
+
+_runtime = ServiceRuntime(embedded_worker=None, last_cleanup=None)
+_worker_lock = threading.Lock()
+_wake = threading.Event()  # Set when a job is queued; wakes the embedded worker
+
+
+def init_report_jobs(app, db, models):
+    """Register the app, db and model classes used by the pipeline"""
+    _runtime.init(db, models, app)
+
+
+_m = _runtime.model
+
+
+def _db():
+    return _runtime['db']
+
+
+def normalize_report_format(export_format):
+    """Canonical export_format value, or None if unsupported"""
+    fmt = (export_format or 'pdf').lower().strip()
+    fmt = FORMAT_ALIASES.get(fmt, fmt)
+    return fmt if fmt in REPORT_FORMATS else None
+
+
+# ==================== SCOPE ====================
+
+class ReportScope:
+    """Set of blocks a report covers"""
+
+    def __init__(self, scope_type, scope_id, label, block_ids):
+        self.scope_type = scope_type
+        self.scope_id = scope_id
+        self.label = label
+        self.block_ids = block_ids
+
+    def worker_ids(self):
+        """Subquery of health worker ids in the scope"""
+        User = _m('User')
+        return select(User.id).where(
+            User.user_type == 'health_worker',
+            User.block_id.in_(self.block_ids)
+        ).scalar_subquery()
+
+
+def resolve_scope(scope_type, scope_id, params=None):
+    """Build the ReportScope for a job"""
+    Block, District = _m('Block'), _m('District')
+    params = params or {}
+
+    if scope_type == 'district':
+        district = District.query.filter_by(district_id=scope_id).first()
+        district_name = params.get('district_name') or (district.name if district else None)
+        conditions = []
+        if district:
+            conditions.append(Block.district_id_fk == district.id)
+        if district_name:
+            conditions.append(Block.district == district_name)
+        block_ids = [b for (b,) in _db().session.query(Block.block_id).filter(or_(*conditions))] if conditions else []
+        return ReportScope('district', scope_id, district_name or scope_id, block_ids)
+
+    block = Block.query.filter_by(block_id=scope_id).first()
+    return ReportScope('block', scope_id, block.name if block else scope_id, [scope_id])
+
+
+# ==================== REPORT BUILDERS ====================
+# Each builder returns a list of sheets, ``(title, header, rows)``, the same
+# shape the streaming export engine consumes.
+
+def _period_filter(column, start, end):
+    conditions = []
+    if start:
+        conditions.append(column >= start)
+    if end:
+        conditions.append(column <= end)
+    return and_(*conditions) if conditions else None
+
+
+def _pct(part, whole):
+    return round(part * 100.0 / whole, 1) if whole else 0.0
+
+
+def _fmt_date(value):
+    return value.strftime('%Y-%m-%d') if value else ''
+
+
+def build_household_coverage(scope, start, end):
+    db = _db()
+    Household, HouseholdMember, User = _m('Household'), _m('HouseholdMember'), _m('User')
+
+    members = db.session.query(
+        HouseholdMember.household_id.label('household_id'),
+        func.count(HouseholdMember.id).label('members')
+    ).group_by(HouseholdMember.household_id).subquery()
+
+    visited = and_(*[c for c in (
+        Household.last_visit_date.isnot(None),
+        _period_filter(Household.last_visit_date, start, end)
+    ) if c is not None])
+
+    by_village = db.session.query(
+        func.coalesce(Household.village, 'Unassigned').label('village'),
+        func.count(Household.id),
+        func.coalesce(func.sum(members.c.members), 0),
+        func.sum(case((Household.risk_level == 'high', 1), else_=0)),
+        func.sum(case((Household.has_pregnant_woman == True, 1), else_=0)),
+        func.sum(case((Household.has_child_under_5 == True, 1), else_=0)),
+        func.sum(case((visited, 1), else_=0)),
+    ).outerjoin(
+        members, members.c.household_id == Household.id
+    ).filter(
+        Household.health_worker_id.in_(scope.worker_ids())
+    ).group_by('village').order_by('village')
+
+    def village_row(row):
+        village, households, population, high_risk, pregnant, under5, visited_count = row
+        return [village, households, int(population or 0), int(high_risk or 0), int(pregnant or 0),
+                int(under5 or 0), int(visited_count or 0), f'{_pct(visited_count or 0, households)}%']
+
+    details = db.session.query(
+        Household, User.full_name, members.c.members
+    ).outerjoin(
+        User, User.id == Household.health_worker_id
+    ).outerjoin(
+        members, members.c.household_id == Household.id
+    ).filter(
+        Household.health_worker_id.in_(scope.worker_ids())
+    ).order_by(Household.village, Household.id)
+
+    def household_row(row):
+        h, worker_name, member_count = row
+        return [h.household_id, h.head_name, h.village or '', worker_name or '', int(member_count or 0),
+                h.risk_level or '', 'Yes' if h.has_pregnant_woman else 'No',
+                'Yes' if h.has_child_under_5 else 'No', _fmt_date(h.last_visit_date)]
+
+    return [
+        ('Coverage by Village',
+         ['Village', 'Households', 'Members', 'High Risk', 'With Pregnant Woman', 'With Child Under 5',
+          'Visited in Period', 'Visit Coverage'],
+         iter_query(by_village, village_row)),
+        ('Households',
+         ['Household ID', 'Head of Household', 'Village', 'Health Worker', 'Members', 'Risk Level',
+          'Pregnant Woman', 'Child Under 5', 'Last Visit'],
+         iter_query(details, household_row)),
+    ]
+
+
+def build_worker_performance(scope, start, end):
+    db = _db()
+    User, Household, HomeVisit = _m('User'), _m('Household'), _m('HomeVisit')
+    WorkerTask, WorkerAttendance = _m('WorkerTask'), _m('WorkerAttendance')
+    ImmunizationRecord, HealthReferral = _m('ImmunizationRecord'), _m('HealthReferral')
+
+    def count_for_worker(model, worker_column, *conditions):
+        stmt = select(func.count(model.id)).where(worker_column == User.id, *[c for c in conditions if c is not None])
+        return stmt.correlate(User).scalar_subquery()
+
+    task_period = _period_filter(WorkerTask.target_date, start, end)
+    query = db.session.query(
+        User.uid,
+        User.full_name,
+        count_for_worker(Household, Household.health_worker_id),
+        count_for_worker(HomeVisit, HomeVisit.worker_id, _period_filter(HomeVisit.visit_date, start, end)),
+        count_for_worker(WorkerTask, WorkerTask.worker_id, task_period),
+        count_for_worker(WorkerTask, WorkerTask.worker_id, task_period, WorkerTask.status == 'completed'),
+        count_for_worker(WorkerAttendance, WorkerAttendance.worker_id,
+                         _period_filter(WorkerAttendance.date, start, end), WorkerAttendance.status == 'present'),
+        count_for_worker(ImmunizationRecord, ImmunizationRecord.health_worker_id,
+                         _period_filter(ImmunizationRecord.given_date, start, end),
+                         ImmunizationRecord.status == 'completed'),
+        count_for_worker(HealthReferral, HealthReferral.health_worker_id,
+                         _period_filter(func.date(HealthReferral.created_at), start, end)),
+    ).filter(
+        User.user_type == 'health_worker',
+        User.block_id.in_(scope.block_ids)
+    ).order_by(User.full_name, User.id)
+
+    def worker_row(row):
+        uid, name, households, visits, tasks, completed, present, immunized, referrals = row
+        return [uid, name or '', households, visits, tasks, completed, f'{_pct(completed, tasks)}%',
+                present, immunized, referrals]
+
+    return [
+        ('Worker Performance',
+         ['UID', 'Health Worker', 'Households', 'Home Visits', 'Tasks', 'Tasks Completed', 'Completion Rate',
+          'Days Present', 'Immunizations Given', 'Referrals'],
+         iter_query(query, worker_row)),
+    ]
+
+
+def build_supply_status(scope, start, end):
+    db = _db()
+    FacilityInventory, Facility = _m('FacilityInventory'), _m('Facility')
+    today = date.today()
+
+    status = case(
+        (FacilityInventory.current_stock <= 0, 'out_of_stock'),
+        (FacilityInventory.current_stock <= FacilityInventory.minimum_stock, 'low'),
+        (FacilityInventory.current_stock >= FacilityInventory.maximum_stock, 'overstock'),
+        else_='normal'
+    ).label('stock_status')
+
+    summary = db.session.query(
+        Facility.name,
+        func.count(FacilityInventory.id),
+        func.sum(case((FacilityInventory.current_stock <= 0, 1), else_=0)),
+        func.sum(case((and_(FacilityInventory.current_stock > 0,
+                            FacilityInventory.current_stock <= FacilityInventory.minimum_stock), 1), else_=0)),
+        func.sum(case((FacilityInventory.expiry_date < today, 1), else_=0)),
+        func.sum(case((and_(FacilityInventory.expiry_date >= today,
+                            FacilityInventory.expiry_date <= today + timedelta(days=30)), 1), else_=0)),
+        func.coalesce(func.sum(FacilityInventory.current_stock * FacilityInventory.unit_price), 0),
+    ).join(
+        FacilityInventory, FacilityInventory.facility_id == Facility.id
+    ).filter(
+        Facility.block_id.in_(scope.block_ids)
+    ).group_by(Facility.id, Facility.name).order_by(Facility.name)
+
+    def summary_row(row):
+        name, items, out_of_stock, low, expired, expiring, value = row
+        return [name, items, int(out_of_stock or 0), int(low or 0), int(expired or 0), int(expiring or 0),
+                round(float(value or 0), 2)]
+
+    items = db.session.query(
+        Facility.name, FacilityInventory, status
+    ).join(
+        Facility, Facility.id == FacilityInventory.facility_id
+    ).filter(
+        Facility.block_id.in_(scope.block_ids)
+    ).order_by(Facility.name, FacilityInventory.category, FacilityInventory.item_name)
+
+    def item_row(row):
+        facility_name, inv, stock_status = row
+        days_to_expiry = (inv.expiry_date - today).days if inv.expiry_date else ''
+        return [facility_name, inv.item_name, inv.category, inv.current_stock, inv.minimum_stock,
+                inv.maximum_stock, inv.unit or '', stock_status, _fmt_date(inv.expiry_date), days_to_expiry]
+
+    return [
+        ('Stock Summary by Facility',
+         ['Facility', 'Items', 'Out of Stock', 'Low Stock', 'Expired', 'Expiring in 30 Days', 'Stock Value'],
+         iter_query(summary, summary_row)),
+        ('Inventory Items',
+         ['Facility', 'Item', 'Category', 'Current Stock', 'Minimum', 'Maximum', 'Unit', 'Status', 'Expiry Date',
+          'Days to Expiry'],
+         iter_query(items, item_row)),
+    ]
+
+
+def build_maternal_health(scope, start, end):
+    db = _db()
+    Household, HouseholdMember, HomeVisit, User = _m('Household'), _m('HouseholdMember'), _m('HomeVisit'), _m('User')
+    today = date.today()
+
+    anc_visits = select(func.count(HomeVisit.id)).where(
+        HomeVisit.household_id == HouseholdMember.household_id,
+        func.lower(HomeVisit.visit_type) == 'anc',
+        *[c for c in (_period_filter(HomeVisit.visit_date, start, end),) if c is not None]
+    ).correlate(HouseholdMember).scalar_subquery()
+
+    base_filter = and_(
+        HouseholdMember.is_pregnant == True,
+        Household.health_worker_id.in_(scope.worker_ids())
+    )
+
+    summary = db.session.query(
+        func.coalesce(Household.village, 'Unassigned').label('village'),
+        func.count(HouseholdMember.id),
+        func.sum(case((HouseholdMember.is_high_risk == True, 1), else_=0)),
+        func.sum(case((and_(HouseholdMember.expected_delivery_date >= today,
+                            HouseholdMember.expected_delivery_date <= today + timedelta(days=30)), 1), else_=0)),
+        func.sum(case((HouseholdMember.expected_delivery_date < today, 1), else_=0)),
+    ).join(
+        Household, Household.id == HouseholdMember.household_id
+    ).filter(base_filter).group_by('village').order_by('village')
+
+    def summary_row(row):
+        village, pregnant, high_risk, due_soon, past_due = row
+        return [village, pregnant, int(high_risk or 0), int(due_soon or 0), int(past_due or 0)]
+
+    details = db.session.query(
+        HouseholdMember, Household.household_id, Household.village, User.full_name, anc_visits
+    ).join(
+        Household, Household.id == HouseholdMember.household_id
+    ).outerjoin(
+        User, User.id == Household.health_worker_id
+    ).filter(base_filter).order_by(HouseholdMember.expected_delivery_date, HouseholdMember.id)
+
+    def member_row(row):
+        m, household_code, village, worker_name, anc_count = row
+        return [m.name, m.age or '', household_code, village or '', m.pregnancy_week or '',
+                _fmt_date(m.expected_delivery_date), 'Yes' if m.is_high_risk else 'No', m.risk_reason or '',
+                anc_count, worker_name or '']
+
+    return [
+        ('Pregnancies by Village',
+         ['Village', 'Pregnant Women', 'High Risk', 'EDD in 30 Days', 'Past EDD'],
+         iter_query(summary, summary_row)),
+        ('Pregnant Women',
+         ['Name', 'Age', 'Household', 'Village', 'Pregnancy Week', 'Expected Delivery', 'High Risk',
+          'Risk Reason', 'ANC Visits in Period', 'Health Worker'],
+         iter_query(details, member_row)),
+    ]
+
+
+def build_immunization(scope, start, end):
+    db = _db()
+    ImmunizationRecord = _m('ImmunizationRecord')
+    in_scope = and_(*[c for c in (
+        ImmunizationRecord.health_worker_id.in_(scope.worker_ids()),
+        _period_filter(ImmunizationRecord.due_date, start, end)
+    ) if c is not None])
+
+    by_vaccine = db.session.query(
+        ImmunizationRecord.vaccine_name,
+        func.count(ImmunizationRecord.id),
+        func.sum(case((ImmunizationRecord.status == 'completed', 1), else_=0)),
+        func.sum(case((ImmunizationRecord.status == 'due', 1), else_=0)),
+        func.sum(case((ImmunizationRecord.status == 'overdue', 1), else_=0)),
+        func.sum(case((ImmunizationRecord.status == 'missed', 1), else_=0)),
+    ).filter(in_scope).group_by(ImmunizationRecord.vaccine_name).order_by(ImmunizationRecord.vaccine_name)
+
+    def vaccine_row(row):
+        vaccine, total, completed, due, overdue, missed = row
+        completed = int(completed or 0)
+        return [vaccine, total, completed, int(due or 0), int(overdue or 0), int(missed or 0),
+                f'{_pct(completed, total)}%']
+
+    records = ImmunizationRecord.query.filter(in_scope).order_by(
+        ImmunizationRecord.due_date, ImmunizationRecord.id
+    )
+
+    def record_row(r):
+        return [r.child_name, _fmt_date(r.date_of_birth), r.village or '', r.vaccine_name, r.vaccine_dose,
+                _fmt_date(r.due_date), _fmt_date(r.given_date), r.status, r.session_site or '']
+
+    return [
+        ('Coverage by Vaccine',
+         ['Vaccine', 'Scheduled', 'Completed', 'Due', 'Overdue', 'Missed', 'Coverage'],
+         iter_query(by_vaccine, vaccine_row)),
+        ('Immunization Records',
+         ['Child', 'Date of Birth', 'Village', 'Vaccine', 'Dose', 'Due Date', 'Given Date', 'Status',
+          'Session Site'],
+         iter_query(records, record_row)),
+    ]
+
+
+def build_district_summary(scope, start, end):
+    db = _db()
+    Block, User, Household, HouseholdMember = _m('Block'), _m('User'), _m('Household'), _m('HouseholdMember')
+    ImmunizationRecord, FacilityInventory, Facility = _m('ImmunizationRecord'), _m('FacilityInventory'), _m('Facility')
+
+    workers = select(User.block_id.label('block_id'), User.id.label('worker_id')).where(
+        User.user_type == 'health_worker', User.block_id.in_(scope.block_ids)
+    ).subquery()
+
+    def per_block(*columns, joins=(), where=()):
+        stmt = select(workers.c.block_id, *columns).select_from(workers)
+        for target, onclause in joins:
+            stmt = stmt.join(target, onclause)
+        return db.session.execute(stmt.where(*where).group_by(workers.c.block_id)).all()
+
+    worker_counts = {b: n for b, n in per_block(func.count(workers.c.worker_id))}
+    household_counts = {b: (n, int(h or 0)) for b, n, h in per_block(
+        func.count(Household.id), func.sum(case((Household.risk_level == 'high', 1), else_=0)),
+        joins=[(Household, Household.health_worker_id == workers.c.worker_id)])}
+    member_counts = {b: (n, int(p or 0)) for b, n, p in per_block(
+        func.count(HouseholdMember.id), func.sum(case((HouseholdMember.is_pregnant == True, 1), else_=0)),
+        joins=[(Household, Household.health_worker_id == workers.c.worker_id),
+               (HouseholdMember, HouseholdMember.household_id == Household.id)])}
+    immunization_counts = {b: (n, int(c or 0)) for b, n, c in per_block(
+        func.count(ImmunizationRecord.id),
+        func.sum(case((ImmunizationRecord.status == 'completed', 1), else_=0)),
+        joins=[(ImmunizationRecord, ImmunizationRecord.health_worker_id == workers.c.worker_id)],
+        where=[c for c in (_period_filter(ImmunizationRecord.due_date, start, end),) if c is not None])}
+    low_stock = dict(db.session.query(
+        Facility.block_id, func.count(FacilityInventory.id)
+    ).join(
+        FacilityInventory, FacilityInventory.facility_id == Facility.id
+    ).filter(
+        Facility.block_id.in_(scope.block_ids),
+        FacilityInventory.current_stock <= FacilityInventory.minimum_stock
+    ).group_by(Facility.block_id).all())
+
+    blocks = Block.query.filter(Block.block_id.in_(scope.block_ids)).order_by(Block.name).all()
+    rows = []
+    for b in blocks:
+        households, high_risk = household_counts.get(b.block_id, (0, 0))
+        population, pregnant = member_counts.get(b.block_id, (0, 0))
+        scheduled, completed = immunization_counts.get(b.block_id, (0, 0))
+        rows.append([b.name, b.block_id, worker_counts.get(b.block_id, 0), households, population, high_risk,
+                     pregnant, scheduled, completed, f'{_pct(completed, scheduled)}%',
+                     low_stock.get(b.block_id, 0)])
+
+    return [
+        ('Block Summary',
+         ['Block', 'Block ID', 'Health Workers', 'Households', 'Population', 'High Risk Households',
+          'Pregnant Women', 'Immunizations Scheduled', 'Immunizations Completed', 'Immunization Coverage',
+          'Low Stock Items'],
+         rows),
+    ]
+
+
+# report_type -> builder, scope it applies to, default period in days
+REPORT_TYPES = {
+    'household_coverage': {'name': 'Household Coverage Report', 'builder': build_household_coverage,
+                           'scope': 'block', 'days': 30},
+    'worker_performance': {'name': 'Worker Performance Report', 'builder': build_worker_performance,
+                           'scope': 'block', 'days': 30},
+    'supply_status': {'name': 'Supply Status Report', 'builder': build_supply_status,
+                      'scope': 'block', 'days': 30},
+    'maternal_health': {'name': 'Maternal Health Report', 'builder': build_maternal_health,
+                        'scope': 'block', 'days': 30},
+    'immunization': {'name': 'Immunization Report', 'builder': build_immunization,
+                     'scope': 'block', 'days': 30},
+    'monthly': {'name': 'Monthly District Report', 'builder': build_district_summary,
+                'scope': 'district', 'days': 30},
+    'quarterly': {'name': 'Quarterly District Report', 'builder': build_district_summary,
+                  'scope': 'district', 'days': 90},
+    'hmis': {'name': 'HMIS District Report', 'builder': build_district_summary,
+             'scope': 'district', 'days': 30},
+}
+
+
+def default_period(report_type, start=None, end=None):
+    """Fill in a missing date range with the report type's default period"""
+    end = end or date.today()
+    start = start or end - timedelta(days=REPORT_TYPES[report_type]['days'])
+    return start, end
+
+
+# ==================== OUTPUT ====================
+
+def report_store_dir():
+    app = _runtime['app']
+    return app.config.get('REPORT_STORE_DIR') or os.path.join(app.instance_path, 'reports')
+
+
+def report_file_path(report):
+    """Absolute path of a report's stored file (None if it has none)"""
+    if not report.file_path:
+        return None
+    return os.path.join(report_store_dir(), report.file_path)
+
+
+def human_size(num_bytes):
+    size = float(num_bytes)
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024 or unit == 'GB':
+            return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+        size /= 1024
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def write_pdf(fh, title, meta_lines, sheets):
+    """Render sheets as paginated tables with reportlab"""
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.pdfbase.pdfmetrics import stringWidth
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(fh, pagesize=landscape(A4))
+    width, height = landscape(A4)
+    margin = 36
+    line_height = 13
+    state = {'y': height - margin, 'page': 1}
+
+    def footer():
+        c.setFont('Helvetica', 8)
+        c.drawRightString(width - margin, margin / 2, f'{title} - Page {state["page"]}')
+
+    def new_page():
+        footer()
+        c.showPage()
+        state['page'] += 1
+        state['y'] = height - margin
+
+    def ensure_space(lines=1):
+        if state['y'] - lines * line_height < margin:
+            new_page()
+            return True
+        return False
+
+    def clip(text, font, size, max_width):
+        if stringWidth(text, font, size) <= max_width:
+            return text
+        while text and stringWidth(text + '...', font, size) > max_width:
+            text = text[:-1]
+        return text + '...'
+
+    c.setFont('Helvetica-Bold', 16)
+    c.drawString(margin, state['y'], title)
+    state['y'] -= 22
+    c.setFont('Helvetica', 10)
+    for line in meta_lines:
+        c.drawString(margin, state['y'], line)
+        state['y'] -= line_height
+
+    for sheet_title, header, rows in sheets:
+        columns = len(header) if header else 1
+        col_width = (width - 2 * margin) / columns
+
+        def draw_row(values, font):
+            c.setFont(font, 8)
+            for i, value in enumerate(values[:columns]):
+                c.drawString(margin + i * col_width, state['y'], clip(_text(value), font, 8, col_width - 4))
+            state['y'] -= line_height
+
+        state['y'] -= 10
+        ensure_space(3)
+        c.setFont('Helvetica-Bold', 12)
+        c.drawString(margin, state['y'], sheet_title)
+        state['y'] -= 16
+        if header:
+            draw_row(header, 'Helvetica-Bold')
+
+        empty = True
+        for row in rows:
+            empty = False
+            if ensure_space() and header:
+                draw_row(header, 'Helvetica-Bold')
+            draw_row(list(row), 'Helvetica')
+        if empty:
+            c.setFont('Helvetica-Oblique', 9)
+            c.drawString(margin, state['y'], 'No records for this period')
+            state['y'] -= line_height
+
+    footer()
+    c.save()
+
+
+def write_json(fh, title, meta, sheets):
+    """Stream sheets as a JSON document without building it in memory"""
+    fh.write(('{"report": %s, "meta": %s, "sheets": [' % (json.dumps(title), json.dumps(meta))).encode('utf-8'))
+    for index, (sheet_title, header, rows) in enumerate(sheets):
+        if index:
+            fh.write(b', ')
+        fh.write(('{"title": %s, "header": %s, "rows": [' % (json.dumps(sheet_title), json.dumps(header))).encode('utf-8'))
+        for row_index, row in enumerate(rows):
+            fh.write(((', ' if row_index else '') + json.dumps([_text(v) if not isinstance(v, (int, float)) else v
+                                                                for v in row])).encode('utf-8'))
+        fh.write(b']}')
+    fh.write(b']}')
+
+
+def write_report_file(report, scope, sheets):
+    """Write the report into the store; returns (relative path, size in bytes)"""
+    extension = REPORT_FORMATS[report.export_format][0]
+    relative = os.path.join(secure_filename(scope.scope_id or 'unscoped'),
+                            f'{secure_filename(report.report_id)}.{extension}')
+    target = os.path.join(report_store_dir(), relative)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = f'{target}.{os.getpid()}.tmp'
+
+    period = f'{_fmt_date(report.date_range_start) or "-"} to {_fmt_date(report.date_range_end) or "-"}'
+    meta = {
+        'report_id': report.report_id,
+        'scope': f'{scope.scope_type.title()}: {scope.label}',
+        'period': period,
+        'generated_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M UTC'),
+    }
+
+    try:
+        with open(tmp_path, 'wb') as fh:
+            if report.export_format == 'pdf':
+                write_pdf(fh, report.report_name, [f'{k.replace("_", " ").title()}: {v}' for k, v in meta.items()], sheets)
+            elif report.export_format == 'json':
+                write_json(fh, report.report_name, meta, sheets)
+            else:
+                info = ('Report', ['Field', 'Value'], [['Report', report.report_name]] + [
+                    [k.replace('_', ' ').title(), v] for k, v in meta.items()])
+                writer = EXPORT_WRITERS['xlsx' if report.export_format == 'excel' else 'csv']
+                for chunk in writer([info] + list(sheets)):
+                    fh.write(chunk)
+        os.replace(tmp_path, target)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return relative, os.path.getsize(target)
+
+
+# ==================== QUEUE ====================
+
+def enqueue_report(report, scope_type, scope_id, params=None):
+    """Queue generation of a GeneratedReport (caller commits)"""
+    ReportJob = _m('ReportJob')
+    report.status = 'queued'
+    job = ReportJob(
+        report=report,
+        scope_type=scope_type,
+        scope_id=scope_id,
+        params=json.dumps(params or {}),
+        status='queued',
+        attempts=0,
+        max_attempts=JOB_MAX_ATTEMPTS,
+        available_at=datetime.utcnow(),
+    )
+    _db().session.add(job)
+    return job
+
+
+def claim_next_job(worker_id):
+    """Atomically move the oldest runnable job to processing; None if idle"""
+    db, ReportJob = _db(), _m('ReportJob')
+    for _ in range(5):
+        now = datetime.utcnow()
+        job_id = db.session.query(ReportJob.id).filter(
+            ReportJob.status == 'queued',
+            ReportJob.available_at <= now
+        ).order_by(ReportJob.available_at, ReportJob.id).limit(1).with_for_update(skip_locked=True).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+
+        # The status guard makes the claim safe when two workers race for the same row
+        claimed = db.session.execute(
+            update(ReportJob).where(
+                ReportJob.id == job_id, ReportJob.status == 'queued'
+            ).values(
+                status='processing', locked_by=worker_id, locked_at=now, started_at=now,
+                attempts=ReportJob.attempts + 1
+            )
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(ReportJob, job_id)
+    return None
+
+
+def requeue_stale_jobs(timeout=JOB_LOCK_TIMEOUT):
+    """Return jobs whose worker died mid-run to the queue"""
+    db, ReportJob = _db(), _m('ReportJob')
+    cutoff = datetime.utcnow() - timeout
+    count = db.session.execute(
+        update(ReportJob).where(
+            ReportJob.status == 'processing', ReportJob.locked_at < cutoff
+        ).values(status='queued', locked_by=None, locked_at=None, available_at=datetime.utcnow())
+    ).rowcount
+    db.session.commit()
+    return count
+
+
+def process_job(job):
+    """Generate the report for a claimed job"""
+    db, GeneratedReport = _db(), _m('GeneratedReport')
+    report = db.session.get(GeneratedReport, job.report_pk)
+    if report is None:
+        job.status = 'failed'
+        job.last_error = 'Report record no longer exists'
+        job.finished_at = datetime.utcnow()
+        db.session.commit()
+        return False
+
+    report.status = 'processing'
+    db.session.commit()
+
+    started = time.perf_counter()
+    try:
+        spec = REPORT_TYPES[report.report_type]
+        scope = resolve_scope(job.scope_type, job.scope_id, json.loads(job.params or '{}'))
+        sheets = spec['builder'](scope, report.date_range_start, report.date_range_end)
+        relative, size = write_report_file(report, scope, sheets)
+
+        retention = _runtime['app'].config.get('REPORT_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+        now = datetime.utcnow()
+        report.file_path = relative
+        report.file_size_bytes = size
+        report.file_size = human_size(size)
+        report.status = 'ready'
+        report.generated_at = now
+        report.expires_at = now + timedelta(days=retention)
+        job.status = 'done'
+        job.finished_at = now
+        job.last_error = None
+        db.session.commit()
+        print(f"📄 Report {report.report_id} ready ({report.file_size}, {time.perf_counter() - started:.2f}s)")
+        return True
+    except Exception as e:
+        db.session.rollback()
+        job = db.session.get(_m('ReportJob'), job.id)
+        report = db.session.get(GeneratedReport, job.report_pk)
+        job.last_error = str(e)[:1000]
+        job.locked_by = None
+        if report is None:
+            # Deleted while it was being generated; there is nothing left to retry
+            job.status = 'failed'
+            job.last_error = 'Report record no longer exists'
+            job.finished_at = datetime.utcnow()
+        elif job.attempts >= job.max_attempts:
+            job.status = 'failed'
+            job.finished_at = datetime.utcnow()
+            report.status = 'failed'
+        else:
+            job.status = 'queued'
+            job.available_at = datetime.utcnow() + timedelta(seconds=JOB_RETRY_BASE_SECONDS * 2 ** (job.attempts - 1))
+            report.status = 'queued'
+        db.session.commit()
+        label = report.report_id if report is not None else f'job {job.id}'
+        print(f"❌ Report {label} failed (attempt {job.attempts}/{job.max_attempts}): {e}")
+        return False
+
+
+def cleanup_expired_reports(now=None):
+    """Delete files of reports past expires_at and mark them expired"""
+    db, GeneratedReport, ReportJob = _db(), _m('GeneratedReport'), _m('ReportJob')
+    now = now or datetime.utcnow()
+    expired = GeneratedReport.query.filter(
+        GeneratedReport.expires_at.isnot(None),
+        GeneratedReport.expires_at <= now,
+        GeneratedReport.status.in_(['ready', 'failed'])
+    ).all()
+
+    removed = 0
+    for report in expired:
+        path = report_file_path(report)
+        if path and os.path.exists(path):
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError as e:
+                print(f"Error removing report file {path}: {e}")
+                continue
+        report.status = 'expired'
+        report.file_path = None
+    if expired:
+        ReportJob.query.filter(
+            ReportJob.report_pk.in_([r.id for r in expired])
+        ).delete(synchronize_session=False)
+    db.session.commit()
+    _runtime['last_cleanup'] = now
+    return {'expired': len(expired), 'files_removed': removed}
+
+
+def run_worker(poll_interval=5, once=False, worker_id=None, wake=None):
+    """Process queued jobs until stopped (or until the queue is empty if once);
+    an idle worker sleeps poll_interval seconds or until ``wake`` is set"""
+    worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+    processed = 0
+    requeue_stale_jobs()
+    while True:
+        last_cleanup = _runtime['last_cleanup']
+        if last_cleanup is None or (datetime.utcnow() - last_cleanup).total_seconds() >= CLEANUP_INTERVAL_SECONDS:
+            cleanup_expired_reports()
+
+        if wake is not None:
+            wake.clear()  # Cleared before looking, so a job queued meanwhile still wakes us
+        job = claim_next_job(worker_id)
+        if job is None:
+            if once:
+                return processed
+            _db().session.remove()
+            if wake is not None:
+                wake.wait(poll_interval)
+            else:
+                time.sleep(poll_interval)
+            continue
+        process_job(job)
+        processed += 1
+        _db().session.remove()
+
+
+def kick_embedded_worker():
+    """Wake the in-process worker thread (embedded mode), starting it if needed"""
+    app = _runtime['app']
+    if app.config.get('REPORT_WORKER_MODE', 'embedded') != 'embedded':
+        return False
+
+    _wake.set()
+    with _worker_lock:
+        thread = _runtime['embedded_worker']
+        if thread is not None and thread.is_alive():
+            return False
+
+        def serve():
+            while True:
+                with app.app_context():
+                    try:
+                        run_worker(poll_interval=EMBEDDED_POLL_SECONDS, wake=_wake)
+                    except Exception as e:
+                        print(f"Error in embedded report worker: {e}")
+                    finally:
+                        _db().session.remove()
+                _wake.wait(EMBEDDED_POLL_SECONDS)
+
+        thread = threading.Thread(target=serve, name='report-worker', daemon=True)
+        _runtime['embedded_worker'] = thread
+        thread.start()
+        return True
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault('DB_PROFILE', 'worker')
+    os.environ.setdefault('REPORT_WORKER_MODE', 'external')
+
+    parser = argparse.ArgumentParser(description='Report job worker')
+    sub = parser.add_subparsers(dest='command', required=True)
+    worker_parser = sub.add_parser('worker', help='Process queued report jobs')
+    worker_parser.add_argument('--poll', type=float, default=5, help='Seconds to wait when the queue is empty')
+    worker_parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+    sub.add_parser('cleanup', help='Expire reports past their expires_at')
+    args = parser.parse_args()
+
+    app, service = cli_app('services.report_jobs')
+
+    with app.app_context():
+        if args.command == 'cleanup':
+            print(f"🧹 {service.cleanup_expired_reports()}")
+        else:
+            print("=" * 50)
+            print("  Report Worker")
+            print("=" * 50)
+            try:
+                count = service.run_worker(poll_interval=args.poll, once=args.once)
+                print(f"✅ Processed {count} job(s)")
+            except KeyboardInterrupt:
+                print("Worker stopped")
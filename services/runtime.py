@@ -0,0 +1,117 @@
+"""
+Service Runtime
+Shared plumbing for the services that keep read models, caches and queues
+next to the ORM.
+
+* ``ServiceRuntime`` - each service's registry of app, db, model classes and
+  process-local state, with model/table lookup, run-once bootstraps and hook
+  registration.
+* Session hooks - one dispatcher per event, listening on the app's scoped
+  session only (``db.session``), not on every SQLAlchemy ``Session``. Each
+  handler names the model classes it watches; flush handlers run only when
+  the flush touched one of them, so a flush of unrelated rows costs a single
+  pass over the session's new/dirty/deleted objects::
+
+      _runtime.listen('after_flush', _collect_changes, 'User', 'FitnessAssessment')
+
+* ``cli_app`` - the app and the app-initialised copy of a service module for
+  its ``python -m services.<name>`` entry point.
+"""
+import importlib
+import os
+import sys
+import threading
+from itertools import chain
+
+from sqlalchemy import event
+
+FLUSH_EVENTS = ('before_flush', 'after_flush')
+BULK_EVENTS = ('after_bulk_update', 'after_bulk_delete')
+SESSION_EVENTS = FLUSH_EVENTS + BULK_EVENTS + ('after_commit', 'after_rollback')
+
+_dispatchers = {}  # (id(scoped session), event name) -> [(handler, watched classes)]
+
+
+class ServiceRuntime(dict):
+    """A service's app, db, model classes and state (``_runtime['db']`` etc.)"""
+
+    def __init__(self, **state):
+        super().__init__(app=None, db=None, models={}, **state)
+        self._done = set()
+        self._lock = threading.Lock()
+
+    def init(self, db, models=None, app=None):
+        self['db'] = db
+        self['models'] = models or {}
+        if app is not None:
+            self['app'] = app
+
+    def model(self, name):
+        return self['models'][name]
+
+    def table(self, name):
+        return self.model(name).__table__
+
+    def listen(self, event_name, handler, *watch):
+        """Register a session hook; flush/bulk hooks only see flushes touching ``watch``"""
+        classes = tuple(self['models'][name] for name in watch if name in self['models'])
+        listen(self['db'], event_name, handler, classes)
+
+    def once(self, key, build):
+        """Run ``build`` the first time ``key`` is asked for in this process"""
+        if key in self._done:
+            return False
+        with self._lock:
+            if key in self._done:
+                return False
+            build()
+            self._done.add(key)
+            return True
+
+
+# ==================== SESSION HOOKS ====================
+
+def listen(db, event_name, handler, watch=()):
+    """Add ``handler`` to the dispatcher for ``event_name`` on ``db.session``"""
+    if event_name not in SESSION_EVENTS:
+        raise ValueError(f'Unsupported session event: {event_name}')
+    key = (id(db.session), event_name)
+    handlers = _dispatchers.get(key)
+    if handlers is None:
+        handlers = _dispatchers[key] = []
+        event.listen(db.session, event_name, _dispatcher(event_name, handlers))
+    if not any(existing is handler for existing, _ in handlers):
+        handlers.append((handler, tuple(watch)))
+
+
+def _dispatcher(event_name, handlers):
+    if event_name in FLUSH_EVENTS:
+        def dispatch(session, *args):
+            touched = {type(obj) for obj in chain(session.new, session.dirty, session.deleted)}
+            if not touched:
+                return
+            for handler, watch in handlers:
+                if not watch or any(issubclass(cls, watch) for cls in touched):
+                    handler(session, *args)
+    elif event_name in BULK_EVENTS:
+        def dispatch(context):
+            target = context.mapper.class_
+            for handler, watch in handlers:
+                if not watch or issubclass(target, watch):
+                    handler(context)
+    else:
+        def dispatch(session):
+            for handler, _ in handlers:
+                handler(session)
+    return dispatch
+
+
+# ==================== COMMAND LINE ====================
+
+def cli_app(module_name):
+    """(app, module) for ``python -m <module_name>``: app.py initialises the imported copy, not __main__"""
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    if root not in sys.path:
+        sys.path.insert(0, root)
+    from app import app
+    return app, importlib.import_module(module_name)
@@ -0,0 +1,251 @@
+"""
+Doctor Slot Inventory
+Pre-materialised appointment slots, one row per doctor/day/time, with a
+unique constraint on (doctor_id, slot_date, slot_time).
+
+Booking claims a slot with a single conditional UPDATE
+(``... SET status='booked' WHERE ... AND status='available'``) in the same
+transaction that inserts the appointment, so two concurrent bookings for
+the same slot can never both succeed. Reschedule claims the new slot and
+releases the old one atomically; cancel releases it.
+
+Slots are materialised lazily the first time a doctor/day is read, or ahead
+of time, and only for hospital doctors (an unknown doctor id has no slots)::
+
+    python -m services.slot_inventory materialise --days 14
+
+200 simultaneous bookings of one slot are covered by tests/test_slot_inventory.py.
+"""
+from datetime import date, datetime, time as dt_time, timedelta
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from services.runtime import ServiceRuntime, cli_app
+
+# Appointment statuses that occupy a slot
+ACTIVE_APPOINTMENT_STATUSES = ('pending', 'upcoming', 'rescheduled', 'completed')
+DOCTOR_USER_TYPE = 'hospital_doctor'
+
+_runtime = ServiceRuntime(template={})
+
+
+class SlotUnavailable(Exception):
+    """Raised when a slot does not exist or is already taken"""
+
+
+def init_slot_inventory(db, models, slot_template):
+    """Register the db, model classes and the period -> ['HH:MM', ...] slot template"""
+    _runtime.init(db, models)
+    _runtime['template'] = slot_template
+
+
+_m = _runtime.model
+
+
+def _db():
+    return _runtime['db']
+
+
+def _parse_time(value):
+    return value if isinstance(value, dt_time) else datetime.strptime(value, '%H:%M').time()
+
+
+def _template_rows(doctor_id, day, taken):
+    rows = []
+    for period, times in _runtime['template'].items():
+        for slot_time in times:
+            rows.append({
+                'doctor_id': doctor_id,
+                'slot_date': day,
+                'slot_time': _parse_time(slot_time),
+                'period': period,
+                'status': 'booked' if slot_time in taken else 'available',
+                'created_at': datetime.utcnow(),
+            })
+    return rows
+
+
+def _insert_ignore_conflicts(rows):
+    """Insert slot rows, skipping any that already exist"""
+    db, DoctorSlot = _db(), _m('DoctorSlot')
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(DoctorSlot.__table__).values(rows).on_conflict_do_nothing(
+            index_elements=['doctor_id', 'slot_date', 'slot_time']
+        )
+        db.session.execute(stmt)
+        return
+
+    for row in rows:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(DoctorSlot.__table__.insert().values(**row))
+        except IntegrityError:
+            pass
+
+
+def _is_doctor(doctor_id):
+    User = _m('User')
+    try:
+        user_id = int(doctor_id)
+    except (TypeError, ValueError):
+        return False
+    return _db().session.query(User.id).filter(
+        User.id == user_id,
+        User.user_type == DOCTOR_USER_TYPE
+    ).first() is not None
+
+
+def materialise_day(doctor_id, day):
+    """
+    Create the slot rows for a doctor/day (idempotent; caller commits).
+    Returns False, creating nothing, if ``doctor_id`` is not a hospital doctor.
+    """
+    if not _is_doctor(doctor_id):
+        return False
+    Appointment = _m('Appointment')
+    # Appointments booked before the inventory existed keep their slots
+    taken = {
+        t.strftime('%H:%M') for (t,) in _db().session.query(Appointment.appointment_time).filter(
+            Appointment.doctor_id == doctor_id,
+            Appointment.appointment_date == day,
+            Appointment.status.in_(ACTIVE_APPOINTMENT_STATUSES)
+        )
+    }
+    _insert_ignore_conflicts(_template_rows(doctor_id, day, taken))
+    return True
+
+
+def materialise_range(doctor_ids, start, days):
+    """Pre-create slots for several doctors over ``days`` days from ``start``"""
+    count = 0
+    for doctor_id in doctor_ids:
+        for offset in range(days):
+            materialise_day(str(doctor_id), start + timedelta(days=offset))
+            count += 1
+        _db().session.commit()
+    return count
+
+
+def _day_slots(doctor_id, day):
+    DoctorSlot = _m('DoctorSlot')
+    return _db().session.query(
+        DoctorSlot.period, DoctorSlot.slot_time, DoctorSlot.status
+    ).filter(
+        DoctorSlot.doctor_id == doctor_id,
+        DoctorSlot.slot_date == day
+    ).order_by(DoctorSlot.slot_time).all()
+
+
+def slot_map(doctor_id, day):
+    """Availability map {period: [{'time', 'available'}]} from one indexed read"""
+    doctor_id = str(doctor_id)
+    rows = _day_slots(doctor_id, day)
+    if not rows and materialise_day(doctor_id, day):
+        _db().session.commit()
+        rows = _day_slots(doctor_id, day)
+
+    slots = {period: [] for period in _runtime['template']}
+    for period, slot_time, status in rows:
+        slots.setdefault(period, []).append({
+            'time': slot_time.strftime('%H:%M'),
+            'available': status == 'available'
+        })
+    return slots
+
+
+def _ensure_day(doctor_id, day):
+    DoctorSlot = _m('DoctorSlot')
+    exists = _db().session.query(DoctorSlot.id).filter(
+        DoctorSlot.doctor_id == doctor_id,
+        DoctorSlot.slot_date == day
+    ).first()
+    # Runs inside the caller's transaction; concurrent callers skip the
+    # rows the first one inserted
+    if exists is None and not materialise_day(doctor_id, day):
+        raise SlotUnavailable('Doctor not found')
+
+
+def claim_slot(doctor_id, day, slot_time, appointment_id=None):
+    """
+    Atomically mark a slot booked. Raises SlotUnavailable if it is taken, not
+    part of the doctor's schedule, or the doctor does not exist. The caller
+    commits (together with the appointment row) or rolls back, which releases
+    the claim.
+    """
+    db, DoctorSlot = _db(), _m('DoctorSlot')
+    doctor_id = str(doctor_id)
+    slot_time = _parse_time(slot_time)
+    _ensure_day(doctor_id, day)
+
+    claimed = db.session.execute(
+        update(DoctorSlot).where(
+            DoctorSlot.doctor_id == doctor_id,
+            DoctorSlot.slot_date == day,
+            DoctorSlot.slot_time == slot_time,
+            DoctorSlot.status == 'available'
+        ).values(status='booked', appointment_id=appointment_id, booked_at=datetime.utcnow())
+    ).rowcount
+    if claimed != 1:
+        raise SlotUnavailable('Selected slot is no longer available')
+
+
+def attach_appointment(doctor_id, day, slot_time, appointment_id):
+    """Record which appointment holds a claimed slot"""
+    DoctorSlot = _m('DoctorSlot')
+    _db().session.execute(
+        update(DoctorSlot).where(
+            DoctorSlot.doctor_id == str(doctor_id),
+            DoctorSlot.slot_date == day,
+            DoctorSlot.slot_time == _parse_time(slot_time),
+            DoctorSlot.status == 'booked'
+        ).values(appointment_id=appointment_id)
+    )
+
+
+def release_slot(doctor_id, day, slot_time, appointment_id=None):
+    """Return a booked slot to the pool (caller commits)"""
+    DoctorSlot = _m('DoctorSlot')
+    conditions = [
+        DoctorSlot.doctor_id == str(doctor_id),
+        DoctorSlot.slot_date == day,
+        DoctorSlot.slot_time == _parse_time(slot_time),
+        DoctorSlot.status == 'booked',
+    ]
+    if appointment_id is not None:
+        # Legacy slots materialised from old appointments carry no appointment_id
+        conditions.append(
+            (DoctorSlot.appointment_id == appointment_id) | (DoctorSlot.appointment_id.is_(None))
+        )
+    return _db().session.execute(
+        update(DoctorSlot).where(*conditions).values(status='available', appointment_id=None, booked_at=None)
+    ).rowcount
+
+
+def move_slot(doctor_id, old_day, old_time, new_day, new_time, appointment_id):
+    """Claim the new slot and release the old one in the caller's transaction"""
+    claim_slot(doctor_id, new_day, new_time, appointment_id)
+    release_slot(doctor_id, old_day, old_time, appointment_id)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Doctor slot inventory tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+    mat = sub.add_parser('materialise', help='Pre-create slots for all hospital doctors')
+    mat.add_argument('--days', type=int, default=14)
+    args = parser.parse_args()
+
+    app, service = cli_app('services.slot_inventory')
+    from app import User
+
+    with app.app_context():
+        doctor_ids = [u.id for u in User.query.filter_by(user_type=service.DOCTOR_USER_TYPE).all()]
+        days = service.materialise_range(doctor_ids, date.today(), args.days)
+        print(f"✅ Materialised {days} doctor-day(s) for {len(doctor_ids)} doctor(s)")
@@ -0,0 +1,406 @@
+"""
+Stock Forecast
+Consumption ledger and reorder forecasts for facility and health-worker inventory.
+
+Every change to ``FacilityInventory.current_stock`` or ``InventoryItem.quantity``
+is written to ``stock_movements`` by a session flush hook, so stock counts,
+adjustments and additions all land in the ledger in the same transaction as
+the change itself. Decreases are consumption; increases are receipts.
+
+``stock_forecasts`` holds one row per item: 7- and 28-day moving averages of
+daily consumption, the blended burn rate, days of stock remaining, the
+projected stock-out date and a reorder suggestion sized to cover the lead time
+plus COVER_DAYS. The nightly refresh (cron) runs one grouped ledger query that
+loads every item's daily consumption for the last LONG_WINDOW_DAYS calendar
+days into an items x days NumPy matrix, and computes the moving averages,
+burn rates and trends over it in one pass; in between, stock edits
+re-evaluate the affected rows against their stored burn rate. Dashboards only
+read the stored rows; items that predate the forecasts are filled in at
+startup::
+
+    python -m services.stock_forecast refresh      # nightly
+    python -m services.stock_forecast show --facility 3
+"""
+import math
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import Date, func, select, inspect as sa_inspect
+
+from services.runtime import ServiceRuntime, cli_app
+
+SHORT_WINDOW_DAYS = 7
+LONG_WINDOW_DAYS = 28
+SHORT_WEIGHT = 0.5  # Blend of the short and long moving averages
+TREND_BAND = 0.15  # Short average this far above/below the long one -> rising/falling
+LEAD_TIME_DAYS = 7  # Order to delivery
+SAFETY_DAYS = 7
+COVER_DAYS = 30  # Stock a reorder should buy beyond the lead time
+
+STATUS_ORDER = ('out', 'critical', 'reorder', 'ok')
+SOURCES = ('facility', 'worker')
+
+FACILITY_FIELDS = ('current_stock', 'minimum_stock', 'maximum_stock', 'item_name', 'category', 'unit', 'facility_id')
+WORKER_FIELDS = ('quantity', 'min_stock_level', 'item_name', 'category', 'unit', 'health_worker_id')
+
+_runtime = ServiceRuntime()
+
+
+def init_stock_forecast(db, models):
+    """Register the db and model classes and install the ledger hook"""
+    _runtime.init(db, models)
+    _runtime.listen('after_flush', _record_stock_movements, 'FacilityInventory', 'InventoryItem')
+
+
+_m = _runtime.model
+_t = _runtime.table
+
+
+# ==================== EVALUATION ====================
+
+def evaluate(current, minimum, maximum, daily_burn, today=None):
+    """Days remaining, status and reorder suggestion for one item"""
+    today = today or date.today()
+    current = max(0, current or 0)
+    minimum = minimum or 0
+    days = current / daily_burn if daily_burn > 0 else None
+
+    if current <= 0:
+        status = 'out'
+    elif days is not None and days <= LEAD_TIME_DAYS:
+        status = 'critical'
+    elif (days is not None and days <= LEAD_TIME_DAYS + SAFETY_DAYS) or current <= minimum:
+        status = 'reorder'
+    else:
+        status = 'ok'
+
+    target = max(minimum, math.ceil(daily_burn * (LEAD_TIME_DAYS + COVER_DAYS)))
+    if maximum:
+        target = max(min(target, maximum), minimum)
+    if status == 'ok':
+        reorder_qty = 0
+        reorder_by = today + timedelta(days=int(days - LEAD_TIME_DAYS - SAFETY_DAYS)) if days is not None else None
+    else:
+        reorder_qty = max(0, target - current)
+        reorder_by = today
+    return {
+        'days_remaining': round(days, 1) if days is not None else None,
+        'stockout_date': today + timedelta(days=int(days)) if days is not None else None,
+        'status': status,
+        'reorder_qty': reorder_qty,
+        'reorder_by': reorder_by,
+    }
+
+
+def _rates(consumed, observed):
+    """
+    (burn_7d, burn_28d, daily_burn, trend) arrays from an items x days matrix of
+    consumption (column 0 is today) and each item's days of ledger history
+    """
+    short = consumed[:, :SHORT_WINDOW_DAYS].sum(axis=1) / np.minimum(SHORT_WINDOW_DAYS, observed)
+    long = consumed[:, :LONG_WINDOW_DAYS].sum(axis=1) / np.minimum(LONG_WINDOW_DAYS, observed)
+    daily = SHORT_WEIGHT * short + (1 - SHORT_WEIGHT) * long
+    trend = np.select(
+        [(long > 0) & (short > long * (1 + TREND_BAND)), short < long * (1 - TREND_BAND)],
+        ['rising', 'falling'], 'steady'
+    )
+    return np.round(short, 3), np.round(long, 3), np.round(daily, 3), trend
+
+
+# ==================== ITEMS ====================
+
+def _item_rows(conn, source, ids=None):
+    """Current stock of items as plain dicts, with the facility/block they report to"""
+    if source == 'facility':
+        i, f = _t('FacilityInventory'), _t('Facility')
+        query = select(
+            i.c.id, i.c.facility_id, i.c.item_name, i.c.category, i.c.unit,
+            i.c.current_stock, i.c.minimum_stock, i.c.maximum_stock, f.c.block_id
+        ).select_from(i.outerjoin(f, i.c.facility_id == f.c.id))
+        if ids is not None:
+            query = query.where(i.c.id.in_(ids))
+        return [{
+            'source': 'facility', 'item_id': r.id, 'facility_id': r.facility_id, 'health_worker_id': None,
+            'block_id': r.block_id, 'item_name': r.item_name, 'category': r.category, 'unit': r.unit,
+            'current_stock': r.current_stock or 0, 'minimum_stock': r.minimum_stock, 'maximum_stock': r.maximum_stock,
+        } for r in conn.execute(query)]
+
+    i, u = _t('InventoryItem'), _t('User')
+    query = select(
+        i.c.id, i.c.health_worker_id, i.c.item_name, i.c.category, i.c.unit,
+        i.c.quantity, i.c.min_stock_level, u.c.facility_id, u.c.block_id
+    ).select_from(i.outerjoin(u, i.c.health_worker_id == u.c.id))
+    if ids is not None:
+        query = query.where(i.c.id.in_(ids))
+    return [{
+        'source': 'worker', 'item_id': r.id, 'facility_id': r.facility_id, 'health_worker_id': r.health_worker_id,
+        'block_id': r.block_id, 'item_name': r.item_name, 'category': r.category, 'unit': r.unit,
+        'current_stock': r.quantity or 0, 'minimum_stock': r.min_stock_level, 'maximum_stock': None,
+    } for r in conn.execute(query)]
+
+
+def _burn_rates(conn, now):
+    """{(source, item_id): (burn_7d, burn_28d, daily_burn, trend)} from one grouped ledger query"""
+    ledger = _t('StockMovement')
+    today = now.date()
+    day = func.date(ledger.c.created_at, type_=Date)
+    first_seen = dict(((r[0], r[1]), r[2]) for r in conn.execute(
+        select(ledger.c.source, ledger.c.item_id, func.min(ledger.c.created_at)).group_by(ledger.c.source, ledger.c.item_id)
+    ))
+    keys = list(first_seen)
+    if not keys:
+        return {}
+    position = {key: n for n, key in enumerate(keys)}
+
+    since = datetime.combine(today - timedelta(days=LONG_WINDOW_DAYS - 1), datetime.min.time())
+    daily_use = conn.execute(select(
+        ledger.c.source, ledger.c.item_id, day, func.sum(-ledger.c.delta)
+    ).where(
+        ledger.c.delta < 0, ledger.c.created_at >= since
+    ).group_by(ledger.c.source, ledger.c.item_id, day)).all()
+    consumed = np.zeros((len(keys), LONG_WINDOW_DAYS))
+    if daily_use:
+        rows = np.array([position[(r[0], r[1])] for r in daily_use])
+        days_back = np.array([(today - r[2]).days for r in daily_use])
+        in_window = (days_back >= 0) & (days_back < LONG_WINDOW_DAYS)
+        np.add.at(consumed, (rows[in_window], days_back[in_window]),
+                  np.array([float(r[3] or 0) for r in daily_use])[in_window])
+
+    observed = np.maximum(1.0, np.array([(now - (first_seen[key] or now)).total_seconds() / 86400 for key in keys]))
+    columns = [column.tolist() for column in _rates(consumed, observed)]
+    return {key: rates for key, rates in zip(keys, zip(*columns))}
+
+
+def _forecast_values(item, rates, today, now):
+    burn_7d, burn_28d, daily, trend = rates or (0.0, 0.0, 0.0, 'steady')
+    values = dict(item)
+    values.update(evaluate(item['current_stock'], item['minimum_stock'], item['maximum_stock'], daily, today))
+    values.update(burn_7d=burn_7d, burn_28d=burn_28d, daily_burn=daily, trend=trend, computed_at=now)
+    return values
+
+
+# ==================== LEDGER ====================
+
+def _stock_change(obj, field):
+    """(before, after) for a stock column touched in this flush, or None"""
+    history = sa_inspect(obj).attrs[field].history
+    if not history.has_changes():
+        return None
+    before = history.deleted[0] if history.deleted else 0
+    return before or 0, getattr(obj, field) or 0
+
+
+def _reevaluate(conn, source, item_ids, today=None):
+    """Refresh forecast rows for edited items against their stored burn rates"""
+    table = _t('StockForecast')
+    today = today or date.today()
+    now = datetime.utcnow()
+    stored = {
+        r.item_id: (r.burn_7d, r.burn_28d, r.daily_burn, r.trend)
+        for r in conn.execute(select(
+            table.c.item_id, table.c.burn_7d, table.c.burn_28d, table.c.daily_burn, table.c.trend
+        ).where(table.c.source == source, table.c.item_id.in_(item_ids)))
+    }
+    for item in _item_rows(conn, source, item_ids):
+        values = _forecast_values(item, stored.get(item['item_id']), today, now)
+        if item['item_id'] in stored:
+            values.pop('computed_at')  # Burn rates were not recomputed
+            conn.execute(table.update().where(
+                table.c.source == source, table.c.item_id == item['item_id']
+            ).values(**values))
+        else:
+            conn.execute(table.insert().values(**values))
+
+
+def _record_stock_movements(session, flush_context):
+    """Append ledger rows for stock changes in this flush and re-evaluate their forecasts"""
+    FacilityInventory, InventoryItem = _m('FacilityInventory'), _m('InventoryItem')
+
+    movements, touched, removed = [], {source: set() for source in SOURCES}, []
+    now = datetime.utcnow()
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, FacilityInventory):
+            source, field, fields, owner = 'facility', 'current_stock', FACILITY_FIELDS, (obj.facility_id, None)
+        elif isinstance(obj, InventoryItem):
+            source, field, fields, owner = 'worker', 'quantity', WORKER_FIELDS, (None, obj.health_worker_id)
+        else:
+            continue
+        if obj.id is None:
+            continue
+        state = sa_inspect(obj)
+        if obj in session.new:
+            change, reason = (0, getattr(obj, field) or 0), 'opening'
+        else:
+            if not any(state.attrs[f].history.has_changes() for f in fields):
+                continue
+            change = _stock_change(obj, field)
+            reason = None
+        touched[source].add(obj.id)
+        if change and change[0] != change[1]:
+            delta = change[1] - change[0]
+            movements.append(dict(
+                source=source, item_id=obj.id, item_name=obj.item_name, delta=delta,
+                quantity_before=change[0], quantity_after=change[1], facility_id=owner[0], health_worker_id=owner[1],
+                reason=reason or ('receipt' if delta > 0 else 'issue'), created_at=now
+            ))
+    for obj in session.deleted:
+        if isinstance(obj, FacilityInventory):
+            removed.append(('facility', obj.id))
+        elif isinstance(obj, InventoryItem):
+            removed.append(('worker', obj.id))
+
+    if not (movements or removed or any(touched.values())):
+        return
+    conn = session.connection()
+    if movements:
+        conn.execute(_t('StockMovement').insert(), movements)
+    for source, ids in touched.items():
+        if ids:
+            _reevaluate(conn, source, ids)
+    table = _t('StockForecast')
+    for source, item_id in removed:
+        conn.execute(table.delete().where(table.c.source == source, table.c.item_id == item_id))
+
+
+# ==================== REFRESH ====================
+
+def _open_ledgers():
+    """Give items that predate the ledger an opening movement holding their current stock"""
+    db = _runtime['db']
+    conn = db.session.connection()
+    ledger = _t('StockMovement')
+    created = 0
+    for source in SOURCES:
+        if source == 'facility':
+            items = _t('FacilityInventory')
+            stock, owner = items.c.current_stock, items.c.facility_id
+        else:
+            items = _t('InventoryItem')
+            stock, owner = items.c.quantity, items.c.health_worker_id
+        logged = select(ledger.c.id).where(ledger.c.source == source, ledger.c.item_id == items.c.id).exists()
+        rows = conn.execute(select(items.c.id, items.c.item_name, stock, owner, items.c.created_at).where(~logged)).all()
+        if rows:
+            conn.execute(ledger.insert(), [{
+                'source': source, 'item_id': r[0], 'item_name': r[1], 'delta': r[2] or 0,
+                'quantity_before': 0, 'quantity_after': r[2] or 0, 'reason': 'opening',
+                'facility_id': r[3] if source == 'facility' else None,
+                'health_worker_id': r[3] if source == 'worker' else None,
+                'created_at': r[4] or datetime.utcnow(),
+            } for r in rows])
+            created += len(rows)
+    return created
+
+
+def refresh_forecasts(today=None):
+    """Recompute burn rates and forecasts for every item (nightly)"""
+    db = _runtime['db']
+    today = today or date.today()
+    now = datetime.utcnow()
+    conn = db.session.connection()
+    if conn.dialect.name == 'postgresql':
+        # Serialise refreshes: a second one waits, then deletes the first one's rows
+        conn.exec_driver_sql('LOCK TABLE stock_forecasts IN EXCLUSIVE MODE')
+    opened = _open_ledgers()
+    rates = _burn_rates(conn, now)
+    rows = []
+    for source in SOURCES:
+        for item in _item_rows(conn, source):
+            rows.append(_forecast_values(item, rates.get((source, item['item_id'])), today, now))
+    table = _t('StockForecast')
+    conn.execute(table.delete())
+    if rows:
+        conn.execute(table.insert(), rows)
+    db.session.commit()
+    return {'items': len(rows), 'opening_movements': opened}
+
+
+def ensure_forecasts():
+    """Forecast items recorded before the forecasts existed (startup); returns the refresh summary or None"""
+    if _unforecast_items_exist():
+        return refresh_forecasts()
+    return None
+
+
+def _unforecast_items_exist():
+    db, Forecast = _runtime['db'], _m('StockForecast')
+    for source, model in (('facility', _m('FacilityInventory')), ('worker', _m('InventoryItem'))):
+        known = db.session.query(Forecast.id).filter(Forecast.source == source, Forecast.item_id == model.id)
+        if db.session.query(model.id).filter(~known.exists()).first() is not None:
+            return True
+    return False
+
+
+# ==================== QUERIES ====================
+
+def forecast_dict(row):
+    return {
+        'item_id': row.item_id,
+        'source': row.source,
+        'item_name': row.item_name,
+        'category': row.category,
+        'unit': row.unit,
+        'facility_id': row.facility_id,
+        'health_worker_id': row.health_worker_id,
+        'current_stock': row.current_stock,
+        'minimum_stock': row.minimum_stock,
+        'daily_use': row.daily_burn,
+        'daily_use_7d': row.burn_7d,
+        'daily_use_28d': row.burn_28d,
+        'trend': row.trend,
+        'days_remaining': row.days_remaining,
+        'stockout_date': row.stockout_date.isoformat() if row.stockout_date else None,
+        'status': row.status,
+        'reorder_qty': row.reorder_qty,
+        'reorder_by': row.reorder_by.isoformat() if row.reorder_by else None,
+    }
+
+
+def _ordered(query):
+    db, Forecast = _runtime['db'], _m('StockForecast')
+    rank = db.case(*[(Forecast.status == s, i) for i, s in enumerate(STATUS_ORDER)], else_=len(STATUS_ORDER))
+    return query.order_by(rank, Forecast.days_remaining.is_(None), Forecast.days_remaining, Forecast.item_name)
+
+
+def forecasts_for(source, facility_ids=None, block_id=None, worker_id=None, statuses=None):
+    """Forecast rows, most urgent first"""
+    Forecast = _m('StockForecast')
+    query = Forecast.query.filter(Forecast.source == source)
+    if facility_ids is not None:
+        query = query.filter(Forecast.facility_id.in_(facility_ids))
+    if block_id is not None:
+        query = query.filter(Forecast.block_id == block_id)
+    if worker_id is not None:
+        query = query.filter(Forecast.health_worker_id == worker_id)
+    if statuses:
+        query = query.filter(Forecast.status.in_(statuses))
+    return _ordered(query).all()
+
+
+def forecast_summary(rows):
+    counts = {status: 0 for status in STATUS_ORDER}
+    for row in rows:
+        counts[row.status] = counts.get(row.status, 0) + 1
+    counts['to_reorder'] = sum(1 for row in rows if row.reorder_qty)
+    return counts
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Stock forecast tools')
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('refresh')
+    show = sub.add_parser('show')
+    show.add_argument('--facility', type=int, required=True)
+    args = parser.parse_args()
+
+    app, service = cli_app('services.stock_forecast')
+
+    with app.app_context():
+        if args.command == 'refresh':
+            print(f"✅ Forecasts refreshed: {service.refresh_forecasts()}")
+        else:
+            for row in service.forecasts_for('facility', facility_ids=[args.facility]):
+                days = f"{row.days_remaining:.1f}d" if row.days_remaining is not None else '-'
+                print(f"{row.status:9} {row.item_name[:30]:30} stock={row.current_stock:<6} "
+                      f"use/day={row.daily_burn:<7} left={days:8} reorder={row.reorder_qty}")
@@ -0,0 +1,596 @@
+"""
+Vaccination Compliance
+Set-based recalculation of MNC employee vaccination compliance.
+
+One run per MNC loads everything it needs up front instead of querying per
+employee x policy pair:
+
+* verified employees and the active policies, with each policy's department
+  and role lists parsed once into sets;
+* the employees' own vaccination history (``vaccinations`` joined through
+  ``mnc_employees.client_id``) and the MNC's verified uploads, one query each;
+* the vaccine-code table, so "Covishield" and "COVID-19" count towards the
+  same policy. A record also matches when the policy's vaccine name is part
+  of the record's name (the old ILIKE rule).
+
+Each applicable pair is evaluated in memory and the compliance rows are
+written with one bulk UPDATE (changed rows only) and one bulk INSERT, in a
+single transaction::
+
+Alerts are generated the same way: one anti-join query finds gaps (non- or
+partially compliant, not exempt) without an open alert and they are inserted
+in bulk; alerts whose gap has closed are resolved with one UPDATE. A unique
+partial index allows one open alert per compliance row. Runs are incremental
+per MNC - only compliance rows whose outcome changed since the last run
+(``vaccination_alert_runs``) - so they can be scheduled per MNC::
+
+    python -m services.vaccination_compliance recalc --mnc 12
+    python -m services.vaccination_compliance alerts [--mnc 12] [--full]
+    python -m services.vaccination_compliance bench [--employees 10000 --policies 10]
+"""
+import json
+import random
+import re
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+from sqlalchemy import func, insert, select, text, update
+from sqlalchemy.exc import IntegrityError
+
+from services.runtime import ServiceRuntime, cli_app
+
+# Normalised alias -> vaccine code; seeded into vaccine_codes, which admins can extend
+DEFAULT_VACCINE_CODES = {
+    'COVID19': ('covid', 'covid 19', 'covid19', 'sars cov 2', 'coronavirus', 'covishield', 'covaxin',
+                'corbevax', 'covovax', 'sputnik', 'comirnaty', 'spikevax', 'pfizer biontech', 'moderna'),
+    'HEPB': ('hepatitis b', 'hep b', 'hepb', 'engerix b', 'recombivax'),
+    'HEPA': ('hepatitis a', 'hep a', 'hepa', 'havrix'),
+    'FLU': ('influenza', 'flu', 'fluarix', 'vaxigrip', 'fluzone'),
+    'TETANUS': ('tetanus', 'tt', 'td', 'tdap', 'dtap', 'dpt', 'boostrix', 'adacel'),
+    'TYPHOID': ('typhoid', 'typbar', 'typhim vi', 'tcv'),
+    'MMR': ('mmr', 'measles', 'mumps', 'rubella', 'priorix'),
+    'VARICELLA': ('varicella', 'chickenpox', 'chicken pox', 'varivax'),
+    'HPV': ('hpv', 'human papillomavirus', 'gardasil', 'cervarix'),
+    'PNEUMO': ('pneumococcal', 'pcv', 'ppsv23', 'prevnar', 'pneumovax'),
+    'MENING': ('meningococcal', 'menactra', 'menveo', 'menacwy'),
+    'POLIO': ('polio', 'ipv', 'opv'),
+    'BCG': ('bcg', 'tuberculosis'),
+    'RABIES': ('rabies', 'rabipur', 'verorab'),
+    'YELLOWFEVER': ('yellow fever', 'stamaril'),
+    'JE': ('japanese encephalitis', 'ixiaro', 'jenvac'),
+    'CHOLERA': ('cholera', 'dukoral', 'shanchol'),
+}
+
+COMPLIANCE_INDEX = ('ix_employee_vaccination_compliance_pair', 'employee_vaccination_compliance',
+                    'employee_id, policy_id')
+RECORD_INDEX = ('ix_mnc_vaccination_records_mnc_status', 'mnc_vaccination_records',
+                'mnc_id, verification_status')
+OPEN_ALERT_INDEX = 'ux_vaccination_alerts_open_compliance'
+OPEN_ALERT_WHERE = 'is_active AND NOT is_resolved'  # At most one open alert per compliance row
+ALERT_LIST_INDEX = ('ix_vaccination_alerts_mnc_open', 'mnc_id, is_active, is_resolved, created_at')
+
+IN_CHUNK = 500
+ALERT_STATUSES = ('Non-Compliant', 'Partially Compliant')
+ALERT_OVERLAP_SECONDS = 60
+EVALUATED_FIELDS = ('compliance_status', 'doses_completed', 'doses_required', 'last_dose_date',
+                    'next_dose_due_date', 'is_overdue', 'days_until_due')
+
+Dose = namedtuple('Dose', ['name', 'completed', 'dose_date', 'next_due'])
+Employee = namedtuple('Employee', ['id', 'client_id', 'department', 'job_role'])
+Policy = namedtuple('Policy', ['id', 'vaccine_name', 'required_doses', 'compliance_deadline',
+                               'applies_to_all', 'departments', 'roles'])
+_BenchPolicy = namedtuple('_BenchPolicy', ['id', 'vaccine_name', 'required_doses', 'compliance_deadline',
+                                           'applies_to_all', 'specific_departments', 'specific_roles'])
+
+_runtime = ServiceRuntime()
+
+
+def init_vaccination_compliance(db, models):
+    """Register the db and model classes used by the compliance engine"""
+    _runtime.init(db, models)
+
+
+_m = _runtime.model
+
+
+# ==================== VACCINE CODES ====================
+
+def normalise_vaccine(name):
+    """Lower-case words only: 'COVID-19 (Covishield)' -> 'covid 19 covishield'"""
+    return ' '.join(re.findall(r'[a-z0-9]+', (name or '').lower()))
+
+
+def load_vaccine_codes():
+    """{normalised alias: code} from the vaccine_codes table"""
+    VaccineCode = _m('VaccineCode')
+    return dict(_runtime['db'].session.query(VaccineCode.alias, VaccineCode.code).all())
+
+
+def code_for(name, codes):
+    """Code of the longest alias found as whole words in the name, or None"""
+    padded = f' {normalise_vaccine(name)} '
+    best = None
+    for alias, code in codes.items():
+        if f' {alias} ' in padded and (best is None or len(alias) > len(best[0])):
+            best = (alias, code)
+    return best[1] if best else None
+
+
+class VaccineMatcher:
+    """Memoised policy-vaccine/record-vaccine matching for one recalculation"""
+
+    def __init__(self, codes):
+        self.codes = codes
+        self._codes = {}
+        self._matches = {}
+
+    def code(self, name):
+        if name not in self._codes:
+            self._codes[name] = code_for(name, self.codes)
+        return self._codes[name]
+
+    def matches(self, policy_name, record_name):
+        key = (policy_name, record_name)
+        if key not in self._matches:
+            policy_code = self.code(policy_name)
+            self._matches[key] = bool(
+                (policy_code is not None and policy_code == self.code(record_name))
+                or (policy_name or '').lower() in (record_name or '').lower()
+            )
+        return self._matches[key]
+
+
+# ==================== APPLICABILITY ====================
+
+@lru_cache(maxsize=1024)
+def _parse_list(raw):
+    if not raw:
+        return frozenset()
+    try:
+        values = json.loads(raw)
+    except (TypeError, ValueError):
+        return frozenset()
+    if isinstance(values, str):
+        values = [values]
+    return frozenset(values)
+
+
+def policy_spec(policy):
+    """Policy tuple with its department/role lists parsed (once per distinct JSON text)"""
+    return Policy(policy.id, policy.vaccine_name, policy.required_doses or 1, policy.compliance_deadline,
+                  bool(policy.applies_to_all), _parse_list(policy.specific_departments),
+                  _parse_list(policy.specific_roles))
+
+
+def applies_to(spec, department, job_role):
+    return spec.applies_to_all or department in spec.departments or job_role in spec.roles
+
+
+# ==================== EVALUATION ====================
+
+def evaluate(policy, doses, uploads, matcher, today):
+    """Compliance fields for one employee and policy from their doses in memory"""
+    own = [d for d in doses if matcher.matches(policy.vaccine_name, d.name)]
+    verified = [d for d in uploads if matcher.matches(policy.vaccine_name, d.name)]
+
+    doses_completed = sum(1 for d in own if d.completed) + len(verified)
+    last_dose_date = next_dose_due = None
+    if own:
+        latest = max(own, key=lambda d: d.dose_date)
+        last_dose_date = latest.dose_date
+        next_dose_due = latest.next_due
+    if verified:
+        # Most recent date between system and MNC records, earliest next dose
+        latest = max(verified, key=lambda d: d.dose_date)
+        if latest.dose_date and (not last_dose_date or latest.dose_date > last_dose_date):
+            last_dose_date = latest.dose_date
+        if latest.next_due and (not next_dose_due or latest.next_due < next_dose_due):
+            next_dose_due = latest.next_due
+
+    compliance_status = 'Non-Compliant'
+    if doses_completed >= policy.required_doses:
+        compliance_status = 'Compliant'
+    elif doses_completed > 0:
+        compliance_status = 'Partially Compliant'
+
+    is_overdue = False
+    days_until_due = None
+    if next_dose_due:
+        days_until_due = (next_dose_due - today).days
+        is_overdue = days_until_due < 0
+    elif policy.compliance_deadline:
+        days_until_due = (policy.compliance_deadline - today).days
+        is_overdue = days_until_due < 0 and compliance_status != 'Compliant'
+
+    return {
+        'compliance_status': compliance_status,
+        'doses_completed': doses_completed,
+        'doses_required': policy.required_doses,
+        'last_dose_date': last_dose_date,
+        'next_dose_due_date': next_dose_due,
+        'is_overdue': is_overdue,
+        'days_until_due': days_until_due,
+    }
+
+
+def evaluate_all(employees, policies, doses_by_client, uploads_by_employee, matcher, today):
+    """{(employee_id, policy_id): fields} for every applicable pair"""
+    results = {}
+    for employee in employees:
+        doses = doses_by_client.get(employee.client_id, ()) if employee.client_id else ()
+        uploads = uploads_by_employee.get(employee.id, ())
+        for policy in policies:
+            if applies_to(policy, employee.department, employee.job_role):
+                results[(employee.id, policy.id)] = evaluate(policy, doses, uploads, matcher, today)
+    return results
+
+
+# ==================== RECALCULATION ====================
+
+def _load_facts(mnc_id, employee_ids):
+    """Own vaccinations per client and verified MNC uploads per employee"""
+    db = _runtime['db']
+    MNCEmployee, Vaccination, Record = _m('MNCEmployee'), _m('Vaccination'), _m('MNCVaccinationRecord')
+
+    own = db.session.query(
+        Vaccination.user_id, Vaccination.vaccine_name, Vaccination.status,
+        Vaccination.vaccination_date, Vaccination.next_due_date
+    ).join(MNCEmployee, MNCEmployee.client_id == Vaccination.user_id).filter(
+        MNCEmployee.mnc_id == mnc_id, MNCEmployee.verification_status == 'Verified'
+    )
+    uploads = db.session.query(
+        Record.employee_id, Record.vaccine_name, Record.vaccination_date, Record.next_dose_due
+    ).filter(Record.mnc_id == mnc_id, Record.verification_status == 'Verified')
+    if employee_ids:
+        own = own.filter(MNCEmployee.id.in_(employee_ids))
+        uploads = uploads.filter(Record.employee_id.in_(employee_ids))
+
+    doses_by_client, uploads_by_employee = {}, {}
+    for user_id, name, status, dose_date, next_due in own:
+        doses_by_client.setdefault(user_id, []).append(Dose(name, status == 'Completed', dose_date, next_due))
+    for employee_id, name, dose_date, next_due in uploads:
+        uploads_by_employee.setdefault(employee_id, []).append(Dose(name, True, dose_date, next_due))
+    return doses_by_client, uploads_by_employee
+
+
+def recalculate_compliance(mnc_id, policy_ids=None, employee_ids=None, today=None):
+    """
+    Recalculate compliance rows for an MNC (optionally only some policies or
+    employees). Returns counts of evaluated pairs, updated and inserted rows.
+    """
+    db = _runtime['db']
+    MNCEmployee, MNCPolicy = _m('MNCEmployee'), _m('MNCVaccinationPolicy')
+    Compliance = _m('EmployeeVaccinationCompliance')
+    today = today or date.today()
+    now = datetime.utcnow()
+
+    employee_query = db.session.query(
+        MNCEmployee.id, MNCEmployee.client_id, MNCEmployee.department, MNCEmployee.job_role
+    ).filter(MNCEmployee.mnc_id == mnc_id, MNCEmployee.verification_status == 'Verified')
+    if employee_ids:
+        employee_query = employee_query.filter(MNCEmployee.id.in_(employee_ids))
+    employees = [Employee(*row) for row in employee_query]
+
+    policy_query = MNCPolicy.query.filter_by(mnc_id=mnc_id, is_active=True)
+    if policy_ids:
+        policy_query = policy_query.filter(MNCPolicy.id.in_(policy_ids))
+    policies = [policy_spec(p) for p in policy_query]
+    if not employees or not policies:
+        return {'employees': len(employees), 'policies': len(policies), 'evaluated': 0,
+                'updated': 0, 'unchanged': 0, 'inserted': 0}
+
+    doses_by_client, uploads_by_employee = _load_facts(mnc_id, employee_ids)
+    matcher = VaccineMatcher(load_vaccine_codes())
+    results = evaluate_all(employees, policies, doses_by_client, uploads_by_employee, matcher, today)
+
+    existing = db.session.query(
+        Compliance.id, Compliance.employee_id, Compliance.policy_id,
+        *[getattr(Compliance, field) for field in EVALUATED_FIELDS]
+    ).join(
+        MNCEmployee, MNCEmployee.id == Compliance.employee_id
+    ).filter(
+        MNCEmployee.mnc_id == mnc_id,
+        Compliance.policy_id.in_([p.id for p in policies])
+    )
+    if employee_ids:
+        existing = existing.filter(Compliance.employee_id.in_(employee_ids))
+
+    # Only rows whose outcome changed get a new updated_at, which is what
+    # incremental alert runs key on; the rest just record the check
+    updates, checked, seen = [], [], set()
+    for row in existing:
+        fields = results.get((row.employee_id, row.policy_id))
+        if fields is None:
+            continue
+        seen.add((row.employee_id, row.policy_id))
+        if all(getattr(row, field) == fields[field] for field in EVALUATED_FIELDS):
+            checked.append(row.id)
+        else:
+            updates.append(dict(fields, id=row.id, last_checked_at=now, updated_at=now))
+    inserts = [
+        dict(fields, employee_id=employee_id, policy_id=policy_id, last_checked_at=now, updated_at=now)
+        for (employee_id, policy_id), fields in results.items()
+        if (employee_id, policy_id) not in seen
+    ]
+    table = Compliance.__table__
+    try:
+        if updates:
+            db.session.execute(update(Compliance), updates)
+        for start in range(0, len(checked), IN_CHUNK):
+            db.session.execute(
+                table.update().where(table.c.id.in_(checked[start:start + IN_CHUNK])).values(last_checked_at=now)
+            )
+        if inserts:
+            db.session.execute(insert(Compliance), inserts)
+        if updates or inserts:
+            # Bulk writes skip the flush hook that keeps the employee directory current
+            from services.mnc_directory import refresh_employees
+            refresh_employees(db.session.connection(), employee_ids=[key[0] for key in results])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return {
+        'employees': len(employees),
+        'policies': len(policies),
+        'evaluated': len(results),
+        'updated': len(updates),
+        'unchanged': len(checked),
+        'inserted': len(inserts),
+    }
+
+
+# ==================== ALERTS ====================
+
+def alert_fields(full_name, vaccine_name, is_overdue, days_until_due):
+    """(alert_type, severity, message) for an open compliance gap"""
+    if is_overdue:
+        return 'Overdue', 'Critical', f"{full_name} is overdue for {vaccine_name} vaccination"
+    if days_until_due and days_until_due <= 7:
+        return 'Due Soon', 'Warning', f"{full_name}'s {vaccine_name} vaccination is due in {days_until_due} days"
+    return 'Due Soon', 'Info', f"{full_name} needs to complete {vaccine_name} vaccination"
+
+
+def _open_alert(Alert):
+    return (Alert.is_active.is_(True)) & (Alert.is_resolved.is_(False))
+
+
+def _insert_new_alerts(mnc_id, since, now):
+    """Anti-join: gaps without an open alert, with employee and policy columns in the same query"""
+    db = _runtime['db']
+    MNCEmployee, MNCPolicy = _m('MNCEmployee'), _m('MNCVaccinationPolicy')
+    Compliance, Alert = _m('EmployeeVaccinationCompliance'), _m('VaccinationAlert')
+
+    open_alert = select(Alert.id).where(Alert.compliance_id == Compliance.id, _open_alert(Alert))
+    gaps = db.session.query(
+        Compliance.id, Compliance.employee_id, Compliance.is_overdue, Compliance.days_until_due,
+        Compliance.next_dose_due_date, MNCEmployee.full_name, MNCPolicy.vaccine_name
+    ).join(MNCEmployee, MNCEmployee.id == Compliance.employee_id).join(
+        MNCPolicy, MNCPolicy.id == Compliance.policy_id
+    ).filter(
+        MNCEmployee.mnc_id == mnc_id,
+        Compliance.compliance_status.in_(ALERT_STATUSES),
+        Compliance.has_exemption.isnot(True),
+        ~open_alert.exists()
+    )
+    if since is not None:
+        gaps = gaps.filter(Compliance.updated_at > since)
+
+    rows = []
+    for gap in gaps:
+        alert_type, severity, message = alert_fields(gap.full_name, gap.vaccine_name, gap.is_overdue, gap.days_until_due)
+        rows.append({
+            'mnc_id': mnc_id,
+            'employee_id': gap.employee_id,
+            'compliance_id': gap.id,
+            'alert_type': alert_type,
+            'severity': severity,
+            'vaccine_name': gap.vaccine_name,
+            'alert_message': message,
+            'due_date': gap.next_dose_due_date,
+            'days_overdue': abs(gap.days_until_due) if gap.is_overdue and gap.days_until_due else None,
+            'is_active': True,
+            'is_acknowledged': False,
+            'is_resolved': False,
+            'created_at': now,
+        })
+    if rows:
+        db.session.execute(insert(Alert), rows)
+    return len(rows)
+
+
+def _resolve_closed_alerts(mnc_id, since, now):
+    """Resolve open alerts whose compliance row is now compliant or exempt"""
+    db = _runtime['db']
+    MNCEmployee = _m('MNCEmployee')
+    Compliance, Alert = _m('EmployeeVaccinationCompliance'), _m('VaccinationAlert')
+    closed = select(Compliance.id).join(MNCEmployee, MNCEmployee.id == Compliance.employee_id).where(
+        MNCEmployee.mnc_id == mnc_id,
+        (Compliance.compliance_status.notin_(ALERT_STATUSES)) | (Compliance.has_exemption.is_(True))
+    )
+    if since is not None:
+        closed = closed.where(Compliance.updated_at > since)
+    table = Alert.__table__
+    return db.session.execute(
+        table.update().where(
+            table.c.compliance_id.in_(closed), table.c.is_active.is_(True), table.c.is_resolved.is_(False)
+        ).values(is_resolved=True, resolved_at=now, resolution_notes='Compliance met')
+    ).rowcount
+
+
+def generate_alerts(mnc_id, full=False, now=None):
+    """
+    Create alerts for new compliance gaps and resolve alerts whose gap closed.
+    Incremental by default: only compliance rows updated since the MNC's last
+    run (with a small overlap; re-processing is harmless). Returns counts.
+    """
+    db = _runtime['db']
+    Run = _m('VaccinationAlertRun')
+    now = now or datetime.utcnow()
+    run = db.session.get(Run, mnc_id)
+    since = None if full or run is None or run.last_run_at is None else run.last_run_at - timedelta(seconds=ALERT_OVERLAP_SECONDS)
+    for attempt in range(2):
+        try:
+            created = _insert_new_alerts(mnc_id, since, now)
+            resolved = _resolve_closed_alerts(mnc_id, since, now)
+            if run is None:
+                run = Run(mnc_id=mnc_id)
+                db.session.add(run)
+            run.last_run_at = now
+            run.alerts_created = created
+            run.alerts_resolved = resolved
+            db.session.commit()
+            return {'mode': 'full' if since is None else 'incremental', 'created': created, 'resolved': resolved}
+        except IntegrityError:
+            # A concurrent run opened some of the same alerts first; the anti-join skips them next time
+            db.session.rollback()
+            run = db.session.get(Run, mnc_id)
+            if attempt:
+                raise
+
+
+def generate_all_alerts(full=False):
+    """Alert run for every MNC that has active vaccination policies"""
+    MNCPolicy = _m('MNCVaccinationPolicy')
+    mnc_ids = [row[0] for row in _runtime['db'].session.query(MNCPolicy.mnc_id).filter_by(is_active=True).distinct()]
+    return {mnc_id: generate_alerts(mnc_id, full=full) for mnc_id in mnc_ids}
+
+
+# ==================== MIGRATION ====================
+
+def ensure_vaccine_codes():
+    """Create the lookup indexes and seed vaccine aliases that are missing; returns aliases added"""
+    db = _runtime['db']
+    VaccineCode = _m('VaccineCode')
+    with db.engine.begin() as conn:
+        for name, table, cols in (COMPLIANCE_INDEX, RECORD_INDEX):
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({cols})'))
+        known = set(conn.execute(select(VaccineCode.alias)).scalars())
+        missing = [
+            {'code': code, 'alias': normalise_vaccine(alias), 'created_at': datetime.utcnow()}
+            for code, aliases in DEFAULT_VACCINE_CODES.items()
+            for alias in aliases if normalise_vaccine(alias) not in known
+        ]
+        if missing:
+            conn.execute(insert(VaccineCode.__table__), missing)
+    return len(missing)
+
+
+def ensure_alert_constraints():
+    """
+    Resolve duplicate open alerts (keeping the oldest per compliance row), then
+    create the unique partial index on open alerts and the MNC listing index.
+    Returns the number of duplicates resolved.
+    """
+    db = _runtime['db']
+    Alert = _m('VaccinationAlert')
+    table = Alert.__table__
+    with db.engine.begin() as conn:
+        keep = select(func.min(table.c.id)).where(
+            table.c.is_active.is_(True), table.c.is_resolved.is_(False)
+        ).group_by(table.c.compliance_id)
+        duplicates = conn.execute(
+            table.update().where(
+                table.c.is_active.is_(True), table.c.is_resolved.is_(False), table.c.id.notin_(keep)
+            ).values(is_resolved=True, resolved_at=datetime.utcnow(), resolution_notes='Duplicate alert')
+        ).rowcount
+        conn.execute(text(f'CREATE UNIQUE INDEX IF NOT EXISTS {OPEN_ALERT_INDEX} ON vaccination_alerts '
+                          f'(compliance_id) WHERE {OPEN_ALERT_WHERE}'))
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS {ALERT_LIST_INDEX[0]} ON vaccination_alerts ({ALERT_LIST_INDEX[1]})'))
+    return duplicates
+
+
+# ==================== BENCHMARK ====================
+
+def run_benchmark(employees=10000, policies=10, seed=11):
+    """
+    Evaluate a synthetic MNC in memory (applicability, vaccine matching and
+    compliance for every pair) and compare with the per-pair query count of
+    the old employee x policy loop.
+    """
+    rng = random.Random(seed)
+    today = date.today()
+    codes = {normalise_vaccine(alias): code for code, aliases in DEFAULT_VACCINE_CODES.items() for alias in aliases}
+    vaccine_names = ['COVID-19', 'Hepatitis B', 'Influenza', 'Typhoid', 'Tetanus', 'MMR',
+                     'Varicella', 'HPV', 'Pneumococcal', 'Hepatitis A', 'Rabies', 'Polio']
+    record_names = vaccine_names + ['Covishield', 'Covaxin', 'Engerix-B', 'Flu shot', 'Tdap', 'Typbar TCV']
+    departments = [f'Dept {i}' for i in range(20)]
+    roles = [f'Role {i}' for i in range(40)]
+
+    build_started = time.perf_counter()
+    policy_specs = [policy_spec(_BenchPolicy(
+        id=pid, vaccine_name=vaccine_names[pid % len(vaccine_names)], required_doses=rng.choice((1, 2, 3)),
+        compliance_deadline=today + timedelta(days=rng.randrange(-60, 120)),
+        applies_to_all=rng.random() < 0.5,
+        specific_departments=json.dumps(rng.sample(departments, 5)),
+        specific_roles=json.dumps(rng.sample(roles, 8)),
+    )) for pid in range(1, policies + 1)]
+    staff, doses_by_client, uploads_by_employee = [], {}, {}
+    for eid in range(1, employees + 1):
+        client_id = eid if rng.random() < 0.8 else None
+        staff.append(Employee(eid, client_id, rng.choice(departments), rng.choice(roles)))
+        if client_id:
+            doses_by_client[client_id] = [
+                Dose(rng.choice(record_names), rng.random() < 0.9,
+                     today - timedelta(days=rng.randrange(900)), today + timedelta(days=rng.randrange(-30, 300)))
+                for _ in range(rng.randrange(8))
+            ]
+        if rng.random() < 0.3:
+            uploads_by_employee[eid] = [
+                Dose(rng.choice(record_names), True, today - timedelta(days=rng.randrange(400)), None)
+                for _ in range(rng.randrange(1, 3))
+            ]
+    build_seconds = time.perf_counter() - build_started
+
+    started = time.perf_counter()
+    results = evaluate_all(staff, policy_specs, doses_by_client, uploads_by_employee, VaccineMatcher(codes), today)
+    seconds = time.perf_counter() - started
+    statuses = {}
+    for fields in results.values():
+        statuses[fields['compliance_status']] = statuses.get(fields['compliance_status'], 0) + 1
+    return {
+        'employees': employees,
+        'policies': policies,
+        'pairs': len(results),
+        'build_seconds': round(build_seconds, 2),
+        'evaluate_seconds': round(seconds, 2),
+        'pairs_per_second': int(len(results) / seconds) if seconds else None,
+        # Old loop: compliance lookup + two vaccine-name queries + commit per pair
+        'old_loop_statements': len(results) * 4,
+        'engine_statements': 6,
+        'statuses': statuses,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description='MNC vaccination compliance engine')
+    parser.add_argument('command', choices=['recalc', 'alerts', 'bench'])
+    parser.add_argument('--mnc', type=int, help='MNC user id (alerts default to every MNC)')
+    parser.add_argument('--full', action='store_true', help='Alerts: re-check every compliance row')
+    parser.add_argument('--employees', type=int, default=10000, help='Synthetic employees for bench')
+    parser.add_argument('--policies', type=int, default=10, help='Synthetic policies for bench')
+    args = parser.parse_args()
+
+    if args.command == 'bench':
+        print(f"✅ Compliance bench: {run_benchmark(args.employees, args.policies)}")
+        sys.exit(0)
+    if args.command == 'recalc' and not args.mnc:
+        parser.error('recalc needs --mnc')
+
+    app, service = cli_app('services.vaccination_compliance')
+
+    with app.app_context():
+        if args.command == 'alerts':
+            if args.mnc:
+                print(f"✅ Vaccination alerts: {service.generate_alerts(args.mnc, full=args.full)}")
+            else:
+                print(f"✅ Vaccination alerts: {service.generate_all_alerts(full=args.full)}")
+            sys.exit(0)
+        started = time.perf_counter()
+        counts = service.recalculate_compliance(args.mnc)
+        print(f"✅ Compliance recalculated in {time.perf_counter() - started:.2f}s: {counts}")
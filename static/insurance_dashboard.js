@@ -4,6 +4,7 @@
 let currentPage = 'overview';
 let dashboardStats = {};
 let selectedClaim = null;
+let claimsNextCursor = null;
 let selectedPreAuth = null;
 
 // Initialize dashboard on load
@@ -115,7 +116,8 @@ function setupEventListeners() {
     
     // Filter buttons
     document.getElementById('applyPolicyFilters')?.addEventListener('click', loadPolicyholders);
-    document.getElementById('applyClaimFilters')?.addEventListener('click', loadClaims);
+    document.getElementById('applyClaimFilters')?.addEventListener('click', () => loadClaims());
+    document.getElementById('claimsLoadMore')?.addEventListener('click', () => loadClaims(true));
     document.getElementById('applyCashlessFilters')?.addEventListener('click', loadCashlessRequests);
     document.getElementById('applyFraudFilters')?.addEventListener('click', loadFraudCases);
     document.getElementById('applyAuditFilters')?.addEventListener('click', loadAuditLogs);
@@ -330,25 +332,32 @@ async function loadPolicyDetails(policyNumber) {
     }
 }
 
-// Load claims
-async function loadClaims() {
+// Load claims (append = next page of the current filters)
+async function loadClaims(append = false) {
     const status = document.getElementById('claimStatusFilter')?.value || 'All';
+    const sla = document.getElementById('claimSlaFilter')?.value || '';
     const dateFrom = document.getElementById('claimDateFrom')?.value || '';
     const dateTo = document.getElementById('claimDateTo')?.value || '';
     
     try {
         const params = new URLSearchParams({
             status,
+            sla,
             date_from: dateFrom,
             date_to: dateTo
         });
+        if (append && claimsNextCursor) {
+            params.set('cursor', claimsNextCursor);
+        }
         
         const response = await fetch(`/insurance/api/claims?${params}`);
         const data = await response.json();
         
         const tbody = document.getElementById('claimsTable');
+        claimsNextCursor = data.pagination?.next_cursor || null;
+        document.getElementById('claimsLoadMoreWrap')?.classList.toggle('d-none', !claimsNextCursor);
         
-        if (data.claims.length === 0) {
+        if (!append && data.claims.length === 0) {
             tbody.innerHTML = `
                 <tr>
                     <td colspan="10" class="text-center text-muted py-4">
@@ -359,7 +368,7 @@ async function loadClaims() {
             return;
         }
         
-        tbody.innerHTML = data.claims.map(claim => `
+        const rows = data.claims.map(claim => `
             <tr>
                 <td><strong>${claim.claim_id}</strong></td>
                 <td>${claim.policy_number}</td>
@@ -378,6 +387,12 @@ async function loadClaims() {
             </tr>
         `).join('');
         
+        if (append) {
+            tbody.insertAdjacentHTML('beforeend', rows);
+        } else {
+            tbody.innerHTML = rows;
+        }
+        
     } catch (error) {
         console.error('Error loading claims:', error);
         showAlert('Failed to load claims', 'danger');
@@ -386,7 +401,7 @@ async function loadClaims() {
 
 // Get SLA status HTML
 function getSlaStatus(hours) {
-    if (!hours) return '<span class="text-muted">-</span>';
+    if (hours === null || hours === undefined) return '<span class="text-muted">-</span>';
     
     if (hours > 24) {
         return `<span class="sla-good">${hours.toFixed(1)}h remaining</span>`;
@@ -277,15 +277,29 @@ async function loadNotifications() {
 
 // ==================== EMPLOYEE DIRECTORY ====================
 
+// The directory is paginated; follow the cursor to collect every matching employee
+async function fetchAllEmployees(filters = {}) {
+    const employees = [];
+    let cursor = null;
+    do {
+        const params = new URLSearchParams({ ...filters, per_page: '200' });
+        if (cursor) params.set('cursor', cursor);
+        const response = await fetch(`/api/mnc/employees?${params}`);
+        const data = await response.json();
+        if (!data.success) return null;
+        employees.push(...data.employees);
+        cursor = data.pagination?.next_cursor || null;
+    } while (cursor);
+    return employees;
+}
+
 async function loadEmployeesData() {
     try {
-        const response = await fetch('/api/mnc/employees');
-        const data = await response.json();
+        const employees = await fetchAllEmployees();
+        if (!employees) return;
         
-        if (data.success) {
-            employeesData = data.employees;
-            displayEmployees(employeesData);
-        }
+        employeesData = employees;
+        displayEmployees(employeesData);
     } catch (error) {
         console.error('Error loading employees:', error);
         showNotification('Failed to load employee data', 'error');
@@ -1371,7 +1385,7 @@ async function fetchEmployeeName() {
     
     try {
         // Use the employee list endpoint to get employee info
-        const response = await fetch(`/api/mnc/employees`);
+        const response = await fetch(`/api/mnc/employees?uid=${encodeURIComponent(uid)}`);
         const data = await response.json();
         
         if (data.success && data.employees) {
@@ -3322,15 +3336,10 @@ async function loadFitnessAssessments() {
 // Load employees pending assessment
 async function loadPendingAssessments() {
     try {
-        const response = await fetch('/api/mnc/employees');
-        const data = await response.json();
+        // Employees with "Review Required" status (filtered server-side, every page)
+        const pendingEmployees = await fetchAllEmployees({ fitness_status: 'Review Required' });
         
-        if (data.success) {
-            // Filter employees with "Review Required" status
-            const pendingEmployees = data.employees.filter(emp => 
-                emp.fitness_status === 'Review Required'
-            );
-            
+        if (pendingEmployees) {
             displayPendingAssessments(pendingEmployees);
         }
     } catch (error) {
@@ -229,6 +229,16 @@ function loadRequests() {
 
                     if (req.notes) details += `<div class="mt-1 small text-muted"><em>Note: ${req.notes}</em></div>`;
 
+                    // Stock check: free stock for pending requests, reserved units once accepted
+                    if (req.stock_check) {
+                        const check = req.stock_check;
+                        const lines = check.lines.map(line => {
+                            const have = line.available !== undefined ? line.available : line.reserved;
+                            return `<span class="${line.short ? 'text-danger' : 'text-success'}">${line.name}: ${have}/${line.requested}</span>`;
+                        }).join('<br>');
+                        details += `<div class="mt-1 small"><span class="badge ${check.can_fill ? 'bg-success' : 'bg-danger'}">${check.can_fill ? 'In stock' : 'Short'}</span><br>${lines}</div>`;
+                    }
+
                     let actions = '';
                     if (req.status === 'pending') {
                         actions = `
@@ -271,7 +281,7 @@ function loadRequests() {
         .catch(error => console.error('Error loading requests:', error));
 }
 
-function updateRequestStatus(id, status) {
+function updateRequestStatus(id, status, allowPartial = false) {
     let remarks = '';
     if (status === 'rejected') {
         remarks = prompt('Enter reason for rejection:');
@@ -279,21 +289,27 @@ function updateRequestStatus(id, status) {
     } else if (status === 'ready') {
         remarks = prompt('Enter any remarks for patient (e.g., "Total amount: $50"):');
     }
+    sendRequestUpdate({ id: id, status: status, remarks: remarks, allow_partial: allowPartial });
+}
+
+function sendRequestUpdate(payload) {
 
     fetch('/api/pharmacy/request/update', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ id: id, status: status, remarks: remarks })
+        body: JSON.stringify(payload)
     })
         .then(response => response.json())
         .then(data => {
             if (data.success) {
                 loadRequests();
-                // Also refresh stats if needed, but simple reload is fine for now
-                // Optionally reload page to update stats
-                // location.reload(); 
+                loadInventory();
+            } else if (data.can_partial && !payload.allow_partial) {
+                if (confirm(data.message + '\n\nAccept anyway and reserve the available units?')) {
+                    sendRequestUpdate(Object.assign({}, payload, { allow_partial: true }));
+                }
             } else {
                 alert('Error: ' + data.message);
             }
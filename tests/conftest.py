@@ -0,0 +1,105 @@
+"""
+Shared fixtures. The app is imported against a throwaway database: a SQLite
+file in a temp directory, or TEST_DATABASE_URL (e.g. a scratch Postgres
+database) when set. Never point the tests at a live database.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+import pytest
+from flask import g
+from sqlalchemy import event
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_scratch = tempfile.mkdtemp(prefix='a3-tests-')
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or f"sqlite:///{os.path.join(_scratch, 'test.db')}"
+os.environ.pop('REPLICA_DATABASE_URL', None)
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def pytest_addoption(parser):
+    parser.addoption('--run-slow', action='store_true', help='also run tests marked slow')
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'slow: takes minutes; skipped unless --run-slow is given')
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption('--run-slow'):
+        return
+    skip = pytest.mark.skip(reason='slow; run with --run-slow')
+    for item in items:
+        if 'slow' in item.keywords:
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app as flask_app
+    flask_app.config.update(TESTING=True)
+    yield flask_app
+    shutil.rmtree(_scratch, ignore_errors=True)
+
+
+@pytest.fixture
+def db(app):
+    from app import db as flask_db
+    with app.app_context():
+        yield flask_db
+        flask_db.session.remove()
+
+
+@pytest.fixture
+def make_user(db):
+    """Create and commit a User with unique uid/email"""
+    from app import User
+
+    def make(user_type, **fields):
+        stamp = uuid.uuid4().hex[:12]
+        user = User(uid=f'T{stamp}', email=f'{stamp}@test.invalid', password_hash='!',
+                    user_type=user_type, full_name=fields.pop('full_name', f'Test {user_type}'), **fields)
+        db.session.add(user)
+        db.session.commit()
+        return user
+    return make
+
+
+@pytest.fixture
+def login(app):
+    """Test client logged in as ``user``"""
+    def log_in(user):
+        # Requests share the test's app context, where flask-login caches the user on g
+        g.pop('_login_user', None)
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user.id)
+            session['_fresh'] = True
+        return client
+    return log_in
+
+
+@pytest.fixture
+def capture_writes(db):
+    """Context manager collecting the INSERT/UPDATE/DELETE statements run on the app's engine
+    (except the api_logs row every API request appends)"""
+    @contextmanager
+    def capture():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            words = statement.split(None, 3)
+            if words[0].upper() in ('INSERT', 'UPDATE', 'DELETE') and 'api_logs' not in words[1:3]:
+                statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+    return capture
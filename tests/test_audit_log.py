@@ -0,0 +1,79 @@
+import gzip
+import threading
+import uuid
+from datetime import datetime
+
+from sqlalchemy import MetaData, Table, event, func, select
+
+from services import audit_log
+
+
+def _month_rows(db, key, user_id):
+    table = audit_log.table_for_month(key)
+    with db.engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(table).where(table.c.user_id == user_id)).scalar()
+
+
+def test_concurrent_legacy_migration_moves_each_row_once(app, db, monkeypatch):
+    legacy = Table(audit_log.LEGACY_TABLE, MetaData(), autoload_with=db.engine)
+    user_id = 800000 + uuid.uuid4().int % 100000
+    stamps = [datetime(2001, 1 + i % 3, 1 + i % 28, 12) for i in range(60)]
+    with db.engine.begin() as conn:
+        conn.execute(legacy.insert(), [
+            {'user_id': user_id, 'action_type': 'Viewed Claim', 'timestamp': stamp} for stamp in stamps
+        ])
+    monkeypatch.setattr(audit_log, 'MIGRATE_BATCH', 7)
+
+    workers = 4
+    barrier = threading.Barrier(workers)
+    errors = []
+
+    def migrate():
+        with app.app_context():
+            barrier.wait()
+            try:
+                audit_log.migrate_legacy_audit()
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=migrate) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert audit_log.migrate_legacy_audit() is None
+    assert [_month_rows(db, key, user_id) for key in (200101, 200102, 200103)] == [20, 20, 20]
+
+
+def test_retention_rerun_after_failed_drop_archives_month_once(app, db, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'INSURANCE_AUDIT_ARCHIVE_DIR', str(tmp_path))
+    key = 199901
+    table = audit_log.table_for_month(key)
+    with db.engine.begin() as conn:
+        conn.execute(table.insert(), [
+            {'user_id': 1, 'action_type': 'Viewed Claim', 'timestamp': datetime(1999, 1, day)} for day in range(1, 11)
+        ])
+
+    def fail_drop(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('DROP TABLE'):
+            raise RuntimeError('drop failed')
+
+    event.listen(db.engine, 'before_cursor_execute', fail_drop)
+    try:
+        try:
+            audit_log.apply_retention(months=120)
+        except RuntimeError:
+            pass
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', fail_drop)
+    assert key in audit_log.stored_months()
+    assert list(tmp_path.iterdir()) == []
+
+    dropped = {month['month']: month for month in audit_log.apply_retention(months=120)['dropped']}
+    assert dropped[key]['rows'] == 10
+    assert key not in audit_log.stored_months()
+    with gzip.open(dropped[key]['archive'], 'rt', encoding='utf-8') as archive:
+        assert len(archive.readlines()) == 10
+    assert sorted(path.name for path in tmp_path.glob(f'*_{key}*')) == [f'{audit_log.PARENT_TABLE}_{key}.jsonl.gz']
@@ -0,0 +1,23 @@
+from datetime import date, timedelta
+
+from services import blood_index
+
+
+def test_index_built_at_startup_and_search_only_reads(app, db, make_user, capture_writes):
+    from app import BloodUnit
+    bank = make_user('blood_bank', city='Searchpur', latitude=12.9, longitude=77.6)
+    # Units written around the ORM hook, as if recorded before the index existed
+    db.session.execute(BloodUnit.__table__.insert(), [
+        {'blood_bank_id': bank.id, 'blood_group': 'O', 'rh_factor': '-', 'status': 'Available',
+         'expiry_date': date.today() + timedelta(days=10 + i)} for i in range(3)
+    ])
+    db.session.commit()
+    assert blood_index.ensure_index() is not None
+    assert blood_index.ensure_index() is None
+
+    with capture_writes() as writes:
+        results = blood_index.search_availability('O-', city='Searchpur')
+        response = app.test_client().get('/blood/search?blood_group=O-&city=Searchpur')
+    assert writes == []
+    assert [(entry.blood_bank_id, entry.units_available) for entry, _, _ in results] == [(bank.id, 3)]
+    assert response.status_code == 200
@@ -0,0 +1,24 @@
+from datetime import datetime
+
+from services import consent_cache
+from services.consent_cache import ConsentGrant
+
+
+def test_grant_revoked_during_fetch_is_not_cached(app, monkeypatch):
+    """A revocation committing between the fetch and the store wins"""
+    consent_cache.clear()
+    grants = {41: ConsentGrant(1, None), 42: ConsentGrant(2, None)}
+
+    def fetch_then_revoke(kind, grantee_id, patient_ids, scope, now):
+        fetched = {patient_id: grants[patient_id] for patient_id in patient_ids if patient_id in grants}
+        consent_cache.invalidate(kind, 41)
+        grants.pop(41, None)
+        return fetched
+
+    monkeypatch.setattr(consent_cache, '_fetch', fetch_then_revoke)
+    now = datetime.utcnow()
+    assert consent_cache.bulk_check('sharing', 7, [41, 42], now=now) == {41: ConsentGrant(1, None),
+                                                                         42: ConsentGrant(2, None)}
+    assert consent_cache.cache_stats()['entries'] == 1
+    assert consent_cache.check('sharing', 7, 41, now=now) is None
+    assert consent_cache.check('sharing', 7, 42, now=now) == ConsentGrant(2, None)
@@ -0,0 +1,56 @@
+import uuid
+
+from services import donor_matching
+from services.donor_matching import normalise_blood_group
+
+
+def test_normalise_blood_group():
+    assert normalise_blood_group('B', '+') == 'B+'
+    assert normalise_blood_group('AB', 'Negative') == 'AB-'
+    assert normalise_blood_group('b positive') == 'B+'
+    assert normalise_blood_group('B', None) == 'B+'
+    assert normalise_blood_group('O', None, unknown_rh='-') == 'O-'
+    assert normalise_blood_group('O', None, unknown_rh=None) is None
+    assert normalise_blood_group('Unknown') is None
+    assert normalise_blood_group('Other') is None
+    assert normalise_blood_group('Other', '+') is None
+    assert normalise_blood_group('Bombay') is None
+    assert normalise_blood_group('Bombay', 'Positive') is None
+    assert donor_matching.compatible_groups('B') == ('O-', 'B-')
+
+
+def test_unindexed_donor_found_behind_unindexable_ones(db, make_user):
+    from app import BloodDonorIndexEntry
+
+    donor_matching.rebuild_index()
+    assert not donor_matching._unindexed_donors_exist()
+    # Never indexable, and ahead of the real donor in the table
+    for blood_group in ['Unknown'] * 110 + ['Other', 'Bombay'] * 5:
+        make_user('blood_donor_recipient', blood_group=blood_group)
+    assert not donor_matching._unindexed_donors_exist()
+
+    donor = make_user('blood_donor_recipient', blood_group='B')
+    entry = BloodDonorIndexEntry.query.filter_by(user_id=donor.id).one()
+    assert entry.blood_group == 'B+'
+    db.session.delete(entry)
+    db.session.commit()
+    assert donor_matching._unindexed_donors_exist()
+    assert donor_matching.ensure_index() is not None
+    assert donor_matching.ensure_index() is None
+
+
+def test_donor_matches_get_only_reads(db, make_user, login, capture_writes):
+    from app import ClientBloodRequest
+    recipient = make_user('client')
+    donor = make_user('blood_donor_recipient', blood_group='O', blood_rh='-', city='Matchpur')
+    blood_request = ClientBloodRequest(user_id=recipient.id, request_id=f'BR-{uuid.uuid4().hex[:10]}',
+                                       blood_group_needed='A-', hospital_city='Matchpur')
+    db.session.add(blood_request)
+    db.session.commit()
+    client = login(recipient)
+
+    with capture_writes() as writes:
+        response = client.get(f'/api/client/blood-requests/{blood_request.request_id}/donor-matches')
+    assert writes == []
+    assert response.status_code == 200
+    assert donor.full_name in [candidate['name'] for candidate in response.get_json()['donors']]
@@ -0,0 +1,30 @@
+import tracemalloc
+from datetime import date
+
+import pytest
+
+from services import export_engine
+
+ROWS = 1000000
+CEILING_MB = 32
+
+
+def _sheet():
+    today = date.today()
+    rows = ([i, f'Employee {i}', f'user{i}@example.com', i * 0.5, today] for i in range(ROWS))
+    return 'Rows', ['ID', 'Name', 'Email', 'Score', 'Created'], rows
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('fmt', sorted(export_engine.WRITERS))
+def test_million_rows_stream_under_memory_ceiling(fmt):
+    total_bytes = 0
+    tracemalloc.start()
+    try:
+        for chunk in export_engine.WRITERS[fmt]([_sheet()]):
+            total_bytes += len(chunk)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert total_bytes > ROWS
+    assert peak / (1024 * 1024) < CEILING_MB, f'{fmt} peaked at {peak / (1024 * 1024):.1f} MB'
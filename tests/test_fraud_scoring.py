@@ -0,0 +1,62 @@
+import uuid
+from datetime import date, timedelta
+
+import numpy as np
+
+from services import fraud_scoring
+
+
+def test_window_counts_stay_within_each_claimant():
+    users = np.array([1, 1, 1, 1, 2, 2])
+    days = np.array([100, 110, 125, 300, 120, 120])
+    assert fraud_scoring.window_counts(users, days, 30).tolist() == [1, 2, 3, 1, 2, 2]
+    assert fraud_scoring.window_counts(users, days, 180).tolist() == [1, 2, 3, 2, 2, 2]
+
+
+def test_score_matrix_levels():
+    m = fraud_scoring.ClaimFeatures(
+        claim_pk=np.array([1, 2, 3]),
+        freq_30=np.array([1, 3, 4]),
+        freq_180=np.array([1, 3, 7]),
+        policy_age_days=np.array([np.nan, 60.0, 5.0]),
+        amount_ratio=np.array([0.1, 0.6, 0.9]),
+        amount_z=np.array([np.nan, 2.5, 4.0]),
+        suspicious_hospital=np.array([False, False, True]),
+    )
+    scores, levels, strength = fraud_scoring.score_matrix(m)
+    assert scores.tolist() == [0.0, 47.5, 100.0]
+    assert levels.tolist() == ['Low', 'Medium', 'Critical']
+    assert strength['new_policy'].tolist() == [0.0, 0.5, 1.0]
+
+
+def test_submitted_claims_match_nightly_rescore(db, make_user):
+    from app import FraudDetection, Insurance, InsuranceClaim, InsuranceCompany
+    insurer_user, claimant = make_user('insurance_company'), make_user('client')
+    company = InsuranceCompany(user_id=insurer_user.id, company_name='Test Assurance')
+    db.session.add(company)
+    db.session.flush()
+    start = date.today() - timedelta(days=20)
+    policy = Insurance(user_id=claimant.id, provider_name='Test Assurance', policy_number=uuid.uuid4().hex[:10],
+                       start_date=start, end_date=start + timedelta(days=365), sum_insured=100000.0,
+                       insurance_company_id=company.id)
+    db.session.add(policy)
+    db.session.flush()
+    claims = []
+    for n in range(4):
+        claim = InsuranceClaim(user_id=claimant.id, insurance_id=policy.id, insurance_company_id=company.id,
+                               claim_id=f'TC{uuid.uuid4().hex[:10]}', claim_date=start + timedelta(days=2 + n * 3),
+                               hospital_name='City Hospital', total_bill_amount=90000.0, claimed_amount=90000.0,
+                               status='Submitted')
+        db.session.add(claim)
+        db.session.commit()  # Scored by the flush hook as each claim is submitted
+        claims.append(claim.id)
+
+    rows = {r.claim_id: r for r in FraudDetection.query.filter(FraudDetection.claim_id.in_(claims))}
+    assert set(rows) == set(claims)
+    # New policy (20) + ratio 0.9 (15), and rapid claims (20) from the third claim on
+    assert [rows[pk].fraud_risk_score for pk in claims] == [35.0, 35.0, 55.0, 55.0]
+    assert rows[claims[-1]].investigation_status == 'Pending'
+    assert rows[claims[-1]].claim_frequency == 4
+
+    totals = fraud_scoring.rescore_insurer(company.id)
+    assert totals == {'claims': 4, 'inserted': 0, 'updated': 0}
@@ -0,0 +1,100 @@
+import random
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from services import incident_cube
+
+DEPARTMENTS = ['Operations', 'Finance', 'Engineering']
+
+
+def _raw(mnc_id):
+    from app import MNCEmployee, WorkplaceIncident
+    rows = WorkplaceIncident.query.filter_by(mnc_id=mnc_id).all()
+    departments = {e.id: e.department for e in MNCEmployee.query.filter_by(mnc_id=mnc_id)}
+    return rows, departments
+
+
+def _assert_cube_matches(mnc_id):
+    """Every cube cell equals a raw recount, and cube rollups equal raw counts"""
+    assert incident_cube.verify_cube(mnc_id) == []
+    rows, departments = _raw(mnc_id)
+
+    totals = incident_cube.incident_totals(mnc_id)
+    closed = sum(1 for r in rows if r.status in incident_cube.CLOSED_STATUSES)
+    assert (totals['total'], totals['closed'], totals['open']) == (len(rows), closed, len(rows) - closed)
+    assert totals['by_severity'] == Counter(r.severity or incident_cube.UNSPECIFIED for r in rows)
+
+    by_department = {c['department']: c['count'] for c in incident_cube.drill_down(mnc_id, ('department',))}
+    assert by_department == Counter(
+        departments.get(r.employee_id) or incident_cube.UNASSIGNED if r.employee_id else incident_cube.UNASSIGNED
+        for r in rows
+    )
+    by_month = {c['month']: c['count'] for c in incident_cube.drill_down(mnc_id, ('month',))}
+    assert by_month == Counter(r.incident_date.date().replace(day=1).isoformat() for r in rows)
+    by_week = {c['week']: c['count'] for c in incident_cube.drill_down(mnc_id, ('week',))}
+    assert by_week == Counter(
+        (r.incident_date.date() - timedelta(days=r.incident_date.weekday())).isoformat() for r in rows
+    )
+
+
+def test_cube_tracks_incident_lifecycle(db, make_user, login):
+    from app import MNCEmployee, WorkplaceIncident
+    rng = random.Random(5)
+    mnc = make_user('mnc', mnc_name='Testcorp')
+    employees = []
+    for n in range(6):
+        client = make_user('client')
+        employee = MNCEmployee(mnc_id=mnc.id, client_id=client.id, employee_id=f'E{uuid.uuid4().hex[:8]}',
+                               full_name=f'Employee {n}', department=DEPARTMENTS[n % len(DEPARTMENTS)])
+        db.session.add(employee)
+        employees.append((employee, client.uid))
+    db.session.commit()
+    client = login(mnc)
+
+    # Create: spread over ~10 weeks so weeks straddle month boundaries
+    for _ in range(40):
+        day = date.today() - timedelta(days=rng.randint(0, 70))
+        employee = rng.choice(employees + [(None, None)])
+        response = client.post('/api/mnc/incidents', json={
+            'date': day.isoformat(), 'time': '10:30', 'type': rng.choice(['injury', 'exposure', 'illness']),
+            'location': 'Block 1', 'description': 'Test incident', 'uid': employee[1],
+        })
+        assert response.get_json()['success']
+    _assert_cube_matches(mnc.id)
+
+    incidents = WorkplaceIncident.query.filter_by(mnc_id=mnc.id).order_by(WorkplaceIncident.id).all()
+    assert len(incidents) == 40
+
+    # Close
+    for incident in incidents[:12]:
+        assert client.post(f'/api/mnc/incidents/{incident.id}/close').get_json()['success']
+    db.session.expire_all()
+    _assert_cube_matches(mnc.id)
+
+    # Edit: date across a month, type, severity, employee
+    edited = incidents[20]
+    edited.incident_date = datetime.combine(date.today().replace(day=1) - timedelta(days=3), datetime.min.time())
+    edited.incident_type = 'accident'
+    incidents[21].severity = 'Critical'
+    incidents[22].employee_id = employees[0][0].id
+    incidents[23].employee_id = None
+    incidents[24].status = 'Open'
+    db.session.commit()
+    _assert_cube_matches(mnc.id)
+
+    # Delete
+    db.session.delete(incidents[25])
+    db.session.delete(incidents[26])
+    db.session.commit()
+    _assert_cube_matches(mnc.id)
+
+    # Department moves
+    employees[1][0].department = 'Relocated'
+    employees[2][0].department = None
+    db.session.commit()
+    _assert_cube_matches(mnc.id)
+
+    # A rebuild from scratch gives the same cells
+    incident_cube.rebuild_cube(mnc.id)
+    _assert_cube_matches(mnc.id)
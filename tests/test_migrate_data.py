@@ -0,0 +1,109 @@
+import sqlite3
+import warnings
+from datetime import datetime
+
+from sqlalchemy import Column, ForeignKey, Integer, MetaData, String, Table, create_engine, event, func, select
+
+import migrate_data
+from services import audit_log
+
+MONTH = f'{audit_log.PARENT_TABLE}_199002'
+
+
+def _source(path):
+    src = sqlite3.connect(path)
+    src.execute('CREATE TABLE resource_categories (id INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, '
+                'description TEXT, icon VARCHAR(50), created_at DATETIME)')
+    src.executemany('INSERT INTO resource_categories (id, name, created_at) VALUES (?, ?, ?)',
+                    [(i, f'Category {i}', '2024-01-02 03:04:05') for i in range(1, 6)])
+    src.execute(f'CREATE TABLE {MONTH} (id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, '
+                'action_type VARCHAR(100) NOT NULL, action_details JSON, timestamp DATETIME NOT NULL)')
+    src.executemany(f'INSERT INTO {MONTH} (id, user_id, action_type, action_details, timestamp) VALUES (?, ?, ?, ?, ?)',
+                    [(i, 7, 'Viewed Claim', '{"claim": %d}' % i, f'1990-02-{i:02d} 10:00:00') for i in range(1, 9)])
+    src.execute('CREATE TABLE scratch_notes (id INTEGER PRIMARY KEY, note TEXT)')
+    src.commit()
+    src.close()
+
+
+def _counts(db):
+    from app import ResourceCategory
+    month = audit_log.month_load_tables(199002)[0]
+    with db.engine.connect() as conn:
+        return (conn.execute(select(func.count()).select_from(ResourceCategory.__table__)).scalar(),
+                conn.execute(select(func.count()).select_from(month)).scalar())
+
+
+def test_restart_reruns_into_emptied_targets_with_service_tables(db, tmp_path, capsys):
+    path = str(tmp_path / 'source.db')
+    _source(path)
+    tables = {'resource_categories', MONTH, 'scratch_notes'}
+
+    assert migrate_data.migrate_data(path, workers=2, only_tables=tables)
+    assert _counts(db) == (5, 8)
+    assert 'Not migrated (no model or service table): scratch_notes' in capsys.readouterr().out
+
+    assert migrate_data.migrate_data(path, workers=2, only_tables=tables, restart=True)
+    assert _counts(db) == (5, 8)
+    events = audit_log.query_events(user_id=7, date_from=datetime(1990, 2, 1), date_to=datetime(1990, 3, 1))
+    assert [event['action_details'] for event in events][:2] == [{'claim': 8}, {'claim': 7}]
+
+
+def _cyclic_metadata():
+    metadata = MetaData()
+    Table('teams', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('name', String(50), nullable=False),
+          Column('captain_id', Integer, ForeignKey('people.id')))
+    Table('people', metadata,
+          Column('id', Integer, primary_key=True),
+          Column('team_id', Integer, ForeignKey('teams.id'), nullable=False))
+    return metadata
+
+
+def test_cyclic_tables_load_with_deferred_foreign_key(tmp_path):
+    """A row referencing a table from a later level is linked after every level is copied"""
+    metadata = _cyclic_metadata()
+    levels, deferred = migrate_data.plan_table_levels(metadata)
+    assert [[t.name for t in level] for level in levels] == [['teams'], ['people']]
+    assert deferred == {'teams': ['captain_id']}
+
+    source = str(tmp_path / 'source.db')
+    src = sqlite3.connect(source)
+    src.execute('CREATE TABLE teams (id INTEGER PRIMARY KEY, name VARCHAR(50) NOT NULL, captain_id INTEGER)')
+    src.execute('CREATE TABLE people (id INTEGER PRIMARY KEY, team_id INTEGER NOT NULL)')
+    src.executemany('INSERT INTO teams VALUES (?, ?, ?)', [(1, 'Red', 2), (2, 'Blue', None)])
+    src.executemany('INSERT INTO people VALUES (?, ?)', [(1, 1), (2, 1), (3, 2)])
+    src.commit()
+    src.close()
+
+    # Foreign keys enforced on every statement, as on a PostgreSQL target
+    engine = create_engine(f"sqlite:///{tmp_path / 'target.db'}")
+    event.listen(engine, 'connect', lambda conn, record: conn.execute('PRAGMA foreign_keys = ON'))
+    metadata.create_all(engine)
+    migrate_data.ensure_checkpoint_table(engine)
+
+    for level in levels:
+        for table in level:
+            stats = migrate_data.migrate_table(engine, source, table, None, 1, False, deferred.get(table.name, ()))
+            assert stats['status'] == 'ok', stats['error']
+    teams = metadata.tables['teams']
+    assert migrate_data.restore_deferred(engine, source, teams, deferred['teams'], 1) == 1
+    with engine.connect() as conn:
+        assert conn.execute(select(teams.c.id, teams.c.captain_id).order_by(teams.c.id)).all() == [(1, 2), (2, None)]
+        assert conn.execute(select(func.count()).select_from(metadata.tables['people'])).scalar() == 3
+    engine.dispose()
+
+
+def test_app_cycles_planned_without_dropping_foreign_keys(db):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        levels, deferred = migrate_data.plan_table_levels(db.metadata)
+    level_of = {t.name: index for index, level in enumerate(levels) for t in level}
+    assert deferred['facilities'] == ['created_by']
+    assert level_of['facilities'] < level_of['users']
+    assert 'workout_logs' in deferred or 'workout_schedule' in deferred
+    for table in db.metadata.tables.values():
+        for fkc in table.foreign_key_constraints:
+            parent = fkc.referred_table.name
+            if parent != table.name and not set(deferred.get(table.name, ())) >= {c.name for c in fkc.columns}:
+                assert level_of[parent] < level_of[table.name], (table.name, parent)
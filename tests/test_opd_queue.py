@@ -0,0 +1,31 @@
+import uuid
+
+
+def _facility(db, block_id):
+    from app import Facility
+    facility = Facility(facility_id=f'FAC-{uuid.uuid4().hex[:10]}', name='Stream Test PHC',
+                        facility_type='PHC', block_id=block_id)
+    db.session.add(facility)
+    db.session.commit()
+    return facility
+
+
+def test_queue_stream_requires_facility_access(app, db, make_user, login):
+    facility = _facility(db, 'BLK-STREAM')
+    other = _facility(db, 'BLK-OTHER')
+    url = f'/api/facility/{facility.id}/opd-queue/stream'
+    facility_id = facility.id
+
+    assert app.test_client().get(url).status_code in (302, 401)
+    for user in (make_user('facility_admin', facility_id=other.id),
+                 make_user('block_admin', block_id='BLK-OTHER'),
+                 make_user('client')):
+        assert login(user).get(url).status_code == 403
+
+    # Each stream drops the request session, so create every user just before its request
+    for user_type, fields in (('facility_admin', {'facility_id': facility_id}),
+                              ('block_admin', {'block_id': 'BLK-STREAM'})):
+        response = login(make_user(user_type, **fields)).get(url, buffered=False)
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        response.close()
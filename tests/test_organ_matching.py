@@ -0,0 +1,98 @@
+import random
+import uuid
+from datetime import date
+
+from services import organ_matching
+
+TYPINGS = ['A2 A24 B7 B44 DR15', 'A2 A3 B7 B8 DR15 DR4', 'A1 A11 B35 B51 DR7', 'A*02:01 B*44:02 DRB1*15:01', '']
+
+
+def _stored(db, organ_request):
+    return [(m.score, m.pledge_id, m.hla_mismatches, m.abo_identical, m.crossmatch_positive)
+            for m in organ_matching.ranked_matches(organ_request)]
+
+
+def _expected(db, organ_request):
+    conn = db.session.connection()
+    profile = organ_matching._request_profiles(conn, [organ_request.id])[0]
+    return organ_matching.rank_pool(profile, organ_matching._load_pool(conn))
+
+
+def _pledge(db, make_user, rng, **user_fields):
+    from app import OrganPledge
+    donor = make_user('organ_donor_recipient', blood_group=user_fields.pop('blood_group', rng.choice(['O+', 'A+'])),
+                      hla_type=user_fields.pop('hla_type', rng.choice(TYPINGS)))
+    pledge = OrganPledge(user_id=donor.id, pledge_id=f'OP-{uuid.uuid4().hex[:10]}', pledge_date=date.today(),
+                         organs_pledged='["Kidney", "Liver"]', status='Active')
+    db.session.add(pledge)
+    return pledge
+
+
+def test_lists_follow_pledge_changes(db, make_user):
+    from app import OrganRequest
+    rng = random.Random(11)
+    recipient = make_user('client', blood_group='A+', hla_type='A2 A24 B7 B44 DR15')
+    organ_request = OrganRequest(user_id=recipient.id, request_id=f'OR-{uuid.uuid4().hex[:10]}',
+                                 organ_needed='Kidney', status='Pending', treating_hospital='City Hospital',
+                                 antibody_screening='{"unacceptable_antigens": ["B8"]}')
+    db.session.add(organ_request)
+    db.session.commit()
+    assert _stored(db, organ_request) == []
+
+    pledges = [_pledge(db, make_user, rng) for _ in range(organ_matching.MATCH_LIST_SIZE + 5)]
+    db.session.commit()
+    stored = _stored(db, organ_request)
+    assert len(stored) == organ_matching.MATCH_LIST_SIZE
+    assert stored == _expected(db, organ_request)
+
+    # A listed pledge is revoked: the list is refilled from the pool
+    top = db.session.get(type(pledges[0]), stored[0][1])
+    top.status = 'Revoked'
+    db.session.commit()
+    assert top.id not in [row[1] for row in _stored(db, organ_request)]
+    assert _stored(db, organ_request) == _expected(db, organ_request)
+
+    # A perfect, ABO-identical donor joins the top of the list
+    best = _pledge(db, make_user, rng, blood_group='A-', hla_type='A2 A24 B7 B44 DR15')
+    db.session.commit()
+    assert (100, best.id, 0, True, False) in _stored(db, organ_request)
+    assert _stored(db, organ_request) == _expected(db, organ_request)
+
+
+def test_matches_scoped_to_treating_hospital(db, make_user, login):
+    from app import OrganRequest
+    recipient = make_user('client', blood_group='O+')
+    organ_request = OrganRequest(user_id=recipient.id, request_id=f'OR-{uuid.uuid4().hex[:10]}',
+                                 organ_needed='Liver', status='Pending', treating_hospital='City Hospital')
+    db.session.add(organ_request)
+    db.session.commit()
+    url = f'/api/client/organ-requests/{organ_request.request_id}/matches'
+
+    assert login(recipient).get(url).status_code == 200
+    outsider = make_user('hospital_doctor', facility_name='Other Hospital')
+    assert login(outsider).get(url).status_code == 403
+    treating = make_user('hospital_doctor', facility_name='city hospital ')
+    assert login(treating).get(url).status_code == 200
+
+
+def _antigen_names(antigens):
+    names = {antigen: name for name, antigen in organ_matching._vocabulary.items()}
+    return sorted(names[antigen] for antigen in antigens)
+
+
+def test_hla_parser_keeps_loci_apart():
+    hla = organ_matching.hla_antigens
+    assert _antigen_names(hla('HLA-A*02:01, B*44:02; DRB1*15:01 Cw7 DQB1*06:02')) == ['A2', 'B44', 'C7', 'DQ6', 'DR15']
+    assert _antigen_names(hla('a2 a24 b7 dr4')) == ['A2', 'A24', 'B7', 'DR4']
+    assert _antigen_names(hla('DQA1*01:02 DPA1*01:03')) == ['DPA1*1', 'DQA1*1']
+    assert _antigen_names(hla('DRB3*01:01 DRB4*01:01 DRB5*01:01')) == ['DRB3*1', 'DRB4*1', 'DRB5*1']
+    assert hla('Bw4 Bw6') == ()
+
+    unacceptable = organ_matching.antibody_antigens('["DQA1*05", "DRB4*01", "DPA1*02"]')
+    assert len(unacceptable) == 3
+    assert all(organ_matching._antigen_loci[antigen] == -1 for antigen in unacceptable)
+
+
+def test_abo_code_needs_a_whole_token():
+    assert [organ_matching.abo_code(group) for group in ('O+', 'ab-', 'B positive', 'A')] == [0, 3, 2, 1]
+    assert [organ_matching.abo_code(group) for group in ('Other', 'Bombay', '', None)] == [-1, -1, -1, -1]
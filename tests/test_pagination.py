@@ -0,0 +1,29 @@
+from services import pagination
+
+
+def test_failed_explain_keeps_callers_transaction(db, monkeypatch):
+    """The planner-estimate path must not roll back work the request has pending"""
+    from app import ResourceCategory
+    category = ResourceCategory(name='Pending category')
+    db.session.add(category)
+    db.session.flush()
+
+    # SQLite cannot run EXPLAIN (FORMAT JSON), so the estimate fails like a bad plan would
+    monkeypatch.setattr(db.engine.dialect, 'name', 'postgresql')
+    count, is_estimate = pagination.approximate_count(ResourceCategory.query.filter_by(name='Pending category'))
+    monkeypatch.undo()
+
+    assert (count, is_estimate) == (1, False)
+    assert category in db.session
+    db.session.rollback()
+
+
+def test_security_logs_reject_page_in_favour_of_cursor(db, make_user, login):
+    client = login(make_user('global_admin'))
+    for endpoint in ('login-logs', 'api-logs', 'access-logs'):
+        response = client.get(f'/api/admin/security/{endpoint}?page=2')
+        assert response.status_code == 400
+        assert 'cursor' in response.get_json()['error']
+        response = client.get(f'/api/admin/security/{endpoint}?per_page=1')
+        assert response.status_code == 200
+        assert 'page' not in response.get_json()['pagination']
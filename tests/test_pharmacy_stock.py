@@ -0,0 +1,137 @@
+import threading
+import uuid
+from datetime import date
+
+from sqlalchemy import func
+
+from services import pharmacy_stock
+from services.pharmacy_stock import InsufficientStock, StockConflict, accept_request, parse_medicine_lines, receive_batch
+
+
+def _item(db, pharmacy, name, batches):
+    from app import Inventory
+    item = Inventory(pharmacy_id=pharmacy.id, medicine_name=name, category='Tablet')
+    db.session.add(item)
+    db.session.flush()
+    for quantity, expiry, number in batches:
+        receive_batch(item, quantity, expiry, number)
+    db.session.commit()
+    return item
+
+
+def test_concurrent_accepts_never_oversell(app, db, make_user):
+    """Requests accepted at once share the stock; duplicate accepts of one request conflict"""
+    from app import Inventory, PharmacyRequest, PharmacyReservation, PharmacyStockIndex
+    workers, stock = 16, 20
+    name = f'Stresstamol {uuid.uuid4().hex[:8]}'
+    pharmacy = make_user('pharmacy', full_name='Stress Pharmacy')
+    item = _item(db, pharmacy, name, [(stock // 2, date(2099, 1, 1), 'B-LATE'),
+                                      (stock - stock // 2, date(2098, 1, 1), 'B-EARLY')])
+    requests = [
+        PharmacyRequest(patient_id=pharmacy.id, pharmacy_id=pharmacy.id, request_type='medicine_request',
+                        medicine_details=f'{name} (Qty: {1 + i % 3})', status='pending')
+        for i in range(workers)
+    ]
+    db.session.add_all(requests)
+    db.session.commit()
+    pharmacy_id, item_id = pharmacy.id, item.id
+    request_ids = [r.id for r in requests]
+    db.session.remove()
+
+    outcomes, outcomes_lock = [], threading.Lock()
+    callers = request_ids + request_ids[:2]
+    barrier = threading.Barrier(len(callers))
+
+    def accept(request_id):
+        with app.app_context():
+            req = db.session.get(PharmacyRequest, request_id)
+            db.session.commit()  # Hand the connection back to the pool while waiting
+            try:
+                barrier.wait(timeout=60)
+                accept_request(req)
+                db.session.commit()
+                outcome = 'accepted'
+            except InsufficientStock:
+                outcome = 'short'
+            except StockConflict:
+                outcome = 'conflict'
+            finally:
+                db.session.remove()
+            with outcomes_lock:
+                outcomes.append((request_id, outcome))
+
+    threads = [threading.Thread(target=accept, args=(rid,)) for rid in callers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(outcomes) == len(callers)
+    accepted = {rid for rid, outcome in outcomes if outcome == 'accepted'}
+    reserved = dict(db.session.query(PharmacyReservation.request_id, func.sum(PharmacyReservation.quantity)).filter(
+        PharmacyReservation.request_id.in_(request_ids)
+    ).group_by(PharmacyReservation.request_id).all())
+    wanted = {r.id: parse_medicine_lines(r.medicine_details)[0]['quantity']
+              for r in PharmacyRequest.query.filter(PharmacyRequest.id.in_(request_ids))}
+    statuses = dict(db.session.query(PharmacyRequest.id, PharmacyRequest.status).filter(
+        PharmacyRequest.id.in_(request_ids)
+    ).all())
+    remaining = db.session.get(Inventory, item_id).stock_quantity
+    indexed = db.session.query(PharmacyStockIndex.quantity_available).filter_by(pharmacy_id=pharmacy_id).scalar() or 0
+
+    assert accepted
+    assert sum(reserved.values()) + remaining == stock
+    assert remaining >= 0 and indexed == remaining
+    assert set(reserved) == accepted
+    assert all(reserved[rid] == wanted[rid] for rid in accepted)
+    assert all(statuses[rid] == ('accepted' if rid in accepted else 'pending') for rid in request_ids)
+
+
+def test_expiry_only_edit_moves_soonest_batch(db, make_user, login):
+    from app import Inventory, InventoryBatch
+    pharmacy = make_user('pharmacy')
+    item = _item(db, pharmacy, f'Edittamol {uuid.uuid4().hex[:8]}', [(5, date(2098, 1, 1), 'B1'),
+                                                                     (5, date(2099, 1, 1), 'B2')])
+    client = login(pharmacy)
+
+    response = client.post('/api/pharmacy/inventory/update', json={
+        'id': item.id, 'stock': '10', 'expiry': '2098-06-30'
+    })
+    assert response.get_json()['success']
+
+    db.session.expire_all()
+    expiries = sorted(b.expiry_date for b in InventoryBatch.query.filter_by(inventory_id=item.id))
+    assert expiries == [date(2098, 6, 30), date(2099, 1, 1)]
+    refreshed = db.session.get(Inventory, item.id)
+    assert refreshed.stock_quantity == 10
+    assert refreshed.expiry_date == date(2098, 6, 30)
+
+
+def test_expiry_edit_without_stock_is_rejected(db, make_user, login):
+    pharmacy = make_user('pharmacy')
+    item = _item(db, pharmacy, f'Emptytamol {uuid.uuid4().hex[:8]}', [])
+    client = login(pharmacy)
+
+    response = client.post('/api/pharmacy/inventory/update', json={
+        'id': item.id, 'stock': '0', 'expiry': '2098-06-30'
+    })
+    assert response.status_code == 400
+    assert pharmacy_stock.set_expiry(item, date(2098, 6, 30)) == 0
+
+
+def test_routing_only_reads_and_nightly_sweep_drops_expired_batches(db, make_user, login, capture_writes):
+    from app import Inventory
+    pharmacy, client_user = make_user('pharmacy'), make_user('client')
+    name = f'Sweepamol {uuid.uuid4().hex[:8]}'
+    item = _item(db, pharmacy, name, [(4, date(2090, 1, 1), 'OLD'), (6, date(2091, 1, 1), 'NEW')])
+    client = login(client_user)
+
+    with capture_writes() as writes:
+        response = client.get('/api/client/pharmacies', query_string={'medicines': f'{name} x 5'})
+    assert writes == []
+    assert pharmacy.id in [p['id'] for p in response.get_json()['pharmacies']]
+
+    assert pharmacy_stock.sweep_expired(today=date(2090, 6, 1))['items_recounted'] >= 1
+    db.session.expire_all()
+    swept = db.session.get(Inventory, item.id)
+    assert (swept.stock_quantity, swept.expiry_date) == (6, date(2091, 1, 1))
@@ -0,0 +1,77 @@
+import uuid
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event, select
+
+from services import preauth_sla
+
+
+def _pre_auths(db, make_user, count, sla_hours=2):
+    from app import CashlessPreAuth, Insurance, InsuranceCompany
+    patient, hospital = make_user('client'), make_user('hospital')
+    company = InsuranceCompany(user_id=make_user('insurer').id, company_name='SLA Test Insurer', sla_hours=sla_hours)
+    policy = Insurance(user_id=patient.id, provider_name='SLA Test Insurer', policy_number=uuid.uuid4().hex[:12],
+                       start_date=date.today(), end_date=date.today() + timedelta(days=365))
+    db.session.add_all([company, policy])
+    db.session.flush()
+    rows = [CashlessPreAuth(pre_auth_id=f'PA-{uuid.uuid4().hex[:12]}', policy_id=policy.id, patient_id=patient.id,
+                            hospital_id=hospital.id, insurance_company_id=company.id, request_date=datetime.utcnow(),
+                            estimated_cost=1000, requested_amount=1000)
+            for _ in range(count)]
+    db.session.add_all(rows)
+    db.session.commit()
+    return rows
+
+
+def _alerted(db, ids):
+    alerts = preauth_sla._t('PreAuthSlaAlert')
+    return sorted(db.session.execute(select(alerts.c.pre_auth_pk).where(alerts.c.pre_auth_pk.in_(ids))).scalars())
+
+
+def test_sweep_alerts_only_rows_it_flips(db, make_user):
+    """A request decided between the sweep's SELECT and UPDATE is neither flagged nor alerted"""
+    rows = _pre_auths(db, make_user, 3)
+    ids = sorted(row.id for row in rows)
+    assert all(row.sla_deadline == row.request_date + timedelta(hours=2) for row in rows)
+    decided = ids[0]
+
+    pending = [decided]
+
+    def decide_first(conn, cursor, statement, parameters, context, executemany):
+        if pending and statement.lstrip().upper().startswith('UPDATE CASHLESS_PRE_AUTH'):
+            cursor.execute(f"UPDATE cashless_pre_auth SET approval_status = 'Approved' WHERE id = {pending.pop()}")
+
+    event.listen(db.engine, 'before_cursor_execute', decide_first)
+    try:
+        flagged = preauth_sla.sweep(now=datetime.utcnow() + timedelta(hours=3))
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', decide_first)
+
+    assert flagged == 2
+    assert _alerted(db, ids) == ids[1:]
+    db.session.expire_all()
+    assert {row.id: row.sla_breach for row in rows} == {decided: False, ids[1]: True, ids[2]: True}
+    assert preauth_sla.sweep(now=datetime.utcnow() + timedelta(hours=3)) == 0
+    assert _alerted(db, ids) == ids[1:]
+
+
+def test_sweeper_woken_only_by_committed_deadlines(db, make_user):
+    from app import CashlessPreAuth
+    template = _pre_auths(db, make_user, 1)[0]
+
+    def new_request():
+        return CashlessPreAuth(pre_auth_id=f'PA-{uuid.uuid4().hex[:12]}', policy_id=template.policy_id,
+                               patient_id=template.patient_id, hospital_id=template.hospital_id,
+                               insurance_company_id=template.insurance_company_id,
+                               estimated_cost=500, requested_amount=500)
+
+    preauth_sla._wake.clear()
+    db.session.add(new_request())
+    db.session.flush()
+    assert not preauth_sla._wake.is_set()
+    db.session.rollback()
+    assert not preauth_sla._wake.is_set()
+
+    db.session.add(new_request())
+    db.session.commit()
+    assert preauth_sla._wake.is_set()
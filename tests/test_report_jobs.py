@@ -0,0 +1,29 @@
+import uuid
+
+from sqlalchemy import delete
+
+from services import report_jobs
+
+
+def test_report_deleted_mid_generation_fails_the_job(db, monkeypatch):
+    from app import GeneratedReport, ReportJob
+    report = GeneratedReport(report_id=f'RPT-{uuid.uuid4().hex[:10]}', report_type='supply_status',
+                             export_format='csv', block_id='BLK-REPORT')
+    db.session.add(report)
+    job = report_jobs.enqueue_report(report, 'block', 'BLK-REPORT')
+    job.status, job.attempts = 'processing', 1
+    db.session.commit()
+    job_id, report_pk = job.id, report.id
+
+    def delete_report(scope, start, end):
+        db.session.execute(delete(GeneratedReport.__table__).where(GeneratedReport.id == report_pk))
+        db.session.commit()
+        raise RuntimeError('builder failed')
+
+    monkeypatch.setitem(report_jobs.REPORT_TYPES['supply_status'], 'builder', delete_report)
+    assert report_jobs.process_job(job) is False
+
+    db.session.expire_all()
+    job = db.session.get(ReportJob, job_id)
+    assert (job.status, job.last_error, job.locked_by) == ('failed', 'Report record no longer exists', None)
+    assert job.finished_at is not None
@@ -0,0 +1,93 @@
+import threading
+import uuid
+from datetime import date, timedelta
+
+import pytest
+
+from services import slot_inventory
+from services.slot_inventory import SlotUnavailable
+
+
+def _slot_times():
+    from app import APPOINTMENT_SLOT_TEMPLATE
+    return next(iter(APPOINTMENT_SLOT_TEMPLATE.values()))
+
+
+def test_simultaneous_bookings_of_one_slot(app, db, make_user):
+    """Many clients book the same slot at once; exactly one appointment is created"""
+    from app import Appointment
+    bookings = 200
+    doctor_id = str(make_user('hospital_doctor').id)
+    day = date.today() + timedelta(days=365)
+    slot_time = _slot_times()[0]
+    user_id = make_user('client').id
+    payload = {
+        'appointmentType': 'Consultation',
+        'specialty': 'General Medicine',
+        'doctorId': doctor_id,
+        'doctorName': 'Slot Race Doctor',
+        'appointmentDate': day.strftime('%Y-%m-%d'),
+        'appointmentTime': slot_time,
+        'consultationMode': 'In-person',
+    }
+
+    barrier = threading.Barrier(bookings)
+    results, lock = [], threading.Lock()
+
+    def book():
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+        barrier.wait(timeout=60)
+        status = client.post('/appointments/book', json=payload).status_code
+        with lock:
+            results.append(status)
+
+    threads = [threading.Thread(target=book) for _ in range(bookings)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    db.session.expire_all()
+    booked = Appointment.query.filter_by(
+        doctor_id=doctor_id, appointment_date=day, appointment_time=slot_inventory._parse_time(slot_time)
+    ).count()
+    assert len(results) == bookings
+    assert results.count(200) == 1
+    assert booked == 1
+
+
+def test_unknown_doctor_has_no_slots(db, make_user, login):
+    from app import DoctorSlot
+    day = date.today() + timedelta(days=30)
+    client_user = make_user('client')
+    for doctor_id in (f'RACE-{uuid.uuid4().hex[:8]}', str(client_user.id)):
+        assert slot_inventory.slot_map(doctor_id, day) == {period: [] for period in slot_inventory._runtime['template']}
+        response = login(client_user).post('/appointments/book', json={
+            'appointmentType': 'Consultation', 'specialty': 'General Medicine', 'doctorId': doctor_id,
+            'doctorName': 'Nobody', 'appointmentDate': day.strftime('%Y-%m-%d'),
+            'appointmentTime': _slot_times()[0], 'consultationMode': 'In-person',
+        })
+        assert response.status_code == 409
+        assert DoctorSlot.query.filter_by(doctor_id=doctor_id).count() == 0
+
+
+def test_claim_release_and_move(db, make_user):
+    doctor_id = str(make_user('hospital_doctor').id)
+    day = date.today() + timedelta(days=30)
+    first, second = _slot_times()[:2]
+
+    slot_inventory.claim_slot(doctor_id, day, first, appointment_id=1)
+    db.session.commit()
+    with pytest.raises(SlotUnavailable):
+        slot_inventory.claim_slot(doctor_id, day, first)
+    db.session.rollback()
+
+    slot_inventory.move_slot(doctor_id, day, first, day, second, 1)
+    db.session.commit()
+    assert slot_inventory.release_slot(doctor_id, day, first) == 0
+    assert slot_inventory.release_slot(doctor_id, day, second, 1) == 1
+    db.session.commit()
+    slot_inventory.claim_slot(doctor_id, day, second)
+    db.session.rollback()
@@ -0,0 +1,57 @@
+import uuid
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from services import stock_forecast
+
+
+def test_rates_over_consumption_matrix():
+    consumed = np.zeros((3, stock_forecast.LONG_WINDOW_DAYS))
+    consumed[0, :] = 2            # Steady 2/day for four weeks
+    consumed[1, :7] = 10          # Jumped to 10/day this week
+    consumed[2, 0] = 6            # New item, first seen two days ago
+    burn_7d, burn_28d, daily, trend = stock_forecast._rates(consumed, np.array([60.0, 60.0, 2.0]))
+    assert burn_7d.tolist() == [2.0, 10.0, 3.0]
+    assert burn_28d.tolist() == [2.0, 2.5, 3.0]
+    assert daily.tolist() == [2.0, 6.25, 3.0]
+    assert trend.tolist() == ['steady', 'rising', 'steady']
+
+
+def test_burn_rates_from_ledger(db):
+    from app import StockMovement
+    now = datetime.utcnow()
+    item_id = 900000 + now.microsecond
+    db.session.add_all([
+        StockMovement(source='facility', item_id=item_id, delta=100, reason='opening', created_at=now - timedelta(days=40)),
+        StockMovement(source='facility', item_id=item_id, delta=-14, reason='issue', created_at=now - timedelta(days=2)),
+        StockMovement(source='facility', item_id=item_id, delta=-28, reason='issue', created_at=now - timedelta(days=20)),
+        StockMovement(source='facility', item_id=item_id, delta=-50, reason='issue', created_at=now - timedelta(days=35)),
+        StockMovement(source='facility', item_id=item_id, delta=30, reason='receipt', created_at=now - timedelta(days=1)),
+    ])
+    db.session.commit()
+    rates = stock_forecast._burn_rates(db.session.connection(), now)
+    assert rates[('facility', item_id)] == (2.0, 1.5, 1.75, 'rising')
+
+
+def test_startup_fills_missing_forecasts_and_dashboard_only_reads(db, make_user, login, capture_writes):
+    from app import Facility, FacilityInventory, StockForecast
+    stamp = uuid.uuid4().hex[:8]
+    facility = Facility(facility_id=f'FAC-T-{stamp}', name='Forecast PHC', facility_type='PHC', block_id=f'B-{stamp}')
+    db.session.add(facility)
+    db.session.flush()
+    item = FacilityInventory(facility_id=facility.id, item_name='ORS sachet', category='medicine', current_stock=40)
+    db.session.add(item)
+    db.session.commit()
+    # As if the item predated the forecasts
+    StockForecast.query.filter_by(source='facility', item_id=item.id).delete()
+    db.session.commit()
+
+    assert stock_forecast.ensure_forecasts() is not None
+    assert stock_forecast.ensure_forecasts() is None
+
+    client = login(make_user('facility_admin'))
+    with capture_writes() as writes:
+        response = client.get(f'/api/facility/{facility.id}/inventory/forecast')
+    assert writes == []
+    assert [f['item_id'] for f in response.get_json()['forecasts']] == [item.id]